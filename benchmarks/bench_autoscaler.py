@@ -0,0 +1,121 @@
+"""Replay a synthetic backlog through the autoscaler's decision logic and report cost and queueing.
+
+The simulated pool follows each decision after node_startup_seconds, the way GKE nodes take minutes to join.  Tasks
+run on ready nodes and wait otherwise.  Compare policies by:
+    node_hours      what the pool cost
+    pending_hours   task time spent waiting for a node
+    resizes         how often the pool was resized
+
+    python benchmarks/bench_autoscaler.py
+"""
+import math
+import sys
+from pathlib import Path
+from typing import List, Dict, Text, Any
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spin import autoscaler
+
+# a Monday at midnight, local time
+START_TIME = 1572822000.0
+
+
+def simulate(
+        policy: autoscaler.PoolScalingPolicy,
+        demand: List[int],
+        step_seconds: float = 60.0,
+        node_startup_seconds: float = 180.0,
+        start_time: float = START_TIME,
+        initial_nodes: int = 0,
+) -> Dict[Text, Any]:
+    """
+    Args:
+        policy: the pool's scaling policy
+        demand: the number of tasks which want to run at each step
+        step_seconds: time between autoscaler steps
+        node_startup_seconds: time between a scale up decision and its nodes being ready
+        start_time: the time of the first step
+        initial_nodes: the pool's size at the start
+    """
+    history = autoscaler.PoolScalingHistory()
+    ready_nodes = initial_nodes
+    target_nodes = initial_nodes
+    # (time ready, size) for scale ups which haven't finished
+    arriving = []
+    node_seconds, pending_seconds, resizes = 0.0, 0.0, 0
+    sizes = []
+
+    for i, tasks in enumerate(demand):
+        now = start_time + i * step_seconds
+        for ready_time, size in list(arriving):
+            if ready_time <= now:
+                ready_nodes = max(ready_nodes, size)
+                arriving.remove((ready_time, size))
+
+        running = min(tasks, ready_nodes * policy.tasks_per_node)
+        observation = autoscaler.PoolObservation(policy.pool_name, target_nodes, tasks - running, running)
+        decision = autoscaler.decide(policy, observation, history, now)
+        history = autoscaler.update_history(history, observation, decision, policy, now)
+
+        if decision.action == autoscaler.ScalingDecision.SCALE_UP:
+            arriving.append((now + node_startup_seconds, decision.target_nodes))
+        elif decision.action == autoscaler.ScalingDecision.SCALE_DOWN:
+            ready_nodes = min(ready_nodes, decision.target_nodes)
+            arriving = []
+        if decision.is_resize():
+            resizes += 1
+            target_nodes = decision.target_nodes
+
+        # nodes cost money from the moment they're requested
+        node_seconds += target_nodes * step_seconds
+        pending_seconds += (tasks - running) * step_seconds
+        sizes.append(target_nodes)
+
+    return {
+        'node_hours': node_seconds / 3600,
+        'pending_hours': pending_seconds / 3600,
+        'resizes': resizes,
+        'max_nodes': max(sizes) if sizes else 0,
+        'final_nodes': target_nodes,
+    }
+
+
+def get_workday_demand(num_days=5, step_seconds=60.0, seed_tasks=4) -> List[int]:
+    """Steady work from 9 to 5 with a gap at lunch, short bursts overnight, and idle weekends."""
+    demand = []
+    steps_per_day = int(24 * 3600 / step_seconds)
+    for day in range(num_days):
+        for step in range(steps_per_day):
+            hour = step * step_seconds / 3600
+            if 9 <= hour < 17 and not (12 <= hour < 12.75):
+                # a few tasks come and go every few minutes
+                tasks = seed_tasks + int(2 * math.sin(step / 7.0))
+            elif hour % 3 < 0.1:
+                tasks = 1
+            else:
+                tasks = 0
+            demand.append(tasks if day < 5 else 0)
+    return demand
+
+
+def get_policies() -> Dict[Text, autoscaler.PoolScalingPolicy]:
+    base = dict(pool_name='gpu-pool', max_nodes=8, tasks_per_node=1)
+    return {
+        'no hysteresis': autoscaler.PoolScalingPolicy(
+            scale_up_cooldown=0, scale_down_cooldown=0, scale_down_delay=0, **base,
+        ),
+        'hysteresis': autoscaler.PoolScalingPolicy(**base),
+        'hysteresis + prewarm': autoscaler.PoolScalingPolicy(
+            prewarm_windows=[autoscaler.PrewarmWindow(start_hour=9, duration_minutes=30, min_nodes=4)], **base,
+        ),
+    }
+
+
+if __name__ == '__main__':
+    demand = get_workday_demand()
+    print(f"{'policy':<24} {'node hours':>11} {'pending hours':>14} {'resizes':>8}")
+    for name, policy in get_policies().items():
+        result = simulate(policy, demand)
+        print(f"{name:<24} {result['node_hours']:>11.1f} {result['pending_hours']:>14.2f} {result['resizes']:>8}")
@@ -0,0 +1,118 @@
+"""Preempt a ResumableTask over and over, locally, and measure the work each preemption throws away.
+
+Each "pod" runs the task until its preemption, then a replacement pod resumes from the latest checkpoint in a
+SimulatedObjectStore.  With the termination notice handled, the task flushes a checkpoint before it goes down.
+Without it, the pod is killed mid-step and everything since the last periodic checkpoint is redone.
+
+    python benchmarks/bench_checkpoint.py
+"""
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Text, Any, List
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spin import checkpoint
+
+
+class SimulatedKill(Exception):
+    """The node went away without a notice."""
+
+
+class CountingTask(checkpoint.ResumableTask):
+    """Sums integers.  Its state has a large part which never changes, like a frozen embedding table."""
+    def __init__(self, preempt_at: int, handle_notice: bool, step_seconds: float, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preempt_at = preempt_at
+        self.handle_notice = handle_notice
+        self.step_seconds = step_seconds
+        self.num_steps_run = 0
+
+    def get_num_steps(self, num_steps: int) -> int:
+        return num_steps
+
+    def get_initial_state(self, num_steps: int) -> Dict[Text, Any]:
+        return {'total': 0, 'frozen': bytes(1000000)}
+
+    def run_step(self, state: Dict[Text, Any], step: int, num_steps: int) -> Dict[Text, Any]:
+        if self.num_steps_run == self.preempt_at:
+            if not self.handle_notice:
+                raise SimulatedKill()
+            self.watcher.trigger('simulated')
+        time.sleep(self.step_seconds)
+        self.num_steps_run += 1
+        state['total'] += step
+        return state
+
+
+def simulate(
+        num_steps: int = 1000,
+        preemption_steps: List[int] = (130, 420, 707),
+        checkpoint_every_steps: int = 100,
+        handle_notice: bool = True,
+        step_seconds: float = .001,
+        latency_seconds: float = .005,
+) -> Dict[Text, Any]:
+    """
+    Args:
+        num_steps: the task's length
+        preemption_steps: when each pod is preempted, in steps since that pod started
+        checkpoint_every_steps: the periodic checkpoint interval
+        handle_notice: whether the task gets and handles the termination notice
+        step_seconds: how long each step takes
+        latency_seconds: the object store's latency per request
+    """
+    with tempfile.TemporaryDirectory() as tdir:
+        store = checkpoint.SimulatedObjectStore(tdir, latency_seconds=latency_seconds)
+        steps_run = 0
+        output = None
+        for preempt_at in list(preemption_steps) + [None]:
+            watcher = checkpoint.PreemptionWatcher(handle_sigterm=False)
+            checkpointer = checkpoint.Checkpointer(store, prefix='counting')
+            task = CountingTask(
+                preempt_at=preempt_at,
+                handle_notice=handle_notice,
+                step_seconds=step_seconds,
+                checkpointer=checkpointer,
+                watcher=watcher,
+                checkpoint_every_steps=checkpoint_every_steps,
+            )
+            try:
+                output = task(num_steps)
+            except (checkpoint.PreemptedError, SimulatedKill):
+                pass
+            # generous to the killed pods: their in-flight checkpoint writes still finish
+            checkpointer.close()
+            steps_run += task.num_steps_run
+
+        if output is None or output['total'] != sum(range(num_steps)):
+            raise ValueError(f"The task gave the wrong answer: {output}")
+        num_preemptions = len(preemption_steps)
+        return {
+            'lost_steps_per_preemption': (steps_run - num_steps) / num_preemptions,
+            'store_mb_written': store.bytes_written / 1e6,
+            'store_requests': store.num_requests,
+        }
+
+
+def get_strategies() -> Dict[Text, Dict[Text, Any]]:
+    return {
+        'every 100 steps, killed': dict(checkpoint_every_steps=100, handle_notice=False),
+        'every 100 steps + notice': dict(checkpoint_every_steps=100, handle_notice=True),
+        'every 500 steps + notice': dict(checkpoint_every_steps=500, handle_notice=True),
+    }
+
+
+if __name__ == '__main__':
+    rng = random.Random(0)
+    preemption_steps = [rng.randrange(50, 400) for _ in range(5)]
+    print(f"preemptions after {preemption_steps} steps")
+    print(f"{'strategy':<26} {'lost steps/preemption':>22} {'MB written':>11} {'requests':>9}")
+    for name, kwargs in get_strategies().items():
+        r = simulate(preemption_steps=preemption_steps, **kwargs)
+        print(f"{name:<26} {r['lost_steps_per_preemption']:>22.1f} {r['store_mb_written']:>11.2f} "
+              f"{r['store_requests']:>9}")
@@ -0,0 +1,51 @@
+"""Benchmark cold, warm and code-only rebuilds of the workbench image.
+
+Requires docker.  Builds a scratch copy of the workbench container directory so the code-only rebuild can edit a
+source file without touching the real tree.  Results are appended to benchmarks/results/image_build.json.
+
+    python benchmarks/bench_image_build.py --repository-uri spin-bench/workbench
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from spin import images, settings
+
+RESULTS_PATH = Path(__file__).resolve().parent / 'results' / 'image_build.json'
+
+
+def run(repository_uri: str):
+    builder = images.DockerImageBuilder(verbose=False)
+    out = {}
+    with tempfile.TemporaryDirectory() as tempdir:
+        context_dir = Path(tempdir) / 'container'
+        shutil.copytree(str(settings.WORKBENCH_CONTAINER_PATH), str(context_dir))
+        spec = images.get_workbench_image_spec(repository_uri=repository_uri, context_dir=context_dir)
+
+        out['cold'] = builder.build(spec, tag='bench', no_cache=True).to_dict()
+        out['warm'] = builder.build(spec, tag='bench').to_dict()
+
+        with open(str(context_dir / 'copy_ssh_keys.py'), 'a') as f:
+            f.write(f'\n# code-only change {time.time()}\n')
+        out['code_only'] = builder.build(spec, tag='bench').to_dict()
+
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repository-uri', default='spin-bench/workbench')
+    args = parser.parse_args()
+
+    results = run(args.repository_uri)
+    for name, result in results.items():
+        print(f"{name:<10} total {result['total_seconds']:8.1f}s   deps {result['deps_seconds']:8.1f}s   "
+              f"deps rebuilt: {result['deps_rebuilt']}")
+
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    history = json.loads(RESULTS_PATH.read_text()) if RESULTS_PATH.exists() else []
+    history.append({'time': time.time(), 'results': results})
+    RESULTS_PATH.write_text(json.dumps(history, indent=2))
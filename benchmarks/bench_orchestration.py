@@ -0,0 +1,455 @@
+"""Measure spin's cluster and workbench orchestration against the fake gcloud and kubectl in fake_cloud.py.
+
+Each scenario runs in its own process with HOME pointed at a scratch directory and the fakes at the front of PATH, so
+nothing touches your real cloud project, kube config, ssh config or spinrc.  For each scenario we report:
+    wall_seconds    time spent in the measured part of the scenario
+    subprocesses    processes spin launched (shell commands and kubectl applies)
+    api_calls       gcloud and kubectl calls which reached the fake cloud
+and the api calls broken down by command.
+
+Subprocess and api call counts don't depend on the machine, so they're checked against baselines/orchestration.json
+and any increase is a regression.  Wall time only means something relative to other runs on the same machine;
+use --latency-ms to model real api round trips.
+
+    python benchmarks/bench_orchestration.py --latency-ms 300
+    python benchmarks/bench_orchestration.py --check
+    python benchmarks/bench_orchestration.py --update-baseline
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Text, Dict, Any, List, Optional
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import fake_cloud
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / 'baselines' / 'orchestration.json'
+RESULTS_PATH = Path(__file__).resolve().parent / 'results' / 'orchestration.json'
+COUNTED_METRICS = ('subprocesses', 'api_calls')
+
+PROJECT = 'bench-project'
+ZONE = 'us-central1-a'
+CLUSTER_NAME = 'bench-cluster'
+
+
+class Scenario:
+    """One measured workflow.  get_initial_state runs in the harness; setup and run run in the scenario's process."""
+    name = None
+
+    def get_initial_state(self) -> Dict[Text, Any]:
+        state = fake_cloud.get_empty_state(PROJECT)
+        state['clusters'][CLUSTER_NAME] = fake_cloud.make_cluster(
+            CLUSTER_NAME, ZONE, [fake_cloud.make_node_pool('default-pool')],
+        )
+        return state
+
+    def setup(self):
+        """Not measured."""
+        pass
+
+    def run(self):
+        raise NotImplementedError()
+
+
+class ClusterCreate(Scenario):
+    name = 'cluster_create'
+    num_node_pools = 10
+
+    def run(self):
+        from spin import cluster
+        gke_cluster = cluster.GkeCluster(
+            project=PROJECT,
+            name=CLUSTER_NAME,
+            zone=ZONE,
+            members=[cluster.NodePool(name=f'pool-{i}', verbose=False) for i in range(self.num_node_pools)],
+            verbose=False,
+        )
+        gke_cluster.create()
+
+
+class ClusterStatus(Scenario):
+    """Check the existence and status of every node pool in a 10 pool cluster."""
+    name = 'cluster_status'
+    num_node_pools = 10
+
+    def get_initial_state(self):
+        state = super().get_initial_state()
+        state['clusters'][CLUSTER_NAME]['nodePools'] += [
+            fake_cloud.make_node_pool(f'pool-{i}') for i in range(self.num_node_pools)
+        ]
+        return state
+
+    def setup(self):
+        from spin import cluster
+        self.cluster = cluster.GkeCluster(
+            project=PROJECT,
+            name=CLUSTER_NAME,
+            zone=ZONE,
+            members=[cluster.NodePool(name=f'pool-{i}', verbose=False) for i in range(self.num_node_pools)],
+            verbose=False,
+        )
+
+    def run(self):
+        assert self.cluster.exists()
+        for node_pool in self.cluster.node_pools.values():
+            assert node_pool.exists()
+            assert node_pool.get_state().is_running()
+
+
+class PoolResize(ClusterStatus):
+    """Resize every node pool in a 10 pool cluster at once and wait for all of the operations."""
+    name = 'pool_resize'
+
+    def setup(self):
+        from spin import operations
+        super().setup()
+        # poll by hand so the number of polls doesn't depend on timing
+        self.tracker = operations.OperationTracker(zone=ZONE, poll_interval=3600, verbose=False)
+        self.cluster._operation_tracker = self.tracker
+
+    def run(self):
+        futures = self.cluster.resize_node_pools({name: 0 for name in self.cluster.node_pools})
+        self.tracker.poll()
+        self.tracker.wait(futures.values(), timeout=60)
+
+
+class _WorkbenchScenario(Scenario):
+    def _get_workbench(self, name='bench-workbench'):
+        from spin import ssh
+        from spin.workbench import workbench
+
+        key_path = Path.home() / '.ssh' / 'id_rsa'
+        if not key_path.exists():
+            key_path.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.check_call(['ssh-keygen', '-q', '-t', 'rsa', '-b', '2048', '-N', '', '-f', str(key_path)])
+        key = ssh.SshKeyOnDisk(str(key_path))
+        return workbench.Workbench(
+            cloud_config=workbench.CloudConfig(cloud_project=PROJECT, zone=ZONE),
+            repos=[workbench.GithubRepo(repo_url='git@github.com:bench/bench.git', ssh_key=key)],
+            ssh_login_key=key,
+            name=name,
+            verbose=False,
+        )
+
+
+class WorkbenchCreate(_WorkbenchScenario):
+    name = 'workbench_create'
+
+    def setup(self):
+        self.workbench = self._get_workbench()
+
+    def run(self):
+        self.workbench.create()
+
+
+class WorkbenchClaim(_WorkbenchScenario):
+    name = 'workbench_claim'
+
+    def setup(self):
+        self._get_workbench().create()
+        self.workbench = self._get_workbench()
+
+    def run(self):
+        self.workbench.create()
+
+
+class WorkbenchDelete(_WorkbenchScenario):
+    name = 'workbench_delete'
+
+    def setup(self):
+        self.workbench = self._get_workbench()
+        self.workbench.create()
+
+    def run(self):
+        self.workbench.delete()
+
+
+class _CrowdedScenario(_WorkbenchScenario):
+    """Starts in a namespace full of objects which spin didn't make, which shouldn't make spin any slower."""
+    num_unrelated_objects = 2000
+
+    def get_initial_state(self):
+        state = super().get_initial_state()
+        for i in range(self.num_unrelated_objects):
+            name = f'unrelated-{i:04d}'
+            labels = {'app': f'unrelated-{i % 50}'}
+            state['kube'].setdefault('secret', {})[name] = {
+                'apiVersion': 'v1', 'kind': 'Secret', 'type': 'Opaque',
+                'metadata': {'name': name, 'labels': labels}, 'data': {'token': 'c2VjcmV0'},
+            }
+            state['kube'].setdefault('deployment', {})[name] = {
+                'apiVersion': 'apps/v1', 'kind': 'Deployment', 'metadata': {'name': name, 'labels': labels},
+            }
+        return state
+
+
+class CrowdedWorkbenchClaim(_CrowdedScenario):
+    name = 'workbench_claim_crowded'
+
+    def setup(self):
+        self._get_workbench().create()
+        self.workbench = self._get_workbench()
+
+    def run(self):
+        self.workbench.create()
+
+
+class GarbageCollect(_CrowdedScenario):
+    """Find and delete what 5 half deleted workbenches left behind, next to 5 live ones."""
+    name = 'garbage_collect'
+    num_workbenches = 5
+
+    def setup(self):
+        from spin import kubes
+        for i in range(self.num_workbenches):
+            self._get_workbench(f'live-{i}').create()
+            dead = self._get_workbench(f'dead-{i}')
+            dead.create()
+            # as if a deletion was interrupted after the deployment went
+            kubes.delete_all([kubes.KubernetesDeployment(dead.name, container_image_uri='')], verbose=False)
+
+    def run(self):
+        from spin.workbench import workbench
+        orphans = workbench.collect_garbage(verbose=False)
+        # a service and 3 secrets each
+        assert len(orphans) == 4 * self.num_workbenches, [o.name for o in orphans]
+
+
+class SecretChurn(_WorkbenchScenario):
+    name = 'secret_churn'
+    num_secrets = 5
+
+    def setup(self):
+        from spin import kubes
+        key = self._get_workbench().ssh_login_key
+        self.secrets = [
+            kubes.KubernetesSecret.from_ssh_keys(f'churn-{i}', mount_point_on_pod=f'/secrets/churn-{i}', ssh_keys=[key])
+            for i in range(self.num_secrets)
+        ]
+
+    def run(self):
+        # replace every secret twice, the way workbench creation does, then clean up
+        for _ in range(2):
+            for secret in self.secrets:
+                secret.delete()
+                secret.create()
+        for secret in self.secrets:
+            secret.delete()
+
+
+class FleetCreate(_WorkbenchScenario):
+    """Create 10 workbenches, 4 at a time."""
+    name = 'fleet_create'
+    num_workbenches = 10
+
+    def setup(self):
+        from spin import fleet
+        self.fleet = fleet.Fleet(
+            [self._get_workbench(f'bench-{i:02d}') for i in range(self.num_workbenches)],
+            max_concurrency=4,
+            verbose=False,
+        )
+
+    def run(self):
+        results = self.fleet.create()
+        assert all(r.status == 'created' for r in results), [r.to_dict() for r in results]
+
+
+class FleetDelete(FleetCreate):
+    """Delete 10 workbenches."""
+    name = 'fleet_delete'
+
+    def setup(self):
+        from spin import fleet
+        super().setup()
+        self.fleet.create()
+        self.fleet = fleet.Fleet(self.fleet.workbenches, verbose=False)
+
+    def run(self):
+        results = self.fleet.delete()
+        assert all(r.status == 'deleted' for r in results), [r.to_dict() for r in results]
+
+
+SCENARIOS = {
+    s.name: s for s in [
+        ClusterCreate, ClusterStatus, PoolResize, WorkbenchCreate, WorkbenchClaim, WorkbenchDelete, SecretChurn,
+        FleetCreate, FleetDelete, CrowdedWorkbenchClaim, GarbageCollect,
+    ]
+}
+
+
+def _child_main(scenario_name: Text, result_file: Text):
+    """Runs inside the scenario's process."""
+    from spin import tracing
+
+    scenario = SCENARIOS[scenario_name]()
+    scenario.setup()
+
+    call_log = os.environ[fake_cloud.CALL_LOG_ENV]
+    num_setup_calls = len(fake_cloud.read_call_log(call_log))
+
+    tracer = tracing.enable()
+    start = time.perf_counter()
+    scenario.run()
+    wall_seconds = time.perf_counter() - start
+    tracing.disable()
+
+    calls = fake_cloud.read_call_log(call_log)[num_setup_calls:]
+    calls_by_name = {}
+    for call in calls:
+        calls_by_name[call['name']] = calls_by_name.get(call['name'], 0) + 1
+
+    result = {
+        'wall_seconds': wall_seconds,
+        'subprocesses': len([s for s in tracer.spans if s.category in ('shell', 'kubectl')]),
+        'api_calls': len(calls),
+        'failed_api_calls': len([c for c in calls if c['exitcode'] != 0]),
+        'api_calls_by_name': dict(sorted(calls_by_name.items())),
+    }
+    Path(result_file).write_text(json.dumps(result))
+
+
+def run_scenario(
+        name: Text,
+        latency_ms: float = 0.0,
+        mutation_latency_ms: float = 0.0,
+        fail_pattern: Optional[Text] = None,
+        fail_times: int = 1,
+        timeout: float = 600.0,
+) -> Dict[Text, Any]:
+    """Run one scenario in a fresh process against a fresh fake cloud and return its measurements.
+
+    Args:
+        name: a key of SCENARIOS
+        latency_ms: every fake call sleeps this long
+        mutation_latency_ms: fake calls which change state sleep this much longer
+        fail_pattern: fake calls matching this regex fail, fail_times times
+        fail_times: see fail_pattern
+        timeout: give up on the scenario after this many seconds
+    """
+    scenario = SCENARIOS[name]()
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        home = tdir / 'home'
+        home.mkdir()
+        bin_dir = fake_cloud.install_fake_cloud(tdir / 'bin')
+        state_file = tdir / 'fake_cloud.json'
+        fake_cloud.FakeCloudState(state_file).initialize(scenario.get_initial_state())
+        result_file = tdir / 'result.json'
+
+        env = dict(os.environ)
+        env.update({
+            'HOME': str(home),
+            'PATH': f'{bin_dir}{os.pathsep}{env.get("PATH", "")}',
+            'PYTHONPATH': f'{REPO_ROOT}{os.pathsep}{env.get("PYTHONPATH", "")}',
+            'KUBECONFIG': str(home / '.kube' / 'config'),
+            'CLOUDSDK_CONFIG': str(home / '.config' / 'gcloud'),
+            fake_cloud.STATE_ENV: str(state_file),
+            fake_cloud.CALL_LOG_ENV: str(tdir / 'calls.jsonl'),
+            fake_cloud.LATENCY_ENV: str(latency_ms),
+            fake_cloud.MUTATION_LATENCY_ENV: str(mutation_latency_ms),
+            fake_cloud.FAIL_TIMES_ENV: str(fail_times),
+        })
+        env.pop(fake_cloud.FAIL_PATTERN_ENV, None)
+        if fail_pattern is not None:
+            env[fake_cloud.FAIL_PATTERN_ENV] = fail_pattern
+
+        proc = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_orchestration', '--child', name, '--result-file', str(result_file)],
+            cwd=str(REPO_ROOT),
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+        if proc.returncode != 0 or not result_file.exists():
+            raise RuntimeError(f"Scenario {name} failed with exit code {proc.returncode}.\n"
+                               f"Stdout: {proc.stdout.decode('utf-8')}\nStderr: {proc.stderr.decode('utf-8')}")
+        result = json.loads(result_file.read_text())
+        result['final_state'] = fake_cloud.FakeCloudState(state_file).read()
+        return result
+
+
+def run(names: List[Text], latency_ms=0.0, mutation_latency_ms=0.0) -> Dict[Text, Dict[Text, Any]]:
+    out = {}
+    for name in names:
+        result = run_scenario(name, latency_ms, mutation_latency_ms)
+        del result['final_state']
+        out[name] = result
+    return out
+
+
+def load_baseline(filename=BASELINE_PATH) -> Dict[Text, Dict[Text, int]]:
+    if not Path(filename).exists():
+        return {}
+    return json.loads(Path(filename).read_text())
+
+
+def get_baseline(results: Dict[Text, Dict[Text, Any]]) -> Dict[Text, Dict[Text, int]]:
+    return {name: {k: result[k] for k in COUNTED_METRICS} for name, result in results.items()}
+
+
+def find_regressions(results: Dict[Text, Dict[Text, Any]], baseline: Dict[Text, Dict[Text, int]]) -> List[Text]:
+    """Every counted metric which went up relative to its baseline."""
+    regressions = []
+    for name, result in results.items():
+        for metric in COUNTED_METRICS:
+            allowed = baseline.get(name, {}).get(metric)
+            if allowed is not None and result[metric] > allowed:
+                regressions.append(f'{name}: {metric} went from {allowed} to {result[metric]}')
+    return regressions
+
+
+def format_results(results: Dict[Text, Dict[Text, Any]]) -> Text:
+    lines = [f"{'scenario':<20} {'wall s':>8} {'subprocesses':>13} {'api calls':>10}"]
+    for name, result in results.items():
+        lines.append(f"{name:<20} {result['wall_seconds']:>8.2f} {result['subprocesses']:>13} "
+                     f"{result['api_calls']:>10}")
+        for call_name, count in result['api_calls_by_name'].items():
+            lines.append(f"    {call_name:<45} {count:>4}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), default=None)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--mutation-latency-ms', type=float, default=0.0)
+    parser.add_argument('--check', action='store_true', help="Exit nonzero if any count is above its baseline.")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        _child_main(args.child, args.result_file)
+        sys.exit(0)
+
+    results = run(args.scenario or list(SCENARIOS), args.latency_ms, args.mutation_latency_ms)
+    print(format_results(results))
+
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    history = json.loads(RESULTS_PATH.read_text()) if RESULTS_PATH.exists() else []
+    history.append({'time': time.time(), 'latency_ms': args.latency_ms, 'results': results})
+    RESULTS_PATH.write_text(json.dumps(history, indent=2))
+
+    if args.update_baseline:
+        baseline = load_baseline()
+        baseline.update(get_baseline(results))
+        BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f"Wrote {BASELINE_PATH}")
+
+    if args.check:
+        regressions = find_regressions(results, load_baseline())
+        if regressions:
+            raise SystemExit('Regressions:\n    ' + '\n    '.join(regressions))
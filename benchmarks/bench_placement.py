@@ -0,0 +1,82 @@
+"""Pack a synthetic mix of workloads onto a cluster's node pools and report node counts and packing density.
+
+Compares spin's best fit placement with placing every workload on the first node pool it fits on, which is what
+you get by hand-writing nodeSelectors against a pool list.
+
+    python benchmarks/bench_placement.py
+"""
+import random
+import sys
+from pathlib import Path
+from typing import List, Dict, Text
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spin import placement
+from spin.cluster import NodePool
+
+
+def get_node_pools() -> List[NodePool]:
+    def _pool(name, machine_type, accelerator=None, accelerator_count=0):
+        return NodePool(name=name, machine_type=machine_type, accelerator=accelerator,
+                        accelerator_count_per_node=accelerator_count, max_nodes=100, verbose=False)
+
+    return [
+        _pool('standard-16', 'n1-standard-16'),
+        _pool('standard-4', 'n1-standard-4'),
+        _pool('highmem-8', 'n1-highmem-8'),
+        _pool('highcpu-16', 'n1-highcpu-16'),
+        _pool('k80-4', 'n1-standard-16', 'nvidia-tesla-k80', 4),
+        _pool('v100-1', 'n1-standard-8', 'nvidia-tesla-v100', 1),
+    ]
+
+
+def get_workloads(seed=0) -> Dict[Text, List[placement.ResourceRequest]]:
+    """Batches of identical pods, the way sweeps and fan outs launch them, and one random mix of every shape."""
+    R = placement.ResourceRequest
+    batches = {
+        'cpu heavy builds': [R(cpu=7, memory_gb=4)] * 40,
+        'memory heavy preprocessing': [R(cpu=2, memory_gb=20)] * 40,
+        'small tasks': [R(cpu=.5, memory_gb=1)] * 200,
+        '1 gpu trainers': [R(cpu=3, memory_gb=12, gpus=1)] * 20,
+        'big 1 gpu trainers': [R(cpu=6, memory_gb=20, gpus=1)] * 20,
+    }
+    rng = random.Random(seed)
+    shapes = [r[0] for r in batches.values()]
+    batches['random mix'] = [rng.choice(shapes) for _ in range(200)]
+    return batches
+
+
+def run(placer: placement.Placer, workloads: List[placement.ResourceRequest], strategy: Text) -> Dict[Text, float]:
+    if strategy == 'best fit':
+        placements = [placer.place(w) for w in workloads]
+    elif strategy == 'first fit':
+        placements = []
+        for w in workloads:
+            candidates = [placer.get_placement(name, w) for name in placer.shapes]
+            placements.append([c for c in candidates if c is not None][0])
+    else:
+        raise ValueError(f"Unknown strategy {strategy}")
+
+    packings = placement.simulate_packing(placer, workloads, placements)
+    shapes = placer.shapes
+    total_cpus = sum(shapes[p.pool_name].cpus * p.num_nodes for p in packings.values())
+    total_memory = sum(shapes[p.pool_name].memory_gb * p.num_nodes for p in packings.values())
+    return {
+        'nodes': sum(p.num_nodes for p in packings.values()),
+        'node_cpus': total_cpus,
+        'cpu_utilization': sum(w.cpu for w in workloads) / total_cpus,
+        'memory_utilization': sum(w.memory_gb for w in workloads) / total_memory,
+        'unschedulable': sum(p.num_unschedulable for p in packings.values()),
+    }
+
+
+if __name__ == '__main__':
+    placer = placement.Placer.from_node_pools(get_node_pools())
+    print(f"{'workloads':<28} {'strategy':<10} {'nodes':>6} {'node cpus':>10} {'cpu util':>9} {'mem util':>9}")
+    for name, workloads in get_workloads().items():
+        for strategy in ('first fit', 'best fit'):
+            r = run(placer, workloads, strategy)
+            print(f"{name:<28} {strategy:<10} {r['nodes']:>6} {r['node_cpus']:>10.1f} {r['cpu_utilization']:>9.0%} "
+                  f"{r['memory_utilization']:>9.0%}")
@@ -0,0 +1,211 @@
+"""Provision a workbench's repos from a local bare repo fixture, offline, and compare checkout strategies.
+
+The fixture is a monorepo with a few dozen top level directories and some history.  It's served over a fake ssh which
+runs git-upload-pack locally but takes a while to connect and throttles what it sends back, like a link to github,
+and counts the bytes.
+
+    python benchmarks/bench_repo_checkout.py
+"""
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Text, Dict, Any, List, Optional
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spin import settings
+
+_spec = importlib.util.spec_from_file_location(
+    'provision_repos', str(settings.WORKBENCH_CONTAINER_PATH / 'provision_repos.py'))
+provision_repos = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(provision_repos)
+
+BYTES_PER_SECOND_ENV = 'SPIN_BENCH_BYTES_PER_SECOND'
+COUNT_FILE_ENV = 'SPIN_BENCH_COUNT_FILE'
+CONNECT_SECONDS_ENV = 'SPIN_BENCH_CONNECT_SECONDS'
+
+THROTTLED_SSH = f'''#!{sys.executable}
+"""Stands in for ssh: runs the remote command locally and slowly relays its output."""
+import os, subprocess, sys, time
+time.sleep(float(os.environ['{CONNECT_SECONDS_ENV}']))
+proc = subprocess.Popen(sys.argv[-1], shell=True, stdout=subprocess.PIPE)
+bytes_per_second = float(os.environ['{BYTES_PER_SECOND_ENV}'])
+total = 0
+while True:
+    chunk = os.read(proc.stdout.fileno(), 65536)
+    if not chunk:
+        break
+    total += len(chunk)
+    time.sleep(len(chunk) / bytes_per_second)
+    os.write(1, chunk)
+with open(os.environ['{COUNT_FILE_ENV}'], 'a') as f:
+    f.write(f'{{total}}\\n')
+sys.exit(proc.wait())
+'''
+
+
+def _git(args: List[Text], cwd: Text):
+    subprocess.check_call(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com'] + args, cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_fixture_repo(
+        directory: Path,
+        num_dirs: int = 30,
+        files_per_dir: int = 20,
+        file_kb: int = 16,
+        num_commits: int = 4,
+        seed: int = 0,
+) -> Path:
+    """A bare repo with num_dirs top level directories, dir00, dir01, etc., whose files change in every commit.
+
+    Returns:
+        the bare repo's path
+    """
+    rng = random.Random(seed)
+    work_dir = directory / 'fixture-work'
+    bare_dir = directory / 'fixture.git'
+    work_dir.mkdir(parents=True)
+    _git(['init', '--quiet', '--initial-branch=main'], str(work_dir))
+    for commit in range(num_commits):
+        for d in range(num_dirs):
+            (work_dir / f'dir{d:02d}').mkdir(exist_ok=True)
+            for f in range(files_per_dir):
+                # random bytes, so the blobs don't compress or delta away
+                (work_dir / f'dir{d:02d}' / f'file{f:03d}.txt').write_text(rng.getrandbits(file_kb * 8192).to_bytes(
+                    file_kb * 1024, 'little').hex()[:file_kb * 1024])
+        _git(['add', '-A'], str(work_dir))
+        _git(['commit', '--quiet', '-m', f'commit {commit}'], str(work_dir))
+    _git(['clone', '--quiet', '--bare', str(work_dir), str(bare_dir)], str(directory))
+    # partial clones need the server's permission
+    _git(['config', 'uploadpack.allowFilter', 'true'], str(bare_dir))
+    return bare_dir
+
+
+def add_commit(bare_dir: Path, directory: Path) -> Text:
+    """Push one small commit to the fixture, like a teammate did while your workbench was down.
+
+    Returns:
+        the name of the file it added
+    """
+    name = f'new-{time.time_ns()}.txt'
+    work_dir = directory / f'push-{time.time_ns()}'
+    _git(['clone', '--quiet', str(bare_dir), str(work_dir)], str(directory))
+    (work_dir / name).write_text('new\n')
+    _git(['add', '-A'], str(work_dir))
+    _git(['commit', '--quiet', '-m', f'add {name}'], str(work_dir))
+    _git(['push', '--quiet', 'origin', 'HEAD'], str(work_dir))
+    return name
+
+
+@contextmanager
+def throttled_ssh(directory: Path, bytes_per_second: float, connect_seconds: float = .3):
+    """Point git's ssh at THROTTLED_SSH.  Yields the file which gets the number of bytes each connection sent."""
+    ssh_path = directory / 'throttled_ssh'
+    ssh_path.write_text(THROTTLED_SSH)
+    ssh_path.chmod(0o755)
+    count_file = directory / f'bytes-{time.time_ns()}.txt'
+    count_file.write_text('')
+    overrides = {
+        'GIT_SSH_COMMAND': str(ssh_path),
+        # so git passes the protocol version along like it would to a real ssh
+        'GIT_SSH_VARIANT': 'ssh',
+        BYTES_PER_SECOND_ENV: str(bytes_per_second),
+        CONNECT_SECONDS_ENV: str(connect_seconds),
+        COUNT_FILE_ENV: str(count_file),
+    }
+    old = {k: os.environ.get(k) for k in overrides}
+    os.environ.update(overrides)
+    try:
+        yield count_file
+    finally:
+        for k, v in old.items():
+            if v is None:
+                del os.environ[k]
+            else:
+                os.environ[k] = v
+
+
+def _get_size_mb(directory: Path) -> float:
+    return sum(p.stat().st_size for p in directory.rglob('*') if p.is_file()) / 1e6
+
+
+def run(
+        bare_dir: Path,
+        directory: Path,
+        partial: bool,
+        sparse_paths: Optional[List[Text]],
+        mirror: Optional[Text],
+        bytes_per_second: float = 20e6,
+) -> Dict[Text, Any]:
+    """Provision the fixture into a fresh workspace.
+
+    Args:
+        mirror: None for no mirror, 'cold' for an empty mirror cache or 'warm' for a mirror which is one commit behind
+    """
+    run_dir = Path(tempfile.mkdtemp(dir=str(directory)))
+    repo_url = f'ssh://fakehost{bare_dir}'
+    mirror_cache_dir = None if mirror is None else str(run_dir / 'mirrors')
+    with throttled_ssh(run_dir, bytes_per_second) as count_file:
+        if mirror == 'warm':
+            provision_repos.update_mirror(repo_url, provision_repos.get_mirror_dir(mirror_cache_dir, repo_url))
+            add_commit(bare_dir, run_dir)
+            count_file.write_text('')
+        repo = {'repo_url': repo_url, 'sparse_paths': sparse_paths, 'partial': partial}
+        result = provision_repos.provision_repo(repo, str(run_dir / 'workspace'), mirror_cache_dir)
+        num_bytes = sum(int(line) for line in count_file.read_text().split())
+    checkout_dir = Path(result['directory'])
+    return {
+        'seconds': result['seconds'],
+        'mb_transferred': num_bytes / 1e6,
+        'workspace_mb': _get_size_mb(checkout_dir),
+        'files_checked_out': len([p for p in checkout_dir.rglob('*') if p.is_file() and '.git' not in p.parts]),
+    }
+
+
+def get_strategies() -> Dict[Text, Dict[Text, Any]]:
+    return {
+        'full clone': dict(partial=False, sparse_paths=None, mirror=None),
+        'partial': dict(partial=True, sparse_paths=None, mirror=None),
+        'partial + sparse': dict(partial=True, sparse_paths=['dir00', 'dir01'], mirror=None),
+        'cold mirror + partial + sparse': dict(partial=True, sparse_paths=['dir00', 'dir01'], mirror='cold'),
+        'warm mirror + partial': dict(partial=True, sparse_paths=None, mirror='warm'),
+        'warm mirror + partial + sparse': dict(partial=True, sparse_paths=['dir00', 'dir01'], mirror='warm'),
+    }
+
+
+def run_concurrent(bare_dirs: List[Path], directory: Path, max_workers: int, bytes_per_second: float = 20e6) -> float:
+    """Seconds to provision every fixture with max_workers at a time."""
+    run_dir = Path(tempfile.mkdtemp(dir=str(directory)))
+    repos = [{'repo_url': f'ssh://fakehost{d}', 'directory': f'repo{i}'} for i, d in enumerate(bare_dirs)]
+    with throttled_ssh(run_dir, bytes_per_second):
+        start = time.time()
+        results = provision_repos.provision_repos(repos, str(run_dir / 'workspace'), None, max_workers=max_workers)
+        seconds = time.time() - start
+    errors = [r['error'] for r in results if 'error' in r]
+    if errors:
+        raise ValueError(f"Provisioning failed: {errors}")
+    return seconds
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        bare_dir = make_fixture_repo(tdir / 'monorepo')
+        print(f"fixture: {_get_size_mb(bare_dir):.1f} MB bare repo, served at 20 MB/s after a .3s connection")
+        print(f"{'strategy':<32} {'seconds':>8} {'MB sent':>8} {'workspace MB':>13} {'files':>6}")
+        for name, kwargs in get_strategies().items():
+            r = run(bare_dir, tdir, **kwargs)
+            print(f"{name:<32} {r['seconds']:>8.2f} {r['mb_transferred']:>8.1f} {r['workspace_mb']:>13.1f} "
+                  f"{r['files_checked_out']:>6}")
+
+        bare_dirs = [make_fixture_repo(tdir / f'repo{i}', num_dirs=10, seed=i) for i in range(4)]
+        for max_workers in (1, 4):
+            print(f"4 repos, {max_workers} at a time: {run_concurrent(bare_dirs, tdir, max_workers):.2f}s")
@@ -0,0 +1,79 @@
+"""Stress SpinRc.transaction with many concurrent writers.
+
+Every writer adds its own projects to one shared .spinrc.  Afterwards, every project must be present (no lost updates).
+Reports how long writers waited for the lock (including the load under the lock) and how long they held it once the
+rc was loaded (mutate, save and release).
+
+    python benchmarks/bench_spinrc_transaction.py --num-writers 48 --num-updates 5
+"""
+import argparse
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from spin import spin_config, utils
+
+
+def _writer(args):
+    filename, writer_index, num_updates = args
+    waits, holds = [], []
+    for update_index in range(num_updates):
+        start = time.perf_counter()
+        with spin_config.SpinRc.transaction(filename) as rc:
+            loaded = time.perf_counter()
+            rc.add_project(spin_config.SpinRcProject(f'/projects/writer-{writer_index}-update-{update_index}'))
+        waits.append(loaded - start)
+        holds.append(time.perf_counter() - loaded)
+    return waits, holds
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(num_writers: int, num_updates: int):
+    with tempfile.TemporaryDirectory() as tdir:
+        filename = str(Path(tdir) / '.spinrc')
+        spin_config.SpinRc(
+            user=spin_config.SpinRcUser(name='bench', email='bench@example.com', github_username='bench'),
+            projects=[],
+        ).save(filename)
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(num_writers) as pool:
+            results = pool.map(_writer, [(filename, i, num_updates) for i in range(num_writers)])
+        wall_seconds = time.perf_counter() - start
+
+        rc = spin_config.SpinRc.load(filename)
+        expected = {f'writer-{w}-update-{u}' for w in range(num_writers) for u in range(num_updates)}
+        found = {p.name for p in rc.projects}
+        lost = expected - found
+
+    waits = [w for result in results for w in result[0]]
+    holds = [h for result in results for h in result[1]]
+    return {
+        'num_writers': num_writers,
+        'num_updates': len(expected),
+        'lost_updates': len(lost),
+        'wall_seconds': wall_seconds,
+        'hold_ms_mean': statistics.mean(holds) * 1000,
+        'hold_ms_p99': _percentile(holds, 99) * 1000,
+        'hold_ms_max': max(holds) * 1000,
+        'wait_ms_mean': statistics.mean(waits) * 1000,
+        'wait_ms_p99': _percentile(waits, 99) * 1000,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-writers', type=int, default=48)
+    parser.add_argument('--num-updates', type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.num_writers, args.num_updates)
+    print(utils.format_dict({k: f'{v:.3f}' if isinstance(v, float) else v for k, v in results.items()}))
+    if results['lost_updates']:
+        raise SystemExit(f"Lost {results['lost_updates']} updates.")
@@ -0,0 +1,81 @@
+"""Replay synthetic learning curves through the sweep's early stopping rules and compare what each costs and finds.
+
+Every trial takes one GPU-step per reported step.  A rule is better if it spends fewer GPU-steps without losing the
+best trial.
+
+    python benchmarks/bench_sweep.py
+"""
+import math
+import random
+import sys
+from pathlib import Path
+from typing import List, Dict, Text, Any
+
+if __package__ in (None, ''):
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spin import sweep
+
+
+def get_curves(num_trials=60, num_steps=27, seed=0) -> List[List[float]]:
+    """Accuracy curves which rise towards each trial's own ceiling at their own rate, with a little noise."""
+    rng = random.Random(seed)
+    curves = []
+    for _ in range(num_trials):
+        ceiling = rng.uniform(.5, .95)
+        rate = rng.uniform(.1, .5)
+        curves.append([
+            ceiling * (1 - math.exp(-rate * (step + 1))) + rng.gauss(0, .005) for step in range(num_steps)
+        ])
+    return curves
+
+
+def simulate(curves: List[List[float]], rule: sweep.StoppingRule, concurrency=8) -> Dict[Text, Any]:
+    """Run trials concurrency at a time.  Each tick, every running trial reports its next step."""
+    trials = [sweep.Trial(f'{i:04d}', {}) for i in range(len(curves))]
+    pending = list(range(len(curves)))
+    running = []
+    gpu_steps = 0
+    while pending or running:
+        while pending and len(running) < concurrency:
+            i = pending.pop(0)
+            trials[i].status = sweep.Trial.RUNNING
+            running.append(i)
+
+        for i in list(running):
+            step = len(trials[i].reports) + 1
+            trials[i].reports.append((step, curves[i][step - 1]))
+            gpu_steps += 1
+            if step == len(curves[i]):
+                trials[i].status = sweep.Trial.SUCCEEDED
+                running.remove(i)
+            elif rule.should_stop(trials[i], trials, maximize=True):
+                trials[i].status = sweep.Trial.STOPPED
+                running.remove(i)
+
+    best_possible = max(c[-1] for c in curves)
+    finished = [curves[i][-1] for i, t in enumerate(trials) if t.status == sweep.Trial.SUCCEEDED]
+    return {
+        'gpu_steps': gpu_steps,
+        'num_finished': len(finished),
+        'best_found': max(finished),
+        'regret': best_possible - max(finished),
+        'trials_per_1000_gpu_steps': 1000 * len(trials) / gpu_steps,
+    }
+
+
+def get_rules() -> Dict[Text, sweep.StoppingRule]:
+    return {
+        'none': sweep.NoStoppingRule(),
+        'median': sweep.MedianStoppingRule(min_step=3),
+        'asha': sweep.AshaRule(min_step=3, reduction_factor=3),
+    }
+
+
+if __name__ == '__main__':
+    curves = get_curves()
+    print(f"{'rule':<8} {'gpu steps':>10} {'finished':>9} {'best found':>11} {'regret':>7} {'trials/1k gpu steps':>20}")
+    for name, rule in get_rules().items():
+        r = simulate(curves, rule)
+        print(f"{name:<8} {r['gpu_steps']:>10} {r['num_finished']:>9} {r['best_found']:>11.3f} {r['regret']:>7.3f} "
+              f"{r['trials_per_1000_gpu_steps']:>20.1f}")
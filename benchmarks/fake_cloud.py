@@ -0,0 +1,608 @@
+"""Offline stand-ins for the `gcloud` and `kubectl` commands which spin runs.
+
+Both commands are served by this one script, backed by a json state file, so spin's orchestration code can be run and
+measured without a cloud project.  `install_fake_cloud` writes `gcloud` and `kubectl` wrappers into a bin directory to
+put at the front of PATH.  Only the subset of each CLI that spin uses is implemented, and it is implemented the way
+the real CLIs behave, e.g.: deleting a missing object fails with NotFound.
+
+Behavior is controlled with environment variables:
+    SPIN_FAKE_STATE                 the json state file.  Required.
+    SPIN_FAKE_CALL_LOG              append one json line per call here: argv, exitcode, start time and duration
+    SPIN_FAKE_LATENCY_MS            sleep this long on every call, to model api round trips
+    SPIN_FAKE_MUTATION_LATENCY_MS   sleep this much longer on synchronous calls which change state
+    SPIN_FAKE_FAIL_PATTERN          fail calls whose space-joined argv matches this regex...
+    SPIN_FAKE_FAIL_TIMES            ...this many times (default 1), then succeed
+    SPIN_FAKE_OPERATION_SECONDS     --async operations stay RUNNING this long before they're DONE
+"""
+import base64
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Text, Dict, Any, List, Tuple, Union, Optional
+
+import yaml
+
+STATE_ENV = 'SPIN_FAKE_STATE'
+CALL_LOG_ENV = 'SPIN_FAKE_CALL_LOG'
+LATENCY_ENV = 'SPIN_FAKE_LATENCY_MS'
+MUTATION_LATENCY_ENV = 'SPIN_FAKE_MUTATION_LATENCY_MS'
+FAIL_PATTERN_ENV = 'SPIN_FAKE_FAIL_PATTERN'
+FAIL_TIMES_ENV = 'SPIN_FAKE_FAIL_TIMES'
+OPERATION_SECONDS_ENV = 'SPIN_FAKE_OPERATION_SECONDS'
+
+COMMANDS = ('gcloud', 'kubectl')
+
+# flags which never take a value.  every other --flag without an = consumes the next token.
+BOOLEAN_FLAGS = {
+    '--async', '--preemptible', '--quiet', '--enable-autoscaling', '--dry-run', '--ignore-not-found', '--wait',
+    '--verbose', '--all',
+}
+
+KUBE_TYPE_ALIASES = {
+    'svc': 'service', 'services': 'service',
+    'secrets': 'secret',
+    'deploy': 'deployment', 'deployments': 'deployment',
+    'ns': 'namespace', 'namespaces': 'namespace',
+    'po': 'pod', 'pods': 'pod',
+    'jobs': 'job',
+    'pvc': 'persistentvolumeclaim', 'persistentvolumeclaims': 'persistentvolumeclaim',
+}
+
+
+class FakeCloudError(Exception):
+    """A call failed the way the real command would fail."""
+
+
+def get_empty_state(project='bench-project') -> Dict[Text, Any]:
+    return {'project': project, 'clusters': {}, 'kube': {}, 'operations': [], 'next_id': 1, 'injected_failures': 0}
+
+
+def make_node_pool(
+        name: Text,
+        machine_type='n1-standard-4',
+        num_nodes=1,
+        min_nodes=0,
+        max_nodes=5,
+        preemptible=False,
+        accelerator: Optional[Tuple[Text, int]] = None,
+        version='1.14.8-gke.12',
+) -> Dict[Text, Any]:
+    """A node pool in the shape `gcloud container clusters describe --format=json` returns them."""
+    config = {'machineType': machine_type, 'preemptible': preemptible, 'diskSizeGb': 100}
+    if accelerator is not None:
+        config['accelerators'] = [{'acceleratorType': accelerator[0], 'acceleratorCount': str(accelerator[1])}]
+    return {
+        'name': name,
+        'status': 'RUNNING',
+        'config': config,
+        'initialNodeCount': num_nodes,
+        # gke reports sizes through instance groups.  the fake keeps the current size here.
+        'currentNodeCount': num_nodes,
+        'autoscaling': {'enabled': True, 'minNodeCount': min_nodes, 'maxNodeCount': max_nodes},
+        'version': version,
+    }
+
+
+def make_cluster(name: Text, zone: Text, node_pools: List[Dict[Text, Any]] = (), version='1.14.8-gke.12'):
+    return {
+        'name': name,
+        'zone': zone,
+        'location': zone,
+        'status': 'RUNNING',
+        'currentMasterVersion': version,
+        'currentNodeVersion': version,
+        'endpoint': '10.0.0.1',
+        'nodePools': list(node_pools),
+    }
+
+
+class FakeCloudState:
+    """Read and write the fake cloud's json state under an exclusive lock."""
+    def __init__(self, filename: Union[Text, Path]):
+        self.filename = str(filename)
+
+    def initialize(self, state: Optional[Dict[Text, Any]] = None):
+        self._write(state if state is not None else get_empty_state())
+
+    def read(self) -> Dict[Text, Any]:
+        with open(self.filename, 'r') as f:
+            return json.load(f)
+
+    def _write(self, state: Dict[Text, Any]):
+        fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(self.filename) or '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_filename, self.filename)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with open(self.filename + '.lock', 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                state = self.read()
+                yield state
+                self._write(state)
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def install_fake_cloud(bin_dir: Union[Text, Path], python: Text = sys.executable) -> Path:
+    """Write `gcloud` and `kubectl` executables into bin_dir which run this script."""
+    bin_path = Path(bin_dir)
+    bin_path.mkdir(parents=True, exist_ok=True)
+    script = Path(__file__).resolve()
+    for command in COMMANDS:
+        wrapper = bin_path / command
+        wrapper.write_text(f'#!/bin/sh\nexec {python} {script} {command} "$@"\n')
+        wrapper.chmod(0o755)
+    return bin_path
+
+
+def read_call_log(filename: Union[Text, Path]) -> List[Dict[Text, Any]]:
+    if not Path(filename).exists():
+        return []
+    with open(str(filename), 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_call_name(argv: List[Text]) -> Text:
+    """A short name for a call, e.g.: 'gcloud container node-pools list' or 'kubectl get secret'."""
+    words = [a for a in argv if a.strip() and not a.startswith('-')]
+    if words and words[0] == 'gcloud':
+        return ' '.join(words[:4])
+    if len(words) >= 3 and words[1] in ('get', 'delete', 'create', 'wait'):
+        return ' '.join(words[:2] + [KUBE_TYPE_ALIASES.get(words[2], words[2])])
+    return ' '.join(words[:2])
+
+
+def parse_args(args: List[Text]) -> Tuple[List[Text], Dict[Text, Any]]:
+    """Split args into positionals and a dict of flags.  Repeated flags become lists."""
+    positionals, flags = [], {}
+
+    def add(k, v):
+        if k in flags:
+            if not isinstance(flags[k], list):
+                flags[k] = [flags[k]]
+            flags[k].append(v)
+        else:
+            flags[k] = v
+
+    # spin's multiline commands leave backslash-escaped newlines behind as tokens
+    args = [a for a in args if a.strip() and a != '\\']
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a.startswith('-') and a != '-':
+            if '=' in a:
+                k, v = a.split('=', 1)
+                add(k, v)
+            elif a in BOOLEAN_FLAGS or i + 1 >= len(args):
+                add(a, True)
+            else:
+                add(a, args[i + 1])
+                i += 1
+        else:
+            positionals.append(a)
+        i += 1
+    return positionals, flags
+
+
+def _get_list(flags: Dict[Text, Any], key: Text) -> List[Any]:
+    v = flags.get(key, [])
+    return v if isinstance(v, list) else [v]
+
+
+def _next_id(state: Dict[Text, Any], prefix: Text) -> Text:
+    n = state['next_id']
+    state['next_id'] = n + 1
+    return f'{prefix}-{n:06d}'
+
+
+def _fake_ip(name: Text) -> Text:
+    h = hashlib.sha256(name.encode('utf-8')).digest()
+    return f'35.{h[0]}.{h[1]}.{max(h[2], 1)}'
+
+
+################################################################
+# gcloud
+################################################################
+def _find_cluster(state, name, zone=None) -> Dict[Text, Any]:
+    cluster = state['clusters'].get(name)
+    if cluster is None or (zone is not None and cluster['zone'] != zone):
+        raise FakeCloudError(f'ERROR: (gcloud.container) ResponseError: code=404, message=Not found: cluster {name}.')
+    return cluster
+
+
+def _find_pool(cluster, name) -> Dict[Text, Any]:
+    for pool in cluster['nodePools']:
+        if pool['name'] == name:
+            return pool
+    raise FakeCloudError(f'ERROR: (gcloud.container) ResponseError: code=404, message=Not found: node pool {name}.')
+
+
+def _format_output(items: List[Dict[Text, Any]], fmt: Optional[Text]) -> Text:
+    if fmt is None or fmt == 'json':
+        return json.dumps(items, indent=2) + '\n'
+    m = re.match(r'value\((.*)\)', fmt)
+    if not m:
+        raise FakeCloudError(f'ERROR: (gcloud) fake does not support --format={fmt}')
+    fields = [f.strip() for f in m.group(1).split(',')]
+    lines = []
+    for item in items:
+        values = []
+        for field in fields:
+            v = item
+            for part in field.lower().split('.'):
+                v = {k.lower(): vv for k, vv in v.items()}.get(part, '') if isinstance(v, dict) else ''
+            values.append(str(v))
+        lines.append('\t'.join(values))
+    return '\n'.join(lines) + ('\n' if lines else '')
+
+
+def _start_operation(state, operation_type: Text, target: Text, zone: Text, is_async: bool) -> Text:
+    """Record an operation.  Async calls print its name, as `--async --format="value(name)"` does."""
+    op_id = _next_id(state, 'operation')
+    now = time.time()
+    duration = float(os.environ.get(OPERATION_SECONDS_ENV, '0')) if is_async else 0.0
+    state['operations'].append({
+        'name': op_id,
+        'operationType': operation_type,
+        'targetLink': target,
+        'zone': zone,
+        'status': 'RUNNING' if duration else 'DONE',
+        'startTime': now,
+        'endTime': now + duration,
+    })
+    if is_async:
+        return f'{op_id}\n'
+    return ''
+
+
+def _get_operations(state, zone: Optional[Text]) -> List[Dict[Text, Any]]:
+    now = time.time()
+    ops = []
+    for o in state['operations']:
+        if zone is None or o['zone'] == zone:
+            o = dict(o)
+            o['status'] = 'DONE' if now >= o['endTime'] else 'RUNNING'
+            ops.append(o)
+    return ops
+
+
+def run_gcloud(state, args: List[Text], stdin: Text) -> Tuple[Text, bool]:
+    """Returns stdout and whether state was changed."""
+    positionals, flags = parse_args(args)
+    if positionals[:3] == ['config', 'get-value', 'project']:
+        return state['project'] + '\n', False
+    if positionals[:3] == ['config', 'set', 'project']:
+        state['project'] = positionals[3]
+        return '', True
+
+    if positionals[:1] != ['container']:
+        raise FakeCloudError(f'ERROR: (gcloud) fake does not support: gcloud {" ".join(args)}')
+
+    group, verb, rest = positionals[1], positionals[2], positionals[3:]
+    zone = flags.get('--zone')
+    fmt = flags.get('--format')
+    is_async = bool(flags.get('--async'))
+
+    if group == 'clusters':
+        if verb == 'list':
+            clusters = [c for c in state['clusters'].values() if zone is None or c['zone'] == zone]
+            return _format_output(clusters, fmt), False
+        if verb == 'describe':
+            cluster = dict(_find_cluster(state, rest[0], zone))
+            cluster['currentNodeCount'] = sum(p['currentNodeCount'] for p in cluster['nodePools'])
+            return json.dumps(cluster, indent=2) + '\n', False
+        if verb == 'create':
+            name = rest[0]
+            if name in state['clusters']:
+                raise FakeCloudError(f'ERROR: (gcloud.container.clusters.create) Already exists: cluster {name}.')
+            num_nodes = int(flags.get('--num-nodes', 3))
+            pool = make_node_pool('default-pool', machine_type=flags.get('--machine-type', 'n1-standard-1'),
+                                  num_nodes=num_nodes)
+            state['clusters'][name] = make_cluster(name, zone, [pool])
+            return _start_operation(state, 'CREATE_CLUSTER', name, zone, is_async), True
+        if verb == 'delete':
+            _find_cluster(state, rest[0], zone)
+            del state['clusters'][rest[0]]
+            return _start_operation(state, 'DELETE_CLUSTER', rest[0], zone, is_async), True
+        if verb == 'resize':
+            cluster = _find_cluster(state, rest[0], zone)
+            pool = _find_pool(cluster, flags.get('--node-pool', 'default-pool'))
+            pool['currentNodeCount'] = int(flags['--num-nodes'])
+            return _start_operation(state, 'SET_NODE_POOL_SIZE', f'{rest[0]}/{pool["name"]}', zone, is_async), True
+
+    if group == 'node-pools':
+        cluster = _find_cluster(state, flags.get('--cluster'), zone)
+        if verb == 'list':
+            return _format_output(cluster['nodePools'], fmt), False
+        if verb == 'describe':
+            return json.dumps(_find_pool(cluster, rest[0]), indent=2) + '\n', False
+        if verb == 'create':
+            name = rest[0]
+            if any(p['name'] == name for p in cluster['nodePools']):
+                raise FakeCloudError(f'ERROR: (gcloud.container.node-pools.create) Already exists: node pool {name}.')
+            accelerator = None
+            if '--accelerator' in flags:
+                parts = dict(kv.split('=', 1) for kv in flags['--accelerator'].split(','))
+                accelerator = (parts['type'], int(parts.get('count', 1)))
+            cluster['nodePools'].append(make_node_pool(
+                name,
+                machine_type=flags.get('--machine-type', 'n1-standard-1'),
+                num_nodes=int(flags.get('--num-nodes', 3)),
+                min_nodes=int(flags.get('--min-nodes', 0)),
+                max_nodes=int(flags.get('--max-nodes', 3)),
+                preemptible=bool(flags.get('--preemptible')),
+                accelerator=accelerator,
+            ))
+            return _start_operation(state, 'CREATE_NODE_POOL', f'{cluster["name"]}/{name}', zone, is_async), True
+        if verb == 'delete':
+            pool = _find_pool(cluster, rest[0])
+            cluster['nodePools'].remove(pool)
+            return _start_operation(state, 'DELETE_NODE_POOL', f'{cluster["name"]}/{rest[0]}', zone, is_async), True
+
+    if group == 'operations':
+        if verb == 'list':
+            return _format_output(_get_operations(state, zone), fmt), False
+        if verb == 'describe':
+            for o in _get_operations(state, zone):
+                if o['name'] == rest[0]:
+                    return json.dumps(o, indent=2) + '\n', False
+            raise FakeCloudError(f'ERROR: (gcloud.container.operations.describe) Not found: operation {rest[0]}.')
+
+    raise FakeCloudError(f'ERROR: (gcloud) fake does not support: gcloud {" ".join(args)}')
+
+
+################################################################
+# kubectl
+################################################################
+def _kube_objects(state, object_type: Text) -> Dict[Text, Any]:
+    return state['kube'].setdefault(object_type, {})
+
+
+def _split_selector(selector: Text) -> List[Text]:
+    """'a=b,c in (d,e)' ==> ['a=b', 'c in (d,e)'], splitting on commas outside of parentheses"""
+    terms, depth, term = [], 0, ''
+    for c in selector:
+        depth += {'(': 1, ')': -1}.get(c, 0)
+        if c == ',' and depth == 0:
+            terms.append(term)
+            term = ''
+        else:
+            term += c
+    return terms + [term]
+
+
+def _matches_selector(obj: Dict[Text, Any], selector: Optional[Text]) -> bool:
+    if not selector:
+        return True
+    labels = obj.get('metadata', {}).get('labels', {}) or {}
+    for term in _split_selector(selector):
+        term = term.strip()
+        m = re.match(r'^(?P<key>\S+)\s+(?P<op>in|notin)\s+\((?P<values>.*)\)$', term)
+        if m:
+            values = [v.strip() for v in m.group('values').split(',')]
+            if (labels.get(m.group('key')) in values) != (m.group('op') == 'in'):
+                return False
+        elif '!=' in term:
+            k, v = term.split('!=', 1)
+            if labels.get(k) == v:
+                return False
+        elif '=' in term:
+            k, v = term.split('=', 1)
+            if labels.get(k) != v.lstrip('='):
+                return False
+        elif term.startswith('!'):
+            if term[1:] in labels:
+                return False
+        elif term not in labels:
+            return False
+    return True
+
+
+def _not_found(object_type, name):
+    return FakeCloudError(f'Error from server (NotFound): {object_type}s "{name}" not found')
+
+
+def _format_kube(obj: Any, fmt: Optional[Text]) -> Text:
+    if fmt == 'name':
+        items = obj['items'] if obj.get('kind') == 'List' else [obj]
+        return ''.join(f'{o["kind"].lower()}/{o["metadata"]["name"]}\n' for o in items)
+    if fmt == 'yaml':
+        return yaml.safe_dump(obj)
+    if fmt is not None and fmt.startswith('jsonpath='):
+        raise FakeCloudError(f'error: fake does not support -o {fmt}')
+    return json.dumps(obj, indent=2) + '\n'
+
+
+def _split_types(type_arg: Text) -> List[Text]:
+    return [KUBE_TYPE_ALIASES.get(t, t) for t in type_arg.split(',')]
+
+
+def _apply(state, obj: Dict[Text, Any]) -> Text:
+    object_type = obj['kind'].lower()
+    name = obj['metadata']['name']
+    objects = _kube_objects(state, object_type)
+    action = 'configured' if name in objects else 'created'
+    obj = dict(obj)
+    obj['metadata'] = dict(obj['metadata'])
+    obj['metadata']['resourceVersion'] = str(state['next_id'])
+    state['next_id'] += 1
+    if object_type == 'service':
+        obj['status'] = {'loadBalancer': {'ingress': [{'ip': _fake_ip(name)}]}}
+    if object_type == 'deployment':
+        replicas = obj.get('spec', {}).get('replicas', 1)
+        obj['status'] = {'replicas': replicas, 'readyReplicas': replicas, 'availableReplicas': replicas}
+    objects[name] = obj
+    return f'{object_type}/{name} {action}\n'
+
+
+def run_kubectl(state, args: List[Text], stdin: Text) -> Tuple[Text, bool]:
+    positionals, flags = parse_args(args)
+    verb, rest = positionals[0], positionals[1:]
+    selector = flags.get('-l', flags.get('--selector'))
+    fmt = flags.get('-o', flags.get('--output'))
+
+    if verb == 'get':
+        object_types = _split_types(rest[0])
+        names = rest[1:]
+        if names:
+            if len(object_types) != 1:
+                raise FakeCloudError('error: fake only gets named objects of one type')
+            objects = _kube_objects(state, object_types[0])
+            found = []
+            for name in names:
+                if name not in objects:
+                    if flags.get('--ignore-not-found'):
+                        continue
+                    raise _not_found(object_types[0], name)
+                found.append(objects[name])
+            if not found:
+                return '', False
+            if len(found) == 1:
+                return _format_kube(found[0], fmt), False
+            return _format_kube({'apiVersion': 'v1', 'kind': 'List', 'items': found}, fmt), False
+        items = []
+        for object_type in object_types:
+            items += [o for o in _kube_objects(state, object_type).values() if _matches_selector(o, selector)]
+        return _format_kube({'apiVersion': 'v1', 'kind': 'List', 'items': items}, fmt), False
+
+    if verb == 'delete':
+        ignore_not_found = bool(flags.get('--ignore-not-found'))
+        out = ''
+        for object_type in _split_types(rest[0]):
+            objects = _kube_objects(state, object_type)
+            if rest[1:]:
+                names = rest[1:]
+            else:
+                if selector is None and not flags.get('--all'):
+                    raise FakeCloudError('error: resource(s) were provided, but no name was specified')
+                names = [n for n, o in objects.items() if _matches_selector(o, selector)]
+            for name in names:
+                if name not in objects:
+                    if ignore_not_found:
+                        continue
+                    raise _not_found(object_type, name)
+                del objects[name]
+                out += f'{object_type} "{name}" deleted\n'
+        return out, True
+
+    if verb == 'apply':
+        if flags.get('-f') != '-':
+            raise FakeCloudError('error: fake only supports kubectl apply -f -')
+        out = ''
+        for doc in yaml.safe_load_all(stdin):
+            if not doc:
+                continue
+            docs = doc['items'] if doc.get('kind') == 'List' else [doc]
+            for obj in docs:
+                out += _apply(state, obj)
+        return out, True
+
+    if verb == 'create':
+        if rest[0] == 'secret':
+            name = rest[2]
+            data = {}
+            for f in _get_list(flags, '--from-file'):
+                key, _, path = f.rpartition('=') if '=' in f else (os.path.basename(f), '', f)
+                with open(path, 'rb') as fh:
+                    data[key] = base64.b64encode(fh.read()).decode('ascii')
+            for literal in _get_list(flags, '--from-literal'):
+                key, value = literal.split('=', 1)
+                data[key] = base64.b64encode(value.encode('utf-8')).decode('ascii')
+            obj = {'apiVersion': 'v1', 'kind': 'Secret', 'type': 'Opaque', 'metadata': {'name': name}, 'data': data}
+        else:
+            object_type = KUBE_TYPE_ALIASES.get(rest[0], rest[0])
+            name = rest[1]
+            obj = {'apiVersion': 'v1', 'kind': object_type.capitalize(), 'metadata': {'name': name}}
+        object_type = obj['kind'].lower()
+        if name in _kube_objects(state, object_type):
+            raise FakeCloudError(f'Error from server (AlreadyExists): {object_type}s "{name}" already exists')
+        _kube_objects(state, object_type)[name] = obj
+        return f'{object_type}/{name} created\n', True
+
+    if verb == 'wait':
+        # everything in the fake is ready as soon as it's applied
+        return '', False
+
+    raise FakeCloudError(f'error: fake does not support: kubectl {" ".join(args)}')
+
+
+################################################################
+# main
+################################################################
+def _should_fail(state, call_str: Text) -> bool:
+    pattern = os.environ.get(FAIL_PATTERN_ENV)
+    if not pattern or not re.search(pattern, call_str):
+        return False
+    if state['injected_failures'] >= int(os.environ.get(FAIL_TIMES_ENV, '1')):
+        return False
+    state['injected_failures'] += 1
+    return True
+
+
+def main(argv: List[Text]) -> int:
+    command, args = argv[1], argv[2:]
+    start = time.time()
+    # only `kubectl apply -f -` reads stdin.  other callers may leave an open, empty pipe there.
+    stdin = sys.stdin.read() if command == 'kubectl' and args[:1] == ['apply'] else ''
+    call_str = ' '.join([command] + args)
+
+    latency = float(os.environ.get(LATENCY_ENV, '0')) / 1000.0
+    if latency:
+        time.sleep(latency)
+
+    exitcode, stdout, stderr, mutated = 0, '', '', False
+    store = FakeCloudState(os.environ[STATE_ENV])
+    with store.transaction() as state:
+        original = json.dumps(state)
+        try:
+            if _should_fail(state, call_str):
+                raise FakeCloudError(f'ERROR: injected failure for: {call_str}')
+            runner = run_gcloud if command == 'gcloud' else run_kubectl
+            stdout, mutated = runner(state, args, stdin)
+        except FakeCloudError as e:
+            exitcode, stderr = 1, str(e) + '\n'
+            # failed calls change nothing, but injected failures are still counted
+            injected_failures = state['injected_failures']
+            state.clear()
+            state.update(json.loads(original))
+            state['injected_failures'] = injected_failures
+
+    mutation_latency = float(os.environ.get(MUTATION_LATENCY_ENV, '0')) / 1000.0
+    # --async calls return as soon as the operation is accepted; SPIN_FAKE_OPERATION_SECONDS models the rest
+    if mutated and mutation_latency and '--async' not in args:
+        time.sleep(mutation_latency)
+
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+
+    call_log = os.environ.get(CALL_LOG_ENV)
+    if call_log:
+        line = json.dumps({
+            'argv': [command] + args,
+            'name': get_call_name([command] + args),
+            'exitcode': exitcode,
+            'start': start,
+            'duration': time.time() - start,
+        }) + '\n'
+        # one O_APPEND write per call keeps concurrent callers' lines whole
+        fd = os.open(call_log, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    return exitcode
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -7,8 +7,8 @@ setup(
     author='"Kevin Bache" <kevin.bache@gmail.com>',
     install_requires=[
         'Click',
-        'cookiecutter',
-        'sshconf',
+        'Jinja2',
+        'PyYAML',
     ],
     packages=find_packages(),
     classifiers=[],
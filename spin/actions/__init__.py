@@ -4,6 +4,8 @@ from flask import Flask, request, jsonify
 import requests
 from typing import Dict, Text, Any
 
+from spin import tracing
+
 app = Flask(__name__)
 
 
@@ -136,7 +138,9 @@ class Server:
     def run_action(self, a: Action) -> requests.Response:
         """Run both the local and remote halves of the given Action."""
         url = f'http://{self.host}:{self.port}/{a.route}'
-        response = requests.post(url=url, json=a.local())
+        with tracing.span(f'action {a.route}', category='http', url=url) as span:
+            response = requests.post(url=url, json=a.local())
+            span.set(status_code=response.status_code, response_bytes=len(response.content))
         return response
 
     def debug_serve(self):
@@ -0,0 +1,353 @@
+"""This module sizes node pools to the backlog of spin work waiting to run on them.
+
+Every step, the Autoscaler takes one snapshot of the cluster (see GkeCluster.get_state) and one of the backlog (by
+default, every pod's node pool and phase from one `kubectl get pods`).  It asks `decide` for each pool's target size
+and launches every resize together, through the cluster's OperationTracker.
+
+`decide` is a pure function of a pool's policy, what was observed and what the autoscaler did before, so scaling
+behavior can be tested against a simulated backlog without a cluster:
+    * pools scale up as soon as there's pending work, but no more often than scale_up_cooldown
+    * pools scale down only after demand has stayed below their size for scale_down_delay (hysteresis) and no more
+      often than scale_down_cooldown, so a short lull doesn't throw away warm nodes
+    * pools with scale_to_zero, e.g.: GPU pools, go all the way to zero nodes when idle
+    * prewarm windows raise a pool's floor ahead of predictable bursts, e.g.: weekday mornings
+"""
+import abc
+import datetime
+import json
+import math
+import threading
+import time
+from typing import Text, Dict, List, Optional, Iterable, Tuple, Callable
+
+from spin import cluster as cluster_module
+from spin import placement, tracing, utils
+
+NODE_POOL_LABEL = placement.NODE_POOL_LABEL
+
+
+class PrewarmWindow(utils.DictBouncer):
+    def __init__(
+            self,
+            start_hour: int,
+            start_minute: int = 0,
+            duration_minutes: int = 60,
+            min_nodes: int = 1,
+            lead_minutes: int = 10,
+            weekdays: Iterable[int] = (0, 1, 2, 3, 4),
+    ):
+        """
+        A recurring period during which a pool keeps at least min_nodes nodes.
+
+        Args:
+            start_hour: local time the burst is expected, e.g.: 9 for 9am
+            start_minute: see start_hour
+            duration_minutes: how long to hold the floor after start
+            min_nodes: the floor
+            lead_minutes: start scaling up this long before start, since nodes take minutes to come up
+            weekdays: days of the week the window applies to.  Monday is 0.
+        """
+        super().__init__()
+        self.start_hour = start_hour
+        self.start_minute = start_minute
+        self.duration_minutes = duration_minutes
+        self.min_nodes = min_nodes
+        self.lead_minutes = lead_minutes
+        self.weekdays = list(weekdays)
+
+    def is_active(self, now: float) -> bool:
+        t = datetime.datetime.fromtimestamp(now)
+        # look at today's window and yesterday's, in case yesterday's window runs past midnight
+        for days_ago in (0, 1):
+            day = t - datetime.timedelta(days=days_ago)
+            if day.weekday() not in self.weekdays:
+                continue
+            start = day.replace(hour=self.start_hour, minute=self.start_minute, second=0, microsecond=0)
+            warm_from = start - datetime.timedelta(minutes=self.lead_minutes)
+            warm_until = start + datetime.timedelta(minutes=self.duration_minutes)
+            if warm_from <= t < warm_until:
+                return True
+        return False
+
+
+class PoolScalingPolicy(utils.DictBouncer):
+    def __init__(
+            self,
+            pool_name: Text,
+            min_nodes: int = 0,
+            max_nodes: int = 5,
+            tasks_per_node: int = 1,
+            headroom_nodes: int = 0,
+            scale_to_zero: bool = True,
+            scale_up_cooldown: float = 60.0,
+            scale_down_cooldown: float = 300.0,
+            scale_down_delay: float = 600.0,
+            prewarm_windows: Iterable[PrewarmWindow] = (),
+    ):
+        """
+        How one node pool should follow its backlog.
+
+        Args:
+            pool_name: the node pool's name
+            min_nodes: never go below this many nodes, prewarm windows aside
+            max_nodes: never go above this many nodes
+            tasks_per_node: how many tasks fit on one node, e.g.: 1 for a pool of single-GPU nodes
+            headroom_nodes: keep this many spare nodes while there is any work, so new tasks start right away
+            scale_to_zero: if False, keep at least one node even when idle
+            scale_up_cooldown: seconds to wait after any resize of this pool before growing it again
+            scale_down_cooldown: seconds to wait after any resize of this pool before shrinking it
+            scale_down_delay: seconds demand must stay below the pool's size before shrinking it
+            prewarm_windows: periods when the pool should have at least the window's min_nodes
+        """
+        super().__init__()
+        if min_nodes > max_nodes:
+            raise ValueError(f"min_nodes, {min_nodes}, is greater than max_nodes, {max_nodes}.")
+        if tasks_per_node < 1:
+            raise ValueError(f"tasks_per_node must be at least 1 but got {tasks_per_node}.")
+        self.pool_name = pool_name
+        self.min_nodes = min_nodes
+        self.max_nodes = max_nodes
+        self.tasks_per_node = tasks_per_node
+        self.headroom_nodes = headroom_nodes
+        self.scale_to_zero = scale_to_zero
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.scale_down_delay = scale_down_delay
+        self.prewarm_windows = list(prewarm_windows)
+
+    @classmethod
+    def from_dict(cls, d):
+        if not d:
+            return None
+        d = dict(d)
+        d['prewarm_windows'] = [PrewarmWindow.from_dict(w) for w in d.get('prewarm_windows', [])]
+        return cls(**d)
+
+    def get_floor(self, now: float) -> int:
+        floor = self.min_nodes
+        for window in self.prewarm_windows:
+            if window.is_active(now):
+                floor = max(floor, window.min_nodes)
+        if not self.scale_to_zero:
+            floor = max(floor, 1)
+        return min(floor, self.max_nodes)
+
+
+class PoolObservation(utils.DictBouncer):
+    def __init__(self, pool_name: Text, current_nodes: int, pending_tasks: int = 0, running_tasks: int = 0):
+        """What the autoscaler saw for one pool: its size and the tasks waiting for and running on it."""
+        super().__init__()
+        self.pool_name = pool_name
+        self.current_nodes = current_nodes
+        self.pending_tasks = pending_tasks
+        self.running_tasks = running_tasks
+
+
+class PoolScalingHistory(utils.DictBouncer):
+    def __init__(self, last_resize_time: Optional[float] = None, below_size_since: Optional[float] = None):
+        """What the autoscaler has done to one pool and for how long demand has been below its size."""
+        super().__init__()
+        self.last_resize_time = last_resize_time
+        self.below_size_since = below_size_since
+
+
+class ScalingDecision(utils.DictBouncer):
+    HOLD = 'hold'
+    SCALE_UP = 'scale_up'
+    SCALE_DOWN = 'scale_down'
+
+    def __init__(self, pool_name: Text, current_nodes: int, target_nodes: int, action: Text, reason: Text):
+        super().__init__()
+        self.pool_name = pool_name
+        self.current_nodes = current_nodes
+        self.target_nodes = target_nodes
+        self.action = action
+        self.reason = reason
+
+    def is_resize(self) -> bool:
+        return self.action != self.HOLD
+
+
+def get_demand_nodes(policy: PoolScalingPolicy, observation: PoolObservation) -> int:
+    tasks = observation.pending_tasks + observation.running_tasks
+    if tasks == 0:
+        return 0
+    return math.ceil(tasks / policy.tasks_per_node) + policy.headroom_nodes
+
+
+def decide(
+        policy: PoolScalingPolicy,
+        observation: PoolObservation,
+        history: PoolScalingHistory,
+        now: float,
+) -> ScalingDecision:
+    """Choose one pool's target size.  Pure: doesn't change history or touch the cluster."""
+    current = observation.current_nodes
+    demand = get_demand_nodes(policy, observation)
+    floor = policy.get_floor(now)
+    desired = min(max(demand, floor), policy.max_nodes)
+    since_resize = math.inf if history.last_resize_time is None else now - history.last_resize_time
+
+    def hold(reason):
+        return ScalingDecision(policy.pool_name, current, current, ScalingDecision.HOLD, reason)
+
+    if desired > current:
+        if since_resize < policy.scale_up_cooldown:
+            return hold(f'scale up to {desired} waiting for cooldown')
+        reason = f'{observation.pending_tasks} pending and {observation.running_tasks} running tasks need {demand}'
+        if floor > demand:
+            reason = f'prewarm or minimum floor of {floor}'
+        return ScalingDecision(policy.pool_name, current, desired, ScalingDecision.SCALE_UP, reason)
+
+    if desired < current:
+        below_since = history.below_size_since if history.below_size_since is not None else now
+        if now - below_since < policy.scale_down_delay:
+            return hold(f'demand below size for {now - below_since:.0f}s of {policy.scale_down_delay:.0f}s')
+        if since_resize < policy.scale_down_cooldown:
+            return hold(f'scale down to {desired} waiting for cooldown')
+        reason = 'idle' if demand == 0 else f'{demand} nodes needed'
+        return ScalingDecision(policy.pool_name, current, desired, ScalingDecision.SCALE_DOWN, reason)
+
+    return hold('at target')
+
+
+def update_history(
+        history: PoolScalingHistory,
+        observation: PoolObservation,
+        decision: ScalingDecision,
+        policy: PoolScalingPolicy,
+        now: float,
+) -> PoolScalingHistory:
+    """The history after acting on decision."""
+    if decision.is_resize():
+        return PoolScalingHistory(last_resize_time=now, below_size_since=None)
+
+    desired = min(max(get_demand_nodes(policy, observation), policy.get_floor(now)), policy.max_nodes)
+    if desired < observation.current_nodes:
+        below_since = history.below_size_since if history.below_size_since is not None else now
+    else:
+        below_since = None
+    return PoolScalingHistory(last_resize_time=history.last_resize_time, below_size_since=below_since)
+
+
+class BacklogSource(abc.ABC):
+    @abc.abstractmethod
+    def get_backlog(self) -> Dict[Text, Tuple[int, int]]:
+        """Map each node pool name to its (pending, running) task counts."""
+        pass
+
+
+class KubernetesPodBacklog(BacklogSource, utils.ShellRunnerMixin):
+    """Counts pods by the node pool they select, with one `kubectl get pods` call.
+
+    Pods pick their pool with a nodeSelector on the GKE node pool label (see spin.placement).  Pods which don't select
+    a pool aren't counted.
+    """
+    def __init__(self, label_selector: Optional[Text] = None, verbose=True):
+        super().__init__(verbose)
+        self.label_selector = label_selector
+
+    def get_backlog(self) -> Dict[Text, Tuple[int, int]]:
+        selector = f' -l {self.label_selector}' if self.label_selector else ''
+        _, out, _ = self._run(f'kubectl get pods{selector} -o json')
+        backlog = {}
+        for pod in json.loads(out)['items']:
+            pool_name = (pod.get('spec', {}).get('nodeSelector') or {}).get(NODE_POOL_LABEL)
+            if pool_name is None:
+                continue
+            phase = pod.get('status', {}).get('phase', 'Pending')
+            pending, running = backlog.get(pool_name, (0, 0))
+            if phase == 'Pending':
+                pending += 1
+            elif phase == 'Running':
+                running += 1
+            backlog[pool_name] = (pending, running)
+        return backlog
+
+
+class Autoscaler:
+    def __init__(
+            self,
+            cluster: cluster_module.GkeCluster,
+            policies: Iterable[PoolScalingPolicy],
+            backlog_source: Optional[BacklogSource] = None,
+            clock: Callable[[], float] = time.time,
+            verbose=True,
+    ):
+        """
+        Args:
+            cluster: the cluster whose node pools are scaled.  Its OperationTracker watches the resizes.
+            policies: one per node pool to scale.  Pools without a policy are left alone.
+            backlog_source: where pending and running task counts come from.  Defaults to KubernetesPodBacklog.
+            clock: returns the current time in seconds since the epoch
+            verbose: if True, print every resize
+        """
+        self.cluster = cluster
+        self.policies = {p.pool_name: p for p in policies}
+        self.backlog_source = backlog_source if backlog_source is not None else KubernetesPodBacklog(verbose=verbose)
+        self.clock = clock
+        self.verbose = verbose
+
+        self.histories = {name: PoolScalingHistory() for name in self.policies}
+        # the size spin last asked for, for when GKE's snapshot doesn't report current sizes
+        self._requested_sizes = {}
+        self._resizes_in_flight = {}
+
+    def observe(self) -> Dict[Text, PoolObservation]:
+        """One cluster describe and one backlog query for every pool."""
+        state = self.cluster.get_state(refresh=True)
+        if state is None:
+            raise ValueError(f"Cluster {self.cluster.name} doesn't exist.")
+        backlog = self.backlog_source.get_backlog()
+
+        observations = {}
+        for name in self.policies:
+            pool_state = state.node_pools.get(name)
+            if pool_state is None or name not in self.cluster.node_pools:
+                raise ValueError(f"Cluster {self.cluster.name} has no node pool named {name}.")
+            current = pool_state.current_node_count
+            if current is None:
+                current = self._requested_sizes.get(name, pool_state.initial_node_count)
+            pending, running = backlog.get(name, (0, 0))
+            observations[name] = PoolObservation(name, current, pending, running)
+        return observations
+
+    def step(self) -> List[ScalingDecision]:
+        """Observe, decide and launch every needed resize together.  Returns every pool's decision."""
+        with tracing.span('autoscaler step', category='autoscaler'):
+            now = self.clock()
+            observations = self.observe()
+
+            decisions, resizes = [], {}
+            for name, policy in self.policies.items():
+                in_flight = self._resizes_in_flight.get(name)
+                if in_flight is not None and not in_flight.done():
+                    current = observations[name].current_nodes
+                    decisions.append(ScalingDecision(name, current, current, ScalingDecision.HOLD, 'resize in flight'))
+                    continue
+
+                decision = decide(policy, observations[name], self.histories[name], now)
+                self.histories[name] = update_history(self.histories[name], observations[name], decision, policy, now)
+                decisions.append(decision)
+                if decision.is_resize():
+                    resizes[name] = decision.target_nodes
+                    if self.verbose:
+                        print(f"Resizing {name} from {decision.current_nodes} to {decision.target_nodes}: "
+                              f"{decision.reason}")
+
+            if resizes:
+                self._resizes_in_flight.update(self.cluster.resize_node_pools(resizes))
+                self._requested_sizes.update(resizes)
+
+        return decisions
+
+    def run(self, interval: float = 30.0, stop_event: Optional[threading.Event] = None):
+        """Step every interval seconds until stop_event is set."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                # keep scaling through transient gcloud or kubectl errors
+                print(f"Autoscaler step failed: {e}")
+            stop_event.wait(interval)
@@ -0,0 +1,530 @@
+"""This module lets long-running Tasks survive their pods being preempted.
+
+Every NodePool is preemptible by default, so a node can be reclaimed with about 30 seconds of warning.  The pieces:
+    * A BlobStore holds checkpoints durably: LocalBlobStore for a persistent disk mounted into the pod or
+      SimulatedObjectStore, a stand-in for an object store like GCS which charges latency and bandwidth per request.
+    * A Checkpointer snapshots a task's state, a dict of named parts, and writes it in a background thread so the
+      task keeps running.  Parts are content addressed, so each checkpoint only uploads the parts which changed
+      since the last one.  A checkpoint's manifest is written after its parts, so a reader never sees a partial one.
+    * A PreemptionWatcher notices the termination notice: SIGTERM from the kubelet or, by polling, the GCE metadata
+      server's `preempted` flag.  Tests and simulations can use a file in place of the metadata server.
+    * A ResumableTask runs in steps, checkpoints periodically, flushes a final checkpoint when it gets the notice and
+      picks up from the latest checkpoint when its replacement pod starts:
+
+    class Train(ResumableTask):
+        def get_num_steps(self, data): return 10000
+        def get_initial_state(self, data): return {'weights': init_weights(), 'step_losses': []}
+        def run_step(self, state, step, data): ...
+
+    store = LocalBlobStore('/mnt/checkpoints')
+    with PreemptionWatcher(GceMetadataSource()) as watcher:
+        Train(Checkpointer(store, prefix='train'), watcher)(data)
+"""
+import abc
+import concurrent.futures
+import hashlib
+import json
+import pickle
+import signal
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Text, Dict, List, Optional, Any, Callable, Tuple, Union
+
+from spin import task, tracing, utils
+
+
+class BlobStore(abc.ABC):
+    """A flat key -> bytes store.  Keys look like paths, e.g.: train/manifests/000000000100.json"""
+    @abc.abstractmethod
+    def put(self, key: Text, data: bytes):
+        pass
+
+    @abc.abstractmethod
+    def get(self, key: Text) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def exists(self, key: Text) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def list(self, prefix: Text = '') -> List[Text]:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: Text):
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under a directory.  Writes are atomic, so a preempted write never leaves a partial blob."""
+    def __init__(self, directory: Union[Text, Path]):
+        self.directory = utils.resolve_path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _get_path(self, key: Text) -> Path:
+        return self.directory / key
+
+    def put(self, key: Text, data: bytes):
+        path = self._get_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        utils.atomic_write_bytes(path, data)
+
+    def get(self, key: Text) -> bytes:
+        path = self._get_path(key)
+        if not path.exists():
+            raise IOError(f"There's no blob named {key} in {self.directory}")
+        return path.read_bytes()
+
+    def exists(self, key: Text) -> bool:
+        return self._get_path(key).exists()
+
+    def list(self, prefix: Text = '') -> List[Text]:
+        keys = []
+        for path in self.directory.rglob('*'):
+            # skip directories and the temp files of writes in progress
+            if path.is_file() and not path.name.startswith('.'):
+                key = path.relative_to(self.directory).as_posix()
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, key: Text):
+        path = self._get_path(key)
+        if path.exists():
+            path.unlink()
+
+
+class SimulatedObjectStore(LocalBlobStore):
+    def __init__(self, directory: Union[Text, Path], latency_seconds=.05, bandwidth_mb_per_second=100.0):
+        """
+        A stand-in for an object store, e.g.: GCS, backed by a local directory.  Every request sleeps for
+        latency_seconds plus its transfer time and is counted.
+
+        Args:
+            directory: where the blobs live
+            latency_seconds: the fixed cost of each request
+            bandwidth_mb_per_second: the transfer rate for puts and gets
+        """
+        super().__init__(directory)
+        self.latency_seconds = latency_seconds
+        self.bandwidth_mb_per_second = bandwidth_mb_per_second
+        self.num_requests = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def _request(self, num_bytes=0):
+        with self._lock:
+            self.num_requests += 1
+        time.sleep(self.latency_seconds + num_bytes / (self.bandwidth_mb_per_second * 1e6))
+
+    def put(self, key: Text, data: bytes):
+        self._request(len(data))
+        with self._lock:
+            self.bytes_written += len(data)
+        super().put(key, data)
+
+    def get(self, key: Text) -> bytes:
+        data = super().get(key)
+        self._request(len(data))
+        with self._lock:
+            self.bytes_read += len(data)
+        return data
+
+    def exists(self, key: Text) -> bool:
+        self._request()
+        return super().exists(key)
+
+    def list(self, prefix: Text = '') -> List[Text]:
+        self._request()
+        return super().list(prefix)
+
+    def delete(self, key: Text):
+        self._request()
+        super().delete(key)
+
+
+class Checkpoint(utils.DictBouncer):
+    def __init__(self, step: int, parts: Dict[Text, Text], created_at: float, metadata: Optional[Dict] = None):
+        """
+        A checkpoint's manifest.
+
+        Args:
+            step: the number of steps finished when the checkpoint was taken
+            parts: state part name -> sha256 of its serialized contents
+            created_at: when the checkpoint was taken
+            metadata: anything else worth recording, e.g.: the reason it was taken
+        """
+        super().__init__()
+        self.step = step
+        self.parts = parts
+        self.created_at = created_at
+        self.metadata = metadata if metadata is not None else {}
+
+
+class Checkpointer:
+    def __init__(
+            self,
+            store: BlobStore,
+            prefix: Text = 'checkpoints',
+            keep: int = 3,
+            serialize: Callable[[Any], bytes] = pickle.dumps,
+            deserialize: Callable[[bytes], Any] = pickle.loads,
+    ):
+        """
+        Writes checkpoints to a store in the background and reads them back.
+
+        Args:
+            store: where checkpoints go
+            prefix: the key prefix for this task's checkpoints.  Use one per task.
+            keep: how many of the latest checkpoints to keep.  Older ones and parts no one uses are deleted.
+            serialize: turns a state part into bytes
+            deserialize: the inverse of serialize
+        """
+        if keep < 1:
+            raise ValueError(f"keep must be at least 1 but got {keep}")
+        self.store = store
+        self.prefix = prefix.strip('/')
+        self.keep = keep
+        self.serialize = serialize
+        self.deserialize = deserialize
+
+        self.last_saved_step = None
+        self.num_parts_written = 0
+        self.num_parts_skipped = 0
+
+        # one writer thread keeps checkpoints in step order
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stored_digests = set()
+        self._manifests = {}
+
+    def _get_blob_key(self, digest: Text) -> Text:
+        return f'{self.prefix}/blobs/{digest}'
+
+    def _get_manifest_key(self, step: int) -> Text:
+        return f'{self.prefix}/manifests/{step:012d}.json'
+
+    def save(self, step: int, state: Dict[Text, Any], metadata: Optional[Dict] = None) -> concurrent.futures.Future:
+        """Snapshot state now and write it in the background.
+
+        The state is serialized before this returns, so the caller is free to keep changing it.
+
+        Returns:
+            A Future for the written Checkpoint.
+        """
+        with tracing.span('checkpoint.serialize', category='checkpoint', step=step):
+            blobs = {name: self.serialize(value) for name, value in state.items()}
+        future = self._executor.submit(self._write, step, blobs, metadata)
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()] + [future]
+        return future
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until every checkpoint which has been saved is in the store.  Raises if any write failed."""
+        with self._lock:
+            pending = list(self._pending)
+        _, not_done = concurrent.futures.wait(pending, timeout=timeout)
+        if not_done:
+            raise TimeoutError(f"{len(not_done)} checkpoints still being written after {timeout}s")
+        for future in pending:
+            future.result()
+
+    def close(self, timeout: Optional[float] = None):
+        self.wait(timeout)
+        self._executor.shutdown(wait=True)
+
+    def _write(self, step: int, blobs: Dict[Text, bytes], metadata: Optional[Dict]) -> Checkpoint:
+        with tracing.span('checkpoint.write', category='checkpoint', step=step) as span:
+            parts = {}
+            num_bytes = 0
+            for name, data in blobs.items():
+                digest = hashlib.sha256(data).hexdigest()
+                if digest in self._stored_digests:
+                    self.num_parts_skipped += 1
+                else:
+                    self.store.put(self._get_blob_key(digest), data)
+                    self._stored_digests.add(digest)
+                    self.num_parts_written += 1
+                    num_bytes += len(data)
+                parts[name] = digest
+
+            checkpoint = Checkpoint(step=step, parts=parts, created_at=time.time(), metadata=metadata)
+            # the manifest goes last, so a checkpoint never shows up before all of its parts have
+            self.store.put(self._get_manifest_key(step), json.dumps(checkpoint.to_dict()).encode('utf-8'))
+            self._manifests[step] = checkpoint
+            self.last_saved_step = step
+            span.set(bytes_written=num_bytes)
+
+        self._prune()
+        return checkpoint
+
+    def list_steps(self) -> List[int]:
+        """The steps of every complete checkpoint in the store, oldest first."""
+        keys = self.store.list(f'{self.prefix}/manifests/')
+        return sorted(int(Path(key).stem) for key in keys if key.endswith('.json'))
+
+    def get_latest_step(self) -> Optional[int]:
+        steps = self.list_steps()
+        return steps[-1] if steps else None
+
+    def get_checkpoint(self, step: int) -> Checkpoint:
+        if step not in self._manifests:
+            d = json.loads(self.store.get(self._get_manifest_key(step)).decode('utf-8'))
+            self._manifests[step] = Checkpoint.from_dict(d)
+        return self._manifests[step]
+
+    def restore(self, step: Optional[int] = None) -> Optional[Tuple[Checkpoint, Dict[Text, Any]]]:
+        """Load a checkpoint's state.
+
+        Args:
+            step: the checkpoint to load.  Defaults to the latest.
+
+        Returns:
+            The checkpoint and its state or None if there are no checkpoints.
+        """
+        if step is None:
+            step = self.get_latest_step()
+            if step is None:
+                return None
+
+        with tracing.span('checkpoint.restore', category='checkpoint', step=step):
+            checkpoint = self.get_checkpoint(step)
+            state = {
+                name: self.deserialize(self.store.get(self._get_blob_key(digest)))
+                for name, digest in checkpoint.parts.items()
+            }
+        # parts which don't change, e.g.: a task's config, won't be uploaded again after a resume
+        self._stored_digests.update(checkpoint.parts.values())
+        return checkpoint, state
+
+    def _prune(self):
+        steps = self.list_steps()
+        old_steps = steps[:-self.keep]
+        if not old_steps:
+            return
+        for step in old_steps:
+            self.store.delete(self._get_manifest_key(step))
+            self._manifests.pop(step, None)
+
+        used_digests = set()
+        for step in steps[-self.keep:]:
+            used_digests.update(self.get_checkpoint(step).parts.values())
+        blob_prefix = f'{self.prefix}/blobs/'
+        for key in self.store.list(blob_prefix):
+            digest = key[len(blob_prefix):]
+            if digest not in used_digests:
+                self.store.delete(key)
+                self._stored_digests.discard(digest)
+
+
+class MetadataSource(abc.ABC):
+    """Somewhere to check whether this machine is about to be reclaimed."""
+    @abc.abstractmethod
+    def is_preempted(self) -> bool:
+        pass
+
+
+class GceMetadataSource(MetadataSource):
+    """The GCE metadata server's preempted flag, which flips to TRUE when the preemption notice goes out.
+
+    ref: https://cloud.google.com/compute/docs/instances/create-start-preemptible-instance#detecting_if_an_instance_was_preempted
+    """
+    URL = 'http://metadata.google.internal/computeMetadata/v1/instance/preempted'
+
+    def __init__(self, timeout_seconds=1.0):
+        self.timeout_seconds = timeout_seconds
+
+    def is_preempted(self) -> bool:
+        request = urllib.request.Request(self.URL, headers={'Metadata-Flavor': 'Google'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+                return response.read().decode('utf-8').strip().upper() == 'TRUE'
+        except (OSError, ValueError):
+            # off GCE or the metadata server is busy.  either way, there's no notice.
+            return False
+
+
+class FileMetadataSource(MetadataSource):
+    """Simulates the metadata server with a file.  Write TRUE to it to send the preemption notice."""
+    def __init__(self, filename: Union[Text, Path]):
+        self.path = Path(filename)
+
+    def is_preempted(self) -> bool:
+        try:
+            return self.path.read_text().strip().upper() == 'TRUE'
+        except IOError:
+            return False
+
+    def set_preempted(self, is_preempted=True):
+        utils.atomic_write_text(self.path, 'TRUE' if is_preempted else 'FALSE')
+
+
+class PreemptionWatcher:
+    def __init__(
+            self,
+            metadata_source: Optional[MetadataSource] = None,
+            poll_interval: float = 1.0,
+            handle_sigterm: bool = True,
+    ):
+        """
+        Notices when this pod is about to go away.
+
+        Args:
+            metadata_source: polled every poll_interval seconds, if given
+            poll_interval: see metadata_source
+            handle_sigterm: treat SIGTERM as the notice.  Only possible from the main thread.
+        """
+        self.metadata_source = metadata_source
+        self.poll_interval = poll_interval
+        self.handle_sigterm = handle_sigterm
+
+        self.reason = None
+        self.notice_time = None
+        self._event = threading.Event()
+        self._stop = threading.Event()
+        self._poller = None
+        self._previous_sigterm_handler = None
+
+    def start(self) -> 'PreemptionWatcher':
+        if self.handle_sigterm and threading.current_thread() is threading.main_thread():
+            self._previous_sigterm_handler = signal.signal(signal.SIGTERM, self._on_sigterm)
+        if self.metadata_source is not None and self._poller is None:
+            self._stop.clear()
+            self._poller = threading.Thread(target=self._poll, name='spin-preemption-watcher', daemon=True)
+            self._poller.start()
+        return self
+
+    def stop(self):
+        if self._previous_sigterm_handler is not None:
+            signal.signal(signal.SIGTERM, self._previous_sigterm_handler)
+            self._previous_sigterm_handler = None
+        if self._poller is not None:
+            self._stop.set()
+            self._poller.join()
+            self._poller = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def trigger(self, reason: Text = 'manual'):
+        """Record the preemption notice.  Only the first notice counts."""
+        if not self._event.is_set():
+            self.reason = reason
+            self.notice_time = time.time()
+            self._event.set()
+
+    def is_preempted(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    def _on_sigterm(self, signum, frame):
+        self.trigger('SIGTERM')
+
+    def _poll(self):
+        while not self._stop.is_set() and not self._event.is_set():
+            if self.metadata_source.is_preempted():
+                self.trigger('metadata')
+                return
+            self._stop.wait(self.poll_interval)
+
+
+class PreemptedError(Exception):
+    """Raised by a ResumableTask which stopped because of a preemption notice, after saving its checkpoint."""
+    def __init__(self, step: int, reason: Optional[Text] = None):
+        super().__init__(f"Preempted ({reason}) after step {step}.  The latest checkpoint has been saved.")
+        self.step = step
+        self.reason = reason
+
+
+class ResumableTask(task.Task):
+    def __init__(
+            self,
+            checkpointer: Checkpointer,
+            watcher: Optional[PreemptionWatcher] = None,
+            checkpoint_every_steps: Optional[int] = 100,
+            checkpoint_every_seconds: Optional[float] = None,
+            flush_timeout_seconds: float = 25.0,
+    ):
+        """
+        A Task which runs in steps, starts from its latest checkpoint and saves one before its pod is reclaimed.
+
+        Subclasses implement get_num_steps, get_initial_state and run_step.  State is a dict of named parts; keep
+        things which rarely change in their own parts so that checkpoints don't upload them again.
+
+        Args:
+            checkpointer: where this task's checkpoints go.  Replacement pods must use the same store and prefix.
+            watcher: tells the task it's about to be preempted.  Without one, the task only checkpoints periodically.
+            checkpoint_every_steps: checkpoint in the background this often
+            checkpoint_every_seconds: checkpoint in the background at least this often
+            flush_timeout_seconds: how long to wait for the final checkpoint after the notice.  Preemptible nodes
+                get 30 seconds.
+        """
+        self.checkpointer = checkpointer
+        self.watcher = watcher
+        self.checkpoint_every_steps = checkpoint_every_steps
+        self.checkpoint_every_seconds = checkpoint_every_seconds
+        self.flush_timeout_seconds = flush_timeout_seconds
+
+        self.resumed_from_step = None
+
+    @abc.abstractmethod
+    def get_num_steps(self, *args, **kwargs) -> int:
+        pass
+
+    @abc.abstractmethod
+    def get_initial_state(self, *args, **kwargs) -> Dict[Text, Any]:
+        pass
+
+    @abc.abstractmethod
+    def run_step(self, state: Dict[Text, Any], step: int, *args, **kwargs) -> Dict[Text, Any]:
+        """Run one step and return the new state."""
+        pass
+
+    def get_output(self, state: Dict[Text, Any]) -> Any:
+        return state
+
+    def _is_checkpoint_due(self, step: int, last_checkpoint_time: float) -> bool:
+        if self.checkpoint_every_steps and step % self.checkpoint_every_steps == 0:
+            return True
+        if self.checkpoint_every_seconds is not None:
+            return time.monotonic() - last_checkpoint_time >= self.checkpoint_every_seconds
+        return False
+
+    def call(self, *args, **kwargs) -> Any:
+        restored = self.checkpointer.restore()
+        if restored is None:
+            step, state = 0, self.get_initial_state(*args, **kwargs)
+            checkpoint_step = None
+        else:
+            checkpoint, state = restored
+            step = checkpoint_step = self.resumed_from_step = checkpoint.step
+
+        num_steps = self.get_num_steps(*args, **kwargs)
+        last_checkpoint_time = time.monotonic()
+        while step < num_steps:
+            if self.watcher is not None and self.watcher.is_preempted():
+                self.checkpointer.save(step, state, metadata={'reason': self.watcher.reason})
+                self.checkpointer.wait(self.flush_timeout_seconds)
+                raise PreemptedError(step, self.watcher.reason)
+
+            state = self.run_step(state, step, *args, **kwargs)
+            step += 1
+            if step < num_steps and self._is_checkpoint_due(step, last_checkpoint_time):
+                self.checkpointer.save(step, state)
+                checkpoint_step, last_checkpoint_time = step, time.monotonic()
+
+        # a pod which restarts after the task finished gets the output without redoing any work
+        if checkpoint_step != step:
+            self.checkpointer.save(step, state, metadata={'reason': 'done'})
+        self.checkpointer.wait()
+        return self.get_output(state)
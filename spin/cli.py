@@ -1,20 +1,68 @@
-import time
+import datetime
 
 import click
-from cookiecutter.main import cookiecutter
 
-from spin import settings, spin_config, utils, ssh
+from spin import fleet as fleet_module
+from spin import images, installer, placement, scaffold, settings, spin_config, tracing, utils, ssh
 from spin.workbench import workbench as workbench_module
 
 
 ############################################
 # spin
 ############################################
+def _finish_trace(trace_path):
+    tracer = tracing.disable()
+    if tracer is None:
+        return
+    tracer.write_chrome_trace(trace_path)
+    click.echo(tracer.format_summary(), err=True)
+    click.echo(f"Wrote trace to {trace_path}.  Open it at chrome://tracing or https://ui.perfetto.dev", err=True)
+
+
 @click.group()
 @click.pass_context
-def root(ctx):
+@click.option('--trace', 'trace_path', default=None, type=click.Path(dir_okay=False),
+              help="Record timed spans for every command spin runs and write them to this Chrome trace json file.")
+def root(ctx, trace_path):
     """This is the CLI for interacting with Spin."""
-    pass
+    if trace_path is not None:
+        tracing.enable()
+        ctx.call_on_close(lambda: _finish_trace(trace_path))
+
+    for record in installer.report_finished_installs():
+        print(f"Background install of {record.project_dir} {record.status}.  Log: {record.log_file}")
+
+
+############################################
+# installs
+############################################
+@root.command()
+@click.pass_context
+def installs(ctx):
+    """Show the status of background project installs."""
+    for record in installer.InstallRecord.load_all():
+        started = datetime.datetime.fromtimestamp(record.start_time).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{record.status:10} {started}  {record.project_dir}  (log: {record.log_file})")
+
+
+############################################
+# place
+############################################
+@root.command()
+@click.pass_context
+@click.option('--cpu', default=1.0, type=float, help="Cpu cores per replica.")
+@click.option('--memory-gb', default=2.0, type=float, help="Memory per replica.")
+@click.option('--gpus', default=0, type=int, help="GPUs per replica.")
+@click.option('--accelerator-type', default=None, help="Only consider pools with this accelerator.")
+def place(ctx, cpu, memory_gb, gpus, accelerator_type):
+    """Show which of your project's node pools a workload fits on and how densely it packs there."""
+    config = spin_config.load_project_config_from_spinrc()
+    placer = placement.Placer.from_cluster(config.cluster)
+    request = placement.ResourceRequest(cpu=cpu, memory_gb=memory_gb, gpus=gpus, accelerator_type=accelerator_type)
+    best = placer.place(request)
+    for candidate in placer.get_candidates(request):
+        marker = '*' if candidate.pool_name == best.pool_name else ' '
+        print(f"{marker} {candidate.get_summary()}")
 
 
 ############################################
@@ -46,6 +94,46 @@ def init(ctx, name, email, github_username, private_key_filename):
     )
     rc.save()
 
+############################################
+# build / publish
+############################################
+def _get_image_spec(target, repository_uri):
+    if target == 'workbench':
+        return images.get_workbench_image_spec(repository_uri or images.DEFAULT_WORKBENCH_REPOSITORY_URI)
+    if repository_uri is None:
+        raise click.UsageError("--repository-uri is required when building a project image.")
+    return images.get_project_image_spec(target, repository_uri)
+
+
+def _get_image_registry(local_registry):
+    if local_registry is not None:
+        return images.LocalImageRegistry(local_registry)
+    return images.DockerRegistry()
+
+
+@root.command()
+@click.pass_context
+@click.argument('target', default='workbench')
+@click.option('--repository-uri', default=None, help="Image repository, e.g.: gcr.io/my-project/workbench")
+def build(ctx, target, repository_uri):
+    """Build the workbench image or the image for the project directory TARGET, unless it's up to date."""
+    spec = _get_image_spec(target, repository_uri)
+    publisher = images.ImagePublisher(registry=_get_image_registry(None))
+    print(publisher.build(spec))
+
+
+@root.command()
+@click.pass_context
+@click.argument('target', default='workbench')
+@click.option('--repository-uri', default=None, help="Image repository, e.g.: gcr.io/my-project/workbench")
+@click.option('--local-registry', default=None, help="Record pushes in this json file rather than a real registry.")
+def publish(ctx, target, repository_uri, local_registry):
+    """Build and push an image tagged by the digest of its inputs, unless the registry already has it."""
+    spec = _get_image_spec(target, repository_uri)
+    publisher = images.ImagePublisher(registry=_get_image_registry(local_registry))
+    print(publisher.publish(spec))
+
+
 ############################################
 # up
 ############################################
@@ -64,11 +152,12 @@ def up(ctx):
 @click.argument('output_dir', default='.')
 @click.option('--config/--no-config', is_flag=True, default=False)
 @click.option('--install/--no-install', is_flag=True, default=True)
+@click.option('--background/--foreground', is_flag=True, default=True, help="Install in a detached process.")
 @click.option('--set-current/--no-set-current', is_flag=True, default=True)
 @click.pass_context
-def project(ctx, pkg_slug, output_dir, config, install, set_current):
+def project(ctx, pkg_slug, output_dir, config, install, background, set_current):
     """Create a directory containing spin project files."""
-    # extra_content is a cookiecutter concept which overwrites cookiecutter.json
+    # extra_content overwrites the defaults in the template's cookiecutter.json
     extra_context = {}
     if pkg_slug is not None:
         extra_context['pkg_slug'] = pkg_slug
@@ -76,37 +165,26 @@ def project(ctx, pkg_slug, output_dir, config, install, set_current):
     rc = spin_config.SpinRc.load()
     extra_context.update(rc.user.to_dict())
 
-    project_dir = cookiecutter(
-        str(settings.TEMPLATES_PATH / 'project'),
+    project_dir = scaffold.Scaffolder(settings.TEMPLATES_PATH / 'project').render(
         extra_context=extra_context,
         no_input=not config,
-        output_dir=output_dir
+        output_dir=output_dir,
     )
 
-    if install:
-        time.sleep(1.0)
-        exitcode, out, err = utils.get_exitcode_stdout_stderr(f'pip install --editable {project_dir}')
-        print(f"New project install finished with exit code: {exitcode}")
-        if out:
-            print(f'    stdout: {out}')
-        if err:
-            print(f'    stderr: {err}')
-
     print(f"Created project at {project_dir}")
     rc_project = spin_config.SpinRcProject(project_dir)
-    rc.add_project(rc_project, set_current)
-    rc.save()
+    with spin_config.SpinRc.transaction() as rc:
+        rc.add_project(rc_project, set_current)
 
+    if install:
+        if background:
+            record = installer.start_background_install(project_dir)
+            print(f"Installing in the background.  Run `spin installs` to check on it.  Log: {record.log_file}")
+        else:
+            installer.ProjectInstaller(project_dir).install()
 
 
-############################################
-# up cluster
-############################################
-@up.command()
-@click.pass_context
-@click.argument('name', default='my-workbench')
-def workbench(ctx, name):
-    """Create a workbench."""
+def _get_ssh_login_key() -> ssh.SshKeyOnDisk:
     spin_rc = spin_config.SpinRc.load()
     if len(spin_rc.ssh_keys) > 0:
         spin_rc_ssh_key = spin_rc.ssh_keys[0]
@@ -116,19 +194,170 @@ def workbench(ctx, name):
     private_key = spin_rc_ssh_key['private_key_file']
     if not utils.file_exists(private_key):
         raise ValueError(f"Your private key, {private_key}, does not exist.")
+    return ssh.SshKeyOnDisk(private_key)
+
 
+def _make_workbench(
+        name,
+        ssh_login_key,
+        cpu=None,
+        memory_gb=None,
+        shm_gb=None,
+        local_ssds=0,
+        shared_datasets=None,
+        ssh_control_persist=ssh.DEFAULT_CONTROL_PERSIST,
+        verbose=True,
+):
     # spinrc needs cloud_project, zone, and ssh key
-    wb = workbench_module.Workbench(
+    return workbench_module.Workbench(
         # TODO: use CloudConfig
         cloud_config=workbench_module.CloudConfig(cloud_project='', zone=''),
         # repos=[GithubRepo(repo_url='git@github.com:kevinbache/spin.git', ssh_key=ssh_key)],
         repos=[],
-        ssh_login_key=ssh.SshKeyOnDisk(private_key),
+        ssh_login_key=ssh_login_key,
         name=name,
+        master_node_config=workbench_module.GCloudNodeConfig(
+            cpu=cpu,
+            memory_gb=memory_gb,
+            shm_size_gb=shm_gb,
+            local_ssd_count=local_ssds,
+        ),
+        volume_config=workbench_module.VolumeConfig(shared_datasets_claim=shared_datasets),
+        ssh_control_persist=None if ssh_control_persist == 'no' else ssh_control_persist,
+        verbose=verbose,
     )
+
+
+def _workbench_options(f):
+    """The options for how to make a workbench, shared by `up workbench` and `fleet up`."""
+    options = [
+        click.option('--cpu', type=float, default=None,
+                     help="Cpu cores reserved for the workbench.  Needs --memory-gb."),
+        click.option('--memory-gb', type=float, default=None, help="Memory reserved for the workbench.  Needs --cpu."),
+        click.option('--shm-gb', type=float, default=None, help="Size of the workbench's /dev/shm."),
+        click.option('--local-ssds', type=int, default=0,
+                     help="Mount this many of the node's local SSDs under /scratch."),
+        click.option('--shared-datasets', default=None,
+                     help="An existing ReadOnlyMany PersistentVolumeClaim to mount read-only on /datasets/shared."),
+        click.option('--ssh-control-persist', default=ssh.DEFAULT_CONTROL_PERSIST,
+                     help="How long an ssh connection to the workbench stays open for reuse after it's last used, "
+                          "e.g.: 10m.  'no' to not multiplex ssh connections."),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+############################################
+# up workbench
+############################################
+@up.command()
+@click.pass_context
+@click.argument('name', default='my-workbench')
+@_workbench_options
+def workbench(ctx, name, **workbench_kwargs):
+    """Create a workbench."""
+    wb = _make_workbench(name, _get_ssh_login_key(), **workbench_kwargs)
     wb.create()
 
 
+############################################
+# down
+############################################
+@root.group()
+@click.pass_context
+def down(ctx):
+    """Delete things."""
+    pass
+
+
+############################################
+# down workbench
+############################################
+@down.command('workbench')
+@click.pass_context
+@click.argument('name', default='my-workbench')
+@click.option('--delete-volumes', is_flag=True, default=False, help="Delete its persistent disks too.")
+def down_workbench(ctx, name, delete_volumes):
+    """Delete a workbench.  Its persistent disks are kept for next time unless you pass --delete-volumes."""
+    _make_workbench(name, ssh_login_key=None).delete(delete_volumes=delete_volumes)
+
+
+############################################
+# fleet
+############################################
+@root.group()
+@click.pass_context
+def fleet(ctx):
+    """Create, claim and delete many workbenches at once.
+
+    Name workbenches with patterns: student-{01..30} for a range or 'student-*' for existing ones.
+    """
+    pass
+
+
+def _exit_if_any_failed(ctx, results):
+    if any(r.status == fleet_module.FAILED for r in results):
+        ctx.exit(1)
+
+
+@fleet.command('up')
+@click.pass_context
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--max-concurrency', type=int, default=8, help="How many workbenches to create at a time.")
+@_workbench_options
+def fleet_up(ctx, patterns, max_concurrency, **workbench_kwargs):
+    """Create the workbenches named by PATTERNS, or claim the ones which already exist."""
+    ssh_login_key = _get_ssh_login_key()
+    f = fleet_module.Fleet.from_patterns(
+        patterns,
+        lambda name: _make_workbench(name, ssh_login_key, verbose=False, **workbench_kwargs),
+        max_concurrency=max_concurrency,
+    )
+    _exit_if_any_failed(ctx, f.create())
+
+
+@fleet.command('claim')
+@click.pass_context
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--max-concurrency', type=int, default=8, help="How many workbenches to claim at a time.")
+def fleet_claim(ctx, patterns, max_concurrency):
+    """Add the existing workbenches named by PATTERNS to your ssh config and known_hosts."""
+    ssh_login_key = _get_ssh_login_key()
+    f = fleet_module.Fleet.from_patterns(
+        patterns,
+        lambda name: _make_workbench(name, ssh_login_key, verbose=False),
+        max_concurrency=max_concurrency,
+    )
+    _exit_if_any_failed(ctx, f.claim())
+
+
+@fleet.command('down')
+@click.pass_context
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('--delete-volumes', is_flag=True, default=False, help="Delete their persistent disks too.")
+def fleet_down(ctx, patterns, delete_volumes):
+    """Delete the workbenches named by PATTERNS."""
+    f = fleet_module.Fleet.from_patterns(patterns, lambda name: _make_workbench(name, None, verbose=False))
+    _exit_if_any_failed(ctx, f.delete(delete_volumes=delete_volumes))
+
+
+############################################
+# gc
+############################################
+@root.command()
+@click.pass_context
+@click.option('--include-volumes', is_flag=True, default=False,
+              help="Delete deleted workbenches' persistent disks too, which are otherwise kept for next time.")
+@click.option('--dry-run', is_flag=True, default=False, help="Just list what would be deleted.")
+def gc(ctx, include_volumes, dry_run):
+    """Delete objects left behind by workbenches which no longer exist."""
+    orphans = workbench_module.collect_garbage(include_volumes=include_volumes, dry_run=dry_run, verbose=False)
+    verb = 'Would delete' if dry_run else 'Deleted'
+    for orphan in orphans:
+        print(f"{verb} {orphan._object_type}/{orphan.name}")
+    if not orphans:
+        print("Nothing to delete.")
 
 
     # utils.confirm_prompt(f"You are about to spin up a cluster for the project {config.name}")
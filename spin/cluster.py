@@ -1,9 +1,134 @@
 import abc
+import concurrent.futures
 import json
 import time
-from typing import Iterable, Text
+from typing import Iterable, Text, Dict, Any, Optional
 
-from spin import utils
+from spin import operations, tracing, utils
+
+
+class NodePoolState(utils.DictBouncer):
+    """A node pool as GKE reported it.  Parsed from `gcloud container clusters describe --format=json`."""
+    def __init__(
+            self,
+            name: Text,
+            status: Text,
+            machine_type: Optional[Text] = None,
+            preemptible=False,
+            accelerator_type: Optional[Text] = None,
+            accelerator_count=0,
+            initial_node_count=0,
+            current_node_count: Optional[int] = None,
+            autoscaling_enabled=False,
+            min_nodes: Optional[int] = None,
+            max_nodes: Optional[int] = None,
+            version: Optional[Text] = None,
+    ):
+        super().__init__()
+        self.name = name
+        self.status = status
+        self.machine_type = machine_type
+        self.preemptible = preemptible
+        self.accelerator_type = accelerator_type
+        self.accelerator_count = accelerator_count
+        self.initial_node_count = initial_node_count
+        self.current_node_count = current_node_count
+        self.autoscaling_enabled = autoscaling_enabled
+        self.min_nodes = min_nodes
+        self.max_nodes = max_nodes
+        self.version = version
+
+    @classmethod
+    def from_gcloud_dict(cls, d: Dict[Text, Any]) -> 'NodePoolState':
+        config = d.get('config', {})
+        accelerators = config.get('accelerators', [])
+        autoscaling = d.get('autoscaling', {})
+        current_node_count = d.get('currentNodeCount')
+        return cls(
+            name=d['name'],
+            status=d.get('status', 'STATUS_UNSPECIFIED'),
+            machine_type=config.get('machineType'),
+            preemptible=bool(config.get('preemptible', False)),
+            accelerator_type=accelerators[0]['acceleratorType'] if accelerators else None,
+            accelerator_count=int(accelerators[0].get('acceleratorCount', 0)) if accelerators else 0,
+            initial_node_count=int(d.get('initialNodeCount', 0)),
+            current_node_count=None if current_node_count is None else int(current_node_count),
+            autoscaling_enabled=bool(autoscaling.get('enabled', False)),
+            min_nodes=int(autoscaling['minNodeCount']) if 'minNodeCount' in autoscaling else None,
+            max_nodes=int(autoscaling['maxNodeCount']) if 'maxNodeCount' in autoscaling else None,
+            version=d.get('version'),
+        )
+
+    @classmethod
+    def from_node_pool(cls, node_pool: 'NodePool', status='RUNNING') -> 'NodePoolState':
+        """The state a node pool will have right after spin creates it."""
+        has_accelerator = node_pool.accelerator_count_per_node > 0
+        return cls(
+            name=node_pool.name,
+            status=status,
+            machine_type=node_pool.machine_type,
+            preemptible=node_pool.preemptible,
+            accelerator_type=node_pool.accelerator if has_accelerator else None,
+            accelerator_count=node_pool.accelerator_count_per_node if has_accelerator else 0,
+            initial_node_count=node_pool.num_nodes,
+            current_node_count=node_pool.num_nodes,
+            autoscaling_enabled=True,
+            min_nodes=node_pool.min_nodes,
+            max_nodes=node_pool.max_nodes,
+        )
+
+    def is_running(self) -> bool:
+        return self.status == 'RUNNING'
+
+
+class ClusterState(utils.DictBouncer):
+    """A snapshot of a GKE cluster and all of its node pools, fetched with a single gcloud call."""
+    def __init__(
+            self,
+            name: Text,
+            zone: Text,
+            status: Text,
+            node_pools: Dict[Text, NodePoolState],
+            master_version: Optional[Text] = None,
+            node_version: Optional[Text] = None,
+            current_node_count: Optional[int] = None,
+            endpoint: Optional[Text] = None,
+    ):
+        super().__init__()
+        self.name = name
+        self.zone = zone
+        self.status = status
+        self.node_pools = node_pools
+        self.master_version = master_version
+        self.node_version = node_version
+        self.current_node_count = current_node_count
+        self.endpoint = endpoint
+
+    @classmethod
+    def from_gcloud_dict(cls, d: Dict[Text, Any]) -> 'ClusterState':
+        node_pools = [NodePoolState.from_gcloud_dict(p) for p in d.get('nodePools', [])]
+        current_node_count = d.get('currentNodeCount')
+        return cls(
+            name=d['name'],
+            zone=d.get('zone', d.get('location')),
+            status=d.get('status', 'STATUS_UNSPECIFIED'),
+            node_pools={p.name: p for p in node_pools},
+            master_version=d.get('currentMasterVersion'),
+            node_version=d.get('currentNodeVersion'),
+            current_node_count=None if current_node_count is None else int(current_node_count),
+            endpoint=d.get('endpoint'),
+        )
+
+    @classmethod
+    def from_dict(cls, d: Dict):
+        if not d:
+            return None
+        d = dict(d)
+        d['node_pools'] = {k: NodePoolState.from_dict(v) for k, v in d['node_pools'].items()}
+        return cls(**d)
+
+    def is_running(self) -> bool:
+        return self.status == 'RUNNING'
 
 
 class NodePool(utils.ShellRunnerMixin):
@@ -53,6 +178,21 @@ class NodePool(utils.ShellRunnerMixin):
             else:
                 return 0, None, None
 
+        out = self._run(self._get_create_command())
+        # the pool is running once the synchronous create returns, so there's no need to describe the cluster again
+        self.cluster.set_node_pool_state(NodePoolState.from_node_pool(self))
+        return out
+
+    def create_async(self) -> concurrent.futures.Future:
+        """Start creating this node pool and return a Future for the create Operation.  Doesn't check existence."""
+        if self.cluster is None:
+            raise ValueError("Cluster is not set.")
+        future = self.cluster.get_operation_tracker().launch(self._get_create_command())
+        self.cluster.set_node_pool_state(NodePoolState.from_node_pool(self, status='PROVISIONING'))
+        future.add_done_callback(lambda _: self.cluster.invalidate_state())
+        return future
+
+    def _get_create_command(self) -> Text:
         command = f'''gcloud container node-pools create {self.name} \
             --cluster={self.cluster.name} \
             --machine-type={self.machine_type} \
@@ -67,40 +207,73 @@ class NodePool(utils.ShellRunnerMixin):
         if self.accelerator_count_per_node > 0:
             command += f' --accelerator=type={self.accelerator},count={self.accelerator_count_per_node}'
 
-        print("nodepool.create command: {}".format(command))
+        if self.verbose:
+            print("nodepool.create command: {}".format(command))
 
-        return self._run(command)
+        return command
 
-    def delete(self, do_async=True):
-        command = f"""gcloud container node-pools delete {self.cluster.name} \
-            --cluster {self.cluster.name} \
-            --zone={self.cluster.zone}"""
-        if do_async:
-            command += ' \ \n --async'
-        self._run(command)
+    def delete(self, do_async=True) -> Optional[concurrent.futures.Future]:
+        """Delete this node pool.
 
-    def resize(self):
+        Returns:
+            If do_async, a Future for the delete Operation, which is tracked by the cluster's OperationTracker.
+        """
         if self.cluster is None:
             raise ValueError("Cluster is not set.")
 
-        command = f'''gcloud container clusters resize {self.cluster.name} \
-            --node-pool {self.name} \
-            --min-nodes {self.min_nodes} \
-            --num-nodes {self.num_nodes} \
-            --max-nodes {self.max_nodes} 
-        '''
-        return self._run(command)
+        command = f'gcloud container node-pools delete {self.name} --cluster={self.cluster.name} ' \
+                  f'--zone={self.cluster.zone} --quiet'
+        if not do_async:
+            self._run(command)
+            self.cluster.remove_node_pool_state(self.name)
+            return None
+
+        future = self.cluster.get_operation_tracker().launch(command)
+        self.cluster.invalidate_state()
+        return future
+
+    def resize(self, num_nodes: Optional[int] = None, do_async=False) -> Optional[concurrent.futures.Future]:
+        """Set the number of nodes in this pool.
+
+        Args:
+            num_nodes: the new size.  Defaults to self.num_nodes.
+            do_async: if True, return a Future for the resize Operation rather than waiting for it
+
+        Returns:
+            If do_async, a Future for the resize Operation, which is tracked by the cluster's OperationTracker.
+        """
+        if self.cluster is None:
+            raise ValueError("Cluster is not set.")
+        if num_nodes is not None:
+            self.num_nodes = num_nodes
+
+        command = f'gcloud container clusters resize {self.cluster.name} --node-pool={self.name} ' \
+                  f'--num-nodes={self.num_nodes} --zone={self.cluster.zone} --quiet'
+        if not do_async:
+            self._run(command)
+            self.cluster.invalidate_state()
+            return None
+
+        future = self.cluster.get_operation_tracker().launch(command)
+        self.cluster.invalidate_state()
+        return future
 
     def list(self):
-        command = f"""gcloud container node-pools list \
-            --cluster={self.cluster.name} \
-            --zone={self.cluster.zone} \
-            --format="value(NAME)" """
-        _, out, _ = self._run(command)
-        return out.strip().split('\n')
+        """The names of all of the node pools in this pool's cluster, from the cluster's state snapshot."""
+        if self.cluster is None:
+            raise ValueError("Cluster is not set.")
+        state = self.cluster.get_state()
+        return [] if state is None else list(state.node_pools.keys())
+
+    def get_state(self, refresh=False) -> Optional[NodePoolState]:
+        """This pool's state from the cluster's snapshot or None if it doesn't exist."""
+        if self.cluster is None:
+            raise ValueError("Cluster is not set.")
+        state = self.cluster.get_state(refresh=refresh)
+        return None if state is None else state.node_pools.get(self.name)
 
     def exists(self):
-        return self.name in self.list()
+        return self.get_state() is not None
 
 
 class Node(NodePool):
@@ -161,6 +334,7 @@ class GkeCluster(Cluster, utils.ShellRunnerMixin):
             members: Iterable[NodePool] = (),
             verbose=True,
             do_error_if_project_different=True,
+            operation_tracker: Optional[operations.OperationTracker] = None,
     ):
         super().__init__()
 
@@ -192,12 +366,68 @@ class GkeCluster(Cluster, utils.ShellRunnerMixin):
 
         self.verbose = verbose
 
+        self._state = None
+        self._is_state_fresh = False
+        self._operation_tracker = operation_tracker
+
     def __eq__(self, o: object) -> bool:
         return type(self) == type(o) and self.__dict__ == o.__dict__
 
     def __hash__(self) -> int:
         return hash(self.__dict__)
 
+    def describe(self) -> Optional[ClusterState]:
+        """Fetch the cluster and all of its node pools with one gcloud call.  None if the cluster doesn't exist."""
+        command = f'gcloud container clusters describe {self.name} --zone={self.zone} --format=json'
+        exitcode, out, err = self._run(command, error_on_nonzero_exit=False)
+        if exitcode:
+            if 'not found' in err.lower() or 'code=404' in err:
+                return None
+            raise ValueError(f"Got nonzero exit code {exitcode} from command `{command}`.  Stderr: {err}.")
+        return ClusterState.from_gcloud_dict(json.loads(out))
+
+    def get_state(self, refresh=False) -> Optional[ClusterState]:
+        """The cluster's state snapshot, which is fetched once and then kept up to date with spin's own changes.
+
+        Args:
+            refresh: describe the cluster again even if there's already a snapshot, e.g.: to see changes made
+                outside of this object.
+        """
+        if refresh or not self._is_state_fresh:
+            self._state = self.describe()
+            self._is_state_fresh = True
+        return self._state
+
+    def get_operation_tracker(self) -> operations.OperationTracker:
+        """The tracker which watches this cluster's async operations."""
+        if self._operation_tracker is None:
+            self._operation_tracker = operations.OperationTracker(zone=self.zone, verbose=self.verbose)
+        return self._operation_tracker
+
+    def resize_node_pools(self, num_nodes_by_pool: Dict[Text, int]) -> Dict[Text, concurrent.futures.Future]:
+        """Start resizing several node pools at once.  Their Operations are watched together by one tracker.
+
+        Returns:
+            A Future per node pool name.
+        """
+        return {
+            name: self.node_pools[name].resize(num_nodes, do_async=True)
+            for name, num_nodes in num_nodes_by_pool.items()
+        }
+
+    def invalidate_state(self):
+        """Make the next state query describe the cluster again."""
+        self._is_state_fresh = False
+
+    def set_node_pool_state(self, node_pool_state: NodePoolState):
+        """Record a node pool change made by spin in the snapshot, if there is one."""
+        if self._is_state_fresh and self._state is not None:
+            self._state.node_pools[node_pool_state.name] = node_pool_state
+
+    def remove_node_pool_state(self, node_pool_name: Text):
+        if self._is_state_fresh and self._state is not None:
+            self._state.node_pools.pop(node_pool_name, None)
+
     def _add_node_pool(self, node_pool: NodePool):
         node_pool.set_cluster(self)
         self.node_pools[node_pool.name] = node_pool
@@ -227,24 +457,30 @@ class GkeCluster(Cluster, utils.ShellRunnerMixin):
         if create_node_pools:
             for node_pool in self.node_pools.values():
                 if self.verbose:
-                    print(f"Creating node pool {node_pool} at {time.clock()}. ", end='')
-                outs.append(node_pool.create())
+                    print(f"Creating node pool {node_pool}. ", end='')
+                start = time.perf_counter()
+                with tracing.span('create node pool', category='gcloud', node_pool=node_pool.name):
+                    outs.append(node_pool.create())
                 if self.verbose:
-                    print("Done.")
+                    print(f"Done in {time.perf_counter() - start:.1f}s.")
 
         return outs
 
-    def delete(self, do_async=True):
-        command = f"gcloud container clusters delete {self.name} --zone={self.zone}"
-        if do_async:
-            command += ' --async'
-        self._run(command)
+    def delete(self, do_async=True) -> Optional[concurrent.futures.Future]:
+        """Delete this cluster.
+
+        Returns:
+            If do_async, a Future for the delete Operation.
+        """
+        command = f"gcloud container clusters delete {self.name} --zone={self.zone} --quiet"
+        self.invalidate_state()
+        if not do_async:
+            self._run(command)
+            return None
+        return self.get_operation_tracker().launch(command)
 
     def exists(self) -> bool:
-        command = f"""gcloud container clusters list --zone={self.zone} --format="value(NAME)" """
-        exitcode, out, err = self._run(command)
-        cluster_names = out.strip().split('\n')
-        return self.name in cluster_names
+        return self.get_state() is not None
 
 
 # if __name__ == '__main__':
@@ -0,0 +1,267 @@
+"""This module runs one program as a group of processes which know their rank and can find each other, e.g.: for
+multi-node data parallel training.
+
+    group = KubernetesDistributedGroup('train', image_uri, world_size=4, placement=placement)
+    group.create()
+    group.wait_until_ready()
+
+Every member of a group gets the environment that torch.distributed's env:// init method, and most launchers built
+on it, read:
+    RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT, LOCAL_RANK, LOCAL_WORLD_SIZE
+and DistributedEnv.from_environ() reads it back.  A Deployment's replicas are interchangeable, so on Kubernetes the
+group is an Indexed KubernetesJob instead, plus a headless KubernetesService.  Pod i of the Job is reachable at
+<name>-<i>.<name>, so rank 0's name is MASTER_ADDR and every pod knows it before any of them has started.
+
+LocalDistributedGroup runs the same command as local processes with the same environment, which stands in for the
+cluster in tests.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Text, List, Dict, Optional, Iterable
+
+from spin import kubes, utils
+from spin import placement as placement_module
+
+RANK_ENV = 'RANK'
+WORLD_SIZE_ENV = 'WORLD_SIZE'
+MASTER_ADDR_ENV = 'MASTER_ADDR'
+MASTER_PORT_ENV = 'MASTER_PORT'
+LOCAL_RANK_ENV = 'LOCAL_RANK'
+LOCAL_WORLD_SIZE_ENV = 'LOCAL_WORLD_SIZE'
+# set by Kubernetes in each pod of an Indexed Job
+JOB_COMPLETION_INDEX_ENV = 'JOB_COMPLETION_INDEX'
+JOB_COMPLETION_INDEX_FIELD = "metadata.annotations['batch.kubernetes.io/job-completion-index']"
+
+DEFAULT_MASTER_PORT = 29500
+GROUP_LABEL = 'spin-distributed'
+
+
+class DistributedEnv(utils.DictBouncer):
+    def __init__(
+            self,
+            rank: int = 0,
+            world_size: int = 1,
+            master_addr: Text = '127.0.0.1',
+            master_port: int = DEFAULT_MASTER_PORT,
+            local_rank: int = 0,
+            local_world_size: int = 1,
+    ):
+        """
+        One process's place in a distributed group.  The defaults are a group of one.
+
+        Args:
+            rank: this process's index in the group, from 0 to world_size - 1
+            world_size: the number of processes in the group
+            master_addr: the host rank 0 runs on
+            master_port: the port rank 0 listens on for the others
+            local_rank: this process's index among the group's processes on the same host
+            local_world_size: the number of the group's processes on the same host
+        """
+        super().__init__()
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank must be in [0, {world_size}) but got {rank}")
+        self.rank = rank
+        self.world_size = world_size
+        self.master_addr = master_addr
+        self.master_port = master_port
+        self.local_rank = local_rank
+        self.local_world_size = local_world_size
+
+    def is_master(self) -> bool:
+        return self.rank == 0
+
+    def to_environ(self) -> Dict[Text, Text]:
+        return {
+            RANK_ENV: str(self.rank),
+            WORLD_SIZE_ENV: str(self.world_size),
+            MASTER_ADDR_ENV: self.master_addr,
+            MASTER_PORT_ENV: str(self.master_port),
+            LOCAL_RANK_ENV: str(self.local_rank),
+            LOCAL_WORLD_SIZE_ENV: str(self.local_world_size),
+        }
+
+    @classmethod
+    def from_environ(cls, environ: Optional[Dict[Text, Text]] = None) -> 'DistributedEnv':
+        """Read the group from the environment.  RANK falls back to an Indexed Job's JOB_COMPLETION_INDEX."""
+        environ = os.environ if environ is None else environ
+        rank = environ.get(RANK_ENV, environ.get(JOB_COMPLETION_INDEX_ENV, '0'))
+        return cls(
+            rank=int(rank),
+            world_size=int(environ.get(WORLD_SIZE_ENV, '1')),
+            master_addr=environ.get(MASTER_ADDR_ENV, '127.0.0.1'),
+            master_port=int(environ.get(MASTER_PORT_ENV, DEFAULT_MASTER_PORT)),
+            local_rank=int(environ.get(LOCAL_RANK_ENV, '0')),
+            local_world_size=int(environ.get(LOCAL_WORLD_SIZE_ENV, '1')),
+        )
+
+
+class KubernetesDistributedGroup(utils.ShellRunnerMixin):
+    def __init__(
+            self,
+            name: Text,
+            container_image_uri: Text,
+            world_size: int,
+            command: Optional[List[Text]] = None,
+            master_port: int = DEFAULT_MASTER_PORT,
+            env: Optional[Dict[Text, Text]] = None,
+            secrets: Iterable[kubes.KubernetesSecret] = (),
+            volumes: Iterable[Dict] = (),
+            volume_mounts: Iterable[Dict] = (),
+            placement: Optional[placement_module.Placement] = None,
+            verbose=True,
+    ):
+        """
+        One pod per rank, all running at once.  The group fails as soon as any pod fails, since the others can't go
+        on without it.  Create it again to restart every rank, e.g.: from a spin.checkpoint.Checkpointer's latest step.
+
+        Args:
+            name: a name for the Job and the Service.  It must be a valid Kubernetes name.
+            container_image_uri: the image to run, e.g.: one built from spin's project template
+            world_size: the number of pods
+            command: the container's command.  Defaults to the image's entrypoint.
+            master_port: the port rank 0 listens on for the others
+            env: extra environment variables for every pod
+            placement: the node pool and resources for each pod, e.g.: a whole GPU node each
+            verbose: if True, print commands as they run
+        """
+        super().__init__(verbose)
+        if world_size < 1:
+            raise ValueError(f"world_size must be positive but got {world_size}")
+        self.name = name
+        self.world_size = world_size
+        self.master_port = master_port
+        self.master_addr = f'{name}-0.{name}'
+
+        # each pod's RANK is its completion index, which kubernetes only knows once it creates the pod
+        group_env = DistributedEnv(world_size=world_size, master_addr=self.master_addr,
+                                   master_port=master_port).to_environ()
+        del group_env[RANK_ENV]
+        ports = [kubes.KubernetesPort(name='rendezvous', external_port=master_port, pod_port=master_port)]
+        self.service = kubes.KubernetesService(
+            name=name,
+            deployment_name=name,
+            ports=ports,
+            headless=True,
+            selector={GROUP_LABEL: name},
+        )
+        self.job = kubes.KubernetesJob(
+            name=name,
+            container_image_uri=container_image_uri,
+            command=command,
+            completions=world_size,
+            parallelism=world_size,
+            completion_mode='Indexed',
+            backoff_limit=0,
+            env=dict(env or {}, **group_env),
+            field_env={RANK_ENV: JOB_COMPLETION_INDEX_FIELD},
+            secrets=secrets,
+            volumes=volumes,
+            volume_mounts=volume_mounts,
+            labels={GROUP_LABEL: name},
+            placement=placement,
+            ports=ports,
+            subdomain=name,
+        )
+        self.service.verbose = verbose
+        self.job.verbose = verbose
+
+    def create(self):
+        # the service first, so rank 0's DNS name exists by the time the other ranks look it up
+        self.service.create()
+        self.job.create()
+
+    def wait_until_ready(self, timeout_seconds: int = 600):
+        """Block until every pod in the group is ready.  One watch on the Job rather than one per pod."""
+        self._run(f"kubectl wait job/{self.name} --for=jsonpath='{{.status.ready}}'={self.world_size} "
+                  f"--timeout={timeout_seconds}s")
+
+    def get_status(self) -> Dict:
+        """The Job's status, e.g.: {'active': 4, 'ready': 4}"""
+        return self.job.get_status()
+
+    def delete(self):
+        # one call for both, and the pods go with the Job
+        self._run(f'kubectl delete job,service {self.name} --ignore-not-found')
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalDistributedGroup:
+    def __init__(
+            self,
+            command: List[Text],
+            world_size: int,
+            master_port: Optional[int] = None,
+            env: Optional[Dict[Text, Text]] = None,
+    ):
+        """
+        One local process per rank, with the same environment as KubernetesDistributedGroup's pods.  Like it, the
+        group fails as soon as any process fails, and the rest are killed.
+
+        Args:
+            command: the command each rank runs
+            world_size: the number of processes
+            master_port: the port rank 0 listens on for the others.  Defaults to a free port.
+            env: extra environment variables for every process
+        """
+        if world_size < 1:
+            raise ValueError(f"world_size must be positive but got {world_size}")
+        self.command = list(command)
+        self.world_size = world_size
+        self.master_port = master_port if master_port is not None else get_free_port()
+        self.env = env if env is not None else {}
+        self.processes = []
+
+    def get_env(self, rank: int) -> DistributedEnv:
+        return DistributedEnv(rank=rank, world_size=self.world_size, master_addr='127.0.0.1',
+                              master_port=self.master_port, local_rank=rank, local_world_size=self.world_size)
+
+    def start(self):
+        if self.processes:
+            raise ValueError("The group has already started")
+        for rank in range(self.world_size):
+            env = dict(os.environ, **self.env)
+            env.update(self.get_env(rank).to_environ())
+            # ranks need to import whatever the caller could, e.g.: spin
+            env['PYTHONPATH'] = os.pathsep.join([p for p in sys.path if p] + [env.get('PYTHONPATH', '')])
+            self.processes.append(subprocess.Popen(self.command, env=env))
+
+    def wait(self, timeout: Optional[float] = None, poll_interval: float = .05) -> List[int]:
+        """Wait for every rank to exit.
+
+        Returns:
+            each rank's exit code.  Ranks killed because another rank failed have negative codes.
+        """
+        start = time.monotonic()
+        while True:
+            exit_codes = [p.poll() for p in self.processes]
+            if any(code for code in exit_codes) or all(code is not None for code in exit_codes):
+                break
+            if timeout is not None and time.monotonic() - start > timeout:
+                self.stop()
+                raise TimeoutError(f"The group didn't finish within {timeout} seconds")
+            time.sleep(poll_interval)
+        self.stop()
+        return [p.returncode for p in self.processes]
+
+    def run(self, timeout: Optional[float] = None) -> List[int]:
+        """Start the group and wait for it.  Raises ValueError if any rank failed."""
+        self.start()
+        exit_codes = self.wait(timeout)
+        failed_ranks = [rank for rank, code in enumerate(exit_codes) if code]
+        if failed_ranks:
+            raise ValueError(f"Ranks {failed_ranks} of {self.world_size} failed with exit codes {exit_codes}")
+        return exit_codes
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
@@ -0,0 +1,445 @@
+"""This module maps a function over a list of items by fanning shards of the list out to worker pods.
+
+    results = ShardedMap(featurize, paths, backend, shard_size=100).gather()
+
+The items are split into shards and written, along with the pickled function, to a BlobStore which the workers can
+reach, e.g.: a volume mounted both locally and on the pods.  Then one Indexed KubernetesJob runs one worker pod per
+shard (`python -m spin.fanout`), each finding its shard through JOB_COMPLETION_INDEX.  Workers write their shard's
+outputs, or its traceback, back to the store, and ShardedMap picks them up with one store listing per poll:
+    * results are yielded as soon as they arrive, in whatever order shards finish
+    * a shard whose worker raised is launched again, up to max_attempts
+    * a shard which is still running long after most shards have finished gets a speculative duplicate.  Whichever
+      copy finishes first wins.
+
+The function has to be importable on the workers, e.g.: a module level function in your project's package.
+LocalProcessBackend runs the same worker command in local processes, which stands in for the cluster in tests.
+"""
+import abc
+import argparse
+import os
+import pickle
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Text, List, Dict, Any, Callable, Iterable, Iterator, Optional, Sequence
+
+from spin import kubes, tracing, utils
+from spin import placement as placement_module
+from spin.checkpoint import BlobStore, LocalBlobStore
+
+INDEX_ENV = 'SPIN_SHARD_INDEX'
+ATTEMPT_ENV = 'SPIN_SHARD_ATTEMPT'
+# set by Kubernetes in each pod of an Indexed Job
+JOB_COMPLETION_INDEX_ENV = 'JOB_COMPLETION_INDEX'
+
+
+def split_into_shards(items: Sequence, num_shards: Optional[int] = None, shard_size: Optional[int] = None) -> List[List]:
+    """Split items into contiguous shards of nearly equal size.  Give exactly one of num_shards or shard_size."""
+    if (num_shards is None) == (shard_size is None):
+        raise ValueError(f"Give exactly one of num_shards or shard_size but got {num_shards} and {shard_size}")
+    items = list(items)
+    if shard_size is not None:
+        if shard_size < 1:
+            raise ValueError(f"shard_size must be positive but got {shard_size}")
+        num_shards = (len(items) + shard_size - 1) // shard_size
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be positive but got {num_shards}")
+    num_shards = min(num_shards, max(1, len(items)))
+
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        # the first len(items) % num_shards shards get one extra item
+        size = len(items) // num_shards + (1 if i < len(items) % num_shards else 0)
+        shards.append(items[start:start + size])
+        start += size
+    return shards
+
+
+def _get_fn_key(prefix: Text) -> Text:
+    return f'{prefix}/fn.pkl'
+
+
+def _get_input_key(prefix: Text, index: int) -> Text:
+    return f'{prefix}/inputs/{index:06d}.pkl'
+
+
+def _get_started_key(prefix: Text, index: int, attempt: Text) -> Text:
+    return f'{prefix}/started/{index:06d}/{attempt}'
+
+
+def _get_result_key(prefix: Text, index: int, attempt: Text) -> Text:
+    return f'{prefix}/results/{index:06d}/{attempt}.pkl'
+
+
+def _get_error_key(prefix: Text, index: int, attempt: Text) -> Text:
+    return f'{prefix}/errors/{index:06d}/{attempt}.txt'
+
+
+def run_shard(store: BlobStore, prefix: Text, index: int, attempt: Text) -> bool:
+    """Run the function over one shard and write its outputs, or its traceback, to the store.
+
+    Returns:
+        True if the function succeeded on every item in the shard.
+    """
+    store.put(_get_started_key(prefix, index, attempt), b'')
+    try:
+        fn = pickle.loads(store.get(_get_fn_key(prefix)))
+        items = pickle.loads(store.get(_get_input_key(prefix, index)))
+        start = time.perf_counter()
+        outputs = [fn(item) for item in items]
+        duration = time.perf_counter() - start
+    except Exception:
+        # the coordinator decides whether to retry, so the pod itself should succeed rather than be restarted
+        store.put(_get_error_key(prefix, index, attempt), traceback.format_exc().encode('utf-8'))
+        return False
+    store.put(_get_result_key(prefix, index, attempt), pickle.dumps({'outputs': outputs, 'duration': duration}))
+    return True
+
+
+class ShardResult(utils.DictBouncer):
+    def __init__(self, index: int, outputs: List[Any], attempt: Text, duration: float, is_speculative=False):
+        """
+        Args:
+            index: the shard's index
+            outputs: fn applied to each of the shard's items
+            attempt: which attempt finished first
+            duration: how long the winning attempt spent running fn
+            is_speculative: whether the winning attempt was a speculative duplicate
+        """
+        super().__init__()
+        self.index = index
+        self.outputs = outputs
+        self.attempt = attempt
+        self.duration = duration
+        self.is_speculative = is_speculative
+
+
+class FanoutBackend(abc.ABC):
+    """Somewhere to run workers.  Workers read and write shards through the backend's store."""
+    def __init__(self, store: BlobStore):
+        self.store = store
+
+    @abc.abstractmethod
+    def launch_all(self, prefix: Text, num_shards: int):
+        """Start one worker per shard."""
+        pass
+
+    @abc.abstractmethod
+    def launch(self, prefix: Text, index: int, attempt: Text):
+        """Start one more worker for one shard, e.g.: to retry it."""
+        pass
+
+    def poll(self):
+        """Called on every ShardedMap poll, e.g.: to start queued workers."""
+        pass
+
+    @abc.abstractmethod
+    def stop(self):
+        """Stop every worker which is still running, e.g.: the losers of speculative duplicates."""
+        pass
+
+
+class LocalProcessBackend(FanoutBackend):
+    def __init__(self, store: LocalBlobStore, parallelism: Optional[int] = None):
+        """
+        Runs each worker as a local `python -m spin.fanout` process, the same command the pods run.
+
+        Args:
+            store: a store on local disk
+            parallelism: the most workers to run at once.  Defaults to the number of cpus.
+        """
+        super().__init__(store)
+        self.parallelism = parallelism or os.cpu_count() or 1
+        self._queue = []
+        self._running = []
+
+    def launch_all(self, prefix: Text, num_shards: int):
+        for index in range(num_shards):
+            self.launch(prefix, index, '0')
+
+    def launch(self, prefix: Text, index: int, attempt: Text):
+        self._queue.append((prefix, index, attempt))
+        self.poll()
+
+    def poll(self):
+        self._running = [p for p in self._running if p.poll() is None]
+        while self._queue and len(self._running) < self.parallelism:
+            prefix, index, attempt = self._queue.pop(0)
+            env = dict(os.environ)
+            env[INDEX_ENV] = str(index)
+            env[ATTEMPT_ENV] = attempt
+            # workers need to import spin and whatever module fn lives in, just like the caller did
+            env['PYTHONPATH'] = os.pathsep.join([p for p in sys.path if p] + [env.get('PYTHONPATH', '')])
+            command = [sys.executable, '-m', 'spin.fanout', '--store-dir', str(self.store.directory),
+                       '--prefix', prefix]
+            self._running.append(subprocess.Popen(command, env=env))
+
+    def stop(self):
+        self._queue = []
+        for process in self._running:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        self._running = []
+
+
+class KubernetesJobBackend(FanoutBackend, utils.ShellRunnerMixin):
+    def __init__(
+            self,
+            store: BlobStore,
+            name: Text,
+            container_image_uri: Text,
+            pod_store_dir: Text,
+            store_volume: Dict,
+            parallelism: int = 10,
+            placement: Optional[placement_module.Placement] = None,
+            verbose=True,
+    ):
+        """
+        Runs workers as pods: one Indexed Job for all shards, plus a one pod Job per retry or duplicate.
+
+        Args:
+            store: the store, as seen from this machine
+            name: a name for the Jobs.  It must be a valid Kubernetes name.
+            container_image_uri: an image with spin and the function's package installed
+            pod_store_dir: where store_volume is mounted on the pods
+            store_volume: a pod volume dict for the same storage as store, e.g.: an NFS or PVC volume
+            parallelism: the most pods to run at once for the Indexed Job
+            placement: the node pool and resources for each pod, e.g.: from spin.placement.Placer
+            verbose: if True, print commands as they run
+        """
+        FanoutBackend.__init__(self, store)
+        utils.ShellRunnerMixin.__init__(self, verbose)
+        self.name = name
+        self.container_image_uri = container_image_uri
+        self.pod_store_dir = pod_store_dir
+        self.store_volume = dict(store_volume)
+        self.parallelism = parallelism
+        self.placement = placement
+        self.job_names = []
+
+    def _get_job(self, name: Text, prefix: Text, completions: int, completion_mode: Text, env: Dict[Text, Text]):
+        volume_name = self.store_volume.get('name', 'spin-fanout-store')
+        self.store_volume['name'] = volume_name
+        return kubes.KubernetesJob(
+            name=name,
+            container_image_uri=self.container_image_uri,
+            command=['python', '-m', 'spin.fanout', '--store-dir', self.pod_store_dir, '--prefix', prefix],
+            completions=completions,
+            parallelism=min(self.parallelism, completions),
+            completion_mode=completion_mode,
+            env=env,
+            volumes=[self.store_volume],
+            volume_mounts=[{'name': volume_name, 'mountPath': self.pod_store_dir}],
+            labels={'spin-fanout': self.name},
+            placement=self.placement,
+        )
+
+    def launch_all(self, prefix: Text, num_shards: int):
+        job = self._get_job(self.name, prefix, num_shards, 'Indexed', env={})
+        job.create()
+        self.job_names.append(job.name)
+
+    def launch(self, prefix: Text, index: int, attempt: Text):
+        job = self._get_job(f'{self.name}-{index}-{attempt}', prefix, 1, 'NonIndexed',
+                            env={INDEX_ENV: str(index), ATTEMPT_ENV: attempt})
+        job.create()
+        self.job_names.append(job.name)
+
+    def stop(self):
+        if self.job_names:
+            # one call for every job, and their pods go with them
+            self._run(f'kubectl delete job {" ".join(self.job_names)} --ignore-not-found')
+            self.job_names = []
+
+
+class ShardedMap:
+    def __init__(
+            self,
+            fn: Callable[[Any], Any],
+            items: Sequence,
+            backend: FanoutBackend,
+            num_shards: Optional[int] = None,
+            shard_size: Optional[int] = None,
+            prefix: Optional[Text] = None,
+            max_attempts: int = 3,
+            speculative_factor: Optional[float] = 2.0,
+            speculative_min_fraction_done: float = .5,
+            poll_interval: float = 1.0,
+            timeout: Optional[float] = None,
+            cleanup=True,
+    ):
+        """
+        Map fn over items on a FanoutBackend, one worker per shard.
+
+        Args:
+            fn: applied to each item.  It must be picklable by reference, i.e.: importable on the workers.
+            items: the inputs
+            num_shards: split items into this many shards.  Give this or shard_size.
+            shard_size: split items into shards of this many items
+            prefix: where this map's files go in the store.  Defaults to a new unique prefix.
+            max_attempts: how many times to launch a shard whose workers raise before giving up
+            speculative_factor: launch a duplicate of a shard which has been running this many times longer than
+                the median finished shard.  None disables speculation.
+            speculative_min_fraction_done: only speculate once this fraction of shards has finished
+            poll_interval: seconds between looks at the store
+            timeout: give up if the map hasn't finished after this many seconds
+            cleanup: delete this map's files from the store when it's done
+        """
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1 but got {max_attempts}")
+        self.fn = fn
+        self.shards = split_into_shards(items, num_shards=num_shards, shard_size=shard_size)
+        self.backend = backend
+        self.store = backend.store
+        self.prefix = prefix if prefix is not None else f'fanout/{uuid.uuid4().hex[:12]}'
+        self.max_attempts = max_attempts
+        self.speculative_factor = speculative_factor
+        self.speculative_min_fraction_done = speculative_min_fraction_done
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.cleanup = cleanup
+
+        num_shards = len(self.shards)
+        self.results = {}
+        self.num_launched = [0] * num_shards
+        self.num_retries = 0
+        self.speculated = set()
+        self._speculative_attempts = set()
+        self._first_seen_running = {}
+        self._seen_errors = {}
+        self._is_started = False
+
+    def start(self):
+        with tracing.span('fanout.start', category='fanout', num_shards=len(self.shards)):
+            self.store.put(_get_fn_key(self.prefix), pickle.dumps(self.fn))
+            for index, shard in enumerate(self.shards):
+                self.store.put(_get_input_key(self.prefix, index), pickle.dumps(shard))
+            self.backend.launch_all(self.prefix, len(self.shards))
+        self.num_launched = [1] * len(self.shards)
+        self._is_started = True
+
+    def _launch(self, index: int, attempt: Text):
+        self.backend.launch(self.prefix, index, attempt)
+        self.num_launched[index] += 1
+
+    def _parse_keys(self, keys: Iterable[Text]) -> Dict[Text, Dict[int, List[Text]]]:
+        """'prefix/results/000003/0.pkl' ==> {'results': {3: ['0']}}"""
+        parsed = {'started': {}, 'results': {}, 'errors': {}}
+        for key in keys:
+            parts = key[len(self.prefix) + 1:].split('/')
+            if len(parts) == 3 and parts[0] in parsed:
+                attempt = parts[2].rsplit('.', 1)[0] if parts[0] != 'started' else parts[2]
+                parsed[parts[0]].setdefault(int(parts[1]), []).append(attempt)
+        return parsed
+
+    def poll(self) -> List[ShardResult]:
+        """Look at the store once, launch retries and duplicates, and return the shards which just finished."""
+        if not self._is_started:
+            self.start()
+
+        now = time.monotonic()
+        parsed = self._parse_keys(self.store.list(f'{self.prefix}/'))
+
+        new_results = []
+        for index, attempts in parsed['results'].items():
+            if index in self.results:
+                continue
+            attempt = sorted(attempts)[0]
+            d = pickle.loads(self.store.get(_get_result_key(self.prefix, index, attempt)))
+            result = ShardResult(index, d['outputs'], attempt, d['duration'],
+                                 is_speculative=attempt in self._speculative_attempts)
+            self.results[index] = result
+            new_results.append(result)
+
+        for index, attempts in parsed['started'].items():
+            self._first_seen_running.setdefault(index, now)
+
+        for index, attempts in parsed['errors'].items():
+            if index in self.results:
+                continue
+            self._seen_errors[index] = attempts
+            if len(attempts) < self.num_launched[index]:
+                # another attempt is still going
+                continue
+            if self.num_launched[index] >= self.max_attempts:
+                error = self.store.get(_get_error_key(self.prefix, index, sorted(attempts)[-1])).decode('utf-8')
+                self.stop()
+                raise ValueError(f"Shard {index} failed {len(attempts)} times.  The last error was:\n{error}")
+            self.num_retries += 1
+            self._launch(index, str(self.num_launched[index]))
+
+        self._speculate(now)
+        self.backend.poll()
+        return new_results
+
+    def _speculate(self, now: float):
+        if self.speculative_factor is None or not self.results:
+            return
+        if len(self.results) < self.speculative_min_fraction_done * len(self.shards):
+            return
+        median_duration = statistics.median(r.duration for r in self.results.values())
+        for index, first_seen in self._first_seen_running.items():
+            if index in self.results or index in self.speculated:
+                continue
+            if now - first_seen > self.speculative_factor * max(median_duration, self.poll_interval):
+                attempt = f'speculative{self.num_launched[index]}'
+                self.speculated.add(index)
+                self._speculative_attempts.add(attempt)
+                self._launch(index, attempt)
+
+    def is_done(self) -> bool:
+        return len(self.results) == len(self.shards)
+
+    def stop(self):
+        self.backend.stop()
+
+    def __iter__(self) -> Iterator[ShardResult]:
+        """Yield each shard's result as soon as it arrives."""
+        start = time.monotonic()
+        try:
+            while True:
+                for result in self.poll():
+                    yield result
+                if self.is_done():
+                    break
+                if self.timeout is not None and time.monotonic() - start > self.timeout:
+                    missing = [i for i in range(len(self.shards)) if i not in self.results]
+                    raise TimeoutError(f"Shards {missing} didn't finish in {self.timeout}s")
+                time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+            if self.cleanup and self.is_done():
+                for key in self.store.list(f'{self.prefix}/'):
+                    self.store.delete(key)
+
+    def gather(self) -> List[Any]:
+        """Wait for every shard and return fn's outputs in the order of the items."""
+        for _ in self:
+            pass
+        return [output for index in range(len(self.shards)) for output in self.results[index].outputs]
+
+
+def _get_index_and_attempt() -> (int, Text):
+    index = os.environ.get(INDEX_ENV, os.environ.get(JOB_COMPLETION_INDEX_ENV))
+    if index is None:
+        raise ValueError(f"Workers need their shard index in ${INDEX_ENV} or ${JOB_COMPLETION_INDEX_ENV}")
+    # each pod of an Indexed Job has its own hostname, so retried pods don't clobber each other's attempts
+    attempt = os.environ.get(ATTEMPT_ENV, socket.gethostname())
+    return int(index), attempt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run one fanout worker.")
+    parser.add_argument('--store-dir', required=True)
+    parser.add_argument('--prefix', required=True)
+    args = parser.parse_args()
+
+    index, attempt = _get_index_and_attempt()
+    run_shard(LocalBlobStore(Path(args.store_dir)), args.prefix, index, attempt)
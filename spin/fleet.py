@@ -0,0 +1,342 @@
+"""This module creates, claims and deletes many workbenches at once, e.g.: one for each student in a class.
+
+    names = expand_names(['student-{01..30}'])
+    Fleet([make_workbench(name) for name in names], max_concurrency=8).create()
+
+The workbenches share one KubernetesListing, taken with a single `kubectl get` of the objects labelled as workbenches',
+to see what already exists.  They don't each list every kind of object themselves.  Creates and claims run
+max_concurrency at a time, and one workbench failing doesn't stop the others.  Deletes go out as one label selector
+`kubectl delete` for the whole fleet.  Your ssh config and known_hosts are written once at the end with every
+workbench's changes.  A FleetProgress table shows where each workbench is, redrawn in place on a terminal.
+"""
+import fnmatch
+import io
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Text, List, Iterable, Optional, Callable, Tuple, TextIO, Dict
+
+from spin import kubes, ssh, utils
+from spin.workbench.workbench import Workbench
+
+# student-{1..30} or student-{01..30}
+_RANGE_PATTERN = re.compile(r'\{(?P<start>\d+)\.\.(?P<end>\d+)\}')
+_GLOB_CHARS = '*?['
+
+PENDING = 'pending'
+FAILED = 'failed'
+NOT_FOUND = 'not found'
+IN_PROGRESS_STATUSES = ('creating', 'claiming', 'deleting')
+
+
+def expand_names(patterns: Iterable[Text], existing_names: Optional[Iterable[Text]] = None) -> List[Text]:
+    """Expand workbench name patterns, in order and without duplicates.
+
+    'student-{01..03}' ==> ['student-01', 'student-02', 'student-03'].  The padding follows the first number.
+    'student-*' ==> the existing_names it matches, as in fnmatch.  Other patterns are names.
+    """
+    names = []
+    for pattern in patterns:
+        m = _RANGE_PATTERN.search(pattern)
+        if m:
+            start, end = m.group('start'), m.group('end')
+            width = len(start) if start.startswith('0') else 0
+            expanded = [
+                f'{pattern[:m.start()]}{i:0{width}d}{pattern[m.end():]}' for i in range(int(start), int(end) + 1)
+            ]
+            # a pattern can have more than one range
+            names += expand_names(expanded, existing_names)
+        elif any(c in pattern for c in _GLOB_CHARS):
+            if existing_names is None:
+                raise ValueError(f"Can't match {pattern} without a list of existing workbenches.")
+            names += sorted(fnmatch.filter(existing_names, pattern))
+        else:
+            names.append(pattern)
+    return list(dict.fromkeys(names))
+
+
+def get_workbench_listing() -> kubes.KubernetesListing:
+    """A listing of every object labelled as a workbench's, whatever else is in the namespace."""
+    return kubes.KubernetesListing(selector=kubes.WORKBENCH_LABEL, verbose=False)
+
+
+def _get_error_detail(e: Exception) -> Text:
+    """The first line of an error, which is all that fits in a table row."""
+    message = str(e).strip()
+    return message.splitlines()[0] if message else type(e).__name__
+
+
+class FleetResult(utils.DictBouncer):
+    def __init__(self, name: Text, status: Text = PENDING, seconds: Optional[float] = None, detail: Text = ''):
+        """
+        Args:
+            name: the workbench's name
+            status: e.g.: 'pending', 'creating', 'created' or 'failed'
+            seconds: how long the operation took, once it's done
+            detail: the workbench's ip or why it failed
+        """
+        super().__init__()
+        self.name = name
+        self.status = status
+        self.seconds = seconds
+        self.detail = detail
+
+    def is_done(self) -> bool:
+        return self.status != PENDING and self.status not in IN_PROGRESS_STATUSES
+
+
+class FleetProgress:
+    """A table of where each workbench in a fleet operation is.
+
+    On a terminal the table is redrawn in place whenever a workbench changes.  Otherwise each change is printed as a
+    line and the table is printed once at the end.
+    """
+    def __init__(self, names: Iterable[Text], stream: Optional[TextIO] = None, live: Optional[bool] = None):
+        """
+        Args:
+            names: the workbenches, in the order to show them
+            stream: where to write the table.  Defaults to stdout.
+            live: whether to redraw the table in place.  Defaults to whether stream is a terminal.
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.live = live if live is not None else self.stream.isatty()
+        self._results = {name: FleetResult(name) for name in names}
+        self._start_times = {}
+        self._lock = threading.Lock()
+        self._num_lines_drawn = 0
+
+    def update(self, result: FleetResult):
+        with self._lock:
+            if result.status in IN_PROGRESS_STATUSES:
+                self._start_times[result.name] = time.time()
+            self._results[result.name] = result
+            if self.live:
+                self._redraw()
+            else:
+                self.stream.write(self._format_row(result) + '\n')
+                self.stream.flush()
+
+    def finish(self):
+        with self._lock:
+            if self.live:
+                self._redraw()
+            else:
+                self.stream.write(self.format_table())
+            self.stream.flush()
+
+    def _format_row(self, result: FleetResult) -> Text:
+        seconds = result.seconds
+        if seconds is None and result.name in self._start_times:
+            seconds = time.time() - self._start_times[result.name]
+        seconds_str = '' if seconds is None else f'{seconds:.1f}'
+        return f'{result.name:<24} {result.status:<10} {seconds_str:>8}  {result.detail}'.rstrip()
+
+    def format_table(self) -> Text:
+        results = list(self._results.values())
+        num_done = len([r for r in results if r.is_done()])
+        num_failed = len([r for r in results if r.status == FAILED])
+        lines = [f'{"NAME":<24} {"STATUS":<10} {"SECONDS":>8}  DETAIL']
+        lines += [self._format_row(r) for r in results]
+        lines.append(f'{num_done}/{len(results)} done, {num_failed} failed')
+        return '\n'.join(lines) + '\n'
+
+    def _redraw(self):
+        table = self.format_table()
+        if self._num_lines_drawn:
+            # back to the start of the old table and clear it
+            self.stream.write(f'\x1b[{self._num_lines_drawn}F\x1b[J')
+        self.stream.write(table)
+        self.stream.flush()
+        self._num_lines_drawn = table.count('\n')
+
+
+class Fleet:
+    """Many workbenches which are created, claimed and deleted together."""
+    def __init__(
+            self,
+            workbenches: List[Workbench],
+            max_concurrency: int = 8,
+            listing: Optional[kubes.KubernetesListing] = None,
+            progress: Optional[FleetProgress] = None,
+            known_hosts_file: Text = '~/.ssh/known_hosts',
+            ssh_config_file: Text = '~/.ssh/config',
+            verbose=True,
+    ):
+        """
+        Args:
+            workbenches: the workbenches, each with a different name
+            max_concurrency: how many workbenches are created or claimed at a time
+            listing: what already exists.  Defaults to a new listing of every workbench's objects.
+            progress: where to show progress.  Defaults to a table on stdout if verbose.
+            known_hosts_file: the known_hosts file to write every workbench's server keys to
+            ssh_config_file: the ssh config file to write every workbench's host entry to
+            verbose: if True, show progress
+        """
+        names = [wb.name for wb in workbenches]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Workbenches in a fleet need distinct names but got {names}")
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be positive but got {max_concurrency}")
+        self.workbenches = workbenches
+        self.max_concurrency = max_concurrency
+        self.listing = listing if listing is not None else get_workbench_listing()
+        self.known_hosts_file = known_hosts_file
+        self.ssh_config_file = ssh_config_file
+        self.verbose = verbose
+        self._progress = progress
+
+    @classmethod
+    def from_patterns(
+            cls,
+            patterns: Iterable[Text],
+            make_workbench: Callable[[Text], Workbench],
+            listing: Optional[kubes.KubernetesListing] = None,
+            **kwargs,
+    ) -> 'Fleet':
+        """A fleet of the workbenches whose names match patterns.  Glob patterns match existing workbenches.
+
+        Args:
+            patterns: see expand_names
+            make_workbench: makes a workbench from its name
+            kwargs: more Fleet args
+        """
+        listing = listing if listing is not None else get_workbench_listing()
+        patterns = list(patterns)
+        existing_names = None
+        if any(c in pattern for pattern in patterns for c in _GLOB_CHARS):
+            existing_names = listing.get_names('deployment')
+        names = expand_names(patterns, existing_names)
+        return cls([make_workbench(name) for name in names], listing=listing, **kwargs)
+
+    def _get_progress(self) -> FleetProgress:
+        if self._progress is not None:
+            return self._progress
+        names = [wb.name for wb in self.workbenches]
+        if self.verbose:
+            return FleetProgress(names)
+        return FleetProgress(names, stream=io.StringIO(), live=False)
+
+    def _run_each(
+            self,
+            in_progress_status: Text,
+            fn: Callable[[Workbench], Tuple[Text, Text]],
+    ) -> List[FleetResult]:
+        """Run fn on every workbench, max_concurrency at a time.  fn returns a finished status and a detail."""
+        progress = self._get_progress()
+
+        def _run_one(wb: Workbench) -> FleetResult:
+            progress.update(FleetResult(wb.name, in_progress_status))
+            start = time.time()
+            try:
+                status, detail = fn(wb)
+                result = FleetResult(wb.name, status, time.time() - start, detail)
+            except Exception as e:
+                result = FleetResult(wb.name, FAILED, time.time() - start, _get_error_detail(e))
+            progress.update(result)
+            return result
+
+        if not self.workbenches:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(self.workbenches))) as executor:
+            results = list(executor.map(_run_one, self.workbenches))
+        progress.finish()
+        return results
+
+    def _apply_ssh_updates(self, name_to_update: Dict[Text, ssh.SshFilesUpdate]):
+        # in the fleet's order rather than the order they finished in
+        updates = [name_to_update[wb.name] for wb in self.workbenches if wb.name in name_to_update]
+        ssh.SshFilesUpdate.combine(updates).apply(self.known_hosts_file, self.ssh_config_file, verbose=False)
+
+    def create(self) -> List[FleetResult]:
+        """Create every workbench, or claim it if it already exists.
+
+        Returns:
+            one result per workbench, in order.  Failed workbenches have status 'failed'.
+        """
+        updates = {}
+
+        def _create(wb: Workbench) -> Tuple[Text, Text]:
+            status = 'claimed' if wb.exists(self.listing) else 'created'
+            updates[wb.name] = wb.create(listing=self.listing, update_ssh_files=False)
+            return status, wb.ip
+
+        results = self._run_each('creating', _create)
+        self._apply_ssh_updates(updates)
+        return results
+
+    def claim(self) -> List[FleetResult]:
+        """Claim every workbench.  Ones which don't exist fail rather than being created.
+
+        Returns:
+            one result per workbench, in order
+        """
+        updates = {}
+
+        def _claim(wb: Workbench) -> Tuple[Text, Text]:
+            if not wb.exists(self.listing):
+                raise ValueError(f"Workbench {wb.name} doesn't exist.")
+            updates[wb.name] = wb.create(listing=self.listing, update_ssh_files=False)
+            return 'claimed', wb.ip
+
+        results = self._run_each('claiming', _claim)
+        self._apply_ssh_updates(updates)
+        return results
+
+    def delete(self, delete_volumes=False) -> List[FleetResult]:
+        """Delete every workbench with one label selector `kubectl delete`, then remove them from your ssh config and
+        known_hosts.  Workbenches created before spin labelled its objects aren't in the listing, so they're deleted
+        by name instead.
+
+        Returns:
+            one result per workbench, in order
+        """
+        progress = self._get_progress()
+        start = time.time()
+        objects, ssh_update = [], ssh.SshFilesUpdate(host_tags_to_remove=[wb.name for wb in self.workbenches])
+        existing, unlisted_objects = {}, []
+        ssh_config = ssh.SshConfigModifier(self.ssh_config_file, verbose=False)
+        for wb in self.workbenches:
+            wb_objects = wb.get_kubernetes_objects(include_volumes=delete_volumes)
+            objects += wb_objects
+            existing[wb.name] = self.listing.exists('deployment', wb.name) or self.listing.exists('service', wb.name)
+            if not existing[wb.name]:
+                unlisted_objects += wb_objects
+            ip, ports_dict = kubes.KubernetesService.parse_ip_and_ports(self.listing.get('service', wb.name) or {})
+            if ip is not None:
+                known_hosts_host = ssh.get_known_hosts_host(ip, ports_dict.get('ssh'))
+            else:
+                # unlisted, so known_hosts has lines for wherever its host entry points, if anywhere
+                entry = ssh_config.get_host_entry(wb.name)
+                known_hosts_host = entry.get_known_hosts_host() if entry is not None else None
+            if known_hosts_host is not None:
+                ssh_update.known_hosts_hosts_to_remove.append(known_hosts_host)
+            progress.update(FleetResult(wb.name, 'deleting'))
+
+        try:
+            if self.workbenches:
+                object_types = Workbench.OBJECT_TYPES + (Workbench.VOLUME_OBJECT_TYPES if delete_volumes else ())
+                selector = kubes.get_in_selector(kubes.WORKBENCH_LABEL, [wb.name for wb in self.workbenches])
+                kubes.delete_by_selector(object_types, selector, verbose=False)
+
+            # e.g.: workbenches from before labels, which the selector can't see
+            if unlisted_objects:
+                for _, out, _ in kubes.delete_all(unlisted_objects, verbose=False):
+                    for object_type, name in kubes.get_deleted_objects(out):
+                        if object_type in ('deployment', 'service') and name in existing:
+                            existing[name] = True
+            self.listing.forget(objects)
+            results = [
+                FleetResult(wb.name, 'deleted' if existing[wb.name] else NOT_FOUND, time.time() - start)
+                for wb in self.workbenches
+            ]
+            ssh_update.apply(self.known_hosts_file, self.ssh_config_file, verbose=False)
+        except ValueError as e:
+            results = [FleetResult(wb.name, FAILED, time.time() - start, _get_error_detail(e))
+                       for wb in self.workbenches]
+
+        for result in results:
+            progress.update(result)
+        progress.finish()
+        return results
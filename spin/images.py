@@ -0,0 +1,392 @@
+"""This module contains tools for building and publishing the docker images that spin runs, e.g.: the workbench image.
+
+Images are built in two steps.  A dependency stage, which only depends on the Dockerfile and the dependency manifests
+(requirements.txt, etc.), is tagged by a content hash of those files and only rebuilt when that hash changes.
+The final image is then built on top of it, so a code-only change just rebuilds the small source layers.
+
+Published images are tagged by a digest of all of their inputs.  If a registry already has that tag, nothing is built
+or pushed, and deployments refer to images by their registry digest so that nodes never re-pull an unchanged image.
+"""
+import abc
+import fnmatch
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Text, Iterable, Optional, Dict, Union, List
+
+from spin import settings, utils
+
+
+class ImageBuildSpec(utils.DictBouncer):
+    def __init__(
+            self,
+            repository_uri: Text,
+            context_dir: Union[Text, Path],
+            dockerfile: Text = 'Dockerfile',
+            dependency_manifests: Iterable[Text] = ('requirements.txt',),
+            deps_target: Optional[Text] = None,
+            build_args: Optional[Dict[Text, Text]] = None,
+    ):
+        """
+        Describes how to build one docker image.
+
+        Args:
+            repository_uri: the image repository without a tag, e.g.: gcr.io/my-project/workbench
+            context_dir: the docker build context directory
+            dockerfile: the Dockerfile's filename, relative to context_dir
+            dependency_manifests: filenames, relative to context_dir, which fully determine the dependency layers
+            deps_target: the name of the Dockerfile stage which holds the dependency layers, if there is one.
+                If set, that stage is built and tagged separately so it can be reused across code changes.
+            build_args: passed to docker build as --build-arg KEY=VALUE
+        """
+        super().__init__()
+        self.repository_uri = repository_uri
+        self.context_dir = str(context_dir)
+        self.dockerfile = dockerfile
+        self.dependency_manifests = list(dependency_manifests)
+        self.deps_target = deps_target
+        self.build_args = build_args or {}
+
+    @property
+    def context_path(self) -> Path:
+        return Path(self.context_dir)
+
+    def get_dependency_hash(self) -> Text:
+        """A sha256 of everything the dependency layers depend on: the Dockerfile, the manifests and the build args."""
+        h = hashlib.sha256()
+        for filename in [self.dockerfile] + sorted(self.dependency_manifests):
+            h.update(filename.encode('utf-8'))
+            h.update(b'\0')
+            h.update((self.context_path / filename).read_bytes())
+            h.update(b'\0')
+        for k, v in sorted(self.build_args.items()):
+            h.update(f'{k}={v}\0'.encode('utf-8'))
+        return h.hexdigest()
+
+    def get_deps_image_uri(self) -> Text:
+        return f'{self.repository_uri}:deps-{self.get_dependency_hash()[:12]}'
+
+    def _get_dockerignore_patterns(self) -> List[Text]:
+        dockerignore_path = self.context_path / '.dockerignore'
+        if not dockerignore_path.exists():
+            return []
+        lines = [line.strip() for line in dockerignore_path.read_text().splitlines()]
+        return [line.rstrip('/') for line in lines if line and not line.startswith('#')]
+
+    @staticmethod
+    def _is_ignored(relative_path: Text, patterns: List[Text]) -> bool:
+        parts = relative_path.split('/')
+        prefixes = ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+        for pattern in patterns:
+            pattern = pattern[3:] if pattern.startswith('**/') else pattern
+            for prefix in prefixes:
+                if fnmatch.fnmatch(prefix, pattern) or fnmatch.fnmatch(prefix.split('/')[-1], pattern):
+                    return True
+        return False
+
+    def get_input_files(self) -> List[Text]:
+        """Sorted paths, relative to the context dir, of every file which docker would send as build context."""
+        patterns = self._get_dockerignore_patterns()
+        out = []
+        for dirpath, _, filenames in os.walk(self.context_dir):
+            for filename in filenames:
+                relative_path = os.path.relpath(os.path.join(dirpath, filename), self.context_dir)
+                relative_path = relative_path.replace(os.sep, '/')
+                if not self._is_ignored(relative_path, patterns):
+                    out.append(relative_path)
+        # docker always reads the Dockerfile, even when it's dockerignored
+        if self.dockerfile not in out:
+            out.append(self.dockerfile)
+        return sorted(out)
+
+    def get_input_digest(self) -> Text:
+        """A sha256 of every input to the image: the build context, the executable bits and the build args."""
+        h = hashlib.sha256()
+        for relative_path in self.get_input_files():
+            path = self.context_path / relative_path
+            h.update(relative_path.encode('utf-8'))
+            h.update(b'\0x' if os.access(str(path), os.X_OK) else b'\0-')
+            h.update(path.read_bytes())
+            h.update(b'\0')
+        for k, v in sorted(self.build_args.items()):
+            h.update(f'{k}={v}\0'.encode('utf-8'))
+        return h.hexdigest()
+
+    def get_input_image_uri(self) -> Text:
+        return f'{self.repository_uri}:in-{self.get_input_digest()[:16]}'
+
+
+class ImageBuildResult(utils.DictBouncer):
+    def __init__(
+            self,
+            image_uri: Text,
+            dependency_hash: Text,
+            deps_rebuilt: bool,
+            deps_seconds: float,
+            total_seconds: float,
+    ):
+        super().__init__()
+        self.image_uri = image_uri
+        self.dependency_hash = dependency_hash
+        self.deps_rebuilt = deps_rebuilt
+        self.deps_seconds = deps_seconds
+        self.total_seconds = total_seconds
+
+
+class DockerImageBuilder(utils.ShellRunnerMixin):
+    """Builds ImageBuildSpecs with BuildKit."""
+    def __init__(self, verbose=True):
+        super().__init__(verbose)
+        utils.ensure_cmdline_program_exists('docker')
+
+    def image_exists_locally(self, image_uri: Text) -> bool:
+        exitcode, _, _ = self._run(f'docker image inspect {image_uri}', error_on_nonzero_exit=False)
+        return exitcode == 0
+
+    def _get_build_command(self, spec: ImageBuildSpec, image_uri: Text, target=None, cache_from=None, no_cache=False):
+        command = f'env DOCKER_BUILDKIT=1 docker build -f {spec.context_path / spec.dockerfile} -t {image_uri}'
+        if target is not None:
+            command += f' --target {target}'
+        if cache_from is not None:
+            command += f' --cache-from {cache_from}'
+        if no_cache:
+            command += ' --no-cache'
+        # embed cache metadata so that other machines can use a pushed image with --cache-from
+        command += ' --build-arg BUILDKIT_INLINE_CACHE=1'
+        for k, v in sorted(spec.build_args.items()):
+            command += f' --build-arg {k}={v}'
+        command += f' {spec.context_path}'
+        return command
+
+    def build(self, spec: ImageBuildSpec, tag: Text = 'latest', no_cache=False) -> ImageBuildResult:
+        """Build the image described by spec and tag it as {spec.repository_uri}:{tag}.
+
+        Args:
+            spec: the image to build
+            tag: the tag to give the final image
+            no_cache: if True, rebuild every layer from scratch
+
+        Returns:
+            An ImageBuildResult with the final image uri and build timings.
+        """
+        start = time.perf_counter()
+        dependency_hash = spec.get_dependency_hash()
+
+        deps_uri = None
+        deps_rebuilt = False
+        if spec.deps_target is not None:
+            deps_uri = spec.get_deps_image_uri()
+            if no_cache or not self.image_exists_locally(deps_uri):
+                self._run(self._get_build_command(spec, deps_uri, target=spec.deps_target, no_cache=no_cache))
+                deps_rebuilt = True
+        deps_seconds = time.perf_counter() - start
+
+        image_uri = f'{spec.repository_uri}:{tag}'
+        self._run(self._get_build_command(spec, image_uri, cache_from=deps_uri))
+
+        return ImageBuildResult(
+            image_uri=image_uri,
+            dependency_hash=dependency_hash,
+            deps_rebuilt=deps_rebuilt,
+            deps_seconds=deps_seconds,
+            total_seconds=time.perf_counter() - start,
+        )
+
+
+def get_repository_from_image_uri(image_uri: Text) -> Text:
+    """'gcr.io/p/workbench:latest' ==> 'gcr.io/p/workbench', 'gcr.io/p/workbench@sha256:...' ==> 'gcr.io/p/workbench'"""
+    if '@' in image_uri:
+        return image_uri.split('@')[0]
+    last = image_uri.rsplit('/', 1)[-1]
+    if ':' in last:
+        return image_uri[:-(len(last) - last.index(':'))]
+    return image_uri
+
+
+class ImageRegistry(abc.ABC):
+    @abc.abstractmethod
+    def get_digest_uri(self, image_uri: Text) -> Optional[Text]:
+        """Return 'repository@sha256:...' if the registry has the given tagged image_uri, else None."""
+        pass
+
+    @abc.abstractmethod
+    def push(self, image_uri: Text) -> Text:
+        """Push the locally built image_uri and return its digest uri."""
+        pass
+
+
+class DockerRegistry(ImageRegistry, utils.ShellRunnerMixin):
+    """A remote registry, e.g.: gcr.io, accessed through the docker cli."""
+    def get_digest_uri(self, image_uri: Text) -> Optional[Text]:
+        exitcode, out, _ = self._run(f'docker manifest inspect --verbose {image_uri}', error_on_nonzero_exit=False)
+        if exitcode:
+            return None
+        manifest = json.loads(out)
+        # multi-platform images come back as a list
+        if isinstance(manifest, list):
+            manifest = manifest[0]
+        digest = manifest['Descriptor']['digest']
+        return f'{get_repository_from_image_uri(image_uri)}@{digest}'
+
+    def push(self, image_uri: Text) -> Text:
+        self._run(f'docker push {image_uri}')
+        _, out, _ = self._run(f"docker image inspect --format='{{{{json .RepoDigests}}}}' {image_uri}")
+        repository = get_repository_from_image_uri(image_uri)
+        for digest_uri in json.loads(out):
+            if get_repository_from_image_uri(digest_uri) == repository:
+                return digest_uri
+        raise ValueError(f"Pushed {image_uri} but docker didn't record a digest for it.  Got: {out}")
+
+
+class LocalImageRegistry(ImageRegistry):
+    """A registry stand-in which records pushes in a json file.  For working offline and for testing.
+
+    Nothing is pushed anywhere, so docker has no registry digest for the image.  Its input-digest tag already names its
+    contents, so the tagged uri stands in for a digest uri.
+    """
+    def __init__(self, index_file: Union[Text, Path], builder: Optional['DockerImageBuilder'] = None):
+        self.index_path = Path(index_file).expanduser()
+        self.builder = builder
+
+    def _load(self) -> Dict[Text, Text]:
+        if not self.index_path.exists():
+            return {}
+        return json.loads(self.index_path.read_text())
+
+    def get_digest_uri(self, image_uri: Text) -> Optional[Text]:
+        return self._load().get(image_uri)
+
+    def push(self, image_uri: Text) -> Text:
+        if self.builder is None:
+            self.builder = DockerImageBuilder()
+        if not self.builder.image_exists_locally(image_uri):
+            raise ValueError(f"Can't push {image_uri}.  It hasn't been built.")
+        digest_uri = image_uri
+        index = self._load()
+        index[image_uri] = digest_uri
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.index_path.write_text(json.dumps(index, indent=2, sort_keys=True))
+        return digest_uri
+
+
+class PublishedImages:
+    """Remembers the digest uri each tagged image was published as, and the one most recently published for each
+    repository, so that deploys can use them."""
+    def __init__(self, index_file: Union[Text, Path] = settings.PUBLISHED_IMAGES_PATH):
+        self.index_path = Path(index_file).expanduser()
+
+    def _load(self) -> Dict[Text, Text]:
+        if not self.index_path.exists():
+            return {}
+        return json.loads(self.index_path.read_text())
+
+    def get(self, repository_uri: Text) -> Optional[Text]:
+        return self._load().get(repository_uri)
+
+    def set(self, repository_uri: Text, digest_uri: Text, image_uri: Optional[Text] = None):
+        """Record digest_uri as repository_uri's latest, and as what image_uri, the tagged uri it was published from,
+        resolves to."""
+        updates = {repository_uri: digest_uri}
+        if image_uri is not None:
+            updates[image_uri] = digest_uri
+        index = self._load()
+        if all(index.get(k) == v for k, v in updates.items()):
+            return
+        index.update(updates)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.index_path.write_text(json.dumps(index, indent=2, sort_keys=True))
+
+    def resolve(self, image_uri: Text, use_latest=False) -> Text:
+        """Swap a tag-based image_uri for the digest uri it was published as, if we published it.
+
+        Args:
+            use_latest: if True, any tag of a published repository resolves to the digest uri published for it last,
+                e.g.: for a default ':latest' uri, which is never published itself
+        """
+        if '@' in image_uri:
+            return image_uri
+        index = self._load()
+        published = index.get(image_uri)
+        if published is None and use_latest:
+            published = index.get(get_repository_from_image_uri(image_uri))
+        return published if published is not None else image_uri
+
+
+class ImagePublisher:
+    """Builds and pushes images only when their inputs have changed."""
+    def __init__(
+            self,
+            registry: ImageRegistry,
+            builder: Optional[DockerImageBuilder] = None,
+            published_images: Optional[PublishedImages] = None,
+            verbose=True,
+    ):
+        self.registry = registry
+        self._builder = builder
+        self.published_images = published_images if published_images is not None else PublishedImages()
+        self.verbose = verbose
+
+    @property
+    def builder(self) -> DockerImageBuilder:
+        # only require docker when something actually needs building
+        if self._builder is None:
+            self._builder = DockerImageBuilder(verbose=self.verbose)
+        return self._builder
+
+    def build(self, spec: ImageBuildSpec) -> Text:
+        """Build spec tagged by its input digest unless that image already exists locally.  Return the image uri."""
+        image_uri = spec.get_input_image_uri()
+        if self.builder.image_exists_locally(image_uri):
+            if self.verbose:
+                print(f"{image_uri} is up to date.  Skipping build.")
+        else:
+            self.builder.build(spec, tag=image_uri.rsplit(':', 1)[-1])
+        return image_uri
+
+    def publish(self, spec: ImageBuildSpec) -> Text:
+        """Build and push spec unless the registry already has its inputs' tag.  Return the image's digest uri."""
+        image_uri = spec.get_input_image_uri()
+        digest_uri = self.registry.get_digest_uri(image_uri)
+        if digest_uri is not None:
+            if self.verbose:
+                print(f"{image_uri} is already published as {digest_uri}.  Skipping build and push.")
+        else:
+            self.build(spec)
+            digest_uri = self.registry.push(image_uri)
+            if self.verbose:
+                print(f"Published {image_uri} as {digest_uri}.")
+
+        self.published_images.set(spec.repository_uri, digest_uri, image_uri)
+        return digest_uri
+
+
+DEFAULT_WORKBENCH_REPOSITORY_URI = 'gcr.io/kb-experiment/workbench'
+
+
+def get_workbench_image_spec(
+        repository_uri: Text = DEFAULT_WORKBENCH_REPOSITORY_URI,
+        context_dir: Union[Text, Path] = settings.WORKBENCH_CONTAINER_PATH,
+        build_args: Optional[Dict[Text, Text]] = None,
+) -> ImageBuildSpec:
+    return ImageBuildSpec(
+        repository_uri=repository_uri,
+        context_dir=context_dir,
+        dependency_manifests=['requirements.txt'],
+        deps_target='deps',
+        build_args=build_args,
+    )
+
+
+def get_project_image_spec(
+        project_dir: Union[Text, Path],
+        repository_uri: Text,
+        build_args: Optional[Dict[Text, Text]] = None,
+) -> ImageBuildSpec:
+    return ImageBuildSpec(
+        repository_uri=repository_uri,
+        context_dir=project_dir,
+        dependency_manifests=['requirements.txt'],
+        build_args=build_args,
+    )
@@ -0,0 +1,200 @@
+"""This module installs new spin projects in the background against a local wheel cache.
+
+Projects made from the same template share a dependency list, so their wheels are built or downloaded once into
+~/.spin/cache/wheels/<hash of the dependency list> and every later install is an offline `pip install --no-index`
+from that directory.  Installs run in a detached process and record their progress in ~/.spin/installs so that
+later spin commands can report when they finish.
+
+Run as `python -m spin.installer <project_dir>` to install a project in the foreground.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Text, List, Optional, Union
+
+from spin import settings, utils
+
+
+class ProjectInstaller(utils.ShellRunnerMixin):
+    REQUIREMENTS_FILENAME = 'requirements.txt'
+    COMPLETE_MARKER = '.complete'
+
+    def __init__(
+            self,
+            project_dir: Union[Text, Path],
+            wheel_cache_dir: Union[Text, Path] = settings.WHEEL_CACHE_PATH,
+            python: Text = sys.executable,
+            verbose=True,
+    ):
+        super().__init__(verbose)
+        self.project_path = Path(project_dir).expanduser().resolve()
+        self.wheel_cache_path = Path(wheel_cache_dir).expanduser()
+        self.python = python
+        self._python_version = None
+
+    def get_requirements(self) -> List[Text]:
+        requirements_path = self.project_path / self.REQUIREMENTS_FILENAME
+        if not requirements_path.exists():
+            return []
+        lines = [line.strip() for line in requirements_path.read_text().splitlines()]
+        return [line for line in lines if line and not line.startswith('#')]
+
+    def get_python_version(self) -> Text:
+        """The major.minor version of the interpreter the wheels are built for and installed into."""
+        if self._python_version is None:
+            _, stdout, _ = self._run(f'{self.python} -c "import sys; print(\'%d.%d\' % sys.version_info[:2])"')
+            self._python_version = stdout.strip()
+        return self._python_version
+
+    def get_requirements_key(self) -> Text:
+        """A hash of the dependency list and the python version, which together determine the wheels needed."""
+        h = hashlib.sha256()
+        h.update(f'{self.get_python_version()}\0'.encode('utf-8'))
+        for requirement in sorted(set(r.lower() for r in self.get_requirements())):
+            h.update(f'{requirement}\0'.encode('utf-8'))
+        return h.hexdigest()[:16]
+
+    def get_wheel_dir(self) -> Path:
+        return self.wheel_cache_path / self.get_requirements_key()
+
+    def ensure_wheels(self) -> Path:
+        """Fill the wheel directory for this project's dependency list unless it's already been filled."""
+        wheel_dir = self.get_wheel_dir()
+        if (wheel_dir / self.COMPLETE_MARKER).exists():
+            return wheel_dir
+
+        self.wheel_cache_path.mkdir(parents=True, exist_ok=True)
+        # several projects may be installing at once; only one of them should download
+        with utils.FileLock(str(wheel_dir) + '.lock'):
+            if (wheel_dir / self.COMPLETE_MARKER).exists():
+                return wheel_dir
+
+            temp_dir = Path(str(wheel_dir) + '.partial')
+            if temp_dir.exists():
+                shutil.rmtree(str(temp_dir))
+            temp_dir.mkdir()
+            requirements_file = str(self.project_path / self.REQUIREMENTS_FILENAME)
+            self._run(f'{self.python} -m pip wheel --wheel-dir {temp_dir} -r {requirements_file}')
+            (temp_dir / self.COMPLETE_MARKER).touch()
+            if wheel_dir.exists():
+                shutil.rmtree(str(wheel_dir))
+            os.replace(str(temp_dir), str(wheel_dir))
+
+        return wheel_dir
+
+    def install(self):
+        """Install the project's dependencies from the wheel cache and then the project itself, in editable mode."""
+        if self.get_requirements():
+            wheel_dir = self.ensure_wheels()
+            requirements_file = str(self.project_path / self.REQUIREMENTS_FILENAME)
+            self._run(f'{self.python} -m pip install --no-index --find-links {wheel_dir} -r {requirements_file}')
+        self._run(f'{self.python} -m pip install --no-deps --no-build-isolation --editable {self.project_path}')
+
+
+class InstallRecord(utils.DictBouncer):
+    """The state of one background install, saved as json in ~/.spin/installs."""
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(
+            self,
+            project_dir: Text,
+            status: Text = PENDING,
+            log_file: Optional[Text] = None,
+            start_time: Optional[float] = None,
+            end_time: Optional[float] = None,
+            reported: bool = False,
+    ):
+        super().__init__()
+        self.project_dir = project_dir
+        self.status = status
+        self.log_file = log_file
+        self.start_time = start_time
+        self.end_time = end_time
+        self.reported = reported
+
+    @staticmethod
+    def get_record_path(project_dir: Text, installs_dir: Union[Text, Path] = settings.INSTALLS_PATH) -> Path:
+        name = hashlib.sha256(str(project_dir).encode('utf-8')).hexdigest()[:16]
+        return Path(installs_dir) / f'{Path(project_dir).name}-{name}.json'
+
+    def save(self, installs_dir: Union[Text, Path] = settings.INSTALLS_PATH):
+        path = self.get_record_path(self.project_dir, installs_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        utils.atomic_write_text(path, json.dumps(self.to_dict()))
+
+    @classmethod
+    def load(cls, path: Union[Text, Path]) -> 'InstallRecord':
+        return cls.from_dict(json.loads(Path(path).read_text()))
+
+    @classmethod
+    def load_all(cls, installs_dir: Union[Text, Path] = settings.INSTALLS_PATH) -> List['InstallRecord']:
+        installs_path = Path(installs_dir)
+        if not installs_path.exists():
+            return []
+        return [cls.load(p) for p in sorted(installs_path.glob('*.json'))]
+
+    def is_finished(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+def start_background_install(
+        project_dir: Union[Text, Path],
+        installs_dir: Union[Text, Path] = settings.INSTALLS_PATH,
+) -> InstallRecord:
+    """Install the project in a detached process and return its record immediately."""
+    project_dir = str(Path(project_dir).expanduser().resolve())
+    record_path = InstallRecord.get_record_path(project_dir, installs_dir)
+    log_file = str(record_path.with_suffix('.log'))
+    record = InstallRecord(project_dir=project_dir, log_file=log_file, start_time=time.time())
+    record.save(installs_dir)
+
+    with open(log_file, 'w') as log:
+        subprocess.Popen(
+            [sys.executable, '-m', 'spin.installer', project_dir, '--installs-dir', str(installs_dir)],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            # keep running after the spin command which started it exits
+            start_new_session=True,
+        )
+    return record
+
+
+def report_finished_installs(installs_dir: Union[Text, Path] = settings.INSTALLS_PATH) -> List[InstallRecord]:
+    """Return background installs which have finished since the last time they were reported, marking them reported."""
+    out = []
+    for record in InstallRecord.load_all(installs_dir):
+        if record.is_finished() and not record.reported:
+            record.reported = True
+            record.save(installs_dir)
+            out.append(record)
+    return out
+
+
+def _main(project_dir: Text, installs_dir: Text):
+    record = InstallRecord.load(InstallRecord.get_record_path(project_dir, installs_dir))
+    try:
+        ProjectInstaller(project_dir).install()
+        record.status = InstallRecord.SUCCEEDED
+    except Exception as e:
+        print(e, flush=True)
+        record.status = InstallRecord.FAILED
+    record.end_time = time.time()
+    record.save(installs_dir)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('project_dir')
+    parser.add_argument('--installs-dir', default=str(settings.INSTALLS_PATH))
+    args = parser.parse_args()
+
+    _main(args.project_dir, args.installs_dir)
@@ -1,35 +1,63 @@
 import abc
+import base64
 import json
+import re
+import shlex
 import subprocess
+import threading
 import time
 from pathlib import Path
-from typing import Text, List, Iterable, Tuple, Dict
+from typing import Text, List, Iterable, Tuple, Dict, Optional
 
 import yaml
 
-from spin import utils
+from spin import placement as placement_module
+from spin import tracing, utils
 from spin.ssh import SshKeyOnDisk
 
+# every object spin creates carries MANAGED_BY_LABEL=MANAGED_BY_VALUE, plus a label naming what owns it, e.g.:
+#   spin/workbench=my-workbench, so that everything belonging to one owner can be fetched or deleted with one selector.
+MANAGED_BY_LABEL = 'app.kubernetes.io/managed-by'
+MANAGED_BY_VALUE = 'spin'
+WORKBENCH_LABEL = 'spin/workbench'
+
+
+def get_selector(labels: Dict[Text, Text]) -> Text:
+    """{'a': 'b', 'c': 'd'} ==> 'a=b,c=d', a label selector for objects with all of the labels"""
+    return ','.join(f'{k}={v}' for k, v in labels.items())
+
+
+def get_in_selector(label: Text, values: Iterable[Text]) -> Text:
+    """'spin/workbench', ['a', 'b'] ==> 'spin/workbench in (a,b)', for objects whose label is any of the values"""
+    return f'{label} in ({",".join(values)})'
+
 
 class _KubernetesObject(utils.ShellRunnerMixin):
-    def __init__(self, object_type: Text, name: Text, verbose=True):
+    def __init__(self, object_type: Text, name: Text, labels: Optional[Dict[Text, Text]] = None, verbose=True):
+        """
+        Args:
+            labels: labels for the object, on top of MANAGED_BY_LABEL
+        """
         super().__init__(verbose)
         self._object_type = object_type
         self.name = name
+        self.labels = labels if labels is not None else {}
+
+    def get_labels(self) -> Dict[Text, Text]:
+        return dict({MANAGED_BY_LABEL: MANAGED_BY_VALUE}, **self.labels)
 
     def create(self):
         # https://stackoverflow.com/questions/52901435/how-i-create-new-namespace-in-kubernetes
         return self._run(f'kubectl create {self._object_type} {self.name}')
 
     def delete(self, error_if_does_not_exist=False):
-        if not self.exists():
-            if error_if_does_not_exist:
+        if error_if_does_not_exist:
+            if not self.exists():
                 raise ValueError(
                     f"Tried to delete kubernetes {self._object_type} named {self.name} but it doesn't exist"
                 )
-            else:
-                return self.EMPTY_RUN_RETURN_VALUE
-        self._run(f'kubectl delete {self._object_type} {self.name}')
+            return self._run(f'kubectl delete {self._object_type} {self.name}')
+        return self._run(f'kubectl delete {self._object_type} {self.name} --ignore-not-found')
 
     def list(self):
         _, out, _ = self._run(f'kubectl get {self._object_type} -o json')
@@ -41,7 +69,9 @@ class _KubernetesObject(utils.ShellRunnerMixin):
         return [obj['metadata']['name'] for obj in objs]
 
     def exists(self):
-        return self.name in self.list_names()
+        # a named get, so the cost doesn't grow with everything else in the namespace
+        _, out, _ = self._run(f'kubectl get {self._object_type} {self.name} --ignore-not-found -o name')
+        return bool(out.strip())
 
 
 class KubernetesNamespace(_KubernetesObject):
@@ -49,29 +79,95 @@ class KubernetesNamespace(_KubernetesObject):
         super().__init__(object_type='namespace', name=name, verbose=verbose)
 
 
-class KubernetesSecret(_KubernetesObject):
-    def __init__(self, name: Text, files: List[Path], mount_point_on_pod: Text, verbose=True):
-        super().__init__(object_type='secret', name=name, verbose=verbose)
+def _kubectl_apply(manifest: Text, dry_run=False) -> bytes:
+    """Run `kubectl apply -f -` on manifest and get its stdout.  Raises a CalledProcessError if it fails.
+
+    The manifest goes in on stdin rather than on a command line, where other users could read secrets in it with ps
+    and a shell would expand $ and backticks in it.
+    """
+    args = ['kubectl', 'apply'] + (['--dry-run'] if dry_run else []) + ['-f', '-']
+    return subprocess.run(args, input=manifest.encode('utf-8'), stdout=subprocess.PIPE, check=True).stdout
+
+
+class _KubernetesApplyObject(_KubernetesObject, abc.ABC):
+    """A _KubernetesObject which creates via `kubectl apply`"""
+    @abc.abstractmethod
+    def _get_yaml(self):
+        pass
+
+    def create(self, dry_run=False):
+        # https://kubernetes.io/docs/reference/kubectl/cheatsheet/#apply
+        yaml = self._get_yaml()
+        if dry_run:
+            print(f'create manifest: \n{yaml}')
+        with tracing.span('kubectl apply', category='kubectl', kind=self._object_type, object_name=self.name) as span:
+            out = _kubectl_apply(yaml, dry_run)
+            span.set(manifest_bytes=len(yaml), stdout_bytes=len(out))
+        return 0, out.decode('utf-8'), ''
+
+
+class KubernetesSecret(_KubernetesApplyObject):
+    def __init__(
+            self,
+            name: Text,
+            files: List[Path],
+            mount_point_on_pod: Text,
+            contents: Optional[Dict[Text, Text]] = None,
+            labels: Optional[Dict[Text, Text]] = None,
+            verbose=True,
+    ):
+        """
+        A secret made from files, each under its file name, as with `kubectl create secret generic --from-file`.
+        Creating it applies it, so an old secret with the same name is replaced in the same call.
+
+        Args:
+            files: the files to put in the secret.  They're read when it's created.
+            mount_point_on_pod: where the secret's files show up on pods which mount it
+            contents: more files to put in the secret, already in memory, keyed by file name
+            labels: labels for the secret
+        """
+        super().__init__(object_type='secret', name=name, labels=labels, verbose=verbose)
         self.mount_point_on_pod = mount_point_on_pod
         self.files = files
+        self.contents = contents if contents is not None else {}
 
     @classmethod
-    def from_ssh_keys(cls, secret_name: Text, mount_point_on_pod: Text, ssh_keys: List[SshKeyOnDisk]):
+    def from_ssh_keys(
+            cls,
+            secret_name: Text,
+            mount_point_on_pod: Text,
+            ssh_keys: List[SshKeyOnDisk],
+            labels: Optional[Dict[Text, Text]] = None,
+    ):
         files = []
         for key in ssh_keys:
             files.append(key.public_key_path)
             files.append(key.private_key_path)
-        return cls(name=secret_name, mount_point_on_pod=mount_point_on_pod, files=files)
+        return cls(name=secret_name, mount_point_on_pod=mount_point_on_pod, files=files, labels=labels)
 
-    def create(self):
-        file_strs = []
+    def _get_yaml(self):
+        file_name_to_bytes = {}
         for f in self.files:
             if not f.exists():
                 raise IOError(f"Trying to create secret from nonexistent file: {f}")
-            file_strs.append(f'--from-file={f}')
-        all_files_str = ' '.join(file_strs)
-        cmd = f'kubectl create secret generic {self.name} {all_files_str}'
-        return self._run(cmd)
+            file_name_to_bytes[f.name] = f.read_bytes()
+        for file_name, contents in self.contents.items():
+            file_name_to_bytes[file_name] = contents.encode('utf-8')
+
+        secret_dict = {
+            'apiVersion': 'v1',
+            'kind': 'Secret',
+            'type': 'Opaque',
+            'metadata': {
+                'name': self.name,
+                'labels': self.get_labels(),
+            },
+            # secret data is base64 encoded
+            'data': {k: base64.b64encode(v).decode('ascii') for k, v in file_name_to_bytes.items()},
+        }
+
+        yaml_str = '\n' + yaml.dump(secret_dict)
+        return yaml_str
 
     def to_volume_mount(self):
         return {
@@ -97,26 +193,213 @@ class EmptyKubernetesSecret(KubernetesSecret):
         super().__init__(name, files=[], mount_point_on_pod='')
 
 
-class _KubernetesApplyObject(_KubernetesObject, abc.ABC):
-    """A _KubernetesObject which creates via `kubectl apply`"""
-    @abc.abstractmethod
+class KubernetesPersistentVolumeClaim(_KubernetesApplyObject):
+    def __init__(
+            self,
+            name: Text,
+            size_gb: int,
+            access_mode: Text = 'ReadWriteOnce',
+            storage_class: Optional[Text] = None,
+            labels: Optional[Dict[Text, Text]] = None,
+            verbose=True,
+    ):
+        """
+        A request for a persistent disk which outlives the pods it's mounted on.  Applying it again once it exists
+        leaves it, and its disk, as they are, so pods which mount it by name get the same disk back.
+
+        Args:
+            size_gb: the disk's size
+            access_mode: 'ReadWriteOnce' to mount it read-write on one node or 'ReadOnlyMany' to mount a disk which
+                already has data on it read-only on many
+            storage_class: e.g.: 'standard' or 'premium-rwo'.  Defaults to the cluster's default storage class.
+            labels: labels for the claim
+        """
+        super().__init__(object_type='pvc', name=name, labels=labels, verbose=verbose)
+        self.size_gb = size_gb
+        self.access_mode = access_mode
+        self.storage_class = storage_class
+
     def _get_yaml(self):
-        pass
+        pvc_dict = {
+            'apiVersion': 'v1',
+            'kind': 'PersistentVolumeClaim',
+            'metadata': {
+                'name': self.name,
+                'labels': self.get_labels(),
+            },
+            'spec': {
+                'accessModes': [self.access_mode],
+                'resources': {
+                    'requests': {
+                        'storage': f'{self.size_gb}Gi',
+                    },
+                },
+            },
+        }
+        if self.storage_class is not None:
+            pvc_dict['spec']['storageClassName'] = self.storage_class
+
+        yaml_str = '\n' + yaml.dump(pvc_dict)
+        return yaml_str
+
+    def to_volume(self, read_only=False):
+        volume = {
+            'name': self.name,
+            'persistentVolumeClaim': {
+                'claimName': self.name,
+            },
+        }
+        if read_only:
+            volume['persistentVolumeClaim']['readOnly'] = True
+        return volume
+
+    def to_volume_mount(self, mount_path: Text, read_only=False):
+        volume_mount = {
+            'name': self.name,
+            'mountPath': mount_path,
+        }
+        if read_only:
+            volume_mount['readOnly'] = True
+        return volume_mount
+
+
+def apply_all(objects: Iterable[_KubernetesApplyObject]) -> Tuple[int, Text, Text]:
+    """Create or update several objects with one `kubectl apply`.  They're applied in order."""
+    objects = list(objects)
+    yaml_str = '---'.join(obj._get_yaml() for obj in objects)
+    with tracing.span('kubectl apply', category='kubectl', kind='list', num_objects=len(objects)) as span:
+        out = _kubectl_apply(yaml_str)
+        span.set(manifest_bytes=len(yaml_str), stdout_bytes=len(out))
+    return 0, out.decode('utf-8'), ''
+
+
+def delete_all(objects: Iterable[_KubernetesObject], verbose=True) -> List[Tuple[int, Text, Text]]:
+    """Delete several objects with one `kubectl delete` per object type.  Objects which don't exist are skipped.
+
+    Types are deleted in the order they first appear in objects, e.g.: deployments before the secrets they mount.
+    """
+    type_to_names = {}
+    for obj in objects:
+        names = type_to_names.setdefault(obj._object_type, [])
+        if obj.name not in names:
+            names.append(obj.name)
+
+    runner = utils.ShellRunnerMixin(verbose)
+    return [
+        runner._run(f'kubectl delete {object_type} {" ".join(names)} --ignore-not-found')
+        for object_type, names in type_to_names.items()
+    ]
+
+
+def get_deleted_objects(delete_output: Text) -> List[Tuple[Text, Text]]:
+    """The type and name of each object `kubectl delete` says it deleted.
+
+    'deployment.apps "wb" deleted' ==> [('deployment', 'wb')]
+    """
+    return re.findall(r'^([a-z]+)(?:\.[\w.]+)? "([^"]+)" deleted', delete_output, flags=re.MULTILINE)
+
+
+def delete_by_selector(object_types: Iterable[Text], selector: Text, verbose=True) -> Tuple[int, Text, Text]:
+    """Delete every object of object_types whose labels match selector, with one `kubectl delete`."""
+    runner = utils.ShellRunnerMixin(verbose)
+    return runner._run(f'kubectl delete {",".join(object_types)} -l {shlex.quote(selector)} --ignore-not-found')
 
-    def create(self, dry_run=False):
-        # https://kubernetes.io/docs/reference/kubectl/cheatsheet/#apply
-        dry_run_str = '--dry-run ' if dry_run else ''
-        yaml = self._get_yaml()
-        cmd = f'cat <<EOF | kubectl apply {dry_run_str}-f - {yaml}EOF'
-        if dry_run:
-            print(f'create command: \n{cmd}')
-        # you have to use subprocess.check_output rather than _run because this is a multiline command.
-        #   ref: https://stackoverflow.com/questions/42312099/how-to-run-multi-line-bash-commands-inside-python
-        #   it will throw an error on nonzero output code
-        out = subprocess.check_output(cmd, shell=True)
-        out = out.decode('utf-8')
-        err = ''
-        return 0, out, err
+
+class KubernetesListing(utils.ShellRunnerMixin):
+    """A snapshot of every object of some types, taken with one `kubectl get` the first time it's needed.
+
+    Operations on many objects at once, e.g.: creating a fleet of workbenches, share one listing to see what's already
+    there rather than each listing every type for itself.  It isn't refreshed by itself, so callers record what they
+    delete.  Give it a label selector, e.g.: WORKBENCH_LABEL, to list only spin's objects, so that its cost doesn't
+    grow with everything else in the namespace.
+    """
+    DEFAULT_OBJECT_TYPES = ('deployment', 'service', 'secret', 'persistentvolumeclaim')
+    # listed objects are keyed by their kind, which is never a short name
+    OBJECT_TYPE_ALIASES = {'pvc': 'persistentvolumeclaim', 'svc': 'service'}
+
+    def __init__(self, object_types: Iterable[Text] = DEFAULT_OBJECT_TYPES, selector: Optional[Text] = None,
+                 verbose=True):
+        """
+        Args:
+            object_types: the types to list
+            selector: a label selector, e.g.: 'spin/workbench=my-workbench'.  Defaults to every object.
+        """
+        super().__init__(verbose)
+        self.object_types = tuple(self.OBJECT_TYPE_ALIASES.get(t, t) for t in object_types)
+        self.selector = selector
+        self._lock = threading.Lock()
+        self._type_to_objects = None
+
+    def refresh(self):
+        selector_str = '' if self.selector is None else f' -l {shlex.quote(self.selector)}'
+        _, out, _ = self._run(f'kubectl get {",".join(self.object_types)}{selector_str} -o json')
+        type_to_objects = {object_type: {} for object_type in self.object_types}
+        for item in json.loads(out)['items']:
+            type_to_objects.setdefault(item['kind'].lower(), {})[item['metadata']['name']] = item
+        self._type_to_objects = type_to_objects
+
+    def _get_objects(self, object_type: Text) -> Dict[Text, Dict]:
+        object_type = self.OBJECT_TYPE_ALIASES.get(object_type, object_type)
+        with self._lock:
+            if self._type_to_objects is None:
+                self.refresh()
+        if object_type not in self._type_to_objects:
+            raise ValueError(f"This listing only has {self.object_types}, not {object_type}.")
+        return self._type_to_objects[object_type]
+
+    def get(self, object_type: Text, name: Text) -> Optional[Dict]:
+        """The object's json, as `kubectl get -o json` returns it, or None if it doesn't exist."""
+        return self._get_objects(object_type).get(name)
+
+    def get_names(self, object_type: Text) -> List[Text]:
+        return list(self._get_objects(object_type))
+
+    def get_all(self, object_type: Text) -> List[Dict]:
+        return list(self._get_objects(object_type).values())
+
+    def exists(self, object_type: Text, name: Text) -> bool:
+        return name in self._get_objects(object_type)
+
+    def forget(self, objects: Iterable[_KubernetesObject]):
+        """Record that objects have been deleted."""
+        for obj in objects:
+            self._get_objects(obj._object_type).pop(obj.name, None)
+
+
+def find_orphans(
+        owner_label: Text,
+        owner_type: Text,
+        object_types: Iterable[Text],
+        listing: Optional[KubernetesListing] = None,
+) -> List[_KubernetesObject]:
+    """Objects labelled with owner_label whose owner, the owner_type named by the label's value, is gone, e.g.: the
+    secrets of a workbench whose deployment was deleted.
+
+    Args:
+        owner_label: the label naming each object's owner, e.g.: WORKBENCH_LABEL
+        owner_type: the type of the owners, e.g.: 'deployment'
+        object_types: the types to look for orphans among
+        listing: a listing of owner_type and object_types, selecting at least everything with owner_label.
+            Defaults to a new one which lists them all with one `kubectl get`.
+
+    Returns:
+        stand-ins for the orphans, e.g.: to pass to delete_all, ordered by type
+    """
+    object_types = [KubernetesListing.OBJECT_TYPE_ALIASES.get(t, t) for t in object_types]
+    if listing is None:
+        listing = KubernetesListing(list(dict.fromkeys([owner_type] + object_types)), selector=owner_label,
+                                    verbose=False)
+    owners = {
+        (obj['metadata'].get('labels') or {}).get(owner_label, obj['metadata']['name'])
+        for obj in listing.get_all(owner_type)
+    }
+    orphans = []
+    for object_type in object_types:
+        for obj in listing.get_all(object_type):
+            owner = (obj['metadata'].get('labels') or {}).get(owner_label)
+            if owner is not None and owner not in owners:
+                orphans.append(_KubernetesObject(object_type, obj['metadata']['name'], verbose=False))
+    return orphans
 
 
 class KubernetesPort:
@@ -138,6 +421,15 @@ class KubernetesPort:
         }
 
 
+def _add_placement(pod_spec_dict: Dict, container_dict: Dict, placement: placement_module.Placement):
+    """Write a placement's resources, nodeSelector and tolerations into a pod spec."""
+    container_dict['resources'] = placement.to_kubernetes_resources()
+    pod_spec_dict['nodeSelector'] = placement.to_node_selector()
+    tolerations = placement.to_tolerations()
+    if tolerations:
+        pod_spec_dict['tolerations'] = tolerations
+
+
 class KubernetesDeployment(_KubernetesApplyObject):
     def __init__(
             self,
@@ -146,12 +438,45 @@ class KubernetesDeployment(_KubernetesApplyObject):
             secrets: Iterable[KubernetesSecret] = (),
             ports: Iterable[KubernetesPort] = (),
             num_replicas=1,
+            image_pull_policy: Optional[Text] = None,
+            placement: Optional[placement_module.Placement] = None,
+            resources: Optional[Dict] = None,
+            volumes: Iterable[Dict] = (),
+            volume_mounts: Iterable[Dict] = (),
+            affinity: Optional[Dict] = None,
+            strategy: Optional[Text] = None,
+            env: Optional[Dict[Text, Text]] = None,
+            labels: Optional[Dict[Text, Text]] = None,
     ):
-        super().__init__(object_type='deployment', name=name)
+        """
+        Args:
+            placement: if given, the pods request its resources and are pinned to its node pool.
+                See spin.placement.Placer.
+            resources: the container's raw `resources` dict.  A placement's resources take precedence.
+            volumes: raw pod volume dicts, in addition to the secrets' volumes
+            volume_mounts: raw container volume mount dicts for volumes
+            affinity: the pod's raw `affinity` dict
+            strategy: 'RollingUpdate' or 'Recreate'.  Pods with ReadWriteOnce volumes need 'Recreate', since the old
+                pod has to let go of its disks before the new one can mount them.  Defaults to Kubernetes' default.
+            env: extra environment variables for the container
+            labels: labels for the Deployment and its pods
+        """
+        super().__init__(object_type='deployment', name=name, labels=labels)
         self.container_image_uri = container_image_uri
         self.secrets = secrets
         self.ports = ports
         self.num_replicas = num_replicas
+        if image_pull_policy is None:
+            # images pinned by digest never change, so there's no reason to ever re-pull them
+            image_pull_policy = 'IfNotPresent' if '@sha256:' in container_image_uri else None
+        self.image_pull_policy = image_pull_policy
+        self.placement = placement
+        self.resources = resources
+        self.volumes = volumes
+        self.volume_mounts = volume_mounts
+        self.affinity = affinity
+        self.strategy = strategy
+        self.env = env if env is not None else {}
 
     def _get_yaml(self):
         deployment_dict = {
@@ -159,6 +484,7 @@ class KubernetesDeployment(_KubernetesApplyObject):
             'kind': 'Deployment',
             'metadata': {
                 'name': self.name,
+                'labels': self.get_labels(),
             },
             'spec': {
                 'selector': {
@@ -169,9 +495,7 @@ class KubernetesDeployment(_KubernetesApplyObject):
                 'replicas': self.num_replicas,
                 'template': {
                     'metadata': {
-                        'labels': {
-                            'run': self.name,
-                        },
+                        'labels': dict(self.get_labels(), run=self.name),
                     },
                     'spec': {
                         'containers': [
@@ -185,26 +509,210 @@ class KubernetesDeployment(_KubernetesApplyObject):
             },
         }
 
+        if self.strategy is not None:
+            deployment_dict['spec']['strategy'] = {'type': self.strategy}
+
         pod_spec_dict = deployment_dict['spec']['template']['spec']
         container_dict = pod_spec_dict['containers'][0]
         if self.ports:
             container_dict['ports'] = [port.to_container_port() for port in self.ports]
 
-        if self.secrets:
-            container_dict['volumeMounts'] = [secret.to_volume_mount() for secret in self.secrets]
-            if 'volumes' not in pod_spec_dict:
-                pod_spec_dict['volumes'] = []
-            pod_spec_dict['volumes'].extend([secret.to_volume() for secret in self.secrets])
+        if self.image_pull_policy is not None:
+            container_dict['imagePullPolicy'] = self.image_pull_policy
+        if self.env:
+            container_dict['env'] = [{'name': k, 'value': str(v)} for k, v in self.env.items()]
+
+        volume_mounts = [secret.to_volume_mount() for secret in self.secrets] + list(self.volume_mounts)
+        volumes = [secret.to_volume() for secret in self.secrets] + list(self.volumes)
+        if volume_mounts:
+            container_dict['volumeMounts'] = volume_mounts
+        if volumes:
+            pod_spec_dict['volumes'] = volumes
+
+        if self.resources:
+            container_dict['resources'] = self.resources
+        if self.affinity:
+            pod_spec_dict['affinity'] = self.affinity
+        if self.placement is not None:
+            _add_placement(pod_spec_dict, container_dict, self.placement)
 
         yaml_str = '\n' + yaml.dump(deployment_dict)
         return yaml_str
 
 
+class KubernetesJob(_KubernetesApplyObject):
+    def __init__(
+            self,
+            name: Text,
+            container_image_uri: Text,
+            command: Optional[List[Text]] = None,
+            completions: int = 1,
+            parallelism: int = 1,
+            completion_mode: Text = 'Indexed',
+            backoff_limit: int = 6,
+            env: Optional[Dict[Text, Text]] = None,
+            secrets: Iterable[KubernetesSecret] = (),
+            volumes: Iterable[Dict] = (),
+            volume_mounts: Iterable[Dict] = (),
+            labels: Optional[Dict[Text, Text]] = None,
+            ttl_seconds_after_finished: Optional[int] = 3600,
+            image_pull_policy: Optional[Text] = None,
+            node_selector: Optional[Dict[Text, Text]] = None,
+            placement: Optional[placement_module.Placement] = None,
+            ports: Iterable[KubernetesPort] = (),
+            field_env: Optional[Dict[Text, Text]] = None,
+            subdomain: Optional[Text] = None,
+    ):
+        """
+        A batch Job.  In Indexed completion mode, each of its pods gets a distinct JOB_COMPLETION_INDEX from
+        0 to completions - 1 in its environment, and the Job is done once every index has succeeded.
+
+        Args:
+            command: the container's command.  Defaults to the image's entrypoint.
+            completions: the number of pods which need to succeed
+            parallelism: the most pods to run at once
+            completion_mode: 'Indexed' or 'NonIndexed'
+            backoff_limit: how many failed pods to retry before failing the whole Job
+            env: extra environment variables for the container
+            volumes: raw pod volume dicts, in addition to the secrets' volumes
+            volume_mounts: raw container volume mount dicts for volumes
+            labels: labels for the Job and its pods
+            ttl_seconds_after_finished: have Kubernetes delete the finished Job after this long.  None keeps it.
+            node_selector: node labels the pods must run on.  A placement's node pool takes precedence.
+            placement: if given, the pods request its resources and are pinned to its node pool.
+            ports: the container's ports
+            field_env: environment variables read from the pod's own fields, e.g.:
+                {'RANK': "metadata.annotations['batch.kubernetes.io/job-completion-index']"}
+            subdomain: a headless Service's name.  Indexed pods are then reachable at <job name>-<index>.<subdomain>
+        """
+        super().__init__(object_type='job', name=name, labels=labels)
+        self.container_image_uri = container_image_uri
+        self.command = command
+        self.completions = completions
+        self.parallelism = parallelism
+        self.completion_mode = completion_mode
+        self.backoff_limit = backoff_limit
+        self.env = env if env is not None else {}
+        self.secrets = secrets
+        self.volumes = volumes
+        self.volume_mounts = volume_mounts
+        self.ttl_seconds_after_finished = ttl_seconds_after_finished
+        if image_pull_policy is None:
+            image_pull_policy = 'IfNotPresent' if '@sha256:' in container_image_uri else None
+        self.image_pull_policy = image_pull_policy
+        self.node_selector = node_selector
+        self.placement = placement
+        self.ports = ports
+        self.field_env = field_env if field_env is not None else {}
+        self.subdomain = subdomain
+
+    def _get_yaml(self):
+        labels = dict(self.get_labels(), job=self.name)
+        job_dict = {
+            'apiVersion': 'batch/v1',
+            'kind': 'Job',
+            'metadata': {
+                'name': self.name,
+                'labels': labels,
+            },
+            'spec': {
+                'completions': self.completions,
+                'parallelism': self.parallelism,
+                'completionMode': self.completion_mode,
+                'backoffLimit': self.backoff_limit,
+                'template': {
+                    'metadata': {
+                        'labels': labels,
+                    },
+                    'spec': {
+                        'restartPolicy': 'Never',
+                        'containers': [
+                            {
+                                'name': self.name,
+                                'image': self.container_image_uri,
+                            },
+                        ],
+                    },
+                },
+            },
+        }
+        if self.ttl_seconds_after_finished is not None:
+            job_dict['spec']['ttlSecondsAfterFinished'] = self.ttl_seconds_after_finished
+
+        pod_spec_dict = job_dict['spec']['template']['spec']
+        container_dict = pod_spec_dict['containers'][0]
+        if self.command:
+            container_dict['command'] = list(self.command)
+        env = [{'name': k, 'value': str(v)} for k, v in self.env.items()]
+        env += [{'name': k, 'valueFrom': {'fieldRef': {'fieldPath': v}}} for k, v in self.field_env.items()]
+        if env:
+            container_dict['env'] = env
+        if self.image_pull_policy is not None:
+            container_dict['imagePullPolicy'] = self.image_pull_policy
+        if self.ports:
+            container_dict['ports'] = [port.to_container_port() for port in self.ports]
+        if self.subdomain is not None:
+            pod_spec_dict['subdomain'] = self.subdomain
+
+        volume_mounts = [secret.to_volume_mount() for secret in self.secrets] + list(self.volume_mounts)
+        volumes = [secret.to_volume() for secret in self.secrets] + list(self.volumes)
+        if volume_mounts:
+            container_dict['volumeMounts'] = volume_mounts
+        if volumes:
+            pod_spec_dict['volumes'] = volumes
+
+        if self.node_selector:
+            pod_spec_dict['nodeSelector'] = dict(self.node_selector)
+        if self.placement is not None:
+            _add_placement(pod_spec_dict, container_dict, self.placement)
+
+        yaml_str = '\n' + yaml.dump(job_dict)
+        return yaml_str
+
+    def get_status(self) -> Dict:
+        """The Job's status, e.g.: {'active': 2, 'succeeded': 8, 'completedIndexes': '0-7'}"""
+        _, out, _ = self._run(f'kubectl get job {self.name} -o json')
+        return json.loads(out).get('status', {})
+
+    @staticmethod
+    def parse_indexes(indexes_str: Optional[Text]) -> List[int]:
+        """'0-2,5' ==> [0, 1, 2, 5], as in an Indexed Job's status.completedIndexes"""
+        indexes = []
+        for part in (indexes_str or '').split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                start, end = part.split('-')
+                indexes.extend(range(int(start), int(end) + 1))
+            else:
+                indexes.append(int(part))
+        return indexes
+
+
 class KubernetesService(_KubernetesApplyObject):
-    def __init__(self, name: Text, deployment_name: Text, ports: List[KubernetesPort]):
-        super().__init__(object_type='service', name=name)
+    def __init__(
+            self,
+            name: Text,
+            deployment_name: Text,
+            ports: List[KubernetesPort],
+            headless: bool = False,
+            selector: Optional[Dict[Text, Text]] = None,
+            labels: Optional[Dict[Text, Text]] = None,
+    ):
+        """
+        Args:
+            deployment_name: the Deployment whose pods the service routes to
+            headless: if True, there's no load balancer or cluster ip, just a DNS record per pod.  Pods get one even
+                before they're ready, so peers can find each other while they start up.
+            selector: the pod labels to route to, instead of deployment_name's
+            labels: labels for the service
+        """
+        super().__init__(object_type='service', name=name, labels=labels)
         self.deployment_name = deployment_name
         self.ports = ports
+        self.headless = headless
+        self.selector = selector if selector is not None else {'run': deployment_name}
 
     def _get_yaml(self):
         service_dict = {
@@ -212,17 +720,15 @@ class KubernetesService(_KubernetesApplyObject):
             'kind': 'Service',
             'metadata': {
                 'name': self.name,
-                'labels': {
-                    'run': self.deployment_name,
-                }
+                'labels': dict(self.get_labels(), run=self.deployment_name),
             },
             'spec': {
                 'type': 'LoadBalancer',
-                'selector': {
-                    'run': self.deployment_name,
-                }
+                'selector': dict(self.selector),
             }
         }
+        if self.headless:
+            service_dict['spec'].update(type='ClusterIP', clusterIP='None', publishNotReadyAddresses=True)
         if self.ports:
             service_dict['spec']['ports'] = [port.to_service_port() for port in self.ports]
 
@@ -250,12 +756,16 @@ class KubernetesService(_KubernetesApplyObject):
         """
         # get devbox ip address
         _, out, _ = self._run(f'kubectl get svc {self.name} -o json')
-        out = json.loads(out)
-        load_balancer_dict = out['status']['loadBalancer']
+        return self.parse_ip_and_ports(json.loads(out))
+
+    @staticmethod
+    def parse_ip_and_ports(service_dict: Dict) -> Tuple[Optional[Text], Optional[Dict[Text, int]]]:
+        """The ip and ports in a service's json, as from `kubectl get svc -o json`.  (None, None) if it has no ip yet."""
+        load_balancer_dict = service_dict.get('status', {}).get('loadBalancer', {})
         if 'ingress' not in load_balancer_dict:
             return None, None
         ip = load_balancer_dict['ingress'][0]['ip']
-        ports = out['spec']['ports']
+        ports = service_dict['spec']['ports']
         ports_dict = {port['name']: port['port'] for port in ports}
         return ip, ports_dict
 
@@ -267,12 +777,21 @@ def get_service_and_deployment(
         ports: List[KubernetesPort],
         secrets: List[KubernetesSecret],
         num_deployment_replicas: int = 1,
+        placement: Optional[placement_module.Placement] = None,
+        labels: Optional[Dict[Text, Text]] = None,
+        **deployment_kwargs,
 ):
-    """Get a paired deployment and service.  They won't be created.  Create your service first."""
+    """Get a paired deployment and service.  They won't be created.  Create your service first.
+
+    Args:
+        labels: labels for both
+        deployment_kwargs: more KubernetesDeployment args, e.g.: resources or volumes
+    """
     service = KubernetesService(
         name=service_name,
         deployment_name=deployment_name,
         ports=ports,
+        labels=labels,
     )
 
     deployment = KubernetesDeployment(
@@ -281,6 +800,9 @@ def get_service_and_deployment(
         ports=ports,
         secrets=secrets,
         num_replicas=num_deployment_replicas,
+        placement=placement,
+        labels=labels,
+        **deployment_kwargs,
     )
     return service, deployment
 
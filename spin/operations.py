@@ -0,0 +1,178 @@
+"""This module tracks long-running GKE operations, e.g.: creating, resizing or deleting clusters and node pools.
+
+Mutations are launched with `--async`, which returns as soon as GKE has accepted the operation.  Every pending
+operation in a zone is then watched with one `gcloud container operations list` call per poll, no matter how many
+there are, and callers get a concurrent.futures.Future per operation.
+
+    tracker = OperationTracker(zone='us-central1-a')
+    futures = [tracker.launch(f'gcloud container clusters resize my-cluster --node-pool {p} --num-nodes 0 ...')
+               for p in pools]
+    tracker.wait(futures)
+"""
+import concurrent.futures
+import json
+import threading
+import time
+from typing import Text, Dict, List, Optional, Iterable
+
+from spin import tracing, utils
+
+
+class Operation(utils.DictBouncer):
+    """A GKE operation as reported by `gcloud container operations list --format=json`."""
+    DONE = 'DONE'
+
+    def __init__(
+            self,
+            name: Text,
+            status: Text,
+            operation_type: Optional[Text] = None,
+            target: Optional[Text] = None,
+            zone: Optional[Text] = None,
+            status_message: Optional[Text] = None,
+    ):
+        super().__init__()
+        self.name = name
+        self.status = status
+        self.operation_type = operation_type
+        self.target = target
+        self.zone = zone
+        self.status_message = status_message
+
+    @classmethod
+    def from_gcloud_dict(cls, d: Dict) -> 'Operation':
+        status_message = d.get('statusMessage')
+        if not status_message and d.get('error'):
+            status_message = d['error'].get('message', str(d['error']))
+        return cls(
+            name=d['name'],
+            status=d.get('status', 'STATUS_UNSPECIFIED'),
+            operation_type=d.get('operationType'),
+            target=d.get('targetLink'),
+            zone=d.get('zone', d.get('location')),
+            status_message=status_message,
+        )
+
+    def is_done(self) -> bool:
+        return self.status == self.DONE
+
+    def is_failed(self) -> bool:
+        # GKE reports a failed operation as DONE with an error message
+        return self.is_done() and bool(self.status_message)
+
+
+class OperationTracker(utils.ShellRunnerMixin):
+    def __init__(self, zone: Text, poll_interval=5.0, timeout=3600.0, verbose=True):
+        """
+        Args:
+            zone: the zone whose operations this tracker watches
+            poll_interval: seconds between polls of the operations list
+            timeout: fail operations which haven't finished this many seconds after they were tracked
+            verbose: if True, log commands as they run
+        """
+        super().__init__(verbose)
+        self.zone = zone
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+        self._futures = {}
+        self._deadlines = {}
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def launch(self, command: Text) -> concurrent.futures.Future:
+        """Run a gcloud mutation asynchronously and return a Future for its Operation.
+
+        Args:
+            command: a `gcloud container ...` command without --async.  It should return immediately with --async.
+        """
+        _, out, _ = self._run(f'{command} --async --format="value(name)"')
+        names = [line.strip() for line in out.splitlines() if line.strip()]
+        if len(names) != 1:
+            raise ValueError(f"Expected one operation name from `{command}` but got: {out}")
+        return self.track(names[0])
+
+    def track(self, operation_name: Text) -> concurrent.futures.Future:
+        """Watch an operation which has already been started.  Tracking the same operation twice returns one Future.
+
+        A background thread polls while anything is pending, so the Future resolves without anyone calling wait.
+        """
+        with self._lock:
+            future = self._futures.get(operation_name)
+            if future is None:
+                future = concurrent.futures.Future()
+                future.set_running_or_notify_cancel()
+                self._futures[operation_name] = future
+                self._deadlines[operation_name] = time.monotonic() + self.timeout
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_until_idle, name='spin-operations', daemon=True)
+                self._poller.start()
+        return future
+
+    def get_pending_names(self) -> List[Text]:
+        with self._lock:
+            return [name for name, future in self._futures.items() if not future.done()]
+
+    def list_operations(self) -> Dict[Text, Operation]:
+        """Every recent operation in this tracker's zone, from one gcloud call."""
+        _, out, _ = self._run(f'gcloud container operations list --zone={self.zone} --format=json')
+        return {d['name']: Operation.from_gcloud_dict(d) for d in json.loads(out or '[]')}
+
+    def poll(self) -> int:
+        """Check every pending operation with a single list call and resolve the ones which have finished.
+
+        Returns:
+            The number of operations which are still pending.
+        """
+        pending = self.get_pending_names()
+        if not pending:
+            return 0
+
+        with tracing.span('poll operations', category='gcloud', num_pending=len(pending)):
+            operations = self.list_operations()
+
+        now = time.monotonic()
+        with self._lock:
+            for name in pending:
+                future = self._futures[name]
+                operation = operations.get(name)
+                if operation is not None and operation.is_done():
+                    if operation.is_failed():
+                        future.set_exception(ValueError(f"Operation {name} ({operation.operation_type} "
+                                                        f"{operation.target}) failed: {operation.status_message}"))
+                    else:
+                        future.set_result(operation)
+                elif now > self._deadlines[name]:
+                    future.set_exception(TimeoutError(f"Operation {name} didn't finish in {self.timeout}s."))
+            return len([f for f in self._futures.values() if not f.done()])
+
+    def wait(
+            self,
+            futures: Optional[Iterable[concurrent.futures.Future]] = None,
+            timeout: Optional[float] = None,
+    ) -> List[Operation]:
+        """Block until the given futures, or all tracked operations, are done.
+
+        Returns:
+            The finished Operations, in the order of futures.  Raises if any of them failed.
+        """
+        with self._lock:
+            futures = list(futures) if futures is not None else list(self._futures.values())
+        _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        if not_done:
+            raise TimeoutError(f"Operations still pending after {timeout}s: {self.get_pending_names()}")
+        return [f.result() for f in futures]
+
+    def _poll_until_idle(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as e:
+                # a failed poll (e.g.: a network blip) shouldn't fail the operations; try again next time
+                if self.verbose:
+                    print(f"Error polling operations: {e}")
+            with self._lock:
+                if all(f.done() for f in self._futures.values()):
+                    self._poller = None
+                    return
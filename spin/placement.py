@@ -0,0 +1,400 @@
+"""This module chooses a node pool for a workload and emits the pod spec fields which keep it there.
+
+A workload says what one replica needs with a ResourceRequest.  A Placer looks at the NodePools in a GkeCluster (e.g.:
+from your ProjectConfig), works out how much of each node's machine type Kubernetes can actually hand out and picks
+the pool whose nodes the workload fills most completely (best fit).  The resulting Placement knows the pod's
+requests and limits, its nodeSelector and its tolerations, which KubernetesDeployment writes into its manifest:
+
+    placer = Placer.from_cluster(PROJECT_CONFIG.cluster)
+    placement = placer.place(ResourceRequest(cpu=3, memory_gb=12, gpus=1))
+    print(placement.get_summary())
+    deployment = KubernetesDeployment(name='trainer', container_image_uri=uri, placement=placement)
+
+`simulate_packing` bin packs a list of workloads onto their chosen pools offline, so you can check the density a
+set of pools will get before paying for any nodes.
+"""
+import math
+import re
+from typing import Text, Dict, List, Optional, Iterable
+
+from spin import utils
+from spin.cluster import GkeCluster, NodePool
+
+NODE_POOL_LABEL = 'cloud.google.com/gke-nodepool'
+GPU_RESOURCE_NAME = 'nvidia.com/gpu'
+
+# GKE taints every GPU node with this so that only pods which ask for GPUs land there
+GPU_TOLERATION = {
+    'key': GPU_RESOURCE_NAME,
+    'operator': 'Exists',
+    'effect': 'NoSchedule',
+}
+
+
+class MachineType(utils.DictBouncer):
+    def __init__(self, name: Text, cpus: float, memory_gb: float):
+        super().__init__()
+        self.name = name
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+
+    def get_allocatable_cpus(self) -> float:
+        """The cpus left for pods after GKE's reservation for the kubelet and system daemons.
+
+        ref: https://cloud.google.com/kubernetes-engine/docs/concepts/cluster-architecture#node_allocatable
+        """
+        reserved = 0.0
+        for start, end, fraction in ((0, 1, .06), (1, 2, .01), (2, 4, .005), (4, math.inf, .0025)):
+            reserved += max(0.0, min(self.cpus, end) - start) * fraction
+        return self.cpus - reserved
+
+    def get_allocatable_memory_gb(self) -> float:
+        """The memory left for pods after GKE's reservation and the kubelet's 100Mi eviction threshold."""
+        reserved = .1
+        for start, end, fraction in ((0, 4, .25), (4, 8, .2), (8, 16, .1), (16, 128, .06), (128, math.inf, .02)):
+            reserved += max(0.0, min(self.memory_gb, end) - start) * fraction
+        return self.memory_gb - reserved
+
+
+def _get_machine_types() -> Dict[Text, MachineType]:
+    # ref: https://cloud.google.com/compute/docs/machine-types
+    machine_types = [
+        MachineType('f1-micro', .2, .6),
+        MachineType('g1-small', .5, 1.7),
+    ]
+    for cpus in (1, 2, 4, 8, 16, 32, 64, 96):
+        machine_types.append(MachineType(f'n1-standard-{cpus}', cpus, 3.75 * cpus))
+    for cpus in (2, 4, 8, 16, 32, 64, 96):
+        machine_types.append(MachineType(f'n1-highmem-{cpus}', cpus, 6.5 * cpus))
+        machine_types.append(MachineType(f'n1-highcpu-{cpus}', cpus, .9 * cpus))
+    for cpus in (2, 4, 8, 16, 32, 48, 64, 80):
+        machine_types.append(MachineType(f'n2-standard-{cpus}', cpus, 4 * cpus))
+        machine_types.append(MachineType(f'n2-highmem-{cpus}', cpus, 8 * cpus))
+    return {m.name: m for m in machine_types}
+
+
+MACHINE_TYPES = _get_machine_types()
+
+
+def get_machine_type(name: Text) -> MachineType:
+    """Look up a machine type by name.  Custom types, e.g.: custom-6-23040 or n2-custom-6-23040, are parsed."""
+    if name in MACHINE_TYPES:
+        return MACHINE_TYPES[name]
+    m = re.match(r'^(?:\w+-)?custom-(?P<cpus>\d+)-(?P<memory_mb>\d+)(?:-ext)?$', name)
+    if m:
+        return MachineType(name, int(m.group('cpus')), int(m.group('memory_mb')) / 1024)
+    raise ValueError(f"Unknown machine type {name}.  Known machine types are {sorted(MACHINE_TYPES.keys())} "
+                     f"and custom-<cpus>-<memory_mb>.")
+
+
+class ResourceRequest(utils.DictBouncer):
+    def __init__(
+            self,
+            cpu: float = 1.0,
+            memory_gb: float = 2.0,
+            gpus: int = 0,
+            accelerator_type: Optional[Text] = None,
+            guaranteed: bool = False,
+    ):
+        """
+        What one replica of a workload needs.
+
+        Args:
+            cpu: cpu cores to request, e.g.: 0.5
+            memory_gb: memory to request.  It's also the limit, so a pod which outgrows it is restarted rather than
+                starving its neighbors.
+            gpus: the number of GPUs to request
+            accelerator_type: only place on pools with this accelerator, e.g.: nvidia-tesla-v100.  None takes any.
+            guaranteed: if True, limit cpu to the request too, which puts the pod in Kubernetes' Guaranteed QoS class.
+                Its cpu can't be taken by its neighbors, and with the static cpu manager policy, whole cores are
+                pinned to it.
+        """
+        super().__init__()
+        if cpu <= 0 or memory_gb <= 0:
+            raise ValueError(f"Resource requests must be positive but got cpu={cpu} and memory_gb={memory_gb}")
+        if gpus < 0:
+            raise ValueError(f"gpus can't be negative but got {gpus}")
+        self.cpu = cpu
+        self.memory_gb = memory_gb
+        self.gpus = gpus
+        self.accelerator_type = accelerator_type
+        self.guaranteed = guaranteed
+
+    def to_kubernetes_resources(self) -> Dict[Text, Dict[Text, Text]]:
+        """The container's `resources` field."""
+        requests = {
+            'cpu': f'{int(math.ceil(self.cpu * 1000))}m',
+            'memory': f'{int(math.ceil(self.memory_gb * 1024))}Mi',
+        }
+        limits = dict(requests) if self.guaranteed else {'memory': requests['memory']}
+        if self.gpus:
+            # GPUs can't be overcommitted, so kubernetes requires their request to equal their limit
+            requests[GPU_RESOURCE_NAME] = str(self.gpus)
+            limits[GPU_RESOURCE_NAME] = str(self.gpus)
+        return {'requests': requests, 'limits': limits}
+
+
+class NodeShape(utils.DictBouncer):
+    """What one node in a pool can hand out to pods."""
+    def __init__(
+            self,
+            pool_name: Text,
+            machine_type: Text,
+            cpus: float,
+            memory_gb: float,
+            gpus: int = 0,
+            accelerator_type: Optional[Text] = None,
+            max_nodes: Optional[int] = None,
+    ):
+        super().__init__()
+        self.pool_name = pool_name
+        self.machine_type = machine_type
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+        self.gpus = gpus
+        self.accelerator_type = accelerator_type
+        self.max_nodes = max_nodes
+
+    @classmethod
+    def from_node_pool(cls, node_pool: NodePool) -> 'NodeShape':
+        machine_type = get_machine_type(node_pool.machine_type)
+        has_accelerator = node_pool.accelerator_count_per_node > 0 and node_pool.accelerator is not None
+        return cls(
+            pool_name=node_pool.name,
+            machine_type=machine_type.name,
+            cpus=machine_type.get_allocatable_cpus(),
+            memory_gb=machine_type.get_allocatable_memory_gb(),
+            gpus=node_pool.accelerator_count_per_node if has_accelerator else 0,
+            accelerator_type=node_pool.accelerator if has_accelerator else None,
+            max_nodes=node_pool.max_nodes,
+        )
+
+    def get_pods_per_node(self, request: ResourceRequest) -> int:
+        """How many replicas of request fit on one node.  0 if it doesn't fit at all or would waste the GPUs."""
+        if request.accelerator_type is not None and request.accelerator_type != self.accelerator_type:
+            return 0
+        # cpu-only pods on GPU nodes would keep expensive nodes up without using their GPUs
+        if bool(request.gpus) != bool(self.gpus):
+            return 0
+        fits = [
+            int(math.floor(self.cpus / request.cpu + 1e-9)),
+            int(math.floor(self.memory_gb / request.memory_gb + 1e-9)),
+        ]
+        if request.gpus:
+            fits.append(self.gpus // request.gpus)
+        return max(0, min(fits))
+
+
+class Placement(utils.DictBouncer):
+    def __init__(
+            self,
+            pool_name: Text,
+            request: ResourceRequest,
+            pods_per_node: int,
+            cpu_utilization: float,
+            memory_utilization: float,
+            gpu_utilization: Optional[float] = None,
+    ):
+        """
+        Where a workload should run and how densely it'll pack there.
+
+        Args:
+            pool_name: the chosen node pool
+            request: what one replica needs
+            pods_per_node: how many replicas fit on one node of the pool
+            cpu_utilization: fraction of a full node's allocatable cpu those replicas request
+            memory_utilization: see cpu_utilization
+            gpu_utilization: see cpu_utilization.  None for pools without GPUs.
+        """
+        super().__init__()
+        self.pool_name = pool_name
+        self.request = request
+        self.pods_per_node = pods_per_node
+        self.cpu_utilization = cpu_utilization
+        self.memory_utilization = memory_utilization
+        self.gpu_utilization = gpu_utilization
+
+    @classmethod
+    def from_dict(cls, d: Dict):
+        if not d:
+            return None
+        d = dict(d)
+        d['request'] = ResourceRequest.from_dict(d['request'])
+        return cls(**d)
+
+    def to_kubernetes_resources(self) -> Dict[Text, Dict[Text, Text]]:
+        return self.request.to_kubernetes_resources()
+
+    def to_node_selector(self) -> Dict[Text, Text]:
+        return {NODE_POOL_LABEL: self.pool_name}
+
+    def to_tolerations(self) -> List[Dict[Text, Text]]:
+        return [dict(GPU_TOLERATION)] if self.request.gpus else []
+
+    def get_density(self) -> float:
+        """How much of a full node the pods use, averaged over cpu, memory and GPUs.  1.0 means nothing is stranded.
+
+        A pool which fits a workload's cpu perfectly but leaves most of its memory idle isn't a good fit, so this
+        averages rather than looking only at the scarcest resource.
+        """
+        utilizations = [self.cpu_utilization, self.memory_utilization]
+        if self.gpu_utilization is not None:
+            utilizations.append(self.gpu_utilization)
+        return sum(utilizations) / len(utilizations)
+
+    def get_summary(self) -> Text:
+        gpu_str = '' if self.gpu_utilization is None else f', gpu {self.gpu_utilization:.0%}'
+        return (f"{self.pool_name}: {self.pods_per_node} pods per node "
+                f"(cpu {self.cpu_utilization:.0%}, memory {self.memory_utilization:.0%}{gpu_str})")
+
+
+class Placer:
+    def __init__(self, shapes: Iterable[NodeShape]):
+        """
+        Chooses node pools for workloads.
+
+        Args:
+            shapes: one per node pool
+        """
+        self.shapes = {shape.pool_name: shape for shape in shapes}
+
+    @classmethod
+    def from_node_pools(cls, node_pools: Iterable[NodePool]) -> 'Placer':
+        return cls([NodeShape.from_node_pool(p) for p in node_pools])
+
+    @classmethod
+    def from_cluster(cls, cluster: GkeCluster) -> 'Placer':
+        return cls.from_node_pools(cluster.node_pools.values())
+
+    def get_placement(self, pool_name: Text, request: ResourceRequest) -> Optional[Placement]:
+        """How request would pack onto pool_name or None if it doesn't fit there."""
+        shape = self.shapes[pool_name]
+        pods_per_node = shape.get_pods_per_node(request)
+        if not pods_per_node:
+            return None
+        return Placement(
+            pool_name=pool_name,
+            request=request,
+            pods_per_node=pods_per_node,
+            cpu_utilization=pods_per_node * request.cpu / shape.cpus,
+            memory_utilization=pods_per_node * request.memory_gb / shape.memory_gb,
+            gpu_utilization=pods_per_node * request.gpus / shape.gpus if shape.gpus else None,
+        )
+
+    def get_candidates(self, request: ResourceRequest) -> List[Placement]:
+        """Every pool request fits on, best fit first."""
+        placements = [self.get_placement(name, request) for name in self.shapes]
+        placements = [p for p in placements if p is not None]
+        # densest first.  on ties, prefer the smaller machine, which costs less to keep up for a few pods.
+        return sorted(
+            placements,
+            key=lambda p: (-p.get_density(), self.shapes[p.pool_name].cpus, p.pool_name),
+        )
+
+    def place(self, request: ResourceRequest) -> Placement:
+        candidates = self.get_candidates(request)
+        if not candidates:
+            shapes_str = '\n  '.join(
+                f'{s.pool_name}: {s.machine_type} ({s.cpus:.2f} cpus, {s.memory_gb:.1f}GB allocatable, '
+                f'{s.gpus} x {s.accelerator_type})'
+                for s in self.shapes.values()
+            )
+            raise ValueError(f"No node pool can fit a pod requesting {request.cpu} cpus, {request.memory_gb}GB "
+                             f"and {request.gpus} x {request.accelerator_type or 'any'} GPUs.  Node pools:\n"
+                             f"  {shapes_str}")
+        return candidates[0]
+
+
+class PoolPacking(utils.DictBouncer):
+    """The result of packing workloads onto one pool's nodes."""
+    def __init__(
+            self,
+            pool_name: Text,
+            num_nodes: int,
+            num_pods: int,
+            cpu_utilization: float,
+            memory_utilization: float,
+            gpu_utilization: Optional[float] = None,
+            num_unschedulable: int = 0,
+    ):
+        super().__init__()
+        self.pool_name = pool_name
+        self.num_nodes = num_nodes
+        self.num_pods = num_pods
+        self.cpu_utilization = cpu_utilization
+        self.memory_utilization = memory_utilization
+        self.gpu_utilization = gpu_utilization
+        self.num_unschedulable = num_unschedulable
+
+
+def simulate_packing(
+        placer: Placer,
+        requests: Iterable[ResourceRequest],
+        placements: Optional[List[Placement]] = None,
+) -> Dict[Text, PoolPacking]:
+    """Bin pack pods onto nodes, offline, the way the scheduler would fill a pool.
+
+    Pods go to their placement's pool, largest first, each onto the first node with room (first fit decreasing).  A
+    pool never grows past its max_nodes; pods which don't fit are counted as unschedulable.
+
+    Args:
+        placer: knows the pools' node shapes
+        requests: one per pod
+        placements: the placement for each request.  Defaults to placer.place(request).
+
+    Returns:
+        A PoolPacking per pool which got any pods.
+    """
+    requests = list(requests)
+    if placements is None:
+        placements = [placer.place(r) for r in requests]
+    if len(placements) != len(requests):
+        raise ValueError(f"Got {len(requests)} requests but {len(placements)} placements")
+
+    pool_to_requests = {}
+    for request, placement in zip(requests, placements):
+        pool_to_requests.setdefault(placement.pool_name, []).append(request)
+
+    packings = {}
+    for pool_name, pool_requests in pool_to_requests.items():
+        shape = placer.shapes[pool_name]
+        # each node's free [cpu, memory, gpus]
+        nodes = []
+        num_unschedulable = 0
+        pool_requests = sorted(
+            pool_requests,
+            key=lambda r: (r.gpus, r.cpu / shape.cpus + r.memory_gb / shape.memory_gb),
+            reverse=True,
+        )
+        for request in pool_requests:
+            needs = [request.cpu, request.memory_gb, request.gpus]
+            for free in nodes:
+                if all(f + 1e-9 >= n for f, n in zip(free, needs)):
+                    break
+            else:
+                if shape.max_nodes is not None and len(nodes) >= shape.max_nodes:
+                    num_unschedulable += 1
+                    continue
+                free = [shape.cpus, shape.memory_gb, shape.gpus]
+                nodes.append(free)
+            for i, n in enumerate(needs):
+                free[i] -= n
+
+        num_nodes = len(nodes)
+        scheduled = len(pool_requests) - num_unschedulable
+
+        def _get_utilization(index, capacity):
+            if not num_nodes or not capacity:
+                return 0.0
+            return sum(capacity - free[index] for free in nodes) / (capacity * num_nodes)
+
+        packings[pool_name] = PoolPacking(
+            pool_name=pool_name,
+            num_nodes=num_nodes,
+            num_pods=scheduled,
+            cpu_utilization=_get_utilization(0, shape.cpus),
+            memory_utilization=_get_utilization(1, shape.memory_gb),
+            gpu_utilization=_get_utilization(2, shape.gpus) if shape.gpus else None,
+            num_unschedulable=num_unschedulable,
+        )
+    return packings
@@ -0,0 +1,204 @@
+"""This module renders cookiecutter-style project templates, e.g.: templates/project.
+
+It follows cookiecutter's conventions (a cookiecutter.json of defaults, which may themselves be templates, and a single
+templated top-level directory) but is built for rendering lots of projects quickly:
+    * compiled templates are kept in a persistent bytecode cache keyed by template content (see utils)
+    * a Scaffolder reads and compiles its templates once and can then render any number of projects
+    * independent files are rendered concurrently and then written out in one pass
+"""
+import concurrent.futures
+import datetime
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Text, Dict, Any, Optional, List, Tuple, Union, Iterable
+
+import click
+import jinja2
+import jinja2.ext
+
+from spin import utils
+
+
+class NowExtension(jinja2.ext.Extension):
+    """Supports cookiecutter's (jinja2-time's) `{% now 'local', '%Y' %}` tag.  Timezones other than 'local' are UTC."""
+    tags = {'now'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        timezone = parser.parse_expression()
+        datetime_format = jinja2.nodes.Const('%Y-%m-%d')
+        if parser.stream.skip_if('comma'):
+            datetime_format = parser.parse_expression()
+        call = self.call_method('_now', [timezone, datetime_format], lineno=lineno)
+        return jinja2.nodes.Output([call], lineno=lineno)
+
+    @staticmethod
+    def _now(timezone, datetime_format):
+        if timezone == 'local':
+            now = datetime.datetime.now()
+        else:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return now.strftime(datetime_format)
+
+
+class Scaffolder:
+    CONFIG_FILENAME = 'cookiecutter.json'
+    CONTEXT_NAME = 'cookiecutter'
+
+    def __init__(self, template_dir: Union[Text, Path], max_workers: Optional[int] = None):
+        """
+        Args:
+            template_dir: a directory containing a cookiecutter.json and a single templated directory,
+                e.g.: settings.TEMPLATES_PATH / 'project'
+            max_workers: the number of threads used to render files.  Defaults to the executor's default.
+        """
+        self.template_path = Path(template_dir).resolve()
+        self.max_workers = max_workers
+
+        with open(str(self.template_path / self.CONFIG_FILENAME), 'r') as f:
+            self.defaults = json.load(f)
+
+        dirs = [p for p in self.template_path.iterdir() if p.is_dir() and '{{' in p.name]
+        if len(dirs) != 1:
+            raise ValueError(f"Expected exactly one templated directory in {self.template_path} but found {dirs}.")
+        self.repo_dir_name = dirs[0].name
+
+        self.environment = utils.get_jinja_environment(
+            str(self.template_path),
+            strict=True,
+            keep_trailing_newline=True,
+            extensions=(NowExtension,),
+        )
+        self._path_templates = {}
+        self._files = self._find_files()
+
+    def _find_files(self) -> List[Tuple[Text, bool]]:
+        """(path relative to template_path, is_text) for every file to be rendered."""
+        out = []
+        for dirpath, _, filenames in os.walk(str(self.template_path / self.repo_dir_name)):
+            for filename in sorted(filenames):
+                full_filename = os.path.join(dirpath, filename)
+                relative_path = os.path.relpath(full_filename, str(self.template_path)).replace(os.sep, '/')
+                out.append((relative_path, self._is_text(full_filename)))
+        return sorted(out)
+
+    @staticmethod
+    def _is_text(filename: Text) -> bool:
+        with open(filename, 'rb') as f:
+            chunk = f.read(8192)
+        if b'\0' in chunk:
+            return False
+        try:
+            chunk.decode('utf-8')
+        except UnicodeDecodeError:
+            return False
+        return True
+
+    def _render_string(self, s: Text, context: Dict[Text, Any]) -> Text:
+        if '{' not in s:
+            return s
+        template = self._path_templates.get(s)
+        if template is None:
+            template = self.environment.from_string(s)
+            self._path_templates[s] = template
+        return template.render(context)
+
+    def get_context(self, extra_context: Optional[Dict[Text, Any]] = None, no_input=True) -> Dict[Text, Any]:
+        """Fill in cookiecutter.json's defaults in order, letting earlier values feed later templated defaults.
+
+        Args:
+            extra_context: values which override the defaults
+            no_input: if False, prompt for each value, using the default or extra_context value as the suggestion
+        """
+        extra_context = extra_context or {}
+        values = {}
+        context = {self.CONTEXT_NAME: values}
+        for key, default in self.defaults.items():
+            if key.startswith('_'):
+                values[key] = default
+                continue
+
+            value = extra_context.get(key, default)
+            if isinstance(value, list):
+                # a list of choices.  the first is the default.
+                value = value[0]
+            if isinstance(value, str):
+                value = self._render_string(value, context)
+            if not no_input:
+                value = click.prompt(key, default=value)
+            values[key] = value
+
+        # extra context keys which aren't in cookiecutter.json are still available to templates
+        for key, value in extra_context.items():
+            values.setdefault(key, value)
+
+        return context
+
+    def _render_file(self, relative_path: Text, is_text: bool, context: Dict[Text, Any]) -> Tuple[Text, Any]:
+        output_relative_path = self._render_string(relative_path, context)
+        if not is_text:
+            return output_relative_path, None
+        return output_relative_path, self.environment.get_template(relative_path).render(context)
+
+    def render(
+            self,
+            extra_context: Optional[Dict[Text, Any]] = None,
+            output_dir: Union[Text, Path] = '.',
+            no_input=True,
+            overwrite_if_exists=False,
+            executor: Optional[concurrent.futures.Executor] = None,
+    ) -> Text:
+        """Render one project.
+
+        Args:
+            extra_context: values which override cookiecutter.json's defaults
+            output_dir: the project directory is created inside this directory
+            no_input: if False, prompt for each value
+            overwrite_if_exists: if False, raise if the project directory already exists
+            executor: render files on this executor rather than a new one
+
+        Returns:
+            The full path of the new project directory.
+        """
+        context = self.get_context(extra_context, no_input=no_input)
+
+        output_path = Path(output_dir).expanduser().resolve()
+        project_path = output_path / self._render_string(self.repo_dir_name, context)
+        if project_path.exists() and not overwrite_if_exists:
+            raise IOError(f"Project directory {project_path} already exists.")
+
+        if executor is None:
+            with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+                rendered = list(executor.map(lambda f: self._render_file(*f, context), self._files))
+        else:
+            rendered = list(executor.map(lambda f: self._render_file(*f, context), self._files))
+
+        # create every directory and then write every file
+        for d in sorted({str((output_path / relative_path).parent) for relative_path, _ in rendered}):
+            os.makedirs(d, exist_ok=True)
+        for (template_relative_path, _), (relative_path, contents) in zip(self._files, rendered):
+            source = str(self.template_path / template_relative_path)
+            target = str(output_path / relative_path)
+            if contents is None:
+                shutil.copyfile(source, target)
+            else:
+                with open(target, 'w') as f:
+                    f.write(contents)
+            shutil.copymode(source, target)
+
+        return str(project_path)
+
+    def render_many(
+            self,
+            extra_contexts: Iterable[Dict[Text, Any]],
+            output_dir: Union[Text, Path] = '.',
+            overwrite_if_exists=False,
+    ) -> List[Text]:
+        """Render one project per extra_context, sharing compiled templates and one pool of render threads."""
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            return [
+                self.render(extra_context, output_dir, overwrite_if_exists=overwrite_if_exists, executor=executor)
+                for extra_context in extra_contexts
+            ]
@@ -10,3 +10,12 @@ TEMPLATES_PATH = PROJECT_ROOT_PATH / 'templates'
 SPIN_RC_FILENAME = '.spinrc'
 SPIN_RC_PATH = Path.home() / SPIN_RC_FILENAME
 SPIN_RC_PATH_STR = str(SPIN_RC_PATH)
+
+WORKBENCH_CONTAINER_PATH = PACKAGE_ROOT_PATH / 'workbench' / 'container'
+
+SPIN_DIR_PATH = Path.home() / '.spin'
+PUBLISHED_IMAGES_PATH = SPIN_DIR_PATH / 'published_images.json'
+SPIN_CACHE_PATH = SPIN_DIR_PATH / 'cache'
+JINJA_CACHE_PATH = SPIN_CACHE_PATH / 'jinja'
+WHEEL_CACHE_PATH = SPIN_CACHE_PATH / 'wheels'
+INSTALLS_PATH = SPIN_DIR_PATH / 'installs'
@@ -1,10 +1,11 @@
 """This module contains utilities for saving and loading system-wide and project-wide settings."""
+import contextlib
 import importlib
 from pathlib import Path
 import sys
-from typing import Dict, Text, Optional, List
+from typing import Dict, Text, Optional, List, Iterator
 
-from spin import settings
+from spin import settings, utils
 from spin.cluster import Cluster
 from spin.utils import DictBouncer, YamlBouncer
 
@@ -64,13 +65,13 @@ class SpinRc(YamlBouncer):
             self,
             user: SpinRcUser,
             projects: List[SpinRcProject],
-            ssh_keys: List[SpinRcSshKey],
+            ssh_keys: Optional[List[SpinRcSshKey]] = None,
             current_project: Text=None,
     ):
         # TODO: super().__init__()?
         self.user = user
         self.projects = projects
-        self.ssh_keys = ssh_keys
+        self.ssh_keys = ssh_keys if ssh_keys is not None else []
         self.current_project = current_project
 
     def add_project(self, project: SpinRcProject, set_current=False):
@@ -100,6 +101,8 @@ class SpinRc(YamlBouncer):
 
     @classmethod
     def from_dict(cls, d: Dict):
+        if not d:
+            return None
         user = SpinRcUser.from_dict(d.get('user', {}))
         del d['user']
         projects = [SpinRcProject.from_dict(p) for p in d.get('projects', [])]
@@ -107,20 +110,42 @@ class SpinRc(YamlBouncer):
         return cls(user, projects, **d)
 
     def save(self, filename: Text = settings.SPIN_RC_PATH_STR):
-        self.to_yaml(filename)
+        """Atomically write this SpinRc, along with a parsed snapshot so the next load doesn't need to parse yaml."""
+        self.to_yaml(filename, use_snapshot=True)
 
     @classmethod
     def load(cls, filename: Text = settings.SPIN_RC_PATH_STR) -> 'SpinRc':
-        d = cls.from_yaml(filename)
+        d = cls.from_yaml(filename, use_snapshot=True)
         if d is None:
             raise ValueError(f"Got empty spin rc file at location {filename}")
         return d
 
+    @staticmethod
+    def get_lock_filename(filename: Text) -> Text:
+        return f'{filename}.lock'
+
+    @classmethod
+    @contextlib.contextmanager
+    def transaction(cls, filename: Text = settings.SPIN_RC_PATH_STR) -> Iterator['SpinRc']:
+        """Load, mutate and save a SpinRc without losing concurrent updates from other spin processes:
+
+            with SpinRc.transaction() as rc:
+                rc.add_project(project)
+
+        Writers are serialized by an advisory lock on a separate lock file and re-read the file once they hold it,
+        so each one applies its change on top of the previous writer's.  The file is atomically replaced on save,
+        so readers using plain load() never block and never see a partial file.  If the body raises, nothing
+        is saved.
+        """
+        with utils.FileLock(cls.get_lock_filename(filename)):
+            rc = cls.load(filename)
+            yield rc
+            rc.save(filename)
+
     @classmethod
     def load_and_set_current_project_and_save(cls, project_name: Text):
-        rc = cls.load()
-        rc.set_current_project(project_name)
-        rc.save()
+        with cls.transaction() as rc:
+            rc.set_current_project(project_name)
 
     @classmethod
     def load_and_get_current_project(cls) -> Optional[SpinRcProject]:
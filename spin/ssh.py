@@ -1,11 +1,22 @@
 """This module contains utilities for working with SSH on a local machine."""
 import abc
+import base64
+import binascii
+import hashlib
+import hmac
 import os
-import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Text, Optional, Union, List
+from typing import Text, Optional, Union, List, Iterable, Dict, Callable, Tuple
 
-from spin import utils
+from spin import utils, tracing
+
+# %C is a hash of the local host, remote host, port and user, so the path stays short enough for a unix socket and
+#   interactive ssh and MultiplexedSshConnection find the same master connection.
+DEFAULT_CONTROL_PATH = '~/.ssh/spin-mux-%C'
+DEFAULT_CONTROL_PERSIST = '10m'
 
 
 def add_line_if_does_not_exist(filename: Union[Text, Path], line: Text):
@@ -13,116 +24,360 @@ def add_line_if_does_not_exist(filename: Union[Text, Path], line: Text):
     if isinstance(filename, Path):
         filename = str(filename)
 
-    with open(filename, 'a+') as f:
-        lines = f.readlines()
-        if line in lines:
-            return
-        else:
-            f.writelines([line + '\n'])
+    # 'a+' mode starts reading at EOF, so read the existing contents separately
+    contents = ''
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            contents = f.read()
+
+    line = line.rstrip('\n')
+    if line in contents.splitlines():
+        return
+
+    with open(filename, 'a') as f:
+        if contents and not contents.endswith('\n'):
+            f.write('\n')
+        f.write(line + '\n')
     return
 
 
+def get_known_hosts_host(host_name: Text, port: Optional[int] = None) -> Text:
+    """The way a host is written in a known_hosts file.
+
+    ('1.2.3.4', 22) ==> '1.2.3.4'
+    ('1.2.3.4', 2222) ==> '[1.2.3.4]:2222'
+    """
+    if port is None or port == 22:
+        return host_name
+    return f'[{host_name}]:{port}'
+
+
+class _KnownHostsLine:
+    """One line of a known_hosts file: [marker] hostnames keytype base64-key [comment]"""
+    HASHED_PREFIX = '|1|'
+
+    def __init__(self, text: Text):
+        self.text = text.rstrip('\n')
+        self.marker = None
+        self.hosts = ()
+        self.key = None
+
+        parts = self.text.split()
+        if not parts or parts[0].startswith('#'):
+            return
+        if parts[0].startswith('@'):
+            self.marker = parts[0]
+            parts = parts[1:]
+        if len(parts) < 3:
+            return
+        self.hosts = tuple(parts[0].split(','))
+        self.key = (self.marker, parts[1], parts[2])
+
+    def is_hashed(self) -> bool:
+        return any(host.startswith(self.HASHED_PREFIX) for host in self.hosts)
+
+    def matches_hashed(self, host: Text) -> bool:
+        """Does host match one of this line's hashed hostnames? (see HashKnownHosts in `man ssh_config`)"""
+        for hashed_host in self.hosts:
+            if not hashed_host.startswith(self.HASHED_PREFIX):
+                continue
+            try:
+                salt_b64, hash_b64 = hashed_host[len(self.HASHED_PREFIX):].split('|')
+                salt = base64.b64decode(salt_b64)
+                expected = base64.b64decode(hash_b64)
+            except (ValueError, binascii.Error):
+                continue
+            if hmac.compare_digest(hmac.new(salt, host.encode('utf-8'), hashlib.sha1).digest(), expected):
+                return True
+        return False
+
+
 class KnownHostsModifier:
+    """Reads a known_hosts file once into a host -> lines index and applies batches of changes in one atomic write.
+
+    Hashed hostnames (`|1|salt|hash`) are matched by hashing the queried host with each hashed line's salt.
+    The file is only rewritten if its contents actually change.
+    """
     def __init__(self, known_hosts_file='~/.ssh/known_hosts'):
         self.known_hosts_file = utils.resolve_path(known_hosts_file)
 
-    def add_known_host(self, line: Text):
-        add_line_if_does_not_exist(self.known_hosts_file, line)
+        self._lines = None
+        self._texts = None
+        self._host_to_lines = None
+        self._hashed_lines = None
+        self._file_stat = None
+        self._text = None
+
+    def _get_file_stat(self):
+        try:
+            st = os.stat(str(self.known_hosts_file))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self):
+        """Parse the file unless it's already been parsed and hasn't changed on disk since."""
+        file_stat = self._get_file_stat()
+        if self._lines is not None and file_stat == self._file_stat:
+            return
 
-    def _get_lines(self) -> List[Text]:
-        with open(str(self.known_hosts_file), 'r') as f:
-            lines = f.readlines()
-        return lines
+        self._text = self.known_hosts_file.read_text() if file_stat is not None else ''
+        self._reindex([_KnownHostsLine(line) for line in self._text.splitlines()])
+        self._file_stat = file_stat
+
+    def _reindex(self, lines: List[_KnownHostsLine]):
+        self._lines = []
+        self._texts = set()
+        self._host_to_lines = {}
+        self._hashed_lines = []
+        for line in lines:
+            self._index(line)
+
+    def _index(self, line: _KnownHostsLine):
+        self._lines.append(line)
+        self._texts.add(line.text)
+        for host in line.hosts:
+            if host.startswith(_KnownHostsLine.HASHED_PREFIX):
+                continue
+            self._host_to_lines.setdefault(host, []).append(line)
+        if line.is_hashed():
+            self._hashed_lines.append(line)
+
+    def _get_lines_for_host(self, host: Text) -> List[_KnownHostsLine]:
+        out = list(self._host_to_lines.get(host, []))
+        out += [line for line in self._hashed_lines if line.matches_hashed(host)]
+        return out
 
-    def _write_lines(self, lines: List[Text]):
-        with open(str(self.known_hosts_file), 'w') as f:
-            f.writelines(lines)
+    def get_lines_for_hostname(self, host_name: Text, port: Optional[int] = None) -> List[Text]:
+        self._load()
+        return [line.text for line in self._get_lines_for_host(get_known_hosts_host(host_name, port))]
+
+    def _is_known(self, line: _KnownHostsLine) -> bool:
+        """Is every one of the line's hosts already known with the line's key?"""
+        if line.text in self._texts:
+            return True
+        if line.is_hashed():
+            # we can't recover the hostname from a hash, so only exact duplicates are known
+            return False
+        for host in line.hosts:
+            if not any(existing.key == line.key for existing in self._get_lines_for_host(host)):
+                return False
+        return True
+
+    def update(self, lines_to_add: Iterable[Text] = (), hosts_to_remove: Iterable[Text] = ()) -> bool:
+        """Remove every line for each of hosts_to_remove, then add each of lines_to_add which isn't already known,
+        all in one atomic rewrite of the file.
 
-    def remove_line(self, line: Text):
-        lines = self._get_lines()
+        Args:
+            lines_to_add: full known_hosts lines, e.g.: from SshKey.get_known_hosts_line
+            hosts_to_remove: hosts as they're written in known_hosts, e.g.: from get_known_hosts_host
 
-        # last line might not end in newline
-        if not lines[-1].endswith('\n'):
-            lines[-1] += '\n'
+        Returns:
+            True if the file was changed.
+        """
+        self._load()
 
-        if not line.endswith('\n'):
-            line += '\n'
-        if line in lines:
-            lines.remove(line)
+        hosts_to_remove = set(hosts_to_remove)
+        removed = set()
+        for host in hosts_to_remove:
+            removed.update(id(line) for line in self._get_lines_for_host(host))
 
-        self._write_lines(lines)
+        if removed:
+            self._reindex([line for line in self._lines if id(line) not in removed])
 
-    def remove_all_lines_for_hostname(self, host_name: Text, port: Optional[int] = None):
-        lines = self._get_lines()
-        host_str = host_name if port is None else f'[{host_name}]:{port}'
-        out_lines = [line for line in lines if not line.startswith(host_str)]
-        self._write_lines(out_lines)
+        num_added = 0
+        for text in lines_to_add:
+            line = _KnownHostsLine(text)
+            if line.key is None:
+                raise ValueError(f"Not a valid known_hosts line: {text}")
+            if not self._is_known(line):
+                self._index(line)
+                num_added += 1
 
+        if not removed and not num_added:
+            return False
 
-class FileBlockModifier:
-    def __init__(
-            self,
-            block_start_str=r'######### begin added by spin #########',
-            block_end_str=r'########## end added by spin ##########',
-            include_leading_newline=True,
-    ):
-        self.block_start_str = block_start_str
-        self.block_end_str = block_end_str
-        self.include_leading_newline = include_leading_newline
+        # e.g.: a host's lines were removed and the same lines added back
+        if self._render() == self._text:
+            return False
 
-    def modify(self, filename: Text, new_block: Text, do_replace_old_block=True):
-        """if there is a block in the file designated by self.block_start_str and self.block_end_str,
-        replace it with the new one.  if there is no such block, put a new one at the end of the file"""
-        with open(filename, 'r') as f:
-            data = f.read()
-
-        if do_replace_old_block:
-            splits = re.split(
-                '{}.*{}'.format(self.block_start_str, self.block_end_str),
-                data,
-                maxsplit=2,
-                flags=re.MULTILINE | re.DOTALL,
-            )
-        else:
-            splits = [data]
-
-        new_block_full = []
-        if self.include_leading_newline and splits[0][-2:] != '\n\n':
-            new_block_full += ['\n']
-        new_block_full += [self.block_start_str, '\n']
-        new_block_full += [new_block]
-        if new_block[-1] != '\n':
-            new_block_full += ['\n']
-        new_block_full += [self.block_end_str]
-        if len(splits) > 1:
-            if splits[1][0] != '\n':
-                new_block_full += ['\n']
-        else:
-            new_block_full += ['\n']
-
-        out = ''.join([splits[0]] + new_block_full + splits[1:])
-
-        open(filename, 'w').write(out)
+        self._write()
+        return True
 
-        return
+    def _render(self) -> Text:
+        return ''.join(line.text + '\n' for line in self._lines)
+
+    def _write(self):
+        self.known_hosts_file.parent.mkdir(parents=True, exist_ok=True)
+        self._text = self._render()
+        utils.atomic_write_text(self.known_hosts_file, self._text)
+        self._file_stat = self._get_file_stat()
+
+    def add_known_host(self, line: Text) -> bool:
+        return self.update(lines_to_add=[line])
+
+    def add_known_hosts(self, lines: Iterable[Text]) -> bool:
+        return self.update(lines_to_add=lines)
+
+    def remove_line(self, line: Text) -> bool:
+        self._load()
+        line = line.rstrip('\n')
+        if line not in self._texts:
+            return False
+
+        self._reindex([l for l in self._lines if l.text != line])
+        self._write()
+        return True
+
+    def remove_all_lines_for_hostname(self, host_name: Text, port: Optional[int] = None) -> bool:
+        return self.update(hosts_to_remove=[get_known_hosts_host(host_name, port)])
+
+    def remove_hosts(self, hosts: Iterable[Text]) -> bool:
+        return self.update(hosts_to_remove=hosts)
+
+
+class SshHostEntry:
+    """One `Host` entry in an ssh config file."""
+    def __init__(self, host_tag: Text, options: Optional[Dict[Text, Text]] = None):
+        """
+        Args:
+            host_tag: the pattern after `Host`
+            options: ssh config keywords, e.g.: 'HostName', to their values, in order
+        """
+        self.host_tag = host_tag
+        self.options = dict(options) if options else {}
+
+    def __eq__(self, o: object) -> bool:
+        return type(self) == type(o) and self.__dict__ == o.__dict__
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(host_tag={self.host_tag}, options={self.options})'
+
+    def get_known_hosts_host(self) -> Optional[Text]:
+        """How the host the entry points at is written in a known_hosts file, or None if it has no HostName."""
+        host_name = self.options.get('HostName')
+        if host_name is None:
+            return None
+        port = self.options.get('Port')
+        return get_known_hosts_host(host_name, int(port) if port is not None else None)
+
+    def to_text(self) -> Text:
+        out = f'Host {self.host_tag}\n'
+        if self.options:
+            out += utils.format_dict(self.options)
+        return out
+
+
+class SpinSshConfig:
+    """An ssh config file split into the user's own text and one spin-managed section of host entries.
+
+    The spin-managed section lives between BLOCK_START_STR and BLOCK_END_STR and holds any number of
+    SshHostEntrys keyed by host tag.  If an older file has several spin sections, they're merged into the first one.
+    """
+    BLOCK_START_STR = '######### begin added by spin #########'
+    BLOCK_END_STR = '########## end added by spin ##########'
+
+    def __init__(self, before: Text = '', entries: Iterable[SshHostEntry] = (), after: Text = ''):
+        self.before = before
+        self.after = after
+        self.entries = {}
+        for entry in entries:
+            # like ssh itself, the first entry for a host wins
+            self.entries.setdefault(entry.host_tag, entry)
+
+    @classmethod
+    def _parse_entries(cls, block_lines: List[Text]) -> List[SshHostEntry]:
+        entries = []
+        for line in block_lines:
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                continue
+            parts = stripped.split(None, 1)
+            key = parts[0]
+            value = parts[1] if len(parts) > 1 else ''
+            if key.lower() == 'host':
+                entries.append(SshHostEntry(value))
+            elif entries:
+                entries[-1].options[key] = value
+        return entries
+
+    @classmethod
+    def parse(cls, text: Text) -> 'SpinSshConfig':
+        lines = text.splitlines(keepends=True)
+        outside = [[]]
+        entries = []
+        block_lines = None
+        for line in lines:
+            stripped = line.rstrip('\n')
+            if block_lines is None and stripped == cls.BLOCK_START_STR:
+                block_lines = []
+            elif block_lines is not None and stripped == cls.BLOCK_END_STR:
+                entries += cls._parse_entries(block_lines)
+                block_lines = None
+                outside.append([])
+                # the newline after the end marker belongs to the text that follows
+                if line.endswith('\n'):
+                    outside[-1].append('\n')
+            elif block_lines is not None:
+                block_lines.append(line)
+            else:
+                outside[-1].append(line)
+
+        if block_lines is not None:
+            raise ValueError(f"Found '{cls.BLOCK_START_STR}' without a matching '{cls.BLOCK_END_STR}'.")
+
+        before = ''.join(outside[0])
+        segments = [''.join(segment) for segment in outside[1:]]
+        after = segments[-1] if segments else ''
+        # text between several old spin sections is kept, minus the blank lines which separated the sections
+        middle = [segment.strip('\n') + '\n' for segment in segments[:-1] if segment.strip('\n')]
+        if middle:
+            after = '\n' + ''.join(middle) + (after[1:] if after.startswith('\n') else after)
+        return cls(before=before, entries=entries, after=after)
+
+    def render(self) -> Text:
+        if not self.entries:
+            if self.after.startswith('\n') and (not self.before or self.before.endswith('\n')):
+                return self.before + self.after[1:]
+            return self.before + self.after
+
+        out = [self.before]
+        if self.before and self.before[-2:] != '\n\n':
+            out.append('\n')
+        out += [self.BLOCK_START_STR, '\n']
+        out.append('\n'.join(entry.to_text() for entry in self.entries.values()))
+        out.append(self.BLOCK_END_STR)
+        if not self.after.startswith('\n'):
+            out.append('\n')
+        out.append(self.after)
+        return ''.join(out)
 
 
 class SshConfigModifier:
+    """Manages the spin-managed section of an ssh config file.
+
+    The file is parsed into a SpinSshConfig once and reparsed only if it changes on disk.  Batches of adds and removes
+    are applied with one atomic write, and nothing is written if the contents don't change.
+    """
     def __init__(
             self,
             config_filename=os.path.expanduser('~/.ssh/config'),
             error_if_config_does_not_exist=False,
             verbose=True
     ):
-        self.config_path = Path(config_filename)
+        # resolved, so that writing through a symlink replaces its target rather than the link
+        self.config_path = utils.resolve_path(config_filename)
         self.error_if_config_does_not_exist = error_if_config_does_not_exist
 
         if not self.config_path.exists() and self.error_if_config_does_not_exist:
             raise IOError(f'SSH config file, {str(self.config_path)} does not exist.')
 
-        self.file_modifier = FileBlockModifier()
         self.verbose = verbose
 
+        self._config = None
+        self._text = None
+        self._file_stat = None
+
     @classmethod
     def _add_to_hosts_dict(cls, d, key, value):
         if value is None:
@@ -135,8 +390,9 @@ class SshConfigModifier:
 
         d[utils.snake_2_camel(key, do_cap_first=True)] = value
 
-    def add_host_entry(
-            self,
+    @classmethod
+    def make_host_entry(
+            cls,
             host_tag: Text,
             host_name: Optional[Text] = None,
             user: Optional[Text] = None,
@@ -144,17 +400,18 @@ class SshConfigModifier:
             identity_file: Optional[Text] = None,  # e.g.: identity_file='~/.ssh/id_rsa'
             add_keys_to_agent: Optional[bool] = True,
             forward_agent: Optional[bool] = True,
-            do_replace_existing_spin_hosts_entry=True,
-    ):
-        """Add a host entry to the ssh config file.
-        In general, if you set a option to None its corresponding line will not be included in the final config file."""
-
-        if not self.config_path.exists():
-            if self.error_if_config_does_not_exist:
-                raise IOError(f'SSH config file, {str(self.config_path)} does not exist.')
-            else:
-                self.config_path.touch(mode=0o644)
-
+            control_persist: Optional[Text] = None,
+            control_path: Text = DEFAULT_CONTROL_PATH,
+    ) -> SshHostEntry:
+        """Make a host entry.  If you set an option to None its line will not be included in the entry.
+
+        If control_persist is set, e.g.: to '10m', the entry also gets `ControlMaster auto`, so the first ssh to the
+        host leaves an authenticated connection behind at control_path for that long and later ones, including
+        MultiplexedSshConnection's, skip the handshake.
+        """
+        control_master = None if control_persist is None else 'auto'
+        if control_persist is None:
+            control_path = None
         keys = (
             'host_name',
             'user',
@@ -162,34 +419,186 @@ class SshConfigModifier:
             'identity_file',
             'add_keys_to_agent',
             'forward_agent',
+            'control_master',
+            'control_path',
+            'control_persist',
         )
 
         l = locals()
         hosts_dict = {}
         for key in keys:
-            self._add_to_hosts_dict(hosts_dict, key, l[key])
+            cls._add_to_hosts_dict(hosts_dict, key, l[key])
+
+        return SshHostEntry(host_tag, hosts_dict)
+
+    def _get_file_stat(self):
+        try:
+            st = os.stat(str(self.config_path))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self) -> SpinSshConfig:
+        file_stat = self._get_file_stat()
+        if self._config is None or file_stat != self._file_stat:
+            self._text = self.config_path.read_text() if file_stat is not None else ''
+            self._config = SpinSshConfig.parse(self._text)
+            self._file_stat = file_stat
+        return self._config
 
-        new_hosts_entry_str = f'Host {host_tag}\n'
-        new_hosts_entry_str += utils.format_dict(hosts_dict)
+    def get_host_entry(self, host_tag: Text) -> Optional[SshHostEntry]:
+        return self._load().entries.get(host_tag)
+
+    def get_host_entries(self) -> List[SshHostEntry]:
+        return list(self._load().entries.values())
+
+    def update(
+            self,
+            entries_to_add: Iterable[SshHostEntry] = (),
+            host_tags_to_remove: Iterable[Text] = (),
+            replace_existing=True,
+    ) -> bool:
+        """Remove and then add host entries in the spin-managed section with a single write.
+
+        Args:
+            entries_to_add: entries to add to the spin-managed section
+            host_tags_to_remove: host tags whose entries should be removed from the spin-managed section
+            replace_existing: if False, leave an existing entry with the same host tag alone rather than replacing it
+
+        Returns:
+            True if the file was changed.
+        """
+        if not self.config_path.exists():
+            if self.error_if_config_does_not_exist:
+                raise IOError(f'SSH config file, {str(self.config_path)} does not exist.')
+            else:
+                self.config_path.parent.mkdir(parents=True, exist_ok=True)
+                self.config_path.touch(mode=0o644)
+
+        config = self._load()
+        for host_tag in host_tags_to_remove:
+            config.entries.pop(host_tag, None)
+        for entry in entries_to_add:
+            if replace_existing or entry.host_tag not in config.entries:
+                config.entries[entry.host_tag] = entry
+
+        new_text = config.render()
+        if new_text == self._text:
+            return False
 
         if self.verbose:
             import logging
-            logging.info(f'Adding new block of code to file {self.config_path}')
-            logging.info(f'{new_hosts_entry_str}')
+            logging.info(f'Updating spin hosts in file {self.config_path}')
+
+        utils.atomic_write_text(self.config_path, new_text)
+        self._text = new_text
+        self._file_stat = self._get_file_stat()
+        return True
 
-        self.file_modifier.modify(
-            str(self.config_path),
-            new_hosts_entry_str,
-            do_replace_old_block=do_replace_existing_spin_hosts_entry
+    def add_host_entries(self, entries: Iterable[SshHostEntry], replace_existing=True) -> bool:
+        return self.update(entries_to_add=entries, replace_existing=replace_existing)
+
+    def add_host_entry(
+            self,
+            host_tag: Text,
+            host_name: Optional[Text] = None,
+            user: Optional[Text] = None,
+            port: Optional[int] = 22,
+            identity_file: Optional[Text] = None,  # e.g.: identity_file='~/.ssh/id_rsa'
+            add_keys_to_agent: Optional[bool] = True,
+            forward_agent: Optional[bool] = True,
+            do_replace_existing_spin_hosts_entry=True,
+            control_persist: Optional[Text] = None,
+            control_path: Text = DEFAULT_CONTROL_PATH,
+    ):
+        """Add a host entry to the spin-managed section of the ssh config file.
+        In general, if you set a option to None its corresponding line will not be included in the final config file.
+
+        If do_replace_existing_spin_hosts_entry is False, an existing spin-managed entry for host_tag is left alone.
+        If control_persist is set, ssh connections to the host are multiplexed.  See make_host_entry.
+        """
+        entry = self.make_host_entry(
+            host_tag=host_tag,
+            host_name=host_name,
+            user=user,
+            port=port,
+            identity_file=identity_file,
+            add_keys_to_agent=add_keys_to_agent,
+            forward_agent=forward_agent,
+            control_persist=control_persist,
+            control_path=control_path,
         )
+        new_hosts_entry_str = entry.to_text()
+
+        if self.verbose:
+            import logging
+            logging.info(f'Adding host entry to file {self.config_path}')
+            logging.info(f'{new_hosts_entry_str}')
+
+        self.update(entries_to_add=[entry], replace_existing=do_replace_existing_spin_hosts_entry)
 
         return new_hosts_entry_str
 
-    def remove(self, name: Text):
-        from sshconf import read_ssh_config
-        conf = read_ssh_config(self.config_path)
-        conf.remove(name)
-        conf.write(self.config_path)
+    def remove(self, name: Text) -> bool:
+        """Remove the spin-managed host entry for the given host tag."""
+        return self.update(host_tags_to_remove=[name])
+
+    def remove_host_entries(self, host_tags: Iterable[Text]) -> bool:
+        return self.update(host_tags_to_remove=host_tags)
+
+
+class SshFilesUpdate:
+    """Changes to known_hosts and the ssh config for some hosts, gathered up so many hosts' changes can be written at
+    once rather than rewriting both files once per host."""
+    def __init__(
+            self,
+            known_hosts_lines: Iterable[Text] = (),
+            known_hosts_hosts_to_remove: Iterable[Text] = (),
+            host_entries: Iterable[SshHostEntry] = (),
+            host_tags_to_remove: Iterable[Text] = (),
+    ):
+        """
+        Args:
+            known_hosts_lines: lines to add to known_hosts
+            known_hosts_hosts_to_remove: hosts whose known_hosts lines are stale.  They're removed before any lines
+                are added.
+            host_entries: entries for the spin-managed section of the ssh config.  They replace existing entries for
+                the same host tags, e.g.: a recreated workbench's, whose ip has changed.
+            host_tags_to_remove: host tags whose entries should be removed from the spin-managed section
+        """
+        self.known_hosts_lines = list(known_hosts_lines)
+        self.known_hosts_hosts_to_remove = list(known_hosts_hosts_to_remove)
+        self.host_entries = list(host_entries)
+        self.host_tags_to_remove = list(host_tags_to_remove)
+
+    @classmethod
+    def combine(cls, updates: Iterable['SshFilesUpdate']) -> 'SshFilesUpdate':
+        combined = cls()
+        for update in updates:
+            combined.known_hosts_lines += update.known_hosts_lines
+            combined.known_hosts_hosts_to_remove += update.known_hosts_hosts_to_remove
+            combined.host_entries += update.host_entries
+            combined.host_tags_to_remove += update.host_tags_to_remove
+        return combined
+
+    def apply(
+            self,
+            known_hosts_file: Text = '~/.ssh/known_hosts',
+            config_filename: Text = '~/.ssh/config',
+            verbose=True,
+    ):
+        """Write the changes with at most one write to each file."""
+        if self.known_hosts_lines or self.known_hosts_hosts_to_remove:
+            KnownHostsModifier(known_hosts_file).update(
+                lines_to_add=self.known_hosts_lines,
+                hosts_to_remove=self.known_hosts_hosts_to_remove,
+            )
+        if self.host_entries or self.host_tags_to_remove:
+            config_modifier = SshConfigModifier(os.path.expanduser(config_filename), verbose=verbose)
+            config_modifier.update(
+                entries_to_add=self.host_entries,
+                host_tags_to_remove=self.host_tags_to_remove,
+            )
 
 
 class SshKeyCreator(utils.ShellRunnerMixin):
@@ -294,11 +703,7 @@ class SshKey(utils.DictBouncer, abc.ABC):
     def get_known_hosts_line(self, ip: Text, port: int):
         # cut out the hostname or email address comment
         key = ' '.join(self.read_public().split(' ')[:2])
-
-        if port == 22:
-            return f'{ip} {key}'
-        else:
-            return f'[{ip}]:{port} {key}'
+        return f'{get_known_hosts_host(ip, port)} {key}'
 
 
 class SshKeyOnDisk(SshKey):
@@ -360,3 +765,198 @@ class SshKeyInMemory(SshKey):
     def from_on_disk_key(cls, ssh_key_on_disk: SshKeyOnDisk):
         return cls(ssh_key_on_disk.read_public(), ssh_key_on_disk.read_private())
 
+
+class MultiplexedSshConnection(utils.ShellRunnerMixin):
+    """Runs commands on a host over one authenticated ssh connection.
+
+    The first command starts a ControlMaster connection at control_path which lingers for control_persist after the
+    last command finishes.  Every command after that is a new session on the master, so it costs a fork and a round
+    trip rather than a tcp connection, key exchange and authentication.  The master is shared with any other ssh to
+    the same host which uses the same control path, e.g.: interactive ssh with a host entry made with
+    control_persist.
+    """
+    def __init__(
+            self,
+            host: Text,
+            control_path: Text = DEFAULT_CONTROL_PATH,
+            control_persist: Text = DEFAULT_CONTROL_PERSIST,
+            ssh_options: Optional[Dict[Text, Text]] = None,
+            connect_timeout_seconds: int = 30,
+            ssh_command: Text = 'ssh',
+            verbose=True,
+    ):
+        """
+        Args:
+            host: a host name or a host tag from your ssh config, e.g.: the workbench's name
+            control_path: where the master connection's socket goes.  Its directory must exist.
+            control_persist: how long the master connection outlives its last session, e.g.: '10m', or 'yes' for
+                until it's closed
+            ssh_options: extra ssh config options, e.g.: {'Port': '2222'}
+            connect_timeout_seconds: give up on starting the master connection after this long
+            ssh_command: the ssh executable
+            verbose: if True, log the commands as they're run
+        """
+        super().__init__(verbose)
+        self.host = host
+        self.control_path = control_path
+        self.control_persist = control_persist
+        self.ssh_options = dict(ssh_options) if ssh_options else {}
+        self.connect_timeout_seconds = connect_timeout_seconds
+        self.ssh_command = ssh_command
+
+        self._lock = threading.Lock()
+        self._is_open = False
+
+    def _get_args(self, *args: Text, control_master: Text = 'auto') -> List[Text]:
+        options = {
+            # never hang on a password or host key prompt
+            'BatchMode': 'yes',
+            'ConnectTimeout': str(self.connect_timeout_seconds),
+            **self.ssh_options,
+            'ControlMaster': control_master,
+            'ControlPath': os.path.expanduser(self.control_path),
+            'ControlPersist': self.control_persist,
+        }
+        out = [self.ssh_command]
+        for k, v in options.items():
+            out += ['-o', f'{k}={v}']
+        return out + list(args) + [self.host]
+
+    def is_open(self) -> bool:
+        """Is there a master connection to the host at control_path?"""
+        proc = subprocess.run(self._get_args('-O', 'check'), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        return proc.returncode == 0
+
+    def open(self):
+        """Start the master connection unless it's already there."""
+        with self._lock:
+            if self._is_open:
+                return
+            if not self.is_open():
+                if self.verbose:
+                    import logging
+                    logging.info(f'Opening a multiplexed ssh connection to {self.host}')
+                with tracing.span('ssh.open', category='shell', host=self.host):
+                    # -f backgrounds the master once it's authenticated.  It lets go of our pipes when it does.
+                    proc = subprocess.run(self._get_args('-f', '-N', control_master='yes'),
+                                          stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                          timeout=self.connect_timeout_seconds + 5)
+                if proc.returncode != 0:
+                    raise IOError(f"Couldn't open an ssh connection to {self.host}.  "
+                                  f"Stderr: {proc.stderr.decode('utf-8')}.")
+            self._is_open = True
+
+    def close(self):
+        """Stop the master connection.  Sessions which are still running on it are cut off."""
+        with self._lock:
+            subprocess.run(self._get_args('-O', 'exit'), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            self._is_open = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _read_lines(pipe, stream_name: Text, lines: List[Text], on_output: Optional[Callable[[Text, Text], None]]):
+        for line in iter(pipe.readline, b''):
+            line = line.decode('utf-8', errors='replace')
+            lines.append(line)
+            if on_output is not None:
+                on_output(stream_name, line)
+        pipe.close()
+
+    def run(
+            self,
+            command: Text,
+            on_output: Optional[Callable[[Text, Text], None]] = None,
+            error_on_nonzero_exit=True,
+            timeout: Optional[float] = None,
+    ) -> Tuple[int, Text, Text]:
+        """Run a shell command on the host.
+
+        Args:
+            command: the command, which the remote user's shell interprets
+            on_output: called with 'stdout' or 'stderr' and each line of output as soon as it arrives
+            error_on_nonzero_exit: if True, raise a ValueError if the command fails
+            timeout: kill the command and raise a TimeoutError if it's still running after this many seconds
+
+        Returns:
+            the command's exitcode, stdout and stderr.  If ssh itself fails, the exitcode is 255.
+        """
+        self.open()
+        if self.verbose:
+            import logging
+            logging.info(f'Running command on {self.host}: {command}')
+
+        with tracing.span(f'ssh {utils.get_command_name(command, num_words=1)}', category='shell', host=self.host,
+                          command=command) as span:
+            proc = subprocess.Popen(self._get_args('-T') + [command], stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout_lines, stderr_lines = [], []
+            readers = [
+                threading.Thread(target=self._read_lines, args=(proc.stdout, 'stdout', stdout_lines, on_output)),
+                threading.Thread(target=self._read_lines, args=(proc.stderr, 'stderr', stderr_lines, on_output)),
+            ]
+            for reader in readers:
+                reader.start()
+            try:
+                exitcode = proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                raise TimeoutError(f"Command `{command}` on {self.host} didn't finish in {timeout} seconds.")
+            finally:
+                for reader in readers:
+                    reader.join()
+            stdout, stderr = ''.join(stdout_lines), ''.join(stderr_lines)
+            span.set(exitcode=exitcode, stdout_bytes=len(stdout), stderr_bytes=len(stderr))
+
+        if error_on_nonzero_exit and exitcode:
+            raise ValueError(f"Got nonzero exit code {exitcode} from command `{command}` on {self.host}.  "
+                             f"Stdout: {stdout}.  "
+                             f"Stderr: {stderr}.")
+        return exitcode, stdout, stderr
+
+    def run_many(
+            self,
+            commands: List[Text],
+            max_concurrency: int = 8,
+            on_output: Optional[Callable[[int, Text, Text], None]] = None,
+            error_on_nonzero_exit=True,
+            timeout: Optional[float] = None,
+    ) -> List[Tuple[int, Text, Text]]:
+        """Run commands on the host at once, as sessions on the one master connection.
+
+        Args:
+            commands: the commands to run
+            max_concurrency: how many commands run at a time.  sshd's MaxSessions, 10 by default, caps how many
+                sessions one connection can hold, so keep this below it.
+            on_output: called with a command's index in commands, 'stdout' or 'stderr' and each line of its output
+            error_on_nonzero_exit: if True, raise a ValueError once every command has finished if any failed
+            timeout: per command, as in run
+
+        Returns:
+            every command's exitcode, stdout and stderr, in order
+        """
+        if not commands:
+            return []
+        # one master for everyone rather than a race to start one
+        self.open()
+
+        def _run(index_command):
+            index, command = index_command
+            on_command_output = None if on_output is None else lambda stream, line: on_output(index, stream, line)
+            return self.run(command, on_command_output, error_on_nonzero_exit=False, timeout=timeout)
+
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(commands))) as executor:
+            results = list(executor.map(_run, enumerate(commands)))
+
+        failures = [(command, exitcode) for command, (exitcode, _, _) in zip(commands, results) if exitcode]
+        if error_on_nonzero_exit and failures:
+            raise ValueError(f"{len(failures)} of {len(commands)} commands on {self.host} failed: {failures}.")
+        return results
@@ -0,0 +1,595 @@
+"""This module runs hyperparameter sweeps: many trials of one training function, each with sampled parameters.
+
+    sweep = Sweep(
+        fn=my_package.train,
+        space={'lr': LogUniform(1e-4, 1e-1), 'layers': Choice([2, 4, 8])},
+        metric='accuracy',
+        num_trials=50,
+        budgets=Sweep.get_budgets_from_cluster(PROJECT_CONFIG.cluster),
+        executor=KubernetesJobExecutor(...),
+        stopping_rule=AshaRule(min_step=1, reduction_factor=3),
+    )
+    for report in sweep:
+        print(report)
+    print(sweep.get_best_trial())
+
+Each trial calls fn(**params) and reports metrics the way cloudml-hypertune does: json lines appended to the file
+named by $CLOUD_ML_HP_METRIC_FILE.  Trial code can use hypertune itself or `report_metric` from this module.  The
+sweep reads every running trial's reports on each poll, yields them as a stream and asks its stopping rule whether
+each reporting trial is losing.  Losers are killed together, which frees their slot for the next trial:
+    * MedianStoppingRule stops a trial whose best value so far is worse than the median of the other trials'
+      running averages at the same step.
+    * AshaRule stops a trial which, at each rung (min_step, min_step * reduction_factor, ...), isn't in the top
+      1 / reduction_factor of the trials which have reached that rung.
+
+Trials run concurrently up to a budget per node pool.  LocalProcessExecutor runs them as local processes for offline
+testing; KubernetesJobExecutor runs each as a one pod Job placed on its pool.
+"""
+import abc
+import argparse
+import json
+import math
+import os
+import pickle
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Text, Dict, List, Any, Callable, Iterator, Optional, Sequence, Tuple
+
+from spin import kubes, tracing, utils
+from spin import placement as placement_module
+from spin.checkpoint import BlobStore, LocalBlobStore
+from spin.cluster import GkeCluster
+
+# the environment variables cloudml-hypertune reads
+METRIC_FILE_ENV = 'CLOUD_ML_HP_METRIC_FILE'
+TRIAL_ID_ENV = 'CLOUD_ML_TRIAL_ID'
+
+
+class Parameter(utils.DictBouncer, abc.ABC):
+    @abc.abstractmethod
+    def sample(self, rng: random.Random) -> Any:
+        pass
+
+
+class Choice(Parameter):
+    def __init__(self, values: Sequence[Any]):
+        super().__init__()
+        if not values:
+            raise ValueError("Choice needs at least one value")
+        self.values = list(values)
+
+    def sample(self, rng: random.Random) -> Any:
+        return rng.choice(self.values)
+
+
+class Uniform(Parameter):
+    def __init__(self, low: float, high: float):
+        super().__init__()
+        if low > high:
+            raise ValueError(f"low must be <= high but got {low} and {high}")
+        self.low = low
+        self.high = high
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.uniform(self.low, self.high)
+
+
+class LogUniform(Uniform):
+    def __init__(self, low: float, high: float):
+        if low <= 0:
+            raise ValueError(f"LogUniform needs a positive low but got {low}")
+        super().__init__(low, high)
+
+    def sample(self, rng: random.Random) -> float:
+        return math.exp(rng.uniform(math.log(self.low), math.log(self.high)))
+
+
+class IntUniform(Uniform):
+    def sample(self, rng: random.Random) -> int:
+        return rng.randint(int(self.low), int(self.high))
+
+
+def sample_params(space: Dict[Text, Parameter], num_trials: int, seed: Optional[int] = None) -> List[Dict[Text, Any]]:
+    rng = random.Random(seed)
+    return [{name: parameter.sample(rng) for name, parameter in space.items()} for _ in range(num_trials)]
+
+
+def report_metric(tag: Text, value: float, step: int):
+    """Report a metric the way cloudml-hypertune's report_hyperparameter_tuning_metric does."""
+    filename = os.environ.get(METRIC_FILE_ENV, '/tmp/hypertune/output.metrics')
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    line = json.dumps({
+        'timestamp': time.time(),
+        'trial': os.environ.get(TRIAL_ID_ENV, '0'),
+        tag: str(value),
+        'global_step': str(int(step)),
+    })
+    with open(filename, 'a') as f:
+        f.write(line + '\n')
+
+
+def parse_metrics(text: Text, metric: Text) -> List[Tuple[int, float]]:
+    """(step, value) for each report of metric in a hypertune metrics file."""
+    reports = []
+    for line in text.splitlines():
+        try:
+            d = json.loads(line)
+        except ValueError:
+            # a line which is still being written
+            continue
+        if metric in d:
+            reports.append((int(d.get('global_step', len(reports))), float(d[metric])))
+    return reports
+
+
+class Trial(utils.DictBouncer):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STOPPED = 'stopped'
+
+    def __init__(
+            self,
+            trial_id: Text,
+            params: Dict[Text, Any],
+            status: Text = PENDING,
+            pool_name: Optional[Text] = None,
+            reports: Optional[List[Tuple[int, float]]] = None,
+            start_time: Optional[float] = None,
+            end_time: Optional[float] = None,
+    ):
+        """
+        Args:
+            trial_id: unique within its sweep
+            params: fn's keyword arguments
+            status: one of the class constants
+            pool_name: the node pool whose budget the trial counts against
+            reports: (step, value) for each report of the sweep's metric, in the order they were made
+            start_time: when the trial was launched
+            end_time: when it finished or was stopped
+        """
+        super().__init__()
+        self.trial_id = trial_id
+        self.params = params
+        self.status = status
+        self.pool_name = pool_name
+        self.reports = reports if reports is not None else []
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def is_finished(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED, self.STOPPED)
+
+    def get_last_step(self) -> Optional[int]:
+        return self.reports[-1][0] if self.reports else None
+
+    def get_best_value(self, maximize=True, up_to_step: Optional[int] = None) -> Optional[float]:
+        values = [v for s, v in self.reports if up_to_step is None or s <= up_to_step]
+        if not values:
+            return None
+        return max(values) if maximize else min(values)
+
+    def get_value_at(self, step: int) -> Optional[float]:
+        """The last value reported at or before step."""
+        values = [v for s, v in self.reports if s <= step]
+        return values[-1] if values else None
+
+
+class MetricReport(utils.DictBouncer):
+    def __init__(self, trial_id: Text, step: int, value: float):
+        super().__init__()
+        self.trial_id = trial_id
+        self.step = step
+        self.value = value
+
+
+class StoppingRule(abc.ABC):
+    @abc.abstractmethod
+    def should_stop(self, trial: Trial, trials: List[Trial], maximize: bool) -> bool:
+        """Whether trial, which just reported, is losing to the others."""
+        pass
+
+
+class NoStoppingRule(StoppingRule):
+    def should_stop(self, trial: Trial, trials: List[Trial], maximize: bool) -> bool:
+        return False
+
+
+class MedianStoppingRule(StoppingRule):
+    def __init__(self, min_step: int = 1, min_trials: int = 3):
+        """
+        Args:
+            min_step: never stop a trial before it has reported this step
+            min_trials: only compare against the median once this many other trials have reached the step
+        """
+        self.min_step = min_step
+        self.min_trials = min_trials
+
+    def should_stop(self, trial: Trial, trials: List[Trial], maximize: bool) -> bool:
+        step = trial.get_last_step()
+        if step is None or step < self.min_step:
+            return False
+        averages = []
+        for other in trials:
+            if other.trial_id == trial.trial_id or other.get_last_step() is None or other.get_last_step() < step:
+                continue
+            values = [v for s, v in other.reports if s <= step]
+            averages.append(sum(values) / len(values))
+        if len(averages) < self.min_trials:
+            return False
+        median = statistics.median(averages)
+        best = trial.get_best_value(maximize)
+        return best < median if maximize else best > median
+
+
+class AshaRule(StoppingRule):
+    def __init__(self, min_step: int = 1, reduction_factor: int = 3, max_step: Optional[int] = None):
+        """
+        Asynchronous successive halving, in its stopping form: trials aren't paused and resumed, they're either
+        allowed to continue past a rung or stopped there.
+
+        Args:
+            min_step: the first rung
+            reduction_factor: rungs are min_step * reduction_factor ** k and only the top 1 / reduction_factor of
+                the trials at each rung continue past it
+            max_step: no rungs past this step
+        """
+        if reduction_factor < 2:
+            raise ValueError(f"reduction_factor must be at least 2 but got {reduction_factor}")
+        self.min_step = min_step
+        self.reduction_factor = reduction_factor
+        self.max_step = max_step
+
+    def get_rungs(self, up_to_step: int) -> List[int]:
+        rungs = []
+        rung = self.min_step
+        while rung <= up_to_step and (self.max_step is None or rung < self.max_step):
+            rungs.append(rung)
+            rung *= self.reduction_factor
+        return rungs
+
+    def should_stop(self, trial: Trial, trials: List[Trial], maximize: bool) -> bool:
+        step = trial.get_last_step()
+        if step is None:
+            return False
+        rungs = self.get_rungs(step)
+        if not rungs:
+            return False
+        rung = rungs[-1]
+        # only judge a trial when it first reaches the rung, as ASHA would
+        previous_steps = [s for s, _ in trial.reports[:-1]]
+        if previous_steps and previous_steps[-1] >= rung:
+            return False
+
+        values = [t.get_value_at(rung) for t in trials if t.get_last_step() is not None and t.get_last_step() >= rung]
+        values = [v for v in values if v is not None]
+        num_to_keep = max(1, len(values) // self.reduction_factor)
+        if len(values) < self.reduction_factor:
+            # too few trials have reached this rung to tell who's losing
+            return False
+        cutoff = sorted(values, reverse=maximize)[num_to_keep - 1]
+        value = trial.get_value_at(rung)
+        return value < cutoff if maximize else value > cutoff
+
+
+class TrialExecutor(abc.ABC):
+    """Somewhere to run trials.  Trials find fn and their params, and write their metrics, through the store."""
+    def __init__(self, store: BlobStore):
+        self.store = store
+
+    @abc.abstractmethod
+    def launch(self, prefix: Text, trial: Trial):
+        pass
+
+    @abc.abstractmethod
+    def get_statuses(self, prefix: Text, trials: List[Trial]) -> Dict[Text, Text]:
+        """The status of each of the given running trials."""
+        pass
+
+    @abc.abstractmethod
+    def kill(self, prefix: Text, trials: List[Trial]):
+        pass
+
+
+class LocalProcessExecutor(TrialExecutor):
+    def __init__(self, store: LocalBlobStore):
+        """Runs each trial as a local `python -m spin.sweep` process, the same command the pods run."""
+        super().__init__(store)
+        self._processes = {}
+
+    def launch(self, prefix: Text, trial: Trial):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([p for p in sys.path if p] + [env.get('PYTHONPATH', '')])
+        command = [sys.executable, '-m', 'spin.sweep', '--store-dir', str(self.store.directory),
+                   '--prefix', prefix, '--trial-id', trial.trial_id]
+        self._processes[trial.trial_id] = subprocess.Popen(command, env=env)
+
+    def get_statuses(self, prefix: Text, trials: List[Trial]) -> Dict[Text, Text]:
+        statuses = {}
+        for trial in trials:
+            exitcode = self._processes[trial.trial_id].poll()
+            if exitcode is None:
+                statuses[trial.trial_id] = Trial.RUNNING
+            else:
+                statuses[trial.trial_id] = Trial.SUCCEEDED if exitcode == 0 else Trial.FAILED
+        return statuses
+
+    def kill(self, prefix: Text, trials: List[Trial]):
+        for trial in trials:
+            process = self._processes.get(trial.trial_id)
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+
+
+class KubernetesJobExecutor(TrialExecutor, utils.ShellRunnerMixin):
+    def __init__(
+            self,
+            store: BlobStore,
+            name: Text,
+            container_image_uri: Text,
+            pod_store_dir: Text,
+            store_volume: Dict,
+            placements: Optional[Dict[Text, placement_module.Placement]] = None,
+            verbose=True,
+    ):
+        """
+        Runs each trial as a one pod Job.
+
+        Args:
+            store: the store, as seen from this machine
+            name: a name for the sweep's Jobs.  It must be a valid Kubernetes name.
+            container_image_uri: an image with spin and fn's package installed
+            pod_store_dir: where store_volume is mounted on the pods
+            store_volume: a pod volume dict for the same storage as store
+            placements: node pool name -> placement for that pool's trials.  Pools without one are only pinned by
+                nodeSelector.
+            verbose: if True, print commands as they run
+        """
+        TrialExecutor.__init__(self, store)
+        utils.ShellRunnerMixin.__init__(self, verbose)
+        self.name = name
+        self.container_image_uri = container_image_uri
+        self.pod_store_dir = pod_store_dir
+        self.store_volume = dict(store_volume)
+        self.store_volume.setdefault('name', 'spin-sweep-store')
+        self.placements = placements if placements is not None else {}
+
+    def _get_job_name(self, trial: Trial) -> Text:
+        return f'{self.name}-{trial.trial_id}'
+
+    def launch(self, prefix: Text, trial: Trial):
+        placement = self.placements.get(trial.pool_name)
+        job = kubes.KubernetesJob(
+            name=self._get_job_name(trial),
+            container_image_uri=self.container_image_uri,
+            command=['python', '-m', 'spin.sweep', '--store-dir', self.pod_store_dir, '--prefix', prefix,
+                     '--trial-id', trial.trial_id],
+            completion_mode='NonIndexed',
+            # a failed trial is a result, not something to retry
+            backoff_limit=0,
+            volumes=[self.store_volume],
+            volume_mounts=[{'name': self.store_volume['name'], 'mountPath': self.pod_store_dir}],
+            labels={'spin-sweep': self.name},
+            node_selector={placement_module.NODE_POOL_LABEL: trial.pool_name} if trial.pool_name else None,
+            placement=placement,
+        )
+        job.create()
+
+    def get_statuses(self, prefix: Text, trials: List[Trial]) -> Dict[Text, Text]:
+        # every trial's status from one call
+        _, out, _ = self._run(f'kubectl get job -l spin-sweep={self.name} -o json')
+        jobs = {item['metadata']['name']: item.get('status', {}) for item in json.loads(out)['items']}
+        statuses = {}
+        for trial in trials:
+            status = jobs.get(self._get_job_name(trial), {})
+            if status.get('succeeded'):
+                statuses[trial.trial_id] = Trial.SUCCEEDED
+            elif status.get('failed'):
+                statuses[trial.trial_id] = Trial.FAILED
+            else:
+                statuses[trial.trial_id] = Trial.RUNNING
+        return statuses
+
+    def kill(self, prefix: Text, trials: List[Trial]):
+        if trials:
+            names = ' '.join(self._get_job_name(t) for t in trials)
+            self._run(f'kubectl delete job {names} --ignore-not-found')
+
+
+class Sweep:
+    def __init__(
+            self,
+            fn: Callable[..., Any],
+            space: Dict[Text, Parameter],
+            metric: Text,
+            num_trials: int,
+            budgets: Dict[Text, int],
+            executor: TrialExecutor,
+            goal: Text = 'maximize',
+            stopping_rule: Optional[StoppingRule] = None,
+            prefix: Optional[Text] = None,
+            seed: Optional[int] = None,
+            poll_interval: float = 5.0,
+            timeout: Optional[float] = None,
+    ):
+        """
+        Args:
+            fn: called as fn(**params) in each trial.  It must be importable on the workers.
+            space: parameter name -> distribution
+            metric: the hypertune metric tag to optimize
+            num_trials: how many trials to run in all
+            budgets: node pool name -> the most trials to run on it at once
+            executor: where trials run
+            goal: 'maximize' or 'minimize'
+            stopping_rule: decides which trials to kill early.  Defaults to never killing.
+            prefix: where the sweep's files go in the executor's store.  Defaults to a new unique prefix.
+            seed: for sampling params
+            poll_interval: seconds between polls
+            timeout: give up if the sweep hasn't finished after this many seconds
+        """
+        if goal not in ('maximize', 'minimize'):
+            raise ValueError(f"goal must be 'maximize' or 'minimize' but got {goal}")
+        if not budgets or any(b < 0 for b in budgets.values()) or not sum(budgets.values()):
+            raise ValueError(f"budgets must allow at least one trial but got {budgets}")
+        self.fn = fn
+        self.metric = metric
+        self.budgets = dict(budgets)
+        self.executor = executor
+        self.store = executor.store
+        self.maximize = goal == 'maximize'
+        self.stopping_rule = stopping_rule if stopping_rule is not None else NoStoppingRule()
+        self.prefix = prefix if prefix is not None else f'sweep/{uuid.uuid4().hex[:12]}'
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+        self.trials = [
+            Trial(f'{i:04d}', params) for i, params in enumerate(sample_params(space, num_trials, seed))
+        ]
+        self._is_started = False
+
+    @staticmethod
+    def get_budgets_from_cluster(cluster: GkeCluster, trials_per_node: int = 1) -> Dict[Text, int]:
+        """A budget per node pool of trials_per_node trials on each of its max_nodes."""
+        return {name: pool.max_nodes * trials_per_node for name, pool in cluster.node_pools.items()}
+
+    def _get_params_key(self, trial: Trial) -> Text:
+        return f'{self.prefix}/trials/{trial.trial_id}/params.pkl'
+
+    def _get_metrics_key(self, trial: Trial) -> Text:
+        return f'{self.prefix}/trials/{trial.trial_id}/output.metrics'
+
+    def start(self):
+        self.store.put(f'{self.prefix}/fn.pkl', pickle.dumps(self.fn))
+        for trial in self.trials:
+            self.store.put(self._get_params_key(trial), pickle.dumps(trial.params))
+        self._is_started = True
+
+    def get_running_trials(self) -> List[Trial]:
+        return [t for t in self.trials if t.status == Trial.RUNNING]
+
+    def _get_free_pool(self) -> Optional[Text]:
+        running = [t.pool_name for t in self.get_running_trials()]
+        free = {name: budget - running.count(name) for name, budget in self.budgets.items()}
+        name = max(free, key=lambda n: free[n])
+        return name if free[name] > 0 else None
+
+    def _launch_pending(self):
+        for trial in self.trials:
+            if trial.status != Trial.PENDING:
+                continue
+            pool_name = self._get_free_pool()
+            if pool_name is None:
+                return
+            trial.pool_name = pool_name
+            trial.status = Trial.RUNNING
+            trial.start_time = time.time()
+            with tracing.span('sweep.launch', category='sweep', trial_id=trial.trial_id, pool=pool_name):
+                self.executor.launch(self.prefix, trial)
+
+    def _read_reports(self, trial: Trial) -> List[MetricReport]:
+        key = self._get_metrics_key(trial)
+        if not self.store.exists(key):
+            return []
+        reports = parse_metrics(self.store.get(key).decode('utf-8', errors='replace'), self.metric)
+        # hypertune only keeps a trial's latest reports in its file, so go by step rather than by position
+        last_step = trial.get_last_step()
+        new_reports = [(step, value) for step, value in reports if last_step is None or step > last_step]
+        trial.reports.extend(new_reports)
+        return [MetricReport(trial.trial_id, step, value) for step, value in new_reports]
+
+    def poll(self) -> List[MetricReport]:
+        """Read every running trial's new reports, kill the losers and launch trials into free slots.
+
+        Returns:
+            The reports which arrived since the last poll.
+        """
+        if not self._is_started:
+            self.start()
+
+        running = self.get_running_trials()
+        statuses = self.executor.get_statuses(self.prefix, running) if running else {}
+        new_reports = []
+        reported = []
+        for trial in running:
+            trial_reports = self._read_reports(trial)
+            new_reports.extend(trial_reports)
+            status = statuses.get(trial.trial_id, Trial.RUNNING)
+            if status != Trial.RUNNING:
+                trial.status = status
+                trial.end_time = time.time()
+            elif trial_reports:
+                reported.append(trial)
+
+        losers = [t for t in reported if self.stopping_rule.should_stop(t, self.trials, self.maximize)]
+        if losers:
+            self.executor.kill(self.prefix, losers)
+            for trial in losers:
+                trial.status = Trial.STOPPED
+                trial.end_time = time.time()
+
+        self._launch_pending()
+        return new_reports
+
+    def is_done(self) -> bool:
+        return all(t.is_finished() for t in self.trials)
+
+    def stop(self):
+        running = self.get_running_trials()
+        if running:
+            self.executor.kill(self.prefix, running)
+            for trial in running:
+                trial.status = Trial.STOPPED
+                trial.end_time = time.time()
+
+    def __iter__(self) -> Iterator[MetricReport]:
+        """Run the sweep, yielding metric reports as they arrive."""
+        start = time.monotonic()
+        try:
+            while True:
+                for report in self.poll():
+                    yield report
+                if self.is_done():
+                    break
+                if self.timeout is not None and time.monotonic() - start > self.timeout:
+                    raise TimeoutError(f"The sweep didn't finish in {self.timeout}s")
+                time.sleep(self.poll_interval)
+        finally:
+            self.stop()
+
+    def run(self) -> Optional[Trial]:
+        """Run the sweep to the end and return the best trial."""
+        for _ in self:
+            pass
+        return self.get_best_trial()
+
+    def get_best_trial(self) -> Optional[Trial]:
+        trials = [t for t in self.trials if t.get_best_value(self.maximize) is not None]
+        if not trials:
+            return None
+        best = max if self.maximize else min
+        return best(trials, key=lambda t: t.get_best_value(self.maximize))
+
+
+def _run_trial(store: LocalBlobStore, prefix: Text, trial_id: Text):
+    fn = pickle.loads(store.get(f'{prefix}/fn.pkl'))
+    params = pickle.loads(store.get(f'{prefix}/trials/{trial_id}/params.pkl'))
+    os.environ[METRIC_FILE_ENV] = str(store.directory / prefix / 'trials' / trial_id / 'output.metrics')
+    os.environ[TRIAL_ID_ENV] = trial_id
+    fn(**params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run one sweep trial.")
+    parser.add_argument('--store-dir', required=True)
+    parser.add_argument('--prefix', required=True)
+    parser.add_argument('--trial-id', required=True)
+    args = parser.parse_args()
+
+    _run_trial(LocalBlobStore(Path(args.store_dir)), args.prefix, args.trial_id)
@@ -54,11 +54,6 @@ class CachedTask(Task):
         return output
 
 
-for output in outputs:
-    serialized_output = serializer.serialize(output)
-    save(serialized_output)
-
-
 # def preprocess_data(x_raw, y_raw):
 #     pass
 #
@@ -0,0 +1,224 @@
+"""This module records nested, timed spans for shell commands, kubectl applies, Action calls and workbench phases.
+
+Tracing is off unless `enable()` is called (the CLI does this for `spin --trace trace.json ...`).  While it's off,
+`span()` returns a shared do-nothing object, so instrumented code pays for one global lookup and nothing else.
+
+Traces export to Chrome's trace event format, which can be opened at chrome://tracing or https://ui.perfetto.dev,
+and to a plain text table summarizing where the time went.
+
+    with tracing.span('create service', category='kubectl', object_name=name) as s:
+        exitcode, out, err = run()
+        s.set(exitcode=exitcode)
+"""
+import functools
+import json
+import os
+import threading
+import time
+from typing import Text, Dict, Any, List, Optional, Union
+from pathlib import Path
+
+# perf_counter_ns is new in python 3.7
+_now_ns = getattr(time, 'perf_counter_ns', lambda: int(time.perf_counter() * 1e9))
+
+
+class Span:
+    """One timed, named piece of work.  Spans started while another span is open on the same thread are its children."""
+    __slots__ = ('name', 'category', 'attributes', 'start_ns', 'end_ns', 'thread_id', 'depth', 'parent', '_tracer')
+
+    def __init__(self, tracer: 'Tracer', name: Text, category: Text, attributes: Dict[Text, Any]):
+        self._tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.start_ns = None
+        self.end_ns = None
+        self.thread_id = None
+        self.depth = 0
+        self.parent = None
+
+    def set(self, **attributes):
+        """Add attributes which are only known once the work is done, e.g.: exit codes and output sizes."""
+        self.attributes.update(attributes)
+
+    def get_duration_ns(self) -> int:
+        end_ns = self.end_ns if self.end_ns is not None else _now_ns()
+        return end_ns - self.start_ns
+
+    def __enter__(self):
+        stack = self._tracer._get_stack()
+        if stack:
+            self.parent = stack[-1]
+            self.depth = self.parent.depth + 1
+        self.thread_id = threading.get_ident()
+        stack.append(self)
+        self.start_ns = _now_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_ns = _now_ns()
+        if exc_type is not None:
+            self.attributes['error'] = f'{exc_type.__name__}: {exc_val}'
+        stack = self._tracer._get_stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self._tracer._record(self)
+        return False
+
+
+class _NullSpan:
+    """Stands in for a Span while tracing is disabled."""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+        self.start_ns = _now_ns()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_stack(self) -> List[Span]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+        return stack
+
+    def _record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def span(self, name: Text, category: Text = 'spin', **attributes) -> Span:
+        return Span(self, name, category, attributes)
+
+    def to_chrome_trace(self) -> Dict[Text, Any]:
+        """Complete ('X') events in microseconds.  Chrome nests events on the same thread by their times."""
+        pid = os.getpid()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        events = []
+        for s in spans:
+            events.append({
+                'name': s.name,
+                'cat': s.category,
+                'ph': 'X',
+                'ts': (s.start_ns - self.start_ns) / 1000.0,
+                'dur': s.get_duration_ns() / 1000.0,
+                'pid': pid,
+                'tid': s.thread_id,
+                'args': {k: _to_jsonable(v) for k, v in s.attributes.items()},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filename: Union[Text, Path]):
+        with open(str(filename), 'w') as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def get_summary(self) -> List[Dict[Text, Any]]:
+        """Total, mean and max milliseconds per (category, name), slowest total first.
+
+        Self time excludes time spent in child spans, which is what to look at when spans nest.
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        child_ns = {}
+        for s in spans:
+            if s.parent is not None:
+                child_ns[id(s.parent)] = child_ns.get(id(s.parent), 0) + s.get_duration_ns()
+
+        rows = {}
+        for s in spans:
+            key = (s.category, s.name)
+            row = rows.get(key)
+            if row is None:
+                row = {'category': s.category, 'name': s.name, 'count': 0, 'total_ms': 0.0, 'self_ms': 0.0,
+                       'max_ms': 0.0}
+                rows[key] = row
+            duration_ms = s.get_duration_ns() / 1e6
+            row['count'] += 1
+            row['total_ms'] += duration_ms
+            row['self_ms'] += duration_ms - child_ns.get(id(s), 0) / 1e6
+            row['max_ms'] = max(row['max_ms'], duration_ms)
+
+        out = sorted(rows.values(), key=lambda r: r['total_ms'], reverse=True)
+        for row in out:
+            row['mean_ms'] = row['total_ms'] / row['count']
+        return out
+
+    def format_summary(self, max_rows: Optional[int] = 30) -> Text:
+        rows = self.get_summary()[:max_rows]
+        if not rows:
+            return 'No spans recorded.\n'
+        name_width = max(len(f"{r['category']}: {r['name']}") for r in rows)
+        name_width = min(max(name_width, len('span')), 60)
+        lines = [f"{'span':<{name_width}}  {'count':>6}  {'total ms':>10}  {'self ms':>10}  {'mean ms':>10}  "
+                 f"{'max ms':>10}"]
+        for r in rows:
+            name = f"{r['category']}: {r['name']}"[:name_width]
+            lines.append(f"{name:<{name_width}}  {r['count']:>6}  {r['total_ms']:>10.1f}  {r['self_ms']:>10.1f}  "
+                         f"{r['mean_ms']:>10.1f}  {r['max_ms']:>10.1f}")
+        return '\n'.join(lines) + '\n'
+
+
+def _to_jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+_tracer = None
+
+
+def enable() -> Tracer:
+    """Start recording spans into a new Tracer and return it."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> Optional[Tracer]:
+    """Stop recording spans.  Return the Tracer which was recording, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: Text, category: Text = 'spin', **attributes) -> Union[Span, _NullSpan]:
+    """A context manager which times its block as a child of the enclosing span, if tracing is enabled."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, **attributes)
+
+
+def traced(name: Optional[Text] = None, category: Text = 'spin'):
+    """Decorate a function to run it in a span named name, or the function's qualified name."""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.span(span_name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,15 +1,24 @@
 import shutil
 
+import fcntl
+import functools
+import hashlib
 import jinja2
+import jinja2.bccache
 import logging
+import marshal
+import os
 from pathlib import Path
 import re
 import shlex
 from subprocess import Popen, PIPE
+import tempfile
 import time
-from typing import Text, Dict, Any, Union
+from typing import Text, Dict, Any, Union, Optional, Tuple
 import yaml
 
+from spin import settings, tracing
+
 
 def snake_2_camel(name, do_cap_first=False):
     words = name.split('_')
@@ -46,6 +55,11 @@ def get_exitcode_stdout_stderr(cmd, shell=False):
     return exitcode, out.decode('utf-8'), err.decode('utf-8')
 
 
+def get_command_name(command: Text, num_words=2) -> Text:
+    """A short name for a command line, e.g.: 'kubectl get' for 'kubectl get svc my-workbench -o json'."""
+    return ' '.join(command.split()[:num_words])
+
+
 def ensure_cmdline_program_exists(program_name: Text):
     out = shutil.which(program_name)
     if out is None:
@@ -63,7 +77,9 @@ class ShellRunnerMixin:
         if self.verbose:
             logging.info(f'Running shell command: {command}')
 
-        exitcode, stdout, stderr = get_exitcode_stdout_stderr(command, shell)
+        with tracing.span(get_command_name(command), category='shell', command=command) as span:
+            exitcode, stdout, stderr = get_exitcode_stdout_stderr(command, shell)
+            span.set(exitcode=exitcode, stdout_bytes=len(stdout), stderr_bytes=len(stderr))
 
         if error_on_nonzero_exit and exitcode:
             raise ValueError(f"Got nonzero exit code {exitcode} from command `{command}`.  "
@@ -119,16 +135,85 @@ class DictBouncer:
         return self.__repr__()
 
 
+# use libyaml's C implementations when they're available.  they're several times faster.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def get_snapshot_path(filename: Union[Text, Path]) -> Path:
+    """'~/.spinrc' ==> '~/.spinrc.snapshot'"""
+    path = Path(filename)
+    return path.with_name(path.name + '.snapshot')
+
+
+def _get_snapshot_key(stat: os.stat_result):
+    # atomic writes replace the inode, so a changed file is caught even within one mtime tick
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _write_snapshot(filename: Union[Text, Path], data: Any):
+    """Save data, parsed from filename, in a compact binary snapshot keyed by filename's inode, mtime and size."""
+    try:
+        key = _get_snapshot_key(os.stat(str(filename)))
+        snapshot_bytes = marshal.dumps((key, data))
+    except (OSError, ValueError):
+        # ValueError: data has types that marshal can't handle, e.g.: datetimes.  just don't snapshot it.
+        return
+
+    snapshot_path = get_snapshot_path(filename)
+    try:
+        fd, temp_filename = tempfile.mkstemp(dir=str(snapshot_path.parent), prefix=f'.{snapshot_path.name}.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(snapshot_bytes)
+        os.replace(temp_filename, str(snapshot_path))
+    except OSError:
+        pass
+
+
+def _read_snapshot(filename: Union[Text, Path]):
+    """Return (True, data) if there's a snapshot of filename which is still valid, else (False, None)."""
+    try:
+        key = _get_snapshot_key(os.stat(str(filename)))
+        with open(str(get_snapshot_path(filename)), 'rb') as f:
+            snapshot_key, data = marshal.loads(f.read())
+    except (OSError, ValueError, EOFError, TypeError):
+        return False, None
+
+    if tuple(snapshot_key) != key:
+        return False, None
+    return True, data
+
+
+def load_yaml(filename: Union[Text, Path], use_snapshot=False) -> Any:
+    """Load a yaml file.  If use_snapshot, skip parsing when a snapshot taken at the file's last write is valid."""
+    if use_snapshot:
+        is_valid, data = _read_snapshot(filename)
+        if is_valid:
+            return data
+
+    with open(str(filename), 'r') as f:
+        data = yaml.load(f, Loader=YAML_LOADER)
+
+    if use_snapshot:
+        _write_snapshot(filename, data)
+    return data
+
+
+def dump_yaml(data: Any, filename: Union[Text, Path], use_snapshot=False):
+    """Atomically write data to a yaml file so that concurrent readers never see a partial file."""
+    atomic_write_text(filename, yaml.dump(data, Dumper=YAML_DUMPER))
+    if use_snapshot:
+        _write_snapshot(filename, data)
+
+
 class YamlBouncer(DictBouncer):
     """This object can bounce itself down to and back up from a YAML file."""
-    def to_yaml(self, filename: Text):
-        with open(filename, 'w') as f:
-            return yaml.dump(self.to_dict(), f, Dumper=yaml.SafeDumper)
+    def to_yaml(self, filename: Text, use_snapshot=False):
+        dump_yaml(self.to_dict(), filename, use_snapshot=use_snapshot)
 
     @classmethod
-    def from_yaml(cls, filename: Text):
-        with open(filename, 'r') as f:
-            return cls.from_dict(yaml.load(f, Loader=yaml.SafeLoader))
+    def from_yaml(cls, filename: Text, use_snapshot=False):
+        return cls.from_dict(load_yaml(filename, use_snapshot=use_snapshot))
 
 
 def confirm_prompt(prompt_str: Text):
@@ -143,23 +228,128 @@ def confirm_prompt(prompt_str: Text):
 
 
 class Timer:
+    """Print how long a block took.  The block is also recorded as a span if tracing is enabled."""
     def __init__(self, name: Text):
         self.name = name
 
     def __enter__(self):
-        self.t = time.time()
-        print(f"Starting timer {self.name} at time {self.t}.", end="")
+        self._span = tracing.span(self.name, category='timer').__enter__()
+        self.t = time.perf_counter()
+        print(f"Starting timer {self.name}.", end="")
 
     def __exit__(self, *args):
-        print(f"Took {time.time() - self.t}")
+        print(f"Took {time.perf_counter() - self.t:.3f}s")
+        self._span.__exit__(*args)
+
+
+class ContentHashBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """A persistent jinja bytecode cache keyed by a hash of each template's source, name and filename, so edited
+    templates never load stale code.  The name and filename are part of the key since compiled code embeds them, e.g.:
+    for error messages, so a template with another's source mustn't load its code."""
+    def __init__(self, directory: Union[Text, Path] = None):
+        if directory is None:
+            directory = settings.JINJA_CACHE_PATH
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory))
+
+    def get_bucket(self, environment, name, filename, source):
+        h = hashlib.sha256(source.encode('utf-8'))
+        h.update(f'\0{name}\0{filename}'.encode('utf-8'))
+        # compiled code also depends on these environment settings
+        h.update(f'\0{environment.undefined.__name__}\0{environment.keep_trailing_newline}'.encode('utf-8'))
+        h.update(f'\0{sorted(environment.extensions)}'.encode('utf-8'))
+        key = h.hexdigest()
+        bucket = jinja2.bccache.Bucket(environment, key, key)
+        self.load_bytecode(bucket)
+        return bucket
+
+
+@functools.lru_cache(maxsize=None)
+def get_jinja_environment(
+        template_dir: Text,
+        strict=False,
+        keep_trailing_newline=False,
+        extensions: Tuple = (),
+) -> jinja2.Environment:
+    """A jinja Environment for the given directory, shared within this process and backed by the bytecode cache.
+
+    Args:
+        template_dir: templates are loaded by their path relative to this directory
+        strict: if True, raise on undefined variables rather than rendering them as empty strings
+        keep_trailing_newline: if True, don't strip a single trailing newline from rendered templates
+        extensions: jinja extension classes
+    """
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(template_dir),
+        extensions=list(extensions),
+        bytecode_cache=ContentHashBytecodeCache(),
+        undefined=jinja2.StrictUndefined if strict else jinja2.Undefined,
+        keep_trailing_newline=keep_trailing_newline,
+    )
 
 
 def render_template(template_fullfile: Text, context_dict: Dict):
     """Render a jinja template."""
     p = Path(template_fullfile)
-    return jinja2.Environment(
-        loader=jinja2.FileSystemLoader(str(p.parent))
-    ).get_template(str(p.name)).render(context_dict)
+    return get_jinja_environment(str(p.parent)).get_template(str(p.name)).render(context_dict)
+
+
+def atomic_write_text(filename_or_path: Union[Text, Path], text: Text, mode: Optional[int] = None):
+    """Replace the file's contents with text such that readers only ever see the old or the new contents.
+    Keeps the file's existing permissions unless mode is given."""
+    atomic_write_bytes(filename_or_path, text.encode('utf-8'), mode=mode)
+
+
+def atomic_write_bytes(filename_or_path: Union[Text, Path], data: bytes, mode: Optional[int] = None):
+    """See atomic_write_text."""
+    path = Path(filename_or_path)
+    if mode is None:
+        mode = path.stat().st_mode & 0o777 if path.exists() else 0o644
+
+    fd, temp_filename = tempfile.mkstemp(dir=str(path.parent), prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_filename, mode)
+        os.replace(temp_filename, str(path))
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+class FileLock:
+    """An advisory, exclusive lock on a file, held via `with FileLock(filename):`.  Posix only.
+
+    wait_seconds and hold_seconds record how long the last acquisition waited for and held the lock.
+    """
+    def __init__(self, lock_filename: Union[Text, Path]):
+        self.lock_path = Path(lock_filename)
+        self._fd = None
+        self._acquired_at = None
+        self.wait_seconds = None
+        self.hold_seconds = None
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._fd = os.open(str(self.lock_path), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(self._fd)
+            self._fd = None
+            raise
+        self._acquired_at = time.perf_counter()
+        self.wait_seconds = self._acquired_at - start
+        return self
+
+    def __exit__(self, *args):
+        self.hold_seconds = time.perf_counter() - self._acquired_at
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
 
 
 def file_exists(filename_or_path: Union[Text, Path]):
@@ -3,8 +3,8 @@
 # TODO: we need a public project to push this to
 export PROJECT_ID=kb-experiment
 export IMAGE_REPO_NAME=workbench
-export IMAGE_TAG=latest
-export IMAGE_URI="gcr.io/${PROJECT_ID}/${IMAGE_REPO_NAME}:${IMAGE_TAG}"
-docker build -f Dockerfile -t ${IMAGE_URI} .
-docker push ${IMAGE_URI}
-#docker build -f Dockerfile -t workbench .
+export REPOSITORY_URI="gcr.io/${PROJECT_ID}/${IMAGE_REPO_NAME}"
+
+# Tags the image by a digest of its inputs and skips the build and push entirely if the registry already has it.
+# The resulting digest uri is recorded in ~/.spin/published_images.json and used by `spin up workbench`.
+spin publish workbench --repository-uri ${REPOSITORY_URI}
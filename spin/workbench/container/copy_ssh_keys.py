@@ -1,83 +1,183 @@
 """This file contains routines for copying ssh keys from a mounted kubernetes secrets directory into the appropriate
 spots on a workbench container.  It is meant to be run when the container boots up.
+
+It's on the critical path to sshd accepting connections, so it avoids shells and extra processes: one ssh-agent for
+all of the user keys, one ssh-add call to load them, and one read and one write per file.
+
+It also seeds a new, empty persistent home disk with the image's home directory, so that dotfiles survive having
+a disk mounted over them.
+
+Run with --report_sshd_ready (supervisord does this) to log how long it took sshd to start accepting connections
+after the key installer started.
 """
 import argparse
-import glob
-from pathlib import Path
 import os
-import shlex
 import shutil
+import socket
+import time
+from pathlib import Path
 from subprocess import Popen, PIPE
-from typing import Text, Tuple, List, Union
+from typing import Text, Tuple, List, Union, Dict, Iterable
+
+BOOT_START_FILE = '/var/run/spin_boot_start'
+HOME_SKEL_DIR = '/etc/spin/home-skel'
+SSH_AGENT_SOCKET = '/tmp/spin-ssh-agent.sock'
+SSH_AGENT_ENV_FILE = '/etc/profile.d/spin-ssh-agent.sh'
 
 
 def resolve_path(path: Union[Text, Path]) -> Path:
     return Path(path).expanduser().resolve()
 
 
-def shell_run(cmd, shell=True):
+def run(args: List[Text], env: Dict[Text, Text] = None) -> Tuple[int, Text, Text]:
     """
-    Execute the external command and get its exitcode, stdout and stderr.
+    Execute the external command without a shell and get its exitcode, stdout and stderr.
     """
-    args = shlex.split(cmd)
-
-    proc = Popen(args, stdout=PIPE, stderr=PIPE, shell=shell)
+    proc = Popen(args, stdout=PIPE, stderr=PIPE, env=env)
     stdout, stderr = proc.communicate()
     stdout = stdout.decode('utf-8')
     stderr = stderr.decode('utf-8')
     exitcode = proc.returncode
 
     if exitcode != 0:
-        raise ValueError(f"Error running command {cmd}.  Stdout: {stdout}.  Stderr: {stderr}.")
+        raise ValueError(f"Error running command {args}.  Stdout: {stdout}.  Stderr: {stderr}.")
 
     return exitcode, stdout, stderr
 
 
-def add_line_if_does_not_exist(filename: Text, line: Text):
-    """Add the given line to the file unless it's already in the file."""
-    with open(filename, 'a+') as f:
-        lines = f.readlines()
-        if line in lines:
-            return
-        else:
-            f.writelines([line])
-    return
-
-
 def find_key_pairs(dir_to_search: Text) -> List[Tuple[Text, Text]]:
     """get a list of (pub, private) key pair filenames within the given directory"""
-    path_to_search = Path(dir_to_search)
-    pub_files = glob.glob(str(path_to_search / '*.pub'))
-    all_files = glob.glob(str(path_to_search / '*'))
+    if not os.path.isdir(dir_to_search):
+        return []
+
+    # kubernetes secret volumes are full of ..data symlinks; only look at the names
+    names = {entry.name for entry in os.scandir(dir_to_search) if not entry.name.startswith('..')}
     key_pairs = []
-    for pub_file in pub_files:
-        private_file = os.path.splitext(pub_file)[0]
-        if private_file not in all_files:
-            raise ValueError(f"Couldn't find corresponding private key for public key {pub_file}."
-                             f"all_files: {str(all_files)}")
-        key_pairs.append((pub_file, private_file))
+    for name in sorted(names):
+        if not name.endswith('.pub'):
+            continue
+        private_name = name[:-len('.pub')]
+        if private_name not in names:
+            raise ValueError(f"Couldn't find corresponding private key for public key {name} in {dir_to_search}."
+                             f"all_files: {sorted(names)}")
+        key_pairs.append((os.path.join(dir_to_search, name), os.path.join(dir_to_search, private_name)))
     return key_pairs
 
 
-def copy_and_add_key_pairs(key_pairs: List[Tuple[Text, Text]], target_dir: Text, do_add=True):
-    print('\nStarting copy_and_add_key_pairs')
+def write_file(filename: Text, contents: bytes, mode: int):
+    """Write contents to filename with permissions mode, using one open, one write and one chmod."""
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        os.write(fd, contents)
+        # O_CREAT's mode is ignored if the file already exists and is subject to the umask
+        os.fchmod(fd, mode)
+    finally:
+        os.close(fd)
+
+
+def copy_key_pairs(key_pairs: List[Tuple[Text, Text]], target_dir: Text) -> List[Text]:
+    """Copy key pairs into target_dir with ssh's required permissions.  Return the copied private key filenames."""
+    target_private_keys = []
     for public_key, private_key in key_pairs:
-        print(f'copy_and_add_key_pairs is copying {public_key} into {target_dir}')
-        shutil.copy2(public_key, target_dir)
-        target_public_key = str(Path(target_dir) / Path(public_key).name)
-        print(f'chmodding target_public_key {target_public_key} to 644')
-        os.chmod(target_public_key, mode=0o644)
+        target_public_key = os.path.join(target_dir, os.path.basename(public_key))
+        with open(public_key, 'rb') as f:
+            write_file(target_public_key, f.read(), 0o644)
+
+        target_private_key = os.path.join(target_dir, os.path.basename(private_key))
+        with open(private_key, 'rb') as f:
+            write_file(target_private_key, f.read(), 0o600)
+
+        print(f'Copied {public_key} and {private_key} into {target_dir}')
+        target_private_keys.append(target_private_key)
+    return target_private_keys
+
+
+def start_ssh_agent(socket_path=SSH_AGENT_SOCKET, env_file=SSH_AGENT_ENV_FILE) -> Dict[Text, Text]:
+    """Start a single ssh-agent and write its environment to env_file so that login shells can use it.
+
+    Returns:
+        os.environ updated with SSH_AUTH_SOCK and SSH_AGENT_PID.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    _, stdout, _ = run(['ssh-agent', '-s', '-a', socket_path])
+
+    # stdout looks like: SSH_AUTH_SOCK=/tmp/...; export SSH_AUTH_SOCK;\nSSH_AGENT_PID=123; export SSH_AGENT_PID;
+    env = dict(os.environ)
+    exports = []
+    for statement in stdout.split(';'):
+        statement = statement.strip()
+        if '=' in statement:
+            k, v = statement.split('=', 1)
+            env[k] = v
+            exports.append(f'export {k}={v}\n')
+
+    env_file_path = Path(env_file)
+    if env_file_path.parent.is_dir():
+        write_file(str(env_file_path), ''.join(exports).encode('utf-8'), 0o644)
+
+    return env
+
 
-        print(f'copy_and_add_key_pairs is copying {private_key} into {target_dir}')
-        shutil.copy2(private_key, target_dir)
-        target_private_key = str(Path(target_dir) / Path(private_key).name)
-        print(f'chmodding target_private_key {target_private_key} to 600')
-        os.chmod(target_private_key, mode=0o600)
+def add_keys_to_agent(private_keys: List[Text], env: Dict[Text, Text]):
+    """Load all of the given keys into the agent with one ssh-add call."""
+    if not private_keys:
+        return
+    print(f"Adding {len(private_keys)} keys to ssh-agent")
+    run(['ssh-add'] + private_keys, env=env)
 
-        if do_add:
-            cmd = f'eval "$(ssh-agent -s)" && ssh-add -K {target_private_key}'
-            print(f"Running ssh-add command: {cmd}")
-            shell_run(cmd, shell=True)
+
+def add_lines_if_they_do_not_exist(filename: Text, lines: Iterable[Text]) -> int:
+    """Add each of the given lines to the file unless it's already in the file.  Reads and writes the file once.
+
+    Returns:
+        The number of lines added.
+    """
+    with open(filename, 'r') as f:
+        contents = f.read()
+    existing = set(line.strip() for line in contents.splitlines())
+
+    new_lines = []
+    for line in lines:
+        line = line.strip()
+        if line and line not in existing:
+            existing.add(line)
+            new_lines.append(line)
+
+    if new_lines:
+        prefix = '' if not contents or contents.endswith('\n') else '\n'
+        with open(filename, 'a') as f:
+            f.write(prefix + '\n'.join(new_lines) + '\n')
+
+    return len(new_lines)
+
+
+def make_dir(path: Path, mode=0o700):
+    if not path.exists():
+        path.mkdir(parents=True, mode=mode)
+    elif not path.is_dir():
+        raise ValueError(f"{str(path)} exists but isn't a directory.")
+
+
+def seed_home_dir(skel_dir: Text = HOME_SKEL_DIR, home_dir: Text = '~') -> int:
+    """Copy each file in skel_dir into home_dir unless it's already there, so a user's own files always win.
+
+    Returns:
+        The number of files copied.
+    """
+    if not os.path.isdir(skel_dir):
+        return 0
+    home_path = resolve_path(home_dir)
+    num_copied = 0
+    for dirpath, dirnames, filenames in os.walk(skel_dir):
+        target_dir = home_path / os.path.relpath(dirpath, skel_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for name in filenames:
+            target = target_dir / name
+            if not os.path.lexists(str(target)):
+                shutil.copy2(os.path.join(dirpath, name), str(target), follow_symlinks=False)
+                num_copied += 1
+    return num_copied
 
 
 def copy_ssh_keys(
@@ -85,7 +185,9 @@ def copy_ssh_keys(
         user_keys_mountpoint='/secrets/user_keys',
         user_login_public_keys_mountpoint='/secrets/user_login_public_keys',
         authorized_keys_file='~/.ssh/authorized_keys',
-        ssh_dir='~/.ssh/'
+        ssh_dir='~/.ssh/',
+        ssh_server_keys_dir='/etc/ssh/',
+        boot_start_file=BOOT_START_FILE,
 ):
     """Copy ssh keys from a secrets directory to the appropriate places on a container to enable
         1) running an SSH server (keys in server_keys_subdir)
@@ -98,49 +200,63 @@ def copy_ssh_keys(
         user_login_public_keys_mountpoint:
         authorized_keys_file:
         ssh_dir:
-
+        ssh_server_keys_dir: where sshd looks for its host keys
+        boot_start_file: the start time is written here for --report_sshd_ready.  None to skip.
     """
+    start = time.time()
+    if boot_start_file is not None and Path(boot_start_file).parent.is_dir():
+        write_file(boot_start_file, str(start).encode('utf-8'), 0o644)
+
     ##################################################
     # add ssh_server_keys to /etc/ssh
     print("\nAdding ssh_server_keys to /etc/ssh")
     server_key_pairs = find_key_pairs(ssh_server_keys_mountpoint)
-    copy_and_add_key_pairs(server_key_pairs, '/etc/ssh/', do_add=False)
-
-    shell_run('ls -la /etc/ssh')
+    copy_key_pairs(server_key_pairs, ssh_server_keys_dir)
 
     ##################################################
     # add users's private/public keys with ssh-add
     print("\nAdding users's private/public keys with ssh-add")
-    ssh_dir_path = Path(ssh_dir).expanduser().resolve()
-    if not ssh_dir_path.exists():
-        ssh_dir_path.mkdir(parents=True, mode=0o700)
-    elif not ssh_dir_path.is_dir():
-        raise ValueError(f"ssh directory, {str(ssh_dir_path)}, exists but isn't a directory.")
-    ssh_dir = str(ssh_dir_path)
-    user_key_pairs = find_key_pairs(user_keys_mountpoint)
-    copy_and_add_key_pairs(user_key_pairs, ssh_dir)
+    ssh_dir_path = resolve_path(ssh_dir)
+    make_dir(ssh_dir_path)
+    user_private_keys = copy_key_pairs(find_key_pairs(user_keys_mountpoint), str(ssh_dir_path))
+    if user_private_keys:
+        add_keys_to_agent(user_private_keys, start_ssh_agent())
 
     ##################################################
     # add user's login public key(s) as authorized_keys
-    authorized_keys_path = Path(authorized_keys_file).expanduser().resolve()
-
-    # create authorized_keys dir
-    authorized_keys_dir_path = authorized_keys_path.parent
-    if not authorized_keys_dir_path.exists():
-        authorized_keys_dir_path.mkdir(parents=True, mode=0o700)
-    elif not authorized_keys_dir_path.is_dir():
-        raise ValueError(f"authorized_keys directory, {str(authorized_keys_dir_path)}, exists but isn't a directory.")
-
-    # create authorized_keys file
+    authorized_keys_path = resolve_path(authorized_keys_file)
+    make_dir(authorized_keys_path.parent)
     if not authorized_keys_path.exists():
         authorized_keys_path.touch(mode=0o644)
 
-    # add public keys to authorized_keys
-    pub_files = glob.glob(str(Path(user_login_public_keys_mountpoint) / '*.pub'))
-    for pub_file in pub_files:
-        pub_key_contents = open(pub_file, 'r').read()
-        print(f"\nAdding line {pub_key_contents} to file {str(authorized_keys_path)}")
-        add_line_if_does_not_exist(str(authorized_keys_path), pub_key_contents)
+    pub_key_contents = []
+    if os.path.isdir(user_login_public_keys_mountpoint):
+        for entry in os.scandir(user_login_public_keys_mountpoint):
+            if entry.name.endswith('.pub') and not entry.name.startswith('..'):
+                with open(entry.path, 'r') as f:
+                    pub_key_contents.append(f.read())
+    num_added = add_lines_if_they_do_not_exist(str(authorized_keys_path), pub_key_contents)
+    print(f"\nAdded {num_added} of {len(pub_key_contents)} login keys to {str(authorized_keys_path)}")
+
+    print(f"Installed ssh keys in {time.time() - start:.3f}s")
+
+
+def report_sshd_ready(host='127.0.0.1', port=22, boot_start_file=BOOT_START_FILE, timeout=120.0, poll_interval=0.05):
+    """Wait until sshd accepts connections and log how long that took since the key installer started."""
+    with open(boot_start_file, 'r') as f:
+        start = float(f.read().strip())
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=poll_interval):
+                print(f"sshd ready on port {port} {time.time() - start:.3f}s after boot", flush=True)
+                return True
+        except OSError:
+            time.sleep(poll_interval)
+
+    print(f"sshd not ready on port {port} after {timeout}s", flush=True)
+    return False
 
 
 if __name__ == '__main__':
@@ -148,6 +264,15 @@ if __name__ == '__main__':
     parser.add_argument("--ssh_server_keys_mountpoint", default='/secrets/ssh-server-keys')
     parser.add_argument("--user_keys_mountpoint", default='/secrets/user-keys')
     parser.add_argument("--user_login_public_keys_mountpoint", default='/secrets/user-login-public-keys')
+    parser.add_argument("--home_skel_dir", default=HOME_SKEL_DIR)
+    parser.add_argument("--report_sshd_ready", action='store_true')
     args = parser.parse_args()
 
-    copy_ssh_keys(**vars(args))
+    if args.report_sshd_ready:
+        report_sshd_ready()
+    else:
+        kwargs = vars(args)
+        del kwargs['report_sshd_ready']
+        num_seeded = seed_home_dir(kwargs.pop('home_skel_dir'))
+        print(f"Seeded {num_seeded} files into the home directory")
+        copy_ssh_keys(**kwargs)
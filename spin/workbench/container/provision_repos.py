@@ -0,0 +1,226 @@
+"""This file clones a workbench's repos when its container boots.  supervisord runs it alongside sshd, so you can log
+in while it works.
+
+Each repo URL has a bare mirror in a cache directory on the node, shared by the workbenches there which clone with
+the same ssh keys.  The workbench mounts that directory at MIRROR_CACHE_DIR.  A boot only fetches what's new into the
+mirror, then clones from the real URL with the mirror as a reference, so almost nothing comes over the network.
+Clones are partial (--filter=blob:none), so a repo's history comes without the blobs of files you never check out,
+and can be sparse, so a monorepo only checks out the directories you list.
+Repos which are already checked out, e.g.: on a persistent home disk, are just fetched.  Every repo is provisioned
+at once.
+
+The repos come as a JSON list in the SPIN_REPOS environment variable:
+    [{"repo_url": "git@github.com:me/monorepo.git", "branch": "main", "sparse_paths": ["libs/core"]}]
+"""
+import argparse
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import Popen, PIPE
+from typing import Text, List, Dict, Optional, Tuple
+
+REPOS_ENV = 'SPIN_REPOS'
+MIRROR_CACHE_DIR = '/var/cache/spin-git-mirrors'
+WORKSPACE_DIR = '~/repos'
+# where copy_ssh_keys.py starts the ssh-agent holding the user's keys
+SSH_AGENT_SOCKET = '/tmp/spin-ssh-agent.sock'
+# `git sparse-checkout init --cone` is from git 2.25.  `set --cone`, without init, needs 2.35, newer than some images'.
+SPARSE_CHECKOUT_MIN_GIT_VERSION = (2, 25)
+
+
+def run(args: List[Text], cwd: Optional[Text] = None) -> Tuple[int, Text, Text]:
+    """
+    Execute the external command without a shell and get its exitcode, stdout and stderr.
+    """
+    env = dict(os.environ)
+    if 'SSH_AUTH_SOCK' not in env and os.path.exists(SSH_AGENT_SOCKET):
+        env['SSH_AUTH_SOCK'] = SSH_AGENT_SOCKET
+    # never hang a boot on a password prompt
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    proc = Popen(args, stdout=PIPE, stderr=PIPE, cwd=cwd, env=env)
+    stdout, stderr = proc.communicate()
+    stdout = stdout.decode('utf-8')
+    stderr = stderr.decode('utf-8')
+    exitcode = proc.returncode
+
+    if exitcode != 0:
+        raise ValueError(f"Error running command {args}.  Stdout: {stdout}.  Stderr: {stderr}.")
+
+    return exitcode, stdout, stderr
+
+
+def get_repo_name(repo_url: Text) -> Text:
+    """ 'git@github.com:me/my-repo.git' ==> 'my-repo' """
+    name = re.split(r'[/:]', repo_url.rstrip('/'))[-1]
+    return name[:-len('.git')] if name.endswith('.git') else name
+
+
+@functools.lru_cache(maxsize=None)
+def get_git_version() -> Tuple[int, ...]:
+    """ 'git version 2.34.1' ==> (2, 34, 1) """
+    _, out, _ = run(['git', '--version'])
+    return tuple(int(n) for n in re.findall(r'\d+', out.split()[2])[:3])
+
+
+def get_mirror_dir(mirror_cache_dir: Text, repo_url: Text) -> Path:
+    """One mirror per repo URL.  The hash keeps repos with the same name from different owners apart."""
+    url_hash = hashlib.sha256(repo_url.encode('utf-8')).hexdigest()[:12]
+    return Path(mirror_cache_dir).expanduser() / f'{get_repo_name(repo_url)}-{url_hash}.git'
+
+
+def update_mirror(repo_url: Text, mirror_dir: Path) -> Text:
+    """Create or fetch the repo's bare mirror.  A lock keeps workbenches on the same node from racing on it.
+
+    Returns:
+        'created' or 'fetched'
+    """
+    mirror_dir.parent.mkdir(parents=True, exist_ok=True)
+    with open(f'{mirror_dir}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if (mirror_dir / 'HEAD').exists():
+            run(['git', '--git-dir', str(mirror_dir), 'fetch', '--prune', '--quiet', 'origin'])
+            return 'fetched'
+        # a half-made mirror from a crashed boot is worthless
+        tmp_dir = Path(f'{mirror_dir}.tmp')
+        if tmp_dir.exists():
+            shutil.rmtree(str(tmp_dir))
+        run(['git', 'clone', '--mirror', '--quiet', repo_url, str(tmp_dir)])
+        os.rename(str(tmp_dir), str(mirror_dir))
+        return 'created'
+
+
+def clone(
+        repo_url: Text,
+        target_dir: Path,
+        branch: Optional[Text] = None,
+        sparse_paths: Optional[List[Text]] = None,
+        mirror_dir: Optional[Path] = None,
+        partial: bool = True,
+):
+    """Clone repo_url into target_dir, borrowing objects from mirror_dir if it's there.
+
+    The borrowed objects are copied in (--dissociate) rather than left as a reference.  The clone usually lives on a
+    persistent disk which can later be mounted on a node without this mirror.  If git is too old for cone-mode sparse
+    checkouts, everything is checked out instead.
+    """
+    if sparse_paths and get_git_version() < SPARSE_CHECKOUT_MIN_GIT_VERSION:
+        print(f"git {'.'.join(map(str, get_git_version()))} can't do sparse checkouts, so checking out all of "
+              f"{repo_url}.")
+        sparse_paths = None
+
+    args = ['git', 'clone', '--quiet', '--no-checkout']
+    if mirror_dir is not None:
+        args += ['--reference-if-able', str(mirror_dir), '--dissociate']
+    if partial:
+        args += ['--filter=blob:none']
+    if branch is not None:
+        args += ['--branch', branch]
+    run(args + [repo_url, str(target_dir)])
+
+    try:
+        if sparse_paths:
+            run(['git', 'sparse-checkout', 'init', '--cone'], cwd=str(target_dir))
+            run(['git', 'sparse-checkout', 'set'] + list(sparse_paths), cwd=str(target_dir))
+        # with --no-checkout, HEAD already points at the branch, so this just fills in the work tree
+        run(['git', 'checkout', '--quiet'], cwd=str(target_dir))
+    except ValueError:
+        # otherwise the next boot would find the .git directory and think the repo was checked out
+        shutil.rmtree(str(target_dir))
+        raise
+
+
+def provision_repo(
+        repo: Dict,
+        workspace_dir: Text = WORKSPACE_DIR,
+        mirror_cache_dir: Optional[Text] = MIRROR_CACHE_DIR,
+) -> Dict:
+    """Make sure one repo is checked out in workspace_dir.
+
+    Args:
+        repo: a dict with repo_url and optionally branch, sparse_paths, partial (defaults to True) and directory,
+            the checkout's name in workspace_dir
+        workspace_dir: where repos are checked out
+        mirror_cache_dir: where mirrors are kept.  None to clone without one.
+
+    Returns:
+        what was done and how long it took
+    """
+    start = time.time()
+    repo_url = repo['repo_url']
+    target_dir = Path(workspace_dir).expanduser() / (repo.get('directory') or get_repo_name(repo_url))
+    result = {'repo_url': repo_url, 'directory': str(target_dir)}
+
+    mirror_dir = None
+    if mirror_cache_dir is not None:
+        mirror_dir = get_mirror_dir(mirror_cache_dir, repo_url)
+        try:
+            result['mirror'] = update_mirror(repo_url, mirror_dir)
+        except ValueError as e:
+            # the mirror only saves time, so a broken one shouldn't keep the repo from being cloned
+            print(f"Couldn't update the mirror of {repo_url}, so cloning without it: {e}")
+            mirror_dir = None
+
+    if (target_dir / '.git').exists():
+        # never touch the work tree of a checkout which is already there; it may have your changes in it
+        run(['git', 'fetch', '--prune', '--quiet', 'origin'], cwd=str(target_dir))
+        result['action'] = 'fetched'
+    else:
+        target_dir.parent.mkdir(parents=True, exist_ok=True)
+        clone(repo_url, target_dir, repo.get('branch'), repo.get('sparse_paths'), mirror_dir,
+              partial=repo.get('partial', True))
+        result['action'] = 'cloned'
+
+    result['seconds'] = time.time() - start
+    return result
+
+
+def provision_repos(
+        repos: List[Dict],
+        workspace_dir: Text = WORKSPACE_DIR,
+        mirror_cache_dir: Optional[Text] = MIRROR_CACHE_DIR,
+        max_workers: int = 8,
+) -> List[Dict]:
+    """Provision every repo at once.  One repo failing doesn't stop the others.
+
+    Returns:
+        one result per repo, in order.  Failed repos have an 'error'.
+    """
+    def _provision(repo):
+        try:
+            return provision_repo(repo, workspace_dir, mirror_cache_dir)
+        except Exception as e:
+            return {'repo_url': repo['repo_url'], 'error': str(e)}
+
+    if not repos:
+        return []
+    directories = [repo.get('directory') or get_repo_name(repo['repo_url']) for repo in repos]
+    if len(set(directories)) != len(directories):
+        raise ValueError(f"Repos would be checked out into the same directories: {directories}.  Give them each "
+                         f"a distinct directory.")
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(repos))) as executor:
+        return list(executor.map(_provision, repos))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workspace_dir", default=WORKSPACE_DIR)
+    parser.add_argument("--mirror_cache_dir", default=MIRROR_CACHE_DIR)
+    args = parser.parse_args()
+
+    repos = json.loads(os.environ.get(REPOS_ENV, '[]'))
+    start = time.time()
+    results = provision_repos(repos, args.workspace_dir, args.mirror_cache_dir)
+    for result in results:
+        if 'error' in result:
+            print(f"Failed to provision {result['repo_url']}: {result['error']}", flush=True)
+        else:
+            print(f"{result['action'].capitalize()} {result['repo_url']} into {result['directory']} in "
+                  f"{result['seconds']:.2f}s", flush=True)
+    print(f"Provisioned {len(repos)} repos in {time.time() - start:.2f}s", flush=True)
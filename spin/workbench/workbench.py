@@ -1,26 +1,55 @@
+import base64
+import hashlib
+import json
+import math
 import re
 import tempfile
-from typing import Text, List, Optional, Tuple, Dict
-import yaml
+from typing import Text, List, Optional, Tuple, Dict, Callable
 
-from spin import utils, constants, kubes, ssh
+from spin import utils, constants, images, kubes, placement, ssh, tracing
 from spin.ssh import SshKeyOnDisk
 
 
 class GithubRepo(utils.DictBouncer):
-    def __init__(self, repo_url: Text, ssh_key: Optional[SshKeyOnDisk] = None):
+    def __init__(
+            self,
+            repo_url: Text,
+            ssh_key: Optional[SshKeyOnDisk] = None,
+            branch: Optional[Text] = None,
+            sparse_paths: Optional[List[Text]] = None,
+            directory: Optional[Text] = None,
+    ):
         """
-        Represents a github repo.
+        Represents a github repo.  The workbench checks it out into ~/repos when it boots.
 
         Args:
             repo_url:
                 e.g. git@github.com:your_github_username/your_github_repo_name.git
             ssh_key:
-                The SSH key that you use to connect to github.  Only required if the repo is private.
+                The SSH key that you use to connect to github.  Only required if the repo is private.  The repo's
+                mirror on the node is only shared with workbenches which clone with the same keys, so anyone who
+                can log in to one of those can read it.
+            branch:
+                The branch to check out.  Defaults to the repo's default branch.
+            sparse_paths:
+                Only check out these directories, e.g.: ['libs/core', 'tools'] in a monorepo.  Defaults to everything.
+            directory:
+                The checkout's name in ~/repos.  Defaults to the repo's name.
         """
         super().__init__()
         self.repo_url = repo_url
         self.ssh_key = ssh_key
+        self.branch = branch
+        self.sparse_paths = sparse_paths
+        self.directory = directory
+
+    def to_provision_dict(self) -> Dict:
+        """What the container's provision_repos.py needs to check this repo out."""
+        d = {'repo_url': self.repo_url}
+        for k in ('branch', 'sparse_paths', 'directory'):
+            if getattr(self, k) is not None:
+                d[k] = getattr(self, k)
+        return d
 
 
 class CloudConfig(utils.DictBouncer):
@@ -31,11 +60,127 @@ class CloudConfig(utils.DictBouncer):
 
 
 class NodeConfig(utils.DictBouncer):
-    def __init__(self, machine_type: Text, accelerator_type: Text, accelerator_count: int = 1):
+    SHM_MOUNT_PATH = '/dev/shm'
+    # where GKE mounts a node's local SSDs when its node pool is created with --local-ssd-count
+    LOCAL_SSD_HOST_PATH_PREFIX = '/mnt/disks/ssd'
+    LOCAL_SSD_NODE_LABEL = 'cloud.google.com/gke-local-ssd'
+    MACHINE_TYPE_NODE_LABEL = 'node.kubernetes.io/instance-type'
+
+    def __init__(
+            self,
+            machine_type: Text,
+            accelerator_type: Text,
+            accelerator_count: int = 1,
+            cpu: Optional[float] = None,
+            memory_gb: Optional[float] = None,
+            shm_size_gb: Optional[float] = None,
+            local_ssd_count: int = 0,
+            scratch_dir: Text = '/scratch',
+            pin_machine_type: bool = False,
+    ):
+        """
+        The machine a workbench runs on and how its pod uses it.  Every knob past accelerator_count is off by default.
+
+        Args:
+            machine_type: e.g.: n1-standard-4
+            accelerator_type: e.g.: nvidia-tesla-k80
+            accelerator_count: the number of accelerators per node
+            cpu: cpu cores to reserve for the pod, e.g.: 3.5.  Give memory_gb too.  Requests equal limits, so the pod
+                is in the Guaranteed QoS class, its cpu isn't shared with its neighbors and it's the last to be evicted.
+            memory_gb: memory to reserve for the pod.  Give cpu too.
+            shm_size_gb: mount a memory-backed emptyDir this big on /dev/shm rather than the container runtime's
+                default of 64 MB, which data loaders that pass batches between processes run out of.  It counts
+                against memory_gb.
+            local_ssd_count: mount this many of the node's local SSDs under scratch_dir as ssd0, ssd1, etc. and only
+                run on nodes which have them.  The node pool must be created with at least this --local-ssd-count.
+            scratch_dir: where the local SSDs are mounted on the pod
+            pin_machine_type: if True, only run on nodes of machine_type
+        """
         super().__init__()
+        if (cpu is None) != (memory_gb is None):
+            raise ValueError(f"Give both cpu and memory_gb or neither but got cpu={cpu} and memory_gb={memory_gb}")
+        if shm_size_gb is not None and memory_gb is not None and shm_size_gb >= memory_gb:
+            raise ValueError(f"shm_size_gb, {shm_size_gb}, counts against memory_gb, {memory_gb}, so it must be "
+                             f"smaller")
+        if local_ssd_count < 0:
+            raise ValueError(f"local_ssd_count can't be negative but got {local_ssd_count}")
         self.machine_type = machine_type
         self.accelerator_type = accelerator_type
         self.accelerator_count = accelerator_count
+        self.cpu = cpu
+        self.memory_gb = memory_gb
+        self.shm_size_gb = shm_size_gb
+        self.local_ssd_count = local_ssd_count
+        self.scratch_dir = scratch_dir
+        self.pin_machine_type = pin_machine_type
+
+    def to_kubernetes_resources(self) -> Optional[Dict]:
+        """The container's `resources` field, or None to leave it out."""
+        if self.cpu is None:
+            return None
+        request = placement.ResourceRequest(cpu=self.cpu, memory_gb=self.memory_gb, guaranteed=True)
+        try:
+            machine_type = placement.get_machine_type(self.machine_type)
+        except ValueError:
+            machine_type = None
+        if machine_type is not None and (self.cpu > machine_type.get_allocatable_cpus() or
+                                         self.memory_gb > machine_type.get_allocatable_memory_gb()):
+            raise ValueError(f"The pod's cpu={self.cpu} and memory_gb={self.memory_gb} would never fit on a "
+                             f"{self.machine_type}")
+        return request.to_kubernetes_resources()
+
+    def get_scratch_dirs(self) -> List[Text]:
+        return [f'{self.scratch_dir}/ssd{i}' for i in range(self.local_ssd_count)]
+
+    def to_volumes(self) -> List[Dict]:
+        volumes = []
+        if self.shm_size_gb is not None:
+            volumes.append({
+                'name': 'dshm',
+                'emptyDir': {'medium': 'Memory', 'sizeLimit': f'{int(math.ceil(self.shm_size_gb * 1024))}Mi'},
+            })
+        for i in range(self.local_ssd_count):
+            volumes.append({
+                'name': f'local-ssd-{i}',
+                'hostPath': {'path': f'{self.LOCAL_SSD_HOST_PATH_PREFIX}{i}', 'type': 'Directory'},
+            })
+        return volumes
+
+    def to_volume_mounts(self) -> List[Dict]:
+        volume_mounts = []
+        if self.shm_size_gb is not None:
+            volume_mounts.append({'name': 'dshm', 'mountPath': self.SHM_MOUNT_PATH})
+        for i, scratch_dir in enumerate(self.get_scratch_dirs()):
+            volume_mounts.append({'name': f'local-ssd-{i}', 'mountPath': scratch_dir})
+        return volume_mounts
+
+    def to_affinity(self) -> Optional[Dict]:
+        """The pod's `affinity` field, or None to leave it out."""
+        match_expressions = []
+        if self.pin_machine_type:
+            match_expressions.append(
+                {'key': self.MACHINE_TYPE_NODE_LABEL, 'operator': 'In', 'values': [self.machine_type]}
+            )
+        if self.local_ssd_count:
+            match_expressions.append({'key': self.LOCAL_SSD_NODE_LABEL, 'operator': 'In', 'values': ['true']})
+        if not match_expressions:
+            return None
+        return {
+            'nodeAffinity': {
+                'requiredDuringSchedulingIgnoredDuringExecution': {
+                    'nodeSelectorTerms': [{'matchExpressions': match_expressions}],
+                },
+            },
+        }
+
+    def get_deployment_kwargs(self) -> Dict:
+        """The KubernetesDeployment args which put these knobs into its manifest."""
+        return {
+            'resources': self.to_kubernetes_resources(),
+            'volumes': self.to_volumes(),
+            'volume_mounts': self.to_volume_mounts(),
+            'affinity': self.to_affinity(),
+        }
 
 
 class GCloudNodeConfig(NodeConfig):
@@ -45,15 +190,101 @@ class GCloudNodeConfig(NodeConfig):
             machine_type='n1-standard-4',
             accelerator_type='nvidia-tesla-k80',
             accelerator_count=1,
+            **kwargs,
     ):
         super().__init__(
             machine_type=machine_type,
             accelerator_type=accelerator_type,
-            accelerator_count=accelerator_count
+            accelerator_count=accelerator_count,
+            **kwargs,
         )
 
 
+class VolumeConfig(utils.DictBouncer):
+    def __init__(
+            self,
+            home_size_gb: Optional[int] = 50,
+            cache_size_gb: Optional[int] = 20,
+            datasets_size_gb: Optional[int] = 100,
+            storage_class: Optional[Text] = None,
+            shared_datasets_claim: Optional[Text] = None,
+            home_dir: Text = '/root',
+            cache_dir: Text = '/root/.cache',
+            datasets_dir: Text = '/datasets',
+            shared_datasets_dir: Text = '/datasets/shared',
+    ):
+        """
+        The persistent disks a workbench mounts.  Each one is a PersistentVolumeClaim named after the workbench, so a
+        workbench which is deleted and created again with the same name gets its disks back: cloned repos, shell
+        history and ~/.ssh in home, pip's wheels in the cache and downloaded data in datasets.
+
+        Args:
+            home_size_gb: the home disk's size.  None for no home disk.
+            cache_size_gb: the package cache disk's size, e.g.: for pip.  It's separate from home so that it can
+                be sized and thrown away on its own.  None for no cache disk.
+            datasets_size_gb: the dataset cache disk's size.  None for no dataset disk.
+            storage_class: the claims' storage class.  Defaults to the cluster's default.
+            shared_datasets_claim: the name of an existing ReadOnlyMany claim, e.g.: on a disk which was filled
+                with datasets once, to mount read-only on every workbench which names it
+            home_dir: where the home disk is mounted
+            cache_dir: where the cache disk is mounted
+            datasets_dir: where the dataset disk is mounted
+            shared_datasets_dir: where the shared dataset claim is mounted
+        """
+        super().__init__()
+        self.home_size_gb = home_size_gb
+        self.cache_size_gb = cache_size_gb
+        self.datasets_size_gb = datasets_size_gb
+        self.storage_class = storage_class
+        self.shared_datasets_claim = shared_datasets_claim
+        self.home_dir = home_dir
+        self.cache_dir = cache_dir
+        self.datasets_dir = datasets_dir
+        self.shared_datasets_dir = shared_datasets_dir
+
+    def get_claims_and_mount_paths(
+            self,
+            workbench_name: Text,
+    ) -> List[Tuple[kubes.KubernetesPersistentVolumeClaim, Text]]:
+        """The workbench's own claims, which it creates, and where each is mounted."""
+        claims_and_mount_paths = []
+        for suffix, size_gb, mount_path in (
+                ('home', self.home_size_gb, self.home_dir),
+                ('cache', self.cache_size_gb, self.cache_dir),
+                ('datasets', self.datasets_size_gb, self.datasets_dir),
+        ):
+            if size_gb is None:
+                continue
+            claim = kubes.KubernetesPersistentVolumeClaim(
+                name=f'{workbench_name}-{suffix}',
+                size_gb=size_gb,
+                storage_class=self.storage_class,
+                labels={kubes.WORKBENCH_LABEL: workbench_name},
+            )
+            claims_and_mount_paths.append((claim, mount_path))
+        return claims_and_mount_paths
+
+    def get_deployment_kwargs(self, workbench_name: Text) -> Dict:
+        """The KubernetesDeployment args which mount these disks."""
+        claims_and_mount_paths = self.get_claims_and_mount_paths(workbench_name)
+        volumes = [claim.to_volume() for claim, _ in claims_and_mount_paths]
+        volume_mounts = [claim.to_volume_mount(mount_path) for claim, mount_path in claims_and_mount_paths]
+        if self.shared_datasets_claim is not None:
+            volumes.append({
+                'name': 'shared-datasets',
+                'persistentVolumeClaim': {'claimName': self.shared_datasets_claim, 'readOnly': True},
+            })
+            volume_mounts.append({'name': 'shared-datasets', 'mountPath': self.shared_datasets_dir, 'readOnly': True})
+        return {
+            'volumes': volumes,
+            'volume_mounts': volume_mounts,
+            # a new pod can't mount a ReadWriteOnce disk until the old pod has let go of it
+            'strategy': 'Recreate' if claims_and_mount_paths else None,
+        }
+
+
 _DEFAULT_MASTER_NODE_CONFIG = GCloudNodeConfig()
+_DEFAULT_VOLUME_CONFIG = VolumeConfig()
 
 
 class Workbench(utils.ShellRunnerMixin):
@@ -77,7 +308,17 @@ class Workbench(utils.ShellRunnerMixin):
     USER_KEY_SECRET_TYPE = SecretType('user-keys')
     USER_LOGIN_PUBLIC_KEYS_SECRET_TYPE = SecretType('user-login-public-keys')
 
-    DEFAULT_CONTAINER_IMAGE_URI = 'gcr.io/kb-experiment/workbench:latest'
+    # everything a workbench puts in kubernetes is labelled kubes.WORKBENCH_LABEL=<its name>, so these are listed and
+    #   deleted with one selector rather than by name
+    OBJECT_TYPES = ('deployment', 'service', 'secret')
+    VOLUME_OBJECT_TYPES = ('persistentvolumeclaim',)
+
+    DEFAULT_CONTAINER_IMAGE_URI = f'{images.DEFAULT_WORKBENCH_REPOSITORY_URI}:latest'
+
+    # must match provision_repos.py in the container
+    REPOS_ENV = 'SPIN_REPOS'
+    # on the node, with a directory per set of repo ssh keys, mounted at the same path in the container
+    REPO_MIRROR_CACHE_DIR = '/var/cache/spin-git-mirrors'
 
     def __init__(
             self,
@@ -88,6 +329,8 @@ class Workbench(utils.ShellRunnerMixin):
             master_node_config: NodeConfig = _DEFAULT_MASTER_NODE_CONFIG,
             kubernetes_namespace=constants.DEFAULT_KUBERNETES_NAMESPACE,
             container_image_uri=DEFAULT_CONTAINER_IMAGE_URI,
+            volume_config: Optional[VolumeConfig] = _DEFAULT_VOLUME_CONFIG,
+            ssh_control_persist: Optional[Text] = ssh.DEFAULT_CONTROL_PERSIST,
             verbose=True,
     ):
         """
@@ -95,11 +338,21 @@ class Workbench(utils.ShellRunnerMixin):
 
         Args:
             cloud_config: config for the cloud where you'll launch this workbench
-            repos: a list of repos to pull into your Workbench
+            repos: a list of repos to pull into your Workbench.  Their mirrors are cached on the node and shared
+                with the other workbenches there which clone with the same ssh keys, or with every workbench
+                there which clones only public repos.
             name: the name of this workbench
-            master_node_config: the configuration for your workbench's master node
+            master_node_config: the configuration for your workbench's master node, including its pod's reserved
+                resources, /dev/shm size and local SSD scratch space
             kubernetes_namespace: the namespace in which to launch this workbench
             ssh_login_key: the ssh key on your computer which you'll use to login to this workbench
+            container_image_uri: the image to run.  If you published this tag with `spin publish`, the digest uri
+                it was published as is used instead, so that an unchanged image is never re-pulled.  The default uri
+                resolves to the workbench image you published last.
+            volume_config: the persistent disks to mount.  They're kept when the workbench is deleted, so creating it
+                again starts warm.  None for none.
+            ssh_control_persist: how long an ssh connection to the workbench stays open after its last session, so
+                the next ssh, scp or run skips the handshake.  None to write a host entry without multiplexing.
             verbose: if True, print out status messages as you go
         """
         super().__init__(verbose)
@@ -108,12 +361,19 @@ class Workbench(utils.ShellRunnerMixin):
         self.repos = repos
         self.name = name
         self.kubernetes_namespace = kubernetes_namespace
-        self.container_image_uri = container_image_uri
+        self.container_image_uri = images.PublishedImages().resolve(
+            container_image_uri,
+            use_latest=container_image_uri == self.DEFAULT_CONTAINER_IMAGE_URI,
+        )
         self.ssh_login_key = ssh_login_key
-        
+        self.volume_config = volume_config
+        self.ssh_control_persist = ssh_control_persist
+
         self._secrets = []
         self._service = None
         self._deployment = None
+        self._ssh_connection = None
+        self.ip = None
 
 
     @staticmethod
@@ -129,38 +389,27 @@ class Workbench(utils.ShellRunnerMixin):
             raise ValueError(f"Couldn't figure out key type from key name: {private_key_name}")
         return m.groupdict()['key_type']
 
+    @tracing.traced('workbench.create_ssh_server_keys_as_secret')
     def _create_ssh_server_keys_as_secret(
             self,
             key_types=('dsa', 'rsa', 'ecdsa', 'ed25519'),
     ) -> Tuple[kubes.KubernetesSecret, Dict[Text, ssh.SshKeyInMemory]]:
-        """Create a Kubernetes secret containing newly generated SSH keys of the given type.
+        """Generate SSH keys of the given types and put them in a Kubernetes secret.
         Used as SSH server keys on the workbench.
 
         Args:
             key_types: the ssh key types to create and add to the secret.
 
         Returns:
-            Reference to a kubernetes secret which has already been created and which contains
-            the requested private and public keys as members.
+            Reference to a kubernetes secret, not yet created, which contains the requested private and public keys
+            as members.
         """
 
         utils.ensure_cmdline_program_exists('ssh-keygen')
 
         key_type_to_in_memory_key = {}
-
-        # # if secret already exists, claim it rather than creating it anew.
-        secret_name = self.SERVER_KEY_SECRET_TYPE.get_secret_name(self.name)
-        secret_mountpoint = self.SERVER_KEY_SECRET_TYPE.get_secret_mountpoint()
-
-        # secret = kubes.KubernetesSecret(
-        #         name=secret_name,
-        #         mount_point_on_pod=secret_mountpoint,
-        # )
-        # if secret.exists():
-        #     pass
-
+        key_filename_to_contents = {}
         with tempfile.TemporaryDirectory() as tempdir:
-            ssh_keys = []
             for key_type in key_types:
                 key_filename = self._key_type_name_to_ssh_key_name(key_type)
                 private_key_location = f'{tempdir}/{key_filename}'
@@ -169,25 +418,25 @@ class Workbench(utils.ShellRunnerMixin):
                 ssh_key = ssh.SshKeyOnDisk(private_key_location)
                 if not ssh_key.exists():
                     raise IOError(f"Error creating key at location {private_key_location}")
-                ssh_keys.append(ssh_key)
-                key_type_to_in_memory_key[key_type] = ssh.SshKeyInMemory.from_on_disk_key(ssh_key)
-            # self._add_keys_as_secret(self.SERVER_KEY_SECRET_TYPE.get_secret_name(self.name), ssh_keys)
-            secret = kubes.KubernetesSecret.from_ssh_keys(
-                secret_name=secret_name,
-                mount_point_on_pod=secret_mountpoint,
-                ssh_keys=ssh_keys,
-            )
-            # delete old secret if it already eixsts and create a new one
-            secret.delete()
-            secret.create()
-
+                in_memory_key = ssh.SshKeyInMemory.from_on_disk_key(ssh_key)
+                key_type_to_in_memory_key[key_type] = in_memory_key
+                # the secret is applied after the temp dir is gone, so it holds the keys rather than their files
+                key_filename_to_contents[key_filename] = in_memory_key.read_private()
+                key_filename_to_contents[f'{key_filename}.pub'] = in_memory_key.read_public()
+
+        secret = kubes.KubernetesSecret(
+            name=self.SERVER_KEY_SECRET_TYPE.get_secret_name(self.name),
+            files=[],
+            mount_point_on_pod=self.SERVER_KEY_SECRET_TYPE.get_secret_mountpoint(),
+            contents=key_filename_to_contents,
+            labels=self.get_labels(),
+        )
         return secret, key_type_to_in_memory_key
 
-    def _claim_secrets(self):
-        secret_types = [self.SERVER_KEY_SECRET_TYPE, self.USER_KEY_SECRET_TYPE, self.USER_LOGIN_PUBLIC_KEYS_SECRET_TYPE]
-
-        expected_secret_names = [t.get_secret_name(self.name) for t in secret_types]
-        found_secret_names = kubes.KubernetesSecret(name='dummy', files=[], mount_point_on_pod='').list_names()
+    @tracing.traced('workbench.claim_secrets')
+    def _claim_secrets(self, listing: kubes.KubernetesListing):
+        expected_secret_names = self._get_secret_names()
+        found_secret_names = listing.get_names('secret')
         if not set(expected_secret_names).issubset(set(found_secret_names)):
             # ssh server keys:
             #   if you don't have the local
@@ -211,10 +460,11 @@ class Workbench(utils.ShellRunnerMixin):
             kubes.EmptyKubernetesSecret(name=name) for name in expected_secret_names
         ]
 
-        secret_name = self.SERVER_KEY_SECRET_TYPE.get_secret_name(self.name)
-        _, out, _ = self._run(f'kubectl get secret {secret_name} -o yaml')
-        out = yaml.load(out)
-        key_filename_to_contents = out['data']
+        secret_dict = listing.get('secret', self.SERVER_KEY_SECRET_TYPE.get_secret_name(self.name))
+        # secret data is base64 encoded
+        key_filename_to_contents = {
+            k: base64.b64decode(v).decode('utf-8') for k, v in secret_dict['data'].items()
+        }
         public_key_names = [k for k in key_filename_to_contents if k.endswith('.pub')]
         private_key_names = [k[:-4] for k in public_key_names]
         if not set(private_key_names).issubset(set(key_filename_to_contents.keys())):
@@ -231,76 +481,151 @@ class Workbench(utils.ShellRunnerMixin):
 
         return secrets, key_type_to_in_memory_key
 
-    def create(self):
-        if self.exists():
+    def get_labels(self) -> Dict[Text, Text]:
+        """The labels on everything the workbench puts in kubernetes."""
+        return {kubes.WORKBENCH_LABEL: self.name}
+
+    def get_listing(self) -> kubes.KubernetesListing:
+        """A listing of the workbench's deployment, service and secrets, taken with one label selector query."""
+        return kubes.KubernetesListing(self.OBJECT_TYPES, selector=kubes.get_selector(self.get_labels()),
+                                       verbose=self.verbose)
+
+    def _get_secret_names(self) -> List[Text]:
+        secret_types = [self.SERVER_KEY_SECRET_TYPE, self.USER_KEY_SECRET_TYPE, self.USER_LOGIN_PUBLIC_KEYS_SECRET_TYPE]
+        return [t.get_secret_name(self.name) for t in secret_types]
+
+    def _get_service_and_deployment(
+            self,
+            secrets: List[kubes.KubernetesSecret],
+    ) -> Tuple[kubes.KubernetesService, kubes.KubernetesDeployment]:
+        return kubes.get_service_and_deployment(
+            deployment_name=self.name,
+            container_image_uri=self.container_image_uri,
+            service_name=self.name,
+            ports=[
+                kubes.KubernetesPort(name='ssh', external_port=22, pod_port=22),
+                kubes.KubernetesPort(name='http', external_port=80, pod_port=80),
+            ],
+            secrets=secrets,
+            num_deployment_replicas=1,
+            labels=self.get_labels(),
+            **self._get_deployment_kwargs(),
+        )
+
+    def _get_deployment_kwargs(self) -> Dict:
+        deployment_kwargs = self.master_node_config.get_deployment_kwargs()
+        if self.volume_config is not None:
+            volume_kwargs = self.volume_config.get_deployment_kwargs(self.name)
+            deployment_kwargs['volumes'] = deployment_kwargs['volumes'] + volume_kwargs['volumes']
+            deployment_kwargs['volume_mounts'] = deployment_kwargs['volume_mounts'] + volume_kwargs['volume_mounts']
+            deployment_kwargs['strategy'] = volume_kwargs['strategy']
+        if self.repos:
+            deployment_kwargs['env'] = {
+                self.REPOS_ENV: json.dumps([repo.to_provision_dict() for repo in self.repos]),
+            }
+            deployment_kwargs['volumes'] = deployment_kwargs['volumes'] + [{
+                'name': 'repo-mirrors',
+                'hostPath': {'path': self._get_repo_mirror_host_path(), 'type': 'DirectoryOrCreate'},
+            }]
+            deployment_kwargs['volume_mounts'] = deployment_kwargs['volume_mounts'] + [
+                {'name': 'repo-mirrors', 'mountPath': self.REPO_MIRROR_CACHE_DIR},
+            ]
+        return deployment_kwargs
+
+    def _get_repo_mirror_host_path(self) -> Text:
+        """Where on the node the workbench's repo mirrors are kept.
+
+        A mirror of a private repo holds everything its ssh key can read, so only workbenches which clone with the
+        same keys share a directory.  Ones which only clone public repos share one of their own.
+        """
+        # just the key type and key, without the comment
+        public_keys = sorted({
+            ' '.join(repo.ssh_key.read_public().split()[:2]) for repo in self.repos if repo.ssh_key is not None
+        })
+        if not public_keys:
+            return f'{self.REPO_MIRROR_CACHE_DIR}/public'
+        keys_hash = hashlib.sha256('\n'.join(public_keys).encode('utf-8')).hexdigest()[:16]
+        return f'{self.REPO_MIRROR_CACHE_DIR}/{keys_hash}'
+
+    def _get_volume_claims(self) -> List[kubes.KubernetesPersistentVolumeClaim]:
+        if self.volume_config is None:
+            return []
+        return [claim for claim, _ in self.volume_config.get_claims_and_mount_paths(self.name)]
+
+    @tracing.traced('workbench.create')
+    def create(
+            self,
+            listing: Optional[kubes.KubernetesListing] = None,
+            update_ssh_files=True,
+    ) -> ssh.SshFilesUpdate:
+        """Create the workbench, or claim it if it already exists, and point your ssh config and known_hosts at it.
+
+        Args:
+            listing: a listing shared with other workbenches, e.g.: by a Fleet, to check what already exists in.
+                Defaults to the workbench's own listing.
+            update_ssh_files: if False, don't write your ssh config or known_hosts, e.g.: so a Fleet can write every
+                workbench's changes at once
+
+        Returns:
+            the changes for your ssh config and known_hosts
+        """
+        listing = listing if listing is not None else self.get_listing()
+        if self.exists(listing):
             # claim secrets / reconstruct keys
             # TODO: clean this up. there are all kinds of differences between the claimed and
             #   created secrets / deployment / services.  these are just stubs used for deleting.
             #   ideal would be to reconstruct full deployment / service / secrets from stuff in kubectl
-            self._secrets, ssh_key_type_to_in_memory_key = self._claim_secrets()
-            self._service, self._deployment = kubes.get_service_and_deployment(
-                deployment_name=self.name,
-                container_image_uri=self.container_image_uri,
-                service_name=self.name,
-                ports=[
-                    kubes.KubernetesPort(name='ssh', external_port=22, pod_port=22),
-                    kubes.KubernetesPort(name='http', external_port=80, pod_port=80),
-                ],
-                secrets=[],
-                num_deployment_replicas=1,
-            )
+            self._secrets, ssh_key_type_to_in_memory_key = self._claim_secrets(listing)
+            self._service, self._deployment = self._get_service_and_deployment(secrets=[])
 
-            ip, ports_dict = self._service.get_ip_and_ports()
+            # a listed service already has its ip, unless its load balancer was still coming up
+            ip, ports_dict = kubes.KubernetesService.parse_ip_and_ports(listing.get('service', self.name))
+            if ip is None:
+                with tracing.span('workbench.get_ip_and_ports'):
+                    ip, ports_dict = self._service.get_ip_and_ports()
 
         else:
-            # create secrets
+            # make secrets
             self._secrets, ssh_key_type_to_in_memory_key = self._create_secrets()
 
             # launch the app to kubernetes
-            self._service, self._deployment = kubes.get_service_and_deployment(
-                deployment_name=self.name,
-                container_image_uri=self.container_image_uri,
-                service_name=self.name,
-                ports=[
-                    kubes.KubernetesPort(name='ssh', external_port=22, pod_port=22),
-                    kubes.KubernetesPort(name='http', external_port=80, pod_port=80),
-                ],
-                secrets=self._secrets,
-                num_deployment_replicas=1,
-            )
+            self._service, self._deployment = self._get_service_and_deployment(secrets=self._secrets)
 
-            # always create your service before your deployment
-            self._service.create()
-            self._deployment.create()
+            # secrets go first since the deployment mounts them, and applying them replaces any left over from an
+            #   earlier workbench with this name.  always create your service before your deployment.  claims which
+            #   survived an earlier deletion are left as they are, so the new pod gets their disks back.
+            with tracing.span('workbench.apply_service_and_deployment'):
+                kubes.apply_all(self._secrets + [self._service] + self._get_volume_claims() + [self._deployment])
 
             # TODO: really, we'd like this to be assigned a static DNS name.
             #   my-workbench.my-username.my-project.cloud.google.com or something.
             #   the reason is that then the user wouldn't have to reconfigure their IDE every time they shut down
             #   their workbench.
             #   we could run a service which would map workbench ip to that statically assigned name.
-            ip, ports_dict = self._service.get_ip_and_ports()
-
-            ssh_port_num = ports_dict['ssh']
-
-            known_hosts_modifier = ssh.KnownHostsModifier()
-            if self.verbose:
-                print(f"Adding workbench's entry into {known_hosts_modifier.known_hosts_file}")
-
-            for ssh_key in ssh_key_type_to_in_memory_key.values():
-                known_hosts_line = ssh_key.get_known_hosts_line(ip, ssh_port_num)
-                known_hosts_modifier.add_known_host(known_hosts_line)
-
-            # TODO: make ssh config modifier short circuit for matching block
-            config_modifier = ssh.SshConfigModifier()
-            config_modifier.add_host_entry(
+            with tracing.span('workbench.get_ip_and_ports'):
+                ip, ports_dict = self._service.get_ip_and_ports()
+
+        self.ip = ip
+        ssh_port_num = ports_dict['ssh']
+        ssh_update = ssh.SshFilesUpdate(
+            known_hosts_lines=[
+                ssh_key.get_known_hosts_line(ip, ssh_port_num) for ssh_key in ssh_key_type_to_in_memory_key.values()
+            ],
+            # these are the workbench's server keys, so any other lines for its ip are stale
+            known_hosts_hosts_to_remove=[ssh.get_known_hosts_host(ip, ssh_port_num)],
+            host_entries=[ssh.SshConfigModifier.make_host_entry(
                 host_tag=self.name,
                 host_name=ip,
                 user='root',
                 port=ssh_port_num,
-                identity_file=self.ssh_login_key.private_key_path,
+                identity_file=str(self.ssh_login_key.private_key_path),
                 forward_agent=True,
-                do_replace_existing_spin_hosts_entry=False,
-            )
+                control_persist=self.ssh_control_persist,
+            )],
+        )
+        if update_ssh_files:
+            with tracing.span('workbench.update_ssh_files'):
+                ssh_update.apply(verbose=self.verbose)
 
         if self.verbose:
             ports_str = '\n               '.join([f'{k}: {v}' for k, v in ports_dict.items()])
@@ -317,7 +642,11 @@ class Workbench(utils.ShellRunnerMixin):
             {ssh_str} 
         """)
 
+        return ssh_update
+
+    @tracing.traced('workbench.create_secrets')
     def _create_secrets(self):
+        """The workbench's secrets, not yet created, and its ssh server keys."""
         secrets = []
         # create SSH server keys as kubernetes secret.  these allow the workbench to run an SSH server
         server_keys_secret, ssh_key_type_to_in_memory_key = self._create_ssh_server_keys_as_secret()
@@ -332,9 +661,8 @@ class Workbench(utils.ShellRunnerMixin):
             secret_name=self.USER_KEY_SECRET_TYPE.get_secret_name(self.name),
             mount_point_on_pod=self.USER_KEY_SECRET_TYPE.get_secret_mountpoint(),
             ssh_keys=user_keys,
+            labels=self.get_labels(),
         )
-        user_keys_secret.delete()
-        user_keys_secret.create()
         secrets.append(user_keys_secret)
 
         # create login key as kubernetes secret.  this allows the user to ssh in to the workbench
@@ -342,29 +670,131 @@ class Workbench(utils.ShellRunnerMixin):
             secret_name=self.USER_LOGIN_PUBLIC_KEYS_SECRET_TYPE.get_secret_name(self.name),
             mount_point_on_pod=self.USER_LOGIN_PUBLIC_KEYS_SECRET_TYPE.get_secret_mountpoint(),
             ssh_keys=[self.ssh_login_key],
+            labels=self.get_labels(),
         )
-        login_keys_secret.delete()
-        login_keys_secret.create()
         secrets.append(login_keys_secret)
 
         return secrets, ssh_key_type_to_in_memory_key
 
-    def delete(self):
-        self._deployment.delete()
-        self._service.delete()
-        for secret in self._secrets:
-            secret.delete()
-
-    def exists(self):
-        self._service, self._deployment = kubes.get_service_and_deployment(
+    def get_kubernetes_objects(self, include_volumes=False) -> List[kubes._KubernetesObject]:
+        """Stand-ins for everything the workbench puts in kubernetes, e.g.: to delete.  Nothing is fetched."""
+        service, deployment = kubes.get_service_and_deployment(
             deployment_name=self.name,
             container_image_uri='',
             service_name=self.name,
             ports=[],
             secrets=[],
-            num_deployment_replicas=1,
         )
-        return self._service.exists() and self._deployment.exists()
+        objects = [deployment, service] + [kubes.EmptyKubernetesSecret(name) for name in self._get_secret_names()]
+        if include_volumes:
+            objects += self._get_volume_claims()
+        return objects
+
+    @tracing.traced('workbench.delete')
+    def delete(self, delete_volumes=False, update_ssh_files=True):
+        """Delete everything labelled as the workbench's with one call, then remove it from your ssh config and
+        known_hosts.  Its persistent disks are kept for next time unless delete_volumes is True.
+
+        Workbenches created before spin labelled its objects carry no labels, so if the selector matches nothing, its
+        objects are deleted by name instead.
+        """
+        object_types = self.OBJECT_TYPES + (self.VOLUME_OBJECT_TYPES if delete_volumes else ())
+        _, out, _ = kubes.delete_by_selector(object_types, kubes.get_selector(self.get_labels()), verbose=self.verbose)
+        if not out.strip():
+            kubes.delete_all(self.get_kubernetes_objects(include_volumes=delete_volumes), verbose=self.verbose)
+        if update_ssh_files:
+            # known_hosts has lines for wherever its host entry points
+            entry = ssh.SshConfigModifier('~/.ssh/config', verbose=self.verbose).get_host_entry(self.name)
+            known_hosts_host = entry.get_known_hosts_host() if entry is not None else None
+            ssh.SshFilesUpdate(
+                known_hosts_hosts_to_remove=[known_hosts_host] if known_hosts_host is not None else [],
+                host_tags_to_remove=[self.name],
+            ).apply(verbose=self.verbose)
+        if self._ssh_connection is not None:
+            self._ssh_connection.close()
+            self._ssh_connection = None
+
+    def get_ssh_connection(self) -> ssh.MultiplexedSshConnection:
+        """The workbench's multiplexed ssh connection, through the host entry which create added to your ssh config."""
+        if self._ssh_connection is None:
+            self._ssh_connection = ssh.MultiplexedSshConnection(
+                self.name,
+                control_persist=self.ssh_control_persist or ssh.DEFAULT_CONTROL_PERSIST,
+                verbose=self.verbose,
+            )
+        return self._ssh_connection
+
+    def run(
+            self,
+            command: Text,
+            on_output: Optional[Callable[[Text, Text], None]] = None,
+            error_on_nonzero_exit=True,
+            timeout: Optional[float] = None,
+    ) -> Tuple[int, Text, Text]:
+        """Run a shell command on the workbench and get its exitcode, stdout and stderr.
+
+        Args:
+            command: the command to run
+            on_output: called with 'stdout' or 'stderr' and each line of output as soon as it arrives
+            error_on_nonzero_exit: if True, raise a ValueError if the command fails
+            timeout: kill the command and raise a TimeoutError if it's still running after this many seconds
+        """
+        return self.get_ssh_connection().run(command, on_output, error_on_nonzero_exit, timeout)
+
+    def run_many(
+            self,
+            commands: List[Text],
+            max_concurrency: int = 8,
+            on_output: Optional[Callable[[int, Text, Text], None]] = None,
+            error_on_nonzero_exit=True,
+            timeout: Optional[float] = None,
+    ) -> List[Tuple[int, Text, Text]]:
+        """Run commands on the workbench at once over one ssh connection.  See MultiplexedSshConnection.run_many."""
+        return self.get_ssh_connection().run_many(commands, max_concurrency, on_output, error_on_nonzero_exit, timeout)
+
+    @tracing.traced('workbench.exists')
+    def exists(self, listing: Optional[kubes.KubernetesListing] = None):
+        """Whether the workbench's service and deployment exist.
+
+        Args:
+            listing: a listing to check in.  Defaults to the workbench's own listing.
+        """
+        listing = listing if listing is not None else self.get_listing()
+        return listing.exists('service', self.name) and listing.exists('deployment', self.name)
+
+
+def find_orphans(include_volumes=False, verbose=True) -> List[kubes._KubernetesObject]:
+    """Objects labelled as belonging to a workbench whose deployment is gone, e.g.: because its deletion was
+    interrupted, with one label selector query.
+
+    Args:
+        include_volumes: if True, include persistent volume claims.  Those are kept on purpose when a workbench is
+            deleted, so that creating it again gets its disks back.
+
+    Objects created before spin labelled them aren't found.  Delete those with `spin down workbench NAME`, which falls
+    back to deleting by name.
+    """
+    object_types = [t for t in Workbench.OBJECT_TYPES if t != 'deployment']
+    if include_volumes:
+        object_types += Workbench.VOLUME_OBJECT_TYPES
+    listing = kubes.KubernetesListing(['deployment'] + object_types, selector=kubes.WORKBENCH_LABEL, verbose=verbose)
+    return kubes.find_orphans(kubes.WORKBENCH_LABEL, 'deployment', object_types, listing)
+
+
+def collect_garbage(include_volumes=False, dry_run=False, verbose=True) -> List[kubes._KubernetesObject]:
+    """Delete the objects find_orphans finds, with one `kubectl delete` per type.
+
+    Args:
+        include_volumes: see find_orphans
+        dry_run: if True, find them but don't delete them
+
+    Returns:
+        the orphans
+    """
+    orphans = find_orphans(include_volumes, verbose)
+    if orphans and not dry_run:
+        kubes.delete_all(orphans, verbose=verbose)
+    return orphans
 
 
 if __name__ == '__main__':
@@ -9,4 +9,5 @@ export IMAGE_REPO_NAME={{cookiecutter.pkg_slug}}-repo
 export IMAGE_TAG={{cookiecutter.pkg_slug}}-app
 export IMAGE_URI=gcr.io/${PROJECT_ID}/${IMAGE_REPO_NAME}:${IMAGE_TAG}
 
-docker build -f Dockerfile -t $IMAGE_URI .
\ No newline at end of file
+# BuildKit is required for the cache mounts in the Dockerfile
+DOCKER_BUILDKIT=1 docker build -f Dockerfile -t $IMAGE_URI .
@@ -13,6 +13,11 @@ def read(filename):
         return re.sub(text_type(r':[a-z]+:`~?(.*?)`'), text_type(r'``\1``'), fd.read())
 
 
+def read_requirements(filename):
+    """Read install_requires from a requirements file.  The Dockerfile installs the same file in its own layer."""
+    return [line.strip() for line in read(filename).splitlines() if line.strip() and not line.startswith('#')]
+
+
 setup(
     name="{{ cookiecutter.pkg_slug }}",
     version='0.0.1',
@@ -37,20 +42,15 @@ setup(
         ],
     },
 
-    install_requires=[
-        'numpy',
-        'scipy',
-        'pandas',
-        'keras',
-        'google-cloud-storage',
-    ],
+    install_requires=read_requirements('requirements.txt'),
+    # the pins in requirements.txt are for the Docker image's Python 3.11
+    python_requires='>=3.11',
 
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.11',
     ],
 )
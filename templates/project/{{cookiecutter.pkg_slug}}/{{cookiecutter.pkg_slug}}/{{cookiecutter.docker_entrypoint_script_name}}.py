@@ -1,5 +1,21 @@
 from {{ cookiecutter.pkg_slug }} import settings
 import inspect
+import os
+
+
+def get_distributed_env():
+    """This process's place in its group, as set by spin.distributed's launchers.  A group of one by default.
+
+    Pass it to your framework, e.g.: torch.distributed.init_process_group('nccl', init_method='env://') reads the
+    same variables.  An Indexed Job's pods all have JOB_COMPLETION_INDEX, so it stands in for a missing RANK.
+    """
+    return {
+        'rank': int(os.environ.get('RANK', os.environ.get('JOB_COMPLETION_INDEX', '0'))),
+        'world_size': int(os.environ.get('WORLD_SIZE', '1')),
+        'master_addr': os.environ.get('MASTER_ADDR', '127.0.0.1'),
+        'master_port': int(os.environ.get('MASTER_PORT', '29500')),
+        'local_rank': int(os.environ.get('LOCAL_RANK', '0')),
+    }
 
 
 def main_funk():
@@ -7,10 +23,13 @@ def main_funk():
     package_name = str(package_root).replace(str(package_root.parents[0]), '')[1:]
     this_file = __file__
     function_name = inspect.stack()[0][3]
+    distributed_env = get_distributed_env()
 
     print(f"""
         Package:            {package_name}
         Rooted at:          {package_root}
         Running in file:    {this_file}
         Inside function:    {function_name}
+        Rank:               {distributed_env['rank']} of {distributed_env['world_size']}
+        Master:             {distributed_env['master_addr']}:{distributed_env['master_port']}
     """)
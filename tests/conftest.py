@@ -0,0 +1,64 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import Text, Dict, Any, List, Optional
+
+import pytest
+
+from benchmarks import fake_cloud as fake_cloud_module
+from spin import ssh
+from spin.workbench import workbench
+
+
+class FakeCloud:
+    """The fake gcloud and kubectl in benchmarks/fake_cloud.py, installed under directory and first on PATH."""
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.bin_dir = directory / 'bin'
+        self.state = fake_cloud_module.FakeCloudState(directory / 'state.json')
+        self.call_log = directory / 'calls.jsonl'
+
+    def read(self) -> Dict[Text, Any]:
+        return self.state.read()
+
+    def read_calls(self) -> List[Dict[Text, Any]]:
+        return fake_cloud_module.read_call_log(self.call_log)
+
+    def get_call_names(self) -> List[Text]:
+        """e.g.: ['kubectl apply', 'kubectl get service']"""
+        return [c['name'] for c in self.read_calls()]
+
+
+@pytest.fixture
+def fake_cloud(tmp_path, monkeypatch):
+    """Call it, with an optional initial state, to point gcloud and kubectl at a new fake cloud for the test.  The
+    default state is an empty project named 'my-project'."""
+    def start(initial_state: Optional[Dict[Text, Any]] = None) -> FakeCloud:
+        cloud = FakeCloud(tmp_path / 'fake-cloud')
+        fake_cloud_module.install_fake_cloud(cloud.bin_dir)
+        if initial_state is None:
+            initial_state = fake_cloud_module.get_empty_state('my-project')
+        cloud.state.initialize(initial_state)
+        monkeypatch.setenv('PATH', f'{cloud.bin_dir}{os.pathsep}{os.environ["PATH"]}')
+        monkeypatch.setenv(fake_cloud_module.STATE_ENV, str(cloud.state.filename))
+        monkeypatch.setenv(fake_cloud_module.CALL_LOG_ENV, str(cloud.call_log))
+        return cloud
+    return start
+
+
+@pytest.fixture
+def make_workbench(tmp_path):
+    """Call it with a name to make a workbench in 'my-project' which logs in with a new key made for the test."""
+    subprocess.check_call(['ssh-keygen', '-q', '-t', 'ed25519', '-N', '', '-f', str(tmp_path / 'id_ed25519')])
+    key = ssh.SshKeyOnDisk(str(tmp_path / 'id_ed25519'))
+
+    def make(name: Text) -> workbench.Workbench:
+        return workbench.Workbench(
+            cloud_config=workbench.CloudConfig(cloud_project='my-project', zone='us-central1-a'),
+            repos=[],
+            ssh_login_key=key,
+            name=name,
+            container_image_uri='image@sha256:abc',
+            verbose=False,
+        )
+    return make
@@ -0,0 +1,135 @@
+import datetime
+
+from benchmarks import bench_autoscaler
+from benchmarks.fake_cloud import get_empty_state, make_cluster, make_node_pool
+from spin import autoscaler, cluster, operations
+
+
+def _at(hour, minute=0, day=4):
+    """A timestamp on Monday, November 4th 2019 (or another day of that week) at the given local time."""
+    return datetime.datetime(2019, 11, day, hour, minute).timestamp()
+
+
+def _step(policy, history, current, pending, running, now):
+    observation = autoscaler.PoolObservation(policy.pool_name, current, pending, running)
+    decision = autoscaler.decide(policy, observation, history, now)
+    return decision, autoscaler.update_history(history, observation, decision, policy, now)
+
+
+def test_scale_up_is_immediate_and_scale_down_waits():
+    policy = autoscaler.PoolScalingPolicy('gpu-pool', max_nodes=4, scale_up_cooldown=60, scale_down_cooldown=300,
+                                          scale_down_delay=600)
+    history = autoscaler.PoolScalingHistory()
+    t = _at(10)
+
+    decision, history = _step(policy, history, current=0, pending=6, running=0, now=t)
+    assert (decision.action, decision.target_nodes) == (autoscaler.ScalingDecision.SCALE_UP, 4)
+
+    # more work shows up but we're already at max_nodes
+    decision, history = _step(policy, history, current=4, pending=3, running=4, now=t + 30)
+    assert not decision.is_resize()
+
+    # work drops off.  hold through the delay, then shrink to what's still running.
+    for dt in (60, 300, 599):
+        decision, history = _step(policy, history, current=4, pending=0, running=1, now=t + dt)
+        assert not decision.is_resize()
+    decision, history = _step(policy, history, current=4, pending=0, running=1, now=t + 700)
+    assert (decision.action, decision.target_nodes) == (autoscaler.ScalingDecision.SCALE_DOWN, 1)
+
+    # a blip of demand resets the scale down delay
+    decision, history = _step(policy, history, current=1, pending=0, running=0, now=t + 1300)
+    decision, history = _step(policy, history, current=1, pending=0, running=1, now=t + 1500)
+    decision, history = _step(policy, history, current=1, pending=0, running=0, now=t + 1600)
+    assert history.below_size_since == t + 1600
+    decision, history = _step(policy, history, current=1, pending=0, running=0, now=t + 2200)
+    assert (decision.action, decision.target_nodes) == (autoscaler.ScalingDecision.SCALE_DOWN, 0)
+
+
+def test_scale_to_zero_and_prewarm():
+    window = autoscaler.PrewarmWindow(start_hour=9, duration_minutes=60, min_nodes=3, lead_minutes=10)
+    policy = autoscaler.PoolScalingPolicy('gpu-pool', prewarm_windows=[window], scale_down_delay=0,
+                                          scale_down_cooldown=0)
+    assert policy.get_floor(_at(8, 45)) == 0
+    assert policy.get_floor(_at(8, 50)) == 3
+    assert policy.get_floor(_at(9, 59)) == 3
+    assert policy.get_floor(_at(10, 0)) == 0
+    # saturday
+    assert policy.get_floor(_at(8, 55, day=9)) == 0
+
+    decision, _ = _step(policy, autoscaler.PoolScalingHistory(), current=0, pending=0, running=0, now=_at(8, 55))
+    assert (decision.action, decision.target_nodes) == (autoscaler.ScalingDecision.SCALE_UP, 3)
+    decision, _ = _step(policy, autoscaler.PoolScalingHistory(), current=3, pending=0, running=0, now=_at(11))
+    assert decision.target_nodes == 0
+
+    policy.scale_to_zero = False
+    decision, _ = _step(policy, autoscaler.PoolScalingHistory(), current=3, pending=0, running=0, now=_at(11))
+    assert decision.target_nodes == 1
+
+    assert autoscaler.PoolScalingPolicy.from_dict(policy.to_dict()) == policy
+
+
+def test_hysteresis_on_simulated_backlog():
+    # demand flaps between 0 and 2 every other minute for an hour
+    demand = [2 if i % 2 else 0 for i in range(60)]
+    flappy = autoscaler.PoolScalingPolicy('gpu-pool', scale_up_cooldown=0, scale_down_cooldown=0, scale_down_delay=0)
+    steady = autoscaler.PoolScalingPolicy('gpu-pool')
+    flappy_result = bench_autoscaler.simulate(flappy, demand)
+    steady_result = bench_autoscaler.simulate(steady, demand)
+    assert steady_result['resizes'] == 1
+    assert flappy_result['resizes'] > 50
+    assert steady_result['pending_hours'] < flappy_result['pending_hours']
+
+    # idle pools end at zero
+    result = bench_autoscaler.simulate(steady, [3] * 10 + [0] * 60)
+    assert result['final_nodes'] == 0
+
+
+def test_step_batches_observations_and_resizes(fake_cloud):
+    state = get_empty_state('my-project')
+    state['clusters']['c'] = make_cluster(
+        'c', 'us-central1-a', [make_node_pool(f'pool-{i}', num_nodes=0) for i in range(3)],
+    )
+    state['kube']['pod'] = {
+        f'task-{i}': {
+            'metadata': {'name': f'task-{i}'},
+            'spec': {'nodeSelector': {autoscaler.NODE_POOL_LABEL: 'pool-0' if i < 3 else 'pool-1'}},
+            'status': {'phase': 'Pending'},
+        }
+        for i in range(4)
+    }
+    cloud = fake_cloud(state)
+
+    tracker = operations.OperationTracker('us-central1-a', poll_interval=3600, verbose=False)
+    gke_cluster = cluster.GkeCluster(
+        project='my-project',
+        name='c',
+        members=[cluster.NodePool(f'pool-{i}', verbose=False) for i in range(3)],
+        operation_tracker=tracker,
+        verbose=False,
+    )
+    scaler = autoscaler.Autoscaler(
+        gke_cluster,
+        [autoscaler.PoolScalingPolicy(f'pool-{i}') for i in range(3)],
+        clock=lambda: _at(10),
+        verbose=False,
+    )
+    decisions = {d.pool_name: d for d in scaler.step()}
+    assert decisions['pool-0'].target_nodes == 3
+    assert decisions['pool-1'].target_nodes == 1
+    assert not decisions['pool-2'].is_resize()
+
+    tracker.poll()
+    tracker.wait(timeout=10)
+    pools = cloud.read()['clusters']['c']['nodePools']
+    assert [p['currentNodeCount'] for p in pools] == [3, 1, 0]
+
+    names = cloud.get_call_names()
+    assert names.count('gcloud container clusters describe') == 1
+    assert names.count('kubectl get pod') == 1
+    assert names.count('gcloud container clusters resize') == 2
+
+
+if __name__ == '__main__':
+    test_scale_up_is_immediate_and_scale_down_waits()
+    test_scale_to_zero_and_prewarm()
+    test_hysteresis_on_simulated_backlog()
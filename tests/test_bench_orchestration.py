@@ -0,0 +1,82 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+
+from benchmarks import bench_orchestration
+from benchmarks import fake_cloud as fake_cloud_module
+from spin import kubes
+
+
+def _run_fake(bin_dir, env, *args, stdin=''):
+    proc = subprocess.run(
+        [str(Path(bin_dir) / args[0])] + list(args[1:]),
+        input=stdin.encode('utf-8'),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+    )
+    return proc.returncode, proc.stdout.decode('utf-8'), proc.stderr.decode('utf-8')
+
+
+def test_fake_cloud_state_and_failure_injection(fake_cloud):
+    cloud = fake_cloud()
+    bin_dir, state = cloud.bin_dir, cloud.state
+    env = dict(os.environ)
+    env.update({
+        fake_cloud_module.FAIL_PATTERN_ENV: 'get svc',
+        fake_cloud_module.FAIL_TIMES_ENV: '1',
+    })
+
+    manifest = 'apiVersion: v1\nkind: Service\nmetadata:\n  name: wb\n  labels:\n    run: wb\n'
+    assert _run_fake(bin_dir, env, 'kubectl', 'apply', '-f', '-', stdin=manifest)[1] == 'service/wb created\n'
+
+    # the first matching call fails and the second succeeds
+    assert _run_fake(bin_dir, env, 'kubectl', 'get', 'svc', 'wb', '-o', 'json')[0] == 1
+    exitcode, out, _ = _run_fake(bin_dir, env, 'kubectl', 'get', 'svc', 'wb', '-o', 'json')
+    assert exitcode == 0
+    assert json.loads(out)['status']['loadBalancer']['ingress'][0]['ip']
+
+    assert _run_fake(bin_dir, env, 'kubectl', 'delete', 'secret', 'missing')[0] == 1
+    assert _run_fake(bin_dir, env, 'kubectl', 'delete', 'service', '-l', 'run=wb')[0] == 0
+    assert state.read()['kube']['service'] == {}
+
+    assert cloud.get_call_names() == [
+        'kubectl apply', 'kubectl get service', 'kubectl get service', 'kubectl delete secret',
+        'kubectl delete service',
+    ]
+
+
+# a few seconds each.  `python benchmarks/bench_orchestration.py --check` runs every scenario, including the fleet and
+#   garbage collection ones whose setup takes a while.
+QUICK_SCENARIOS = [
+    'cluster_status', 'pool_resize', 'workbench_create', 'workbench_claim', 'workbench_delete',
+    'workbench_claim_crowded',
+]
+
+
+def test_orchestration_counts_do_not_regress():
+    results = bench_orchestration.run(QUICK_SCENARIOS)
+    regressions = bench_orchestration.find_regressions(results, bench_orchestration.load_baseline())
+    assert not regressions, '\n'.join(regressions)
+    assert all(r['failed_api_calls'] == 0 for r in results.values())
+
+
+def test_workbench_create_leaves_expected_state():
+    result = bench_orchestration.run_scenario('workbench_create')
+    kube = result['final_state']['kube']
+    assert set(kube['service']) == {'bench-workbench'}
+    assert set(kube['deployment']) == {'bench-workbench'}
+    assert len(kube['secret']) == 3
+    assert set(kube['persistentvolumeclaim']) == {
+        'bench-workbench-home', 'bench-workbench-cache', 'bench-workbench-datasets',
+    }
+    # everything is labelled, so it can be found and deleted with one selector
+    for objects in kube.values():
+        for obj in objects.values():
+            assert obj['metadata']['labels'][kubes.WORKBENCH_LABEL] == 'bench-workbench'
+
+
+if __name__ == '__main__':
+    test_orchestration_counts_do_not_regress()
+    test_workbench_create_leaves_expected_state()
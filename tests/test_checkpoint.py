@@ -0,0 +1,115 @@
+import os
+import signal
+import tempfile
+
+import pytest
+
+from benchmarks import bench_checkpoint
+from spin import checkpoint
+
+
+def test_incremental_checkpoints():
+    with tempfile.TemporaryDirectory() as tdir:
+        store = checkpoint.LocalBlobStore(tdir)
+        checkpointer = checkpoint.Checkpointer(store, prefix='task', keep=2)
+        assert checkpointer.restore() is None
+
+        state = {'frozen': list(range(1000)), 'total': 0}
+        for step in range(1, 5):
+            state['total'] = step
+            checkpointer.save(step, state)
+        checkpointer.wait()
+        # the frozen part is only ever written once
+        assert (checkpointer.num_parts_written, checkpointer.num_parts_skipped) == (5, 3)
+
+        # old checkpoints and the parts only they used are gone
+        assert checkpointer.list_steps() == [3, 4]
+        assert len(store.list('task/blobs/')) == 3
+
+        # a replacement pod picks up the latest checkpoint and doesn't upload the frozen part again
+        resumed = checkpoint.Checkpointer(store, prefix='task', keep=2)
+        restored_checkpoint, restored_state = resumed.restore()
+        assert restored_checkpoint.step == 4
+        assert restored_state == state
+        resumed.save(5, dict(state, total=5))
+        resumed.close()
+        assert resumed.num_parts_written == 1
+
+
+class SumTask(checkpoint.ResumableTask):
+    def __init__(self, preempt_at=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preempt_at = preempt_at
+        self.steps_run = 0
+
+    def get_num_steps(self, n):
+        return n
+
+    def get_initial_state(self, n):
+        return {'total': 0}
+
+    def run_step(self, state, step, n):
+        if step == self.preempt_at:
+            self.watcher.trigger('test')
+        self.steps_run += 1
+        state['total'] += step
+        return state
+
+    def get_output(self, state):
+        return state['total']
+
+
+def test_resume_after_preemption():
+    with tempfile.TemporaryDirectory() as tdir:
+        store = checkpoint.LocalBlobStore(tdir)
+
+        watcher = checkpoint.PreemptionWatcher(handle_sigterm=False)
+        first = SumTask(preempt_at=37, checkpointer=checkpoint.Checkpointer(store), watcher=watcher,
+                        checkpoint_every_steps=10)
+        with pytest.raises(checkpoint.PreemptedError) as e:
+            first(100)
+        assert e.value.step == 38
+
+        second = SumTask(checkpointer=checkpoint.Checkpointer(store), watcher=checkpoint.PreemptionWatcher(),
+                         checkpoint_every_steps=10)
+        assert second(100) == sum(range(100))
+        assert second.resumed_from_step == 38
+        assert first.steps_run + second.steps_run == 100
+
+        # once it's done, a restart just returns the output
+        third = SumTask(checkpointer=checkpoint.Checkpointer(store))
+        assert third(100) == sum(range(100))
+        assert third.steps_run == 0
+
+
+def test_watcher_notices():
+    with tempfile.TemporaryDirectory() as tdir:
+        source = checkpoint.FileMetadataSource(os.path.join(tdir, 'preempted'))
+        assert not source.is_preempted()
+        with checkpoint.PreemptionWatcher(source, poll_interval=.01, handle_sigterm=False) as watcher:
+            source.set_preempted()
+            assert watcher.wait(timeout=5)
+            assert watcher.reason == 'metadata'
+
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    with checkpoint.PreemptionWatcher() as watcher:
+        os.kill(os.getpid(), signal.SIGTERM)
+        assert watcher.wait(timeout=5)
+        assert watcher.reason == 'SIGTERM'
+    assert signal.getsignal(signal.SIGTERM) == previous_handler
+
+
+def test_notice_saves_lost_work():
+    killed = bench_checkpoint.simulate(num_steps=300, preemption_steps=[55, 120], checkpoint_every_steps=50,
+                                       handle_notice=False, step_seconds=0, latency_seconds=0)
+    noticed = bench_checkpoint.simulate(num_steps=300, preemption_steps=[55, 120], checkpoint_every_steps=50,
+                                        handle_notice=True, step_seconds=0, latency_seconds=0)
+    assert killed['lost_steps_per_preemption'] == 12.5
+    assert noticed['lost_steps_per_preemption'] == 0
+
+
+if __name__ == '__main__':
+    test_incremental_checkpoints()
+    test_resume_after_preemption()
+    test_watcher_notices()
+    test_notice_saves_lost_work()
@@ -0,0 +1,68 @@
+import json
+
+from benchmarks import fake_cloud
+from spin import cluster
+
+
+def _get_describe_dict():
+    return fake_cloud.make_cluster('my-cluster', 'us-central1-a', [
+        fake_cloud.make_node_pool('default-pool'),
+        fake_cloud.make_node_pool('gpu-pool', num_nodes=2, max_nodes=4, preemptible=True,
+                                  accelerator=('nvidia-tesla-k80', 2)),
+    ])
+
+
+def test_cluster_state_from_describe():
+    state = cluster.ClusterState.from_gcloud_dict(_get_describe_dict())
+    assert state.is_running()
+    assert state.zone == 'us-central1-a'
+    assert set(state.node_pools) == {'default-pool', 'gpu-pool'}
+
+    gpu_pool = state.node_pools['gpu-pool']
+    assert gpu_pool.accelerator_type == 'nvidia-tesla-k80'
+    assert gpu_pool.accelerator_count == 2
+    assert gpu_pool.preemptible
+    assert (gpu_pool.min_nodes, gpu_pool.current_node_count, gpu_pool.max_nodes) == (0, 2, 4)
+
+    assert cluster.ClusterState.from_dict(state.to_dict()) == state
+
+
+def test_state_checks_share_one_describe(monkeypatch):
+    monkeypatch.setattr(cluster.GcloudHelper, 'get_project', lambda self: 'my-project')
+    commands = []
+
+    def fake_run(self, command, error_on_nonzero_exit=True, shell=False):
+        commands.append(command)
+        if 'clusters describe' in command:
+            return 0, json.dumps(_get_describe_dict()), ''
+        return 0, '', ''
+    monkeypatch.setattr(cluster.GkeCluster, '_run', fake_run)
+    monkeypatch.setattr(cluster.NodePool, '_run', fake_run)
+
+    gke_cluster = cluster.GkeCluster(
+        project='my-project',
+        name='my-cluster',
+        members=[cluster.NodePool(name=name, verbose=False) for name in ['default-pool', 'gpu-pool', 'new-pool']],
+    )
+    assert gke_cluster.exists()
+    assert gke_cluster.node_pools['gpu-pool'].get_state().is_running()
+    assert not gke_cluster.node_pools['new-pool'].exists()
+    gke_cluster.create()
+    assert gke_cluster.node_pools['new-pool'].exists()
+
+    assert len([c for c in commands if 'clusters describe' in c]) == 1
+    assert len([c for c in commands if 'node-pools create' in c]) == 1
+
+
+def test_missing_cluster(monkeypatch):
+    monkeypatch.setattr(cluster.GcloudHelper, 'get_project', lambda self: 'my-project')
+    monkeypatch.setattr(
+        cluster.GkeCluster,
+        '_run',
+        lambda self, command, error_on_nonzero_exit=True, shell=False: (1, '', 'ResponseError: code=404, Not found'),
+    )
+    assert not cluster.GkeCluster(project='my-project').exists()
+
+
+if __name__ == '__main__':
+    test_cluster_state_from_describe()
@@ -0,0 +1,83 @@
+import importlib.util
+import os
+from pathlib import Path
+import tempfile
+
+from spin import settings
+
+_spec = importlib.util.spec_from_file_location(
+    'copy_ssh_keys', str(settings.WORKBENCH_CONTAINER_PATH / 'copy_ssh_keys.py'))
+copy_ssh_keys = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(copy_ssh_keys)
+
+
+def _get_file_permission(filename):
+    return oct(os.stat(filename).st_mode & 0o777)
+
+
+def test_copy_ssh_keys_is_idempotent():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        server_keys = tdir / 'ssh-server-keys'
+        user_keys = tdir / 'user-keys'
+        login_keys = tdir / 'user-login-public-keys'
+        etc_ssh = tdir / 'etc-ssh'
+        for d in (server_keys, user_keys, login_keys, etc_ssh):
+            d.mkdir()
+
+        (server_keys / 'ssh_host_rsa_key').write_text('private')
+        (server_keys / 'ssh_host_rsa_key.pub').write_text('ssh-rsa AAAA')
+        (login_keys / 'id_rsa.pub').write_text('ssh-rsa BBBB me@here\n')
+        (login_keys / 'id_rsa2.pub').write_text('ssh-rsa CCCC me@there')
+
+        authorized_keys = tdir / 'home' / '.ssh' / 'authorized_keys'
+        kwargs = dict(
+            ssh_server_keys_mountpoint=str(server_keys),
+            user_keys_mountpoint=str(user_keys),
+            user_login_public_keys_mountpoint=str(login_keys),
+            authorized_keys_file=str(authorized_keys),
+            ssh_dir=str(tdir / 'home' / '.ssh'),
+            ssh_server_keys_dir=str(etc_ssh),
+            boot_start_file=str(tdir / 'boot_start'),
+        )
+
+        for _ in range(3):
+            copy_ssh_keys.copy_ssh_keys(**kwargs)
+
+        assert _get_file_permission(str(etc_ssh / 'ssh_host_rsa_key')) == oct(0o600)
+        assert _get_file_permission(str(etc_ssh / 'ssh_host_rsa_key.pub')) == oct(0o644)
+        assert (etc_ssh / 'ssh_host_rsa_key').read_text() == 'private'
+
+        lines = authorized_keys.read_text().splitlines()
+        assert sorted(lines) == ['ssh-rsa BBBB me@here', 'ssh-rsa CCCC me@there']
+
+
+def test_find_key_pairs_requires_private_key():
+    with tempfile.TemporaryDirectory() as tdir:
+        Path(tdir, 'id_rsa.pub').write_text('ssh-rsa AAAA')
+        try:
+            copy_ssh_keys.find_key_pairs(tdir)
+            assert False, "expected a ValueError"
+        except ValueError:
+            pass
+
+
+def test_seed_home_dir_keeps_existing_files():
+    with tempfile.TemporaryDirectory() as tdir:
+        skel, home = Path(tdir, 'skel'), Path(tdir, 'home')
+        (skel / '.config').mkdir(parents=True)
+        (skel / '.bashrc').write_text('image bashrc')
+        (skel / '.config' / 'settings').write_text('image settings')
+        home.mkdir()
+        (home / '.bashrc').write_text('my bashrc')
+
+        assert copy_ssh_keys.seed_home_dir(str(skel), str(home)) == 1
+        assert (home / '.bashrc').read_text() == 'my bashrc'
+        assert (home / '.config' / 'settings').read_text() == 'image settings'
+        assert copy_ssh_keys.seed_home_dir(str(skel), str(home)) == 0
+
+
+if __name__ == '__main__':
+    test_copy_ssh_keys_is_idempotent()
+    test_find_key_pairs_requires_private_key()
+    test_seed_home_dir_keeps_existing_files()
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+
+import pytest
+
+from spin import distributed
+
+# every rank sends its rank to rank 0 at MASTER_ADDR:MASTER_PORT, which checks it heard from the whole group
+RENDEZVOUS_SCRIPT = '''
+import socket, time
+from spin.distributed import DistributedEnv
+env = DistributedEnv.from_environ()
+if env.is_master():
+    server = socket.create_server((env.master_addr, env.master_port))
+    ranks = [0]
+    for _ in range(env.world_size - 1):
+        conn, _ = server.accept()
+        ranks.append(int(conn.recv(16)))
+        conn.close()
+    assert sorted(ranks) == list(range(env.world_size)), ranks
+else:
+    for _ in range(200):
+        try:
+            conn = socket.create_connection((env.master_addr, env.master_port))
+            break
+        except ConnectionRefusedError:
+            time.sleep(.05)
+    conn.sendall(str(env.rank).encode())
+    conn.close()
+'''
+
+
+def test_distributed_env():
+    env = distributed.DistributedEnv(rank=2, world_size=4, master_addr='train-0.train', master_port=1234)
+    assert distributed.DistributedEnv.from_environ(env.to_environ()) == env
+    from_index = distributed.DistributedEnv.from_environ({'JOB_COMPLETION_INDEX': '3', 'WORLD_SIZE': '4'})
+    assert (from_index.rank, from_index.world_size, from_index.is_master()) == (3, 4, False)
+    assert distributed.DistributedEnv.from_environ({}) == distributed.DistributedEnv()
+    with pytest.raises(ValueError):
+        distributed.DistributedEnv(rank=4, world_size=4)
+
+
+def test_local_group_rendezvous():
+    group = distributed.LocalDistributedGroup([sys.executable, '-c', RENDEZVOUS_SCRIPT], world_size=4)
+    assert group.run(timeout=60) == [0, 0, 0, 0]
+
+
+def test_local_group_fails_fast():
+    script = 'import os, sys, time\nif os.environ["RANK"] == "1": sys.exit(3)\ntime.sleep(60)'
+    group = distributed.LocalDistributedGroup([sys.executable, '-c', script], world_size=3)
+    start = time.monotonic()
+    with pytest.raises(ValueError, match=r'Ranks \[0, 1, 2\]'):
+        group.run(timeout=30)
+    assert time.monotonic() - start < 30
+    assert group.processes[1].returncode == 3
+
+
+def test_kubernetes_group(fake_cloud):
+    cloud = fake_cloud()
+    group = distributed.KubernetesDistributedGroup('train', 'gcr.io/my-project/trainer@sha256:abc', world_size=4,
+                                                   verbose=False)
+    group.create()
+    group.wait_until_ready(timeout_seconds=60)
+
+    kube = cloud.read()['kube']
+    service_spec = kube['service']['train']['spec']
+    assert (service_spec['clusterIP'], service_spec['selector']) == ('None', {'spin-distributed': 'train'})
+    job_spec = kube['job']['train']['spec']
+    assert (job_spec['completions'], job_spec['parallelism'], job_spec['backoffLimit']) == (4, 4, 0)
+    pod_spec = job_spec['template']['spec']
+    assert pod_spec['subdomain'] == 'train'
+    assert job_spec['template']['metadata']['labels']['spin-distributed'] == 'train'
+    env = {e['name']: e.get('value', e.get('valueFrom')) for e in pod_spec['containers'][0]['env']}
+    assert (env['WORLD_SIZE'], env['MASTER_ADDR'], env['MASTER_PORT']) == ('4', 'train-0.train', '29500')
+    assert env['RANK'] == {'fieldRef': {'fieldPath': distributed.JOB_COMPLETION_INDEX_FIELD}}
+
+    group.delete()
+    kube = cloud.read()['kube']
+    assert kube['job'] == {} and kube['service'] == {}
+    names = cloud.get_call_names()
+    assert (names.count('kubectl wait job/train'), names.count('kubectl delete job,service')) == (1, 1)
+
+
+if __name__ == '__main__':
+    test_distributed_env()
+    test_local_group_rendezvous()
+    test_local_group_fails_fast()
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import time
+
+import pytest
+import yaml
+
+from spin import fanout, kubes
+from spin.checkpoint import LocalBlobStore
+
+
+def square(x):
+    return x * x
+
+
+def fail_first_attempt_of_three(x):
+    if x == 3 and os.environ[fanout.ATTEMPT_ENV] == '0':
+        raise ValueError("flaky")
+    return x * x
+
+
+def always_fail(x):
+    raise ValueError(f"bad item {x}")
+
+
+def straggle_on_zero(x):
+    if x == 0 and os.environ[fanout.ATTEMPT_ENV] == '0':
+        time.sleep(60)
+    return x * x
+
+
+def test_split_into_shards():
+    assert fanout.split_into_shards(range(7), num_shards=3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert fanout.split_into_shards(range(7), shard_size=3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert fanout.split_into_shards(range(2), num_shards=5) == [[0], [1]]
+    with pytest.raises(ValueError):
+        fanout.split_into_shards(range(7), num_shards=3, shard_size=3)
+
+
+def test_local_map_with_retries():
+    with tempfile.TemporaryDirectory() as tdir:
+        store = LocalBlobStore(tdir)
+        backend = fanout.LocalProcessBackend(store, parallelism=4)
+        sharded_map = fanout.ShardedMap(fail_first_attempt_of_three, list(range(10)), backend, num_shards=5,
+                                        poll_interval=.05, timeout=60)
+        assert sharded_map.gather() == [x * x for x in range(10)]
+        assert sharded_map.num_retries == 1
+        assert sharded_map.results[1].attempt == '1'
+        # cleaned up after itself
+        assert store.list() == []
+
+        failing_map = fanout.ShardedMap(always_fail, [1, 2], backend, num_shards=1,
+                                        max_attempts=2, poll_interval=.05, timeout=60)
+        with pytest.raises(ValueError, match='bad item 1'):
+            failing_map.gather()
+        assert failing_map.num_launched == [2]
+
+
+def test_speculative_duplicates():
+    with tempfile.TemporaryDirectory() as tdir:
+        backend = fanout.LocalProcessBackend(LocalBlobStore(tdir), parallelism=8)
+        sharded_map = fanout.ShardedMap(straggle_on_zero, list(range(6)), backend, num_shards=6,
+                                        speculative_factor=2, poll_interval=.1, timeout=30)
+        start = time.monotonic()
+        results = list(sharded_map)
+        assert time.monotonic() - start < 30
+        assert [r.index for r in results][-1] == 0
+        assert sharded_map.results[0].is_speculative
+        assert sharded_map.gather() == [x * x for x in range(6)]
+
+
+def test_kubernetes_backend(fake_cloud, tmp_path):
+    cloud = fake_cloud()
+    backend = fanout.KubernetesJobBackend(
+        LocalBlobStore(tmp_path / 'store'),
+        name='featurize',
+        container_image_uri='gcr.io/my-project/worker@sha256:abc',
+        pod_store_dir='/mnt/store',
+        store_volume={'persistentVolumeClaim': {'claimName': 'fanout-store'}},
+        parallelism=4,
+        verbose=False,
+    )
+    backend.launch_all('fanout/abc', num_shards=10)
+    backend.launch('fanout/abc', index=3, attempt='1')
+
+    jobs = cloud.read()['kube']['job']
+    spec = jobs['featurize']['spec']
+    assert (spec['completions'], spec['parallelism'], spec['completionMode']) == (10, 4, 'Indexed')
+    container = spec['template']['spec']['containers'][0]
+    assert container['command'][:3] == ['python', '-m', 'spin.fanout']
+    assert container['volumeMounts'] == [{'name': 'spin-fanout-store', 'mountPath': '/mnt/store'}]
+    retry_container = jobs['featurize-3-1']['spec']['template']['spec']['containers'][0]
+    assert {'name': fanout.INDEX_ENV, 'value': '3'} in retry_container['env']
+
+    backend.stop()
+    assert cloud.read()['kube']['job'] == {}
+    assert cloud.get_call_names().count('kubectl delete job') == 1
+
+
+def test_job_manifest():
+    job = kubes.KubernetesJob(name='j', container_image_uri='image', completions=3, parallelism=2,
+                              env={'A': 1}, ttl_seconds_after_finished=None)
+    d = yaml.safe_load(job._get_yaml())
+    assert d['spec']['template']['spec']['restartPolicy'] == 'Never'
+    assert d['spec']['template']['spec']['containers'][0]['env'] == [{'name': 'A', 'value': '1'}]
+    assert 'ttlSecondsAfterFinished' not in d['spec']
+    assert kubes.KubernetesJob.parse_indexes('0-2,5, 7-8') == [0, 1, 2, 5, 7, 8]
+
+
+if __name__ == '__main__':
+    test_split_into_shards()
+    test_local_map_with_retries()
+    test_speculative_duplicates()
+    test_job_manifest()
@@ -0,0 +1,123 @@
+import io
+
+import pytest
+
+from spin import fleet, ssh
+from spin.workbench import workbench
+
+
+def test_expand_names():
+    assert fleet.expand_names(['student-{08..10}', 'ta', 'student-09']) == [
+        'student-08', 'student-09', 'student-10', 'ta',
+    ]
+    assert fleet.expand_names(['g{1..2}-s{1..2}']) == ['g1-s1', 'g1-s2', 'g2-s1', 'g2-s2']
+    assert fleet.expand_names(['student-*'], existing_names=['student-2', 'ta', 'student-1']) == [
+        'student-1', 'student-2',
+    ]
+    with pytest.raises(ValueError):
+        fleet.expand_names(['student-*'])
+
+
+def test_progress_table():
+    stream = io.StringIO()
+    progress = fleet.FleetProgress(['wb-0', 'wb-1'], stream=stream, live=True)
+    progress.update(fleet.FleetResult('wb-0', 'creating'))
+    progress.update(fleet.FleetResult('wb-0', 'created', 12.34, '10.0.0.1'))
+    progress.update(fleet.FleetResult('wb-1', fleet.FAILED, 1.0, 'quota exceeded'))
+    assert progress.format_table().splitlines() == [
+        'NAME                     STATUS      SECONDS  DETAIL',
+        'wb-0                     created        12.3  10.0.0.1',
+        'wb-1                     failed          1.0  quota exceeded',
+        '2/2 done, 1 failed',
+    ]
+    # each redraw moves back over the four lines of the last one
+    assert stream.getvalue().count('\x1b[4F\x1b[J') == 2
+
+
+def test_fleet_create_claim_and_delete(fake_cloud, make_workbench, tmp_path):
+    cloud = fake_cloud()
+    ssh_files = dict(known_hosts_file=str(tmp_path / 'known_hosts'), ssh_config_file=str(tmp_path / 'config'))
+
+    fleet.Fleet([make_workbench('wb-0')], verbose=False, **ssh_files).create()
+    num_calls = len(cloud.read_calls())
+
+    # wb-0 is claimed and the rest are created, 2 at a time, against one listing
+    f = fleet.Fleet.from_patterns(['wb-{0..3}'], make_workbench, max_concurrency=2, verbose=False, **ssh_files)
+    results = f.create()
+    assert [(r.name, r.status) for r in results] == [
+        ('wb-0', 'claimed'), ('wb-1', 'created'), ('wb-2', 'created'), ('wb-3', 'created'),
+    ]
+    names = cloud.get_call_names()[num_calls:]
+    assert [n for n in names if n.startswith('kubectl get')] == [
+        'kubectl get deployment,service,secret,persistentvolumeclaim'] + ['kubectl get service'] * 3
+
+    config = ssh.SshConfigModifier(tmp_path / 'config')
+    assert [e.host_tag for e in config.get_host_entries()] == ['wb-0', 'wb-1', 'wb-2', 'wb-3']
+    known_hosts = ssh.KnownHostsModifier(tmp_path / 'known_hosts')
+    ips = [r.detail for r in results]
+    # the claimed workbench's keys are read back out of its secret
+    assert all(known_hosts.get_lines_for_hostname(ip) for ip in ips)
+
+    results = fleet.Fleet.from_patterns(['wb-*', 'missing'], make_workbench, verbose=False, **ssh_files).delete()
+    assert [r.status for r in results] == ['deleted'] * 4 + [fleet.NOT_FOUND]
+    kube = cloud.read()['kube']
+    assert kube['deployment'] == {} and kube['service'] == {} and kube['secret'] == {}
+    assert ssh.SshConfigModifier(tmp_path / 'config').get_host_entries() == []
+    known_hosts = ssh.KnownHostsModifier(tmp_path / 'known_hosts')
+    assert all(known_hosts.get_lines_for_hostname(ip) == [] for ip in ips)
+
+
+def test_collect_garbage(fake_cloud, make_workbench, tmp_path):
+    cloud = fake_cloud()
+    ssh_files = dict(known_hosts_file=str(tmp_path / 'known_hosts'), ssh_config_file=str(tmp_path / 'config'))
+    fleet.Fleet([make_workbench('live'), make_workbench('dead')], verbose=False, **ssh_files).create()
+
+    # an interrupted deletion of dead got its deployment but left the rest, next to objects spin doesn't own
+    with cloud.state.transaction() as s:
+        del s['kube']['deployment']['dead']
+        s['kube']['secret']['unrelated'] = {'kind': 'Secret', 'metadata': {'name': 'unrelated'}}
+    objects = workbench.find_orphans(include_volumes=True, verbose=False)
+    assert sorted((o._object_type, o.name) for o in objects) == [
+        ('persistentvolumeclaim', 'dead-cache'), ('persistentvolumeclaim', 'dead-datasets'),
+        ('persistentvolumeclaim', 'dead-home'),
+        ('secret', 'dead-ssh-server-keys'), ('secret', 'dead-user-keys'),
+        ('secret', 'dead-user-login-public-keys'), ('service', 'dead'),
+    ]
+
+    num_calls = len(cloud.read_calls())
+    workbench.collect_garbage(verbose=False)
+    names = cloud.get_call_names()[num_calls:]
+    # one selector query, then one delete per type
+    assert names == ['kubectl get deployment,service,secret', 'kubectl delete service', 'kubectl delete secret']
+    kube = cloud.read()['kube']
+    assert set(kube['service']) == {'live'} and set(kube['secret']) == {
+        'live-ssh-server-keys', 'live-user-keys', 'live-user-login-public-keys', 'unrelated',
+    }
+    # volumes are kept unless asked for
+    assert len(kube['persistentvolumeclaim']) == 6
+    assert make_workbench('live').exists()
+
+
+def test_fleet_deletes_workbenches_from_before_labels(fake_cloud, make_workbench, tmp_path):
+    cloud = fake_cloud()
+    ssh_files = dict(known_hosts_file=str(tmp_path / 'known_hosts'), ssh_config_file=str(tmp_path / 'config'))
+    [old] = fleet.Fleet([make_workbench('old')], verbose=False, **ssh_files).create()
+    fleet.Fleet([make_workbench('new')], verbose=False, **ssh_files).create()
+    with cloud.state.transaction() as s:
+        for objects in s['kube'].values():
+            for name, obj in objects.items():
+                if name.startswith('old'):
+                    obj['metadata'].pop('labels', None)
+
+    # the labelled listing doesn't see old, so it's deleted by name
+    results = fleet.Fleet.from_patterns(['old', 'missing'], make_workbench, verbose=False, **ssh_files).delete()
+    assert [r.status for r in results] == ['deleted', fleet.NOT_FOUND]
+    kube = cloud.read()['kube']
+    assert set(kube['deployment']) == {'new'} and set(kube['service']) == {'new'}
+    assert set(kube['secret']) == {'new-ssh-server-keys', 'new-user-keys', 'new-user-login-public-keys'}
+    assert [e.host_tag for e in ssh.SshConfigModifier(tmp_path / 'config').get_host_entries()] == ['new']
+    assert ssh.KnownHostsModifier(tmp_path / 'known_hosts').get_lines_for_hostname(old.detail) == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
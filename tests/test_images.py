@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+import tempfile
+
+from spin import images
+
+
+def test_dependency_hash_only_depends_on_manifests():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        (tdir / 'Dockerfile').write_text('FROM scratch\n')
+        (tdir / 'requirements.txt').write_text('numpy==1.17.0\n')
+        (tdir / 'app.py').write_text('print("hi")\n')
+
+        spec = images.ImageBuildSpec(repository_uri='gcr.io/my-project/workbench', context_dir=tdir, deps_target='deps')
+        h = spec.get_dependency_hash()
+
+        # code-only change
+        (tdir / 'app.py').write_text('print("hello")\n')
+        assert spec.get_dependency_hash() == h
+
+        # dependency change
+        (tdir / 'requirements.txt').write_text('numpy==1.17.1\n')
+        h2 = spec.get_dependency_hash()
+        assert h2 != h
+        assert spec.get_deps_image_uri() == f'gcr.io/my-project/workbench:deps-{h2[:12]}'
+
+        # build arg change
+        spec.build_args = {'BASE_IMAGE': 'tensorflow/tensorflow:2.0.0-py3'}
+        assert spec.get_dependency_hash() != h2
+
+
+def test_input_digest_respects_dockerignore():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        (tdir / 'Dockerfile').write_text('FROM scratch\n')
+        (tdir / '.dockerignore').write_text('ignored_dir\n**/*.pyc\n')
+        (tdir / 'app.py').write_text('print("hi")\n')
+        (tdir / 'ignored_dir').mkdir()
+        (tdir / 'ignored_dir' / 'key').write_text('secret')
+
+        spec = images.ImageBuildSpec(repository_uri='gcr.io/my-project/workbench', context_dir=tdir)
+        assert spec.get_input_files() == ['.dockerignore', 'Dockerfile', 'app.py']
+
+        digest = spec.get_input_digest()
+        (tdir / 'ignored_dir' / 'key').write_text('other secret')
+        (tdir / 'app.cpython-37.pyc').write_bytes(b'\0')
+        assert spec.get_input_digest() == digest
+
+        (tdir / 'app.py').write_text('print("hello")\n')
+        assert spec.get_input_digest() != digest
+
+
+def test_publish_skips_when_registry_has_inputs():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        context = tdir / 'context'
+        context.mkdir()
+        (context / 'Dockerfile').write_text('FROM scratch\n')
+        spec = images.ImageBuildSpec(repository_uri='gcr.io/my-project/workbench', context_dir=context)
+
+        registry = images.LocalImageRegistry(tdir / 'registry.json')
+        digest_uri = 'gcr.io/my-project/workbench@sha256:abc'
+        (tdir / 'registry.json').write_text(json.dumps({spec.get_input_image_uri(): digest_uri}))
+
+        published = images.PublishedImages(tdir / 'published.json')
+        # no builder and no docker needed when nothing has changed
+        publisher = images.ImagePublisher(registry=registry, published_images=published, verbose=False)
+        assert publisher.publish(spec) == digest_uri
+        assert publisher._builder is None
+
+        assert published.resolve(spec.get_input_image_uri()) == digest_uri
+        # other tags are left alone unless they ask for the latest
+        assert published.resolve('gcr.io/my-project/workbench:v1') == 'gcr.io/my-project/workbench:v1'
+        assert published.resolve('gcr.io/my-project/workbench:latest', use_latest=True) == digest_uri
+        assert published.resolve('gcr.io/other/image:latest', use_latest=True) == 'gcr.io/other/image:latest'
+
+
+def test_get_repository_from_image_uri():
+    assert images.get_repository_from_image_uri('gcr.io/p/workbench:latest') == 'gcr.io/p/workbench'
+    assert images.get_repository_from_image_uri('gcr.io/p/workbench@sha256:abc') == 'gcr.io/p/workbench'
+    assert images.get_repository_from_image_uri('localhost:5000/workbench') == 'localhost:5000/workbench'
+
+
+if __name__ == '__main__':
+    test_dependency_hash_only_depends_on_manifests()
+    test_input_digest_respects_dockerignore()
+    test_publish_skips_when_registry_has_inputs()
+    test_get_repository_from_image_uri()
@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+import tempfile
+
+from spin import installer
+
+FAKE_PYTHON = """#!/bin/sh
+echo "$@" >> {log_file}
+if [ "$1" = "-c" ]; then echo {version}; fi
+"""
+
+
+def _make_fake_python(parent: Path, name: str, version: str = '3.11') -> Path:
+    fake_python = parent / name
+    fake_python.write_text(FAKE_PYTHON.format(log_file=parent / 'calls.log', version=version))
+    os.chmod(str(fake_python), 0o755)
+    return fake_python
+
+
+def _make_project(parent: Path, name: str, requirements: str) -> Path:
+    project_dir = parent / name
+    project_dir.mkdir()
+    (project_dir / 'requirements.txt').write_text(requirements)
+    return project_dir
+
+
+def test_requirements_key_ignores_order_and_comments():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        a = installer.ProjectInstaller(_make_project(tdir, 'a', 'numpy\nscipy\n'))
+        b = installer.ProjectInstaller(_make_project(tdir, 'b', '# deps\nscipy\n\nnumpy\n'))
+        c = installer.ProjectInstaller(_make_project(tdir, 'c', 'numpy\n'))
+        assert a.get_requirements_key() == b.get_requirements_key()
+        assert a.get_requirements_key() != c.get_requirements_key()
+
+
+def test_requirements_key_depends_on_the_target_python():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        project_dir = _make_project(tdir, 'a', 'numpy\n')
+        keys = []
+        for name, version in [('python3.10', '3.10'), ('python3.11', '3.11'), ('python3', '3.11')]:
+            python = str(_make_fake_python(tdir, name, version))
+            keys.append(installer.ProjectInstaller(project_dir, python=python).get_requirements_key())
+        assert keys[0] != keys[1] and keys[1] == keys[2]
+
+
+def test_wheels_are_only_fetched_once():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        log_file = tdir / 'calls.log'
+        fake_python = _make_fake_python(tdir, 'python')
+
+        for i in range(3):
+            project_dir = _make_project(tdir, f'project{i}', 'numpy\n')
+            installer.ProjectInstaller(
+                project_dir,
+                wheel_cache_dir=tdir / 'wheels',
+                python=str(fake_python),
+                verbose=False,
+            ).install()
+
+        calls = log_file.read_text().splitlines()
+        assert len([c for c in calls if c.startswith('-m pip wheel')]) == 1
+        assert len([c for c in calls if '--no-index' in c]) == 3
+        assert len([c for c in calls if '--editable' in c]) == 3
+
+
+def test_finished_installs_are_reported_once():
+    with tempfile.TemporaryDirectory() as tdir:
+        installs_dir = Path(tdir) / 'installs'
+        installer.InstallRecord('/tmp/running', log_file='running.log').save(installs_dir)
+        installer.InstallRecord('/tmp/done', status=installer.InstallRecord.SUCCEEDED).save(installs_dir)
+
+        reported = installer.report_finished_installs(installs_dir)
+        assert [r.project_dir for r in reported] == ['/tmp/done']
+        assert installer.report_finished_installs(installs_dir) == []
+        assert len(installer.InstallRecord.load_all(installs_dir)) == 2
+
+
+if __name__ == '__main__':
+    test_requirements_key_ignores_order_and_comments()
+    test_requirements_key_depends_on_the_target_python()
+    test_wheels_are_only_fetched_once()
+    test_finished_installs_are_reported_once()
@@ -0,0 +1,178 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+import yaml
+
+from spin import kubes
+from spin.workbench.workbench import GCloudNodeConfig, VolumeConfig
+
+
+def _get_pod_spec(node_config: GCloudNodeConfig):
+    deployment = kubes.KubernetesDeployment(
+        name='wb',
+        container_image_uri='gcr.io/my-project/workbench@sha256:abc',
+        secrets=[kubes.EmptyKubernetesSecret('wb-keys')],
+        ports=[kubes.KubernetesPort(name='ssh', external_port=22, pod_port=22)],
+        **node_config.get_deployment_kwargs(),
+    )
+    return yaml.safe_load(deployment._get_yaml())['spec']['template']['spec']
+
+
+def test_default_node_config_adds_nothing():
+    pod_spec = _get_pod_spec(GCloudNodeConfig())
+    assert pod_spec == {
+        'containers': [{
+            'name': 'wb',
+            'image': 'gcr.io/my-project/workbench@sha256:abc',
+            'imagePullPolicy': 'IfNotPresent',
+            'ports': [{'containerPort': 22}],
+            'volumeMounts': [{'name': 'wb-keys', 'mountPath': '', 'readOnly': True}],
+        }],
+        'volumes': [{'name': 'wb-keys', 'secret': {'secretName': 'wb-keys'}}],
+    }
+
+
+def test_guaranteed_resources():
+    container = _get_pod_spec(GCloudNodeConfig(cpu=3, memory_gb=10))['containers'][0]
+    assert container['resources'] == {
+        'requests': {'cpu': '3000m', 'memory': '10240Mi'},
+        'limits': {'cpu': '3000m', 'memory': '10240Mi'},
+    }
+
+
+def test_shm_and_local_ssd_scratch():
+    pod_spec = _get_pod_spec(GCloudNodeConfig(shm_size_gb=4, local_ssd_count=2))
+    assert pod_spec['volumes'][1:] == [
+        {'name': 'dshm', 'emptyDir': {'medium': 'Memory', 'sizeLimit': '4096Mi'}},
+        {'name': 'local-ssd-0', 'hostPath': {'path': '/mnt/disks/ssd0', 'type': 'Directory'}},
+        {'name': 'local-ssd-1', 'hostPath': {'path': '/mnt/disks/ssd1', 'type': 'Directory'}},
+    ]
+    assert pod_spec['containers'][0]['volumeMounts'][1:] == [
+        {'name': 'dshm', 'mountPath': '/dev/shm'},
+        {'name': 'local-ssd-0', 'mountPath': '/scratch/ssd0'},
+        {'name': 'local-ssd-1', 'mountPath': '/scratch/ssd1'},
+    ]
+    # only nodes with local SSDs have anything at the hostPaths
+    assert pod_spec['affinity'] == {'nodeAffinity': {'requiredDuringSchedulingIgnoredDuringExecution': {
+        'nodeSelectorTerms': [{'matchExpressions': [
+            {'key': 'cloud.google.com/gke-local-ssd', 'operator': 'In', 'values': ['true']},
+        ]}],
+    }}}
+
+
+def test_pin_machine_type():
+    pod_spec = _get_pod_spec(GCloudNodeConfig(machine_type='n1-highmem-8', pin_machine_type=True))
+    assert pod_spec['affinity'] == {'nodeAffinity': {'requiredDuringSchedulingIgnoredDuringExecution': {
+        'nodeSelectorTerms': [{'matchExpressions': [
+            {'key': 'node.kubernetes.io/instance-type', 'operator': 'In', 'values': ['n1-highmem-8']},
+        ]}],
+    }}}
+
+
+def test_node_config_validation():
+    with pytest.raises(ValueError, match='both cpu and memory_gb'):
+        GCloudNodeConfig(cpu=2)
+    with pytest.raises(ValueError, match='shm_size_gb'):
+        GCloudNodeConfig(cpu=2, memory_gb=4, shm_size_gb=8)
+    with pytest.raises(ValueError, match='never fit'):
+        GCloudNodeConfig(machine_type='n1-standard-4', cpu=4, memory_gb=8).to_kubernetes_resources()
+    node_config = GCloudNodeConfig(cpu=3, memory_gb=10, shm_size_gb=4, local_ssd_count=1)
+    assert GCloudNodeConfig.from_dict(node_config.to_dict()) == node_config
+
+
+def test_persistent_volume_claim():
+    claim = kubes.KubernetesPersistentVolumeClaim('wb-home', size_gb=50, storage_class='premium-rwo',
+                                                  labels={kubes.WORKBENCH_LABEL: 'wb'})
+    assert yaml.safe_load(claim._get_yaml()) == {
+        'apiVersion': 'v1',
+        'kind': 'PersistentVolumeClaim',
+        'metadata': {
+            'name': 'wb-home',
+            'labels': {kubes.MANAGED_BY_LABEL: kubes.MANAGED_BY_VALUE, kubes.WORKBENCH_LABEL: 'wb'},
+        },
+        'spec': {
+            'accessModes': ['ReadWriteOnce'],
+            'resources': {'requests': {'storage': '50Gi'}},
+            'storageClassName': 'premium-rwo',
+        },
+    }
+
+
+def test_secret_manifest(tmp_path):
+    (tmp_path / 'id_rsa.pub').write_text('public\n')
+    secret = kubes.KubernetesSecret('wb-keys', files=[tmp_path / 'id_rsa.pub'], mount_point_on_pod='/secrets/keys',
+                                    contents={'id_rsa': 'private\n'}, labels={kubes.WORKBENCH_LABEL: 'wb'})
+    secret_dict = yaml.safe_load(secret._get_yaml())
+    assert secret_dict['metadata']['labels'] == {
+        kubes.MANAGED_BY_LABEL: kubes.MANAGED_BY_VALUE, kubes.WORKBENCH_LABEL: 'wb',
+    }
+    assert secret_dict['data'] == {'id_rsa.pub': 'cHVibGljCg==', 'id_rsa': 'cHJpdmF0ZQo='}
+    with pytest.raises(IOError):
+        kubes.KubernetesSecret('wb-keys', files=[tmp_path / 'missing'], mount_point_on_pod='')._get_yaml()
+
+    assert kubes.get_selector({kubes.WORKBENCH_LABEL: 'wb', 'a': 'b'}) == 'spin/workbench=wb,a=b'
+    assert kubes.get_in_selector(kubes.WORKBENCH_LABEL, ['wb-0', 'wb-1']) == 'spin/workbench in (wb-0,wb-1)'
+
+
+def test_volume_config():
+    volume_config = VolumeConfig(cache_size_gb=None, shared_datasets_claim='imagenet')
+    assert [c.name for c, _ in volume_config.get_claims_and_mount_paths('wb')] == ['wb-home', 'wb-datasets']
+    deployment = kubes.KubernetesDeployment('wb', 'image', **volume_config.get_deployment_kwargs('wb'))
+    deployment_dict = yaml.safe_load(deployment._get_yaml())
+    assert deployment_dict['spec']['strategy'] == {'type': 'Recreate'}
+    pod_spec = deployment_dict['spec']['template']['spec']
+    assert pod_spec['volumes'] == [
+        {'name': 'wb-home', 'persistentVolumeClaim': {'claimName': 'wb-home'}},
+        {'name': 'wb-datasets', 'persistentVolumeClaim': {'claimName': 'wb-datasets'}},
+        {'name': 'shared-datasets', 'persistentVolumeClaim': {'claimName': 'imagenet', 'readOnly': True}},
+    ]
+    assert pod_spec['containers'][0]['volumeMounts'] == [
+        {'name': 'wb-home', 'mountPath': '/root'},
+        {'name': 'wb-datasets', 'mountPath': '/datasets'},
+        {'name': 'shared-datasets', 'mountPath': '/datasets/shared', 'readOnly': True},
+    ]
+    # only a shared read-only claim, so there's nothing to hand over between pods
+    shared_only = VolumeConfig(home_size_gb=None, cache_size_gb=None, datasets_size_gb=None,
+                               shared_datasets_claim='imagenet')
+    assert shared_only.get_deployment_kwargs('wb')['strategy'] is None
+
+
+def test_apply_passes_the_manifest_verbatim():
+    env = {'PASSWORD': 'p$HOME`id`EOF\n$(whoami)'}
+    deployment = kubes.KubernetesDeployment('wb', container_image_uri='image@sha256:abc', env=env)
+    service = kubes.KubernetesService('wb', deployment_name='wb', ports=[])
+    with tempfile.TemporaryDirectory() as tdir:
+        # a kubectl which records its arguments and the manifests it reads
+        kubectl = Path(tdir) / 'kubectl'
+        kubectl.write_text('#!/bin/sh\necho "$@" >> "$(dirname "$0")/args"\ncat > "$(dirname "$0")/stdin-$$"\n')
+        kubectl.chmod(0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = f'{tdir}{os.pathsep}{path}'
+        try:
+            deployment.create()
+            kubes.apply_all([service, deployment])
+        finally:
+            os.environ['PATH'] = path
+        args = (Path(tdir) / 'args').read_text()
+        manifests = [m for f in Path(tdir).glob('stdin-*') for m in yaml.safe_load_all(f.read_text()) if m]
+
+    # nothing from the manifest goes on a command line
+    assert args == 'apply -f -\n' * 2
+    assert sorted(m['kind'] for m in manifests) == ['Deployment', 'Deployment', 'Service']
+    for m in manifests:
+        if m['kind'] == 'Deployment':
+            [container] = m['spec']['template']['spec']['containers']
+            assert container['env'] == [{'name': 'PASSWORD', 'value': env['PASSWORD']}]
+
+
+if __name__ == '__main__':
+    test_default_node_config_adds_nothing()
+    test_guaranteed_resources()
+    test_shm_and_local_ssd_scratch()
+    test_pin_machine_type()
+    test_node_config_validation()
+    test_persistent_volume_claim()
+    test_volume_config()
+    test_apply_passes_the_manifest_verbatim()
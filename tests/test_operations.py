@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from benchmarks.fake_cloud import OPERATION_SECONDS_ENV, get_empty_state, make_cluster, make_node_pool
+from spin import operations
+
+
+def test_async_resizes_are_watched_together(fake_cloud, monkeypatch):
+    state = get_empty_state()
+    state['clusters']['c'] = make_cluster('c', 'us-central1-a', [make_node_pool(f'pool-{i}') for i in range(3)])
+    cloud = fake_cloud(state)
+    monkeypatch.setenv(OPERATION_SECONDS_ENV, '0.5')
+
+    tracker = operations.OperationTracker(zone='us-central1-a', poll_interval=0.1, verbose=False)
+    futures = [
+        tracker.launch(f'gcloud container clusters resize c --node-pool=pool-{i} --num-nodes=0 '
+                       f'--zone=us-central1-a --quiet')
+        for i in range(3)
+    ]
+    assert len(set(f.result(timeout=30).name for f in futures)) == 3
+    assert all(f.result().is_done() for f in futures)
+    assert tracker.get_pending_names() == []
+
+    calls = cloud.read_calls()
+    num_polls = len([c for c in calls if c['name'] == 'gcloud container operations list'])
+    assert 1 <= num_polls < 30
+    pools = cloud.read()['clusters']['c']['nodePools']
+    assert all(p['currentNodeCount'] == 0 for p in pools)
+
+
+def test_failed_and_unfinished_operations(monkeypatch):
+    listed = [
+        {'name': 'op-ok', 'status': 'DONE', 'operationType': 'SET_NODE_POOL_SIZE'},
+        {'name': 'op-bad', 'status': 'DONE', 'operationType': 'DELETE_NODE_POOL', 'statusMessage': 'quota exceeded'},
+        {'name': 'op-running', 'status': 'RUNNING'},
+    ]
+    monkeypatch.setattr(
+        operations.OperationTracker,
+        '_run',
+        lambda self, command, error_on_nonzero_exit=True, shell=False: (0, json.dumps(listed), ''),
+    )
+    tracker = operations.OperationTracker(zone='us-central1-a', poll_interval=3600, verbose=False)
+    ok, bad, running = tracker.track('op-ok'), tracker.track('op-bad'), tracker.track('op-running')
+    assert tracker.track('op-ok') is ok
+
+    assert tracker.poll() == 1
+    assert ok.result().operation_type == 'SET_NODE_POOL_SIZE'
+    with pytest.raises(ValueError):
+        bad.result()
+    assert not running.done()
+    assert tracker.get_pending_names() == ['op-running']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
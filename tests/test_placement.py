@@ -0,0 +1,103 @@
+import pytest
+import yaml
+
+from benchmarks import bench_placement
+from spin import kubes, placement
+from spin.cluster import NodePool
+
+
+def _get_placer(max_nodes=5):
+    def _pool(name, machine_type, accelerator=None, accelerator_count=0):
+        return NodePool(name=name, machine_type=machine_type, accelerator=accelerator,
+                        accelerator_count_per_node=accelerator_count, max_nodes=max_nodes, verbose=False)
+
+    return placement.Placer.from_node_pools([
+        _pool('standard', 'n1-standard-4'),
+        _pool('highmem', 'n1-highmem-8'),
+        _pool('highcpu', 'n1-highcpu-16'),
+        _pool('k80', 'n1-standard-8', 'nvidia-tesla-k80', 2),
+    ])
+
+
+def test_machine_types():
+    machine_type = placement.get_machine_type('n1-standard-4')
+    assert machine_type.get_allocatable_cpus() == pytest.approx(3.92)
+    assert machine_type.get_allocatable_memory_gb() == pytest.approx(12.4)
+
+    custom = placement.get_machine_type('n2-custom-6-23040')
+    assert (custom.cpus, custom.memory_gb) == (6, 22.5)
+
+    with pytest.raises(ValueError):
+        placement.get_machine_type('n9-imaginary-4')
+
+
+def test_best_fit():
+    placer = _get_placer()
+    R = placement.ResourceRequest
+    assert placer.place(R(cpu=7, memory_gb=4)).pool_name == 'highcpu'
+    assert placer.place(R(cpu=2, memory_gb=20)).pool_name == 'highmem'
+    assert placer.place(R(cpu=3, memory_gb=10)).pool_name == 'standard'
+
+    gpu_placement = placer.place(R(cpu=3, memory_gb=12, gpus=1))
+    assert gpu_placement.pool_name == 'k80'
+    assert gpu_placement.pods_per_node == 2
+    assert gpu_placement.gpu_utilization == 1.0
+    assert placement.Placement.from_dict(gpu_placement.to_dict()) == gpu_placement
+
+    # cpu work stays off the GPU nodes and GPU work which doesn't fit anywhere is an error
+    assert 'k80' not in [p.pool_name for p in placer.get_candidates(R(cpu=1, memory_gb=1))]
+    with pytest.raises(ValueError):
+        placer.place(R(cpu=1, memory_gb=1, gpus=4))
+    with pytest.raises(ValueError):
+        placer.place(R(cpu=1, memory_gb=1, gpus=1, accelerator_type='nvidia-tesla-v100'))
+
+
+def test_deployment_manifest():
+    gpu_placement = _get_placer().place(placement.ResourceRequest(cpu=2.5, memory_gb=12, gpus=1))
+    deployment = kubes.KubernetesDeployment(name='trainer', container_image_uri='gcr.io/p/trainer:latest',
+                                            placement=gpu_placement)
+    pod_spec = yaml.safe_load(deployment._get_yaml())['spec']['template']['spec']
+    assert pod_spec['containers'][0]['resources'] == {
+        'requests': {'cpu': '2500m', 'memory': '12288Mi', 'nvidia.com/gpu': '1'},
+        'limits': {'memory': '12288Mi', 'nvidia.com/gpu': '1'},
+    }
+    assert pod_spec['nodeSelector'] == {'cloud.google.com/gke-nodepool': 'k80'}
+    assert pod_spec['tolerations'] == [placement.GPU_TOLERATION]
+
+    cpu_placement = _get_placer().place(placement.ResourceRequest(cpu=1, memory_gb=2))
+    deployment = kubes.KubernetesDeployment(name='worker', container_image_uri='gcr.io/p/worker:latest',
+                                            placement=cpu_placement)
+    pod_spec = yaml.safe_load(deployment._get_yaml())['spec']['template']['spec']
+    assert 'tolerations' not in pod_spec
+
+
+def test_simulate_packing():
+    placer = _get_placer(max_nodes=2)
+    requests = [placement.ResourceRequest(cpu=7, memory_gb=4)] * 5
+    packing = placement.simulate_packing(placer, requests)['highcpu']
+    assert (packing.num_nodes, packing.num_pods, packing.num_unschedulable) == (2, 4, 1)
+    assert packing.cpu_utilization == pytest.approx(28 / (2 * placer.shapes['highcpu'].cpus))
+
+    # the simulated packing agrees with the per node estimate
+    request = placement.ResourceRequest(cpu=.5, memory_gb=1)
+    best = placer.place(request)
+    packing = placement.simulate_packing(placer, [request] * (2 * best.pods_per_node))[best.pool_name]
+    assert packing.num_nodes == 2
+    assert packing.cpu_utilization == pytest.approx(best.cpu_utilization)
+
+
+def test_best_fit_beats_first_fit_on_batches():
+    placer = placement.Placer.from_node_pools(bench_placement.get_node_pools())
+    for name, workloads in bench_placement.get_workloads().items():
+        if name == 'random mix':
+            continue
+        best_fit = bench_placement.run(placer, workloads, 'best fit')
+        first_fit = bench_placement.run(placer, workloads, 'first fit')
+        assert best_fit['node_cpus'] <= first_fit['node_cpus'] + 1e-6, name
+
+
+if __name__ == '__main__':
+    test_machine_types()
+    test_best_fit()
+    test_deployment_manifest()
+    test_simulate_packing()
@@ -0,0 +1,126 @@
+import json
+import subprocess
+import tempfile
+from pathlib import Path
+
+import yaml
+
+from benchmarks import bench_repo_checkout
+from spin import ssh
+from spin.workbench import workbench
+
+provision_repos = bench_repo_checkout.provision_repos
+
+
+def _git_output(args, cwd):
+    return subprocess.check_output(['git'] + args, cwd=str(cwd)).decode('utf-8')
+
+
+def test_sparse_partial_clone_from_mirror():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        bare_dir = bench_repo_checkout.make_fixture_repo(tdir / 'monorepo', num_dirs=3, files_per_dir=2, file_kb=1,
+                                                         num_commits=2)
+        repo_url = f'file://{bare_dir}'
+        repo = {'repo_url': repo_url, 'sparse_paths': ['dir01'], 'directory': 'mono'}
+        mirror_cache_dir = str(tdir / 'mirrors')
+
+        [result] = provision_repos.provision_repos([repo], str(tdir / 'workspace'), mirror_cache_dir)
+        assert (result['mirror'], result['action']) == ('created', 'cloned')
+        checkout = tdir / 'workspace' / 'mono'
+        assert sorted(p.name for p in checkout.iterdir() if p.name != '.git') == ['dir01']
+        assert _git_output(['config', 'remote.origin.url'], checkout).strip() == repo_url
+        assert _git_output(['config', 'remote.origin.partialclonefilter'], checkout).strip() == 'blob:none'
+        # dissociated, so the checkout still works on a node without this mirror
+        assert not (checkout / '.git' / 'objects' / 'info' / 'alternates').exists()
+
+        # a second boot fetches the new commit into the mirror and the checkout but leaves the work tree alone
+        new_file = bench_repo_checkout.add_commit(bare_dir, tdir)
+        [result] = provision_repos.provision_repos([repo], str(tdir / 'workspace'), mirror_cache_dir)
+        assert (result['mirror'], result['action']) == ('fetched', 'fetched')
+        assert new_file in _git_output(['ls-tree', '--name-only', 'origin/main'], checkout)
+        assert not (checkout / new_file).exists()
+
+
+def test_old_git_checks_out_everything():
+    get_git_version = provision_repos.get_git_version
+    provision_repos.get_git_version = lambda: (2, 17, 1)
+    try:
+        with tempfile.TemporaryDirectory() as tdir:
+            tdir = Path(tdir)
+            bare_dir = bench_repo_checkout.make_fixture_repo(tdir / 'monorepo', num_dirs=2, files_per_dir=1,
+                                                             file_kb=1, num_commits=1)
+            repo = {'repo_url': f'file://{bare_dir}', 'sparse_paths': ['dir01'], 'directory': 'mono'}
+            [result] = provision_repos.provision_repos([repo], str(tdir / 'workspace'), None)
+            assert result['action'] == 'cloned'
+            checkout = tdir / 'workspace' / 'mono'
+            assert sorted(p.name for p in checkout.iterdir() if p.name != '.git') == ['dir00', 'dir01']
+    finally:
+        provision_repos.get_git_version = get_git_version
+
+
+def test_failures_are_per_repo():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        bare_dir = bench_repo_checkout.make_fixture_repo(tdir / 'repo', num_dirs=1, files_per_dir=1, file_kb=1,
+                                                         num_commits=1)
+        repos = [{'repo_url': str(tdir / 'missing.git')}, {'repo_url': f'file://{bare_dir}', 'directory': 'ok'}]
+        results = provision_repos.provision_repos(repos, str(tdir / 'workspace'), str(tdir / 'mirrors'))
+        assert 'error' in results[0]
+        assert results[1]['action'] == 'cloned'
+
+
+def test_workbench_passes_repos_to_container():
+    repos = [
+        workbench.GithubRepo('git@github.com:me/monorepo.git', branch='dev', sparse_paths=['libs/core']),
+        workbench.GithubRepo('git@github.com:me/tools.git'),
+    ]
+    wb = workbench.Workbench(
+        cloud_config=workbench.CloudConfig(cloud_project='p', zone='z'),
+        repos=repos,
+        ssh_login_key=None,
+        name='wb',
+        container_image_uri='image@sha256:abc',
+        volume_config=None,
+    )
+    _, deployment = wb._get_service_and_deployment(secrets=[])
+    container = yaml.safe_load(deployment._get_yaml())['spec']['template']['spec']['containers'][0]
+    [env] = container['env']
+    assert env['name'] == provision_repos.REPOS_ENV == workbench.Workbench.REPOS_ENV
+    assert json.loads(env['value']) == [
+        {'repo_url': 'git@github.com:me/monorepo.git', 'branch': 'dev', 'sparse_paths': ['libs/core']},
+        {'repo_url': 'git@github.com:me/tools.git'},
+    ]
+    assert {'name': 'repo-mirrors', 'mountPath': provision_repos.MIRROR_CACHE_DIR} in container['volumeMounts']
+
+
+def test_repo_mirrors_are_scoped_to_ssh_keys():
+    def get_mirror_host_path(*key_names):
+        repos = [workbench.GithubRepo('git@github.com:me/public.git')]
+        for key_name in key_names:
+            ssh_key = ssh.SshKeyInMemory(f'ssh-ed25519 AAAA{key_name} {key_name}@example.com\n', '')
+            repos.append(workbench.GithubRepo(f'git@github.com:me/{key_name}.git', ssh_key=ssh_key))
+        wb = workbench.Workbench(
+            cloud_config=workbench.CloudConfig(cloud_project='p', zone='z'),
+            repos=repos,
+            ssh_login_key=None,
+            name='wb',
+            container_image_uri='image@sha256:abc',
+            volume_config=None,
+        )
+        [volume] = [v for v in wb._get_deployment_kwargs()['volumes'] if v['name'] == 'repo-mirrors']
+        return volume['hostPath']['path']
+
+    assert get_mirror_host_path() == f'{workbench.Workbench.REPO_MIRROR_CACHE_DIR}/public'
+    # private mirrors are only shared by workbenches which clone with the same keys
+    assert get_mirror_host_path('alice') == get_mirror_host_path('alice')
+    assert len({get_mirror_host_path(), get_mirror_host_path('alice'), get_mirror_host_path('bob'),
+                get_mirror_host_path('alice', 'bob')}) == 4
+
+
+if __name__ == '__main__':
+    test_sparse_partial_clone_from_mirror()
+    test_old_git_checks_out_everything()
+    test_failures_are_per_repo()
+    test_workbench_passes_repos_to_container()
+    test_repo_mirrors_are_scoped_to_ssh_keys()
@@ -0,0 +1,60 @@
+import filecmp
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+
+from spin import scaffold, settings
+
+EXTRA_CONTEXT = {
+    'pkg_slug': 'my_new_project',
+    'full_name': 'Kevin Bache',
+    'email': 'kevin.bache@gmail.com',
+    'github_username': 'kevinbache',
+}
+
+
+def _list_files(root):
+    out = []
+    for dirpath, _, filenames in os.walk(root):
+        out += [os.path.relpath(os.path.join(dirpath, f), root) for f in filenames]
+    return sorted(out)
+
+
+def test_scaffold_matches_cookiecutter():
+    cookiecutter_main = pytest.importorskip('cookiecutter.main')
+    with tempfile.TemporaryDirectory() as tdir:
+        spin_dir = scaffold.Scaffolder(settings.TEMPLATES_PATH / 'project').render(
+            EXTRA_CONTEXT, output_dir=Path(tdir) / 'spin')
+        cookiecutter_dir = cookiecutter_main.cookiecutter(
+            str(settings.TEMPLATES_PATH / 'project'),
+            extra_context=EXTRA_CONTEXT,
+            no_input=True,
+            output_dir=str(Path(tdir) / 'cookiecutter'),
+        )
+
+        assert Path(spin_dir).name == 'my_new_project'
+        files = _list_files(spin_dir)
+        assert files == _list_files(cookiecutter_dir)
+        _, mismatch, errors = filecmp.cmpfiles(spin_dir, cookiecutter_dir, files, shallow=False)
+        assert mismatch == [] and errors == []
+
+
+def test_scaffold_many():
+    with tempfile.TemporaryDirectory() as tdir:
+        scaffolder = scaffold.Scaffolder(settings.TEMPLATES_PATH / 'project')
+        contexts = [dict(EXTRA_CONTEXT, pkg_slug=f'project_{i}') for i in range(10)]
+        project_dirs = scaffolder.render_many(contexts, output_dir=tdir)
+
+        assert [Path(d).name for d in project_dirs] == [f'project_{i}' for i in range(10)]
+        setup_py = (Path(project_dirs[3]) / 'setup.py').read_text()
+        assert 'name="project_3"' in setup_py
+
+        with pytest.raises(IOError):
+            scaffolder.render(contexts[0], output_dir=tdir)
+
+
+if __name__ == '__main__':
+    test_scaffold_matches_cookiecutter()
+    test_scaffold_many()
@@ -1,4 +1,7 @@
-from spin import spin_config
+import multiprocessing
+from pathlib import Path
+
+from spin import spin_config, utils
 import tempfile
 
 
@@ -15,5 +18,60 @@ def test_spinrc_yaml_bounce():
     assert spinrc == spinrc2
 
 
+def test_spinrc_snapshot(monkeypatch):
+    with tempfile.TemporaryDirectory() as tdir:
+        filename = str(Path(tdir) / '.spinrc')
+        spinrc = spin_config.SpinRc(
+            user=spin_config.SpinRcUser(name="Kevin Bache", email="kevin.bache@gmail.com", github_username='kevinbache'),
+            projects=[spin_config.SpinRcProject(project_dir='/Users/bache/projects/dervish/')],
+        )
+        spinrc.save(filename)
+        assert utils.get_snapshot_path(filename).exists()
+        assert spin_config.SpinRc.load(filename) == spinrc
+
+        # warm loads don't parse yaml at all
+        with monkeypatch.context() as m:
+            m.setattr(utils.yaml, 'load', None)
+            assert spin_config.SpinRc.load(filename) == spinrc
+
+        # edits outside of spin invalidate the snapshot
+        spinrc.user.name = 'Someone Else'
+        utils.dump_yaml(spinrc.to_dict(), filename)
+        assert spin_config.SpinRc.load(filename).user.name == 'Someone Else'
+
+
+def _add_projects(args):
+    filename, writer_index = args
+    for update_index in range(3):
+        with spin_config.SpinRc.transaction(filename) as rc:
+            rc.add_project(spin_config.SpinRcProject(project_dir=f'/projects/p-{writer_index}-{update_index}'))
+
+
+def test_spinrc_transaction_loses_no_updates():
+    with tempfile.TemporaryDirectory() as tdir:
+        filename = str(Path(tdir) / '.spinrc')
+        spin_config.SpinRc(
+            user=spin_config.SpinRcUser(name="Kevin Bache", email="kevin.bache@gmail.com", github_username='kevinbache'),
+            projects=[],
+        ).save(filename)
+
+        num_writers = 8
+        with multiprocessing.Pool(num_writers) as pool:
+            pool.map(_add_projects, [(filename, i) for i in range(num_writers)])
+
+        names = {p.name for p in spin_config.SpinRc.load(filename).projects}
+        assert names == {f'p-{w}-{u}' for w in range(num_writers) for u in range(3)}
+
+        # nothing is saved if the body raises
+        try:
+            with spin_config.SpinRc.transaction(filename) as rc:
+                rc.projects = []
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        assert len(spin_config.SpinRc.load(filename).projects) == num_writers * 3
+
+
 if __name__ == '__main__':
     test_spinrc_yaml_bounce()
+    test_spinrc_transaction_loses_no_updates()
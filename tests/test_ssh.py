@@ -1,3 +1,6 @@
+import base64
+import hashlib
+import hmac
 import os
 from pathlib import Path
 from typing import Text
@@ -76,13 +79,26 @@ Host host_tag
     # DO NOT OVERWRITE OLD SPIN HOSTS ENTRY
     m.add_host_entry(
         host_tag='host_tag',
-        host_name='127.0.0.1',
-        user='myuser',
+        host_name='10.0.0.1',
+        user='otheruser',
         add_keys_to_agent=False,
         identity_file='~/.ssh/id_rsa',
         do_replace_existing_spin_hosts_entry=False,
     )
 
+    out = open(t.name, 'r').read()
+    assert expected_output == out
+
+    # NEW HOSTS GO INTO THE SAME SPIN SECTION
+    m.add_host_entry(
+        host_tag='other_host',
+        host_name='10.0.0.2',
+        user='root',
+        port=2222,
+        identity_file='~/.ssh/id_rsa',
+        do_replace_existing_spin_hosts_entry=False,
+    )
+
     expected_output = '''Host existing_host
     HostName 127.0.0.1
     User myUser
@@ -97,21 +113,67 @@ Host host_tag
     IdentityFile    ~/.ssh/id_rsa
     AddKeysToAgent  no
     ForwardAgent    yes
-########## end added by spin ##########
 
-######### begin added by spin #########
-Host host_tag
-    HostName        127.0.0.1
-    User            myuser
-    Port            22
+Host other_host
+    HostName        10.0.0.2
+    User            root
+    Port            2222
     IdentityFile    ~/.ssh/id_rsa
-    AddKeysToAgent  no
+    AddKeysToAgent  yes
     ForwardAgent    yes
 ########## end added by spin ##########
 '''
     out = open(t.name, 'r').read()
     assert expected_output == out
 
+    # REMOVE EVERYTHING SPIN ADDED
+    m.remove_host_entries(['host_tag', 'other_host'])
+    out = open(t.name, 'r').read()
+    assert existing_host == out
+
+
+def test_batched_config_updates():
+    with tempfile.TemporaryDirectory() as tdir:
+        config_file = Path(tdir) / 'config'
+        legacy = '''Host *
+    ForwardAgent yes
+
+######### begin added by spin #########
+Host wb-1
+    HostName        10.0.0.1
+########## end added by spin ##########
+
+######### begin added by spin #########
+Host wb-2
+    HostName        10.0.0.2
+########## end added by spin ##########
+Host after
+    User me
+'''
+        config_file.write_text(legacy)
+        m = ssh.SshConfigModifier(config_file)
+        assert [e.host_tag for e in m.get_host_entries()] == ['wb-1', 'wb-2']
+
+        entries = [ssh.SshConfigModifier.make_host_entry(f'wb-{i}', host_name=f'10.0.1.{i}') for i in range(200)]
+        assert m.update(entries_to_add=entries, host_tags_to_remove=['wb-1', 'wb-2'])
+
+        out = config_file.read_text()
+        assert out.count(ssh.SpinSshConfig.BLOCK_START_STR) == 1
+        assert out.startswith('Host *\n    ForwardAgent yes\n\n' + ssh.SpinSshConfig.BLOCK_START_STR)
+        assert out.endswith(ssh.SpinSshConfig.BLOCK_END_STR + '\nHost after\n    User me\n')
+        assert m.get_host_entry('wb-199').options['HostName'] == '10.0.1.199'
+
+        # unchanged content doesn't touch the file
+        stat = os.stat(str(config_file))
+        assert not ssh.SshConfigModifier(config_file).add_host_entries(entries)
+        assert os.stat(str(config_file)).st_ino == stat.st_ino
+
+        # a symlinked config is written through to its target
+        link = Path(tdir) / 'link'
+        link.symlink_to(config_file)
+        assert ssh.SshConfigModifier(link).remove_host_entries(['wb-0'])
+        assert link.is_symlink() and 'Host wb-0\n' not in config_file.read_text()
+
 
 def _get_file_permission(filename: Text):
     return oct(os.stat(filename).st_mode & 0o777)
@@ -181,6 +243,71 @@ def test_new_identity():
         assert config_str == open(config_file, 'r').read()
 
 
+def _hash_host(host: Text, salt: bytes = b'0123456789abcdefghij') -> Text:
+    digest = hmac.new(salt, host.encode('utf-8'), hashlib.sha1).digest()
+    return f'|1|{base64.b64encode(salt).decode()}|{base64.b64encode(digest).decode()}'
+
+
+def test_known_hosts():
+    with tempfile.TemporaryDirectory() as tdir:
+        known_hosts_file = Path(tdir) / 'known_hosts'
+        existing = [
+            '# a comment',
+            'github.com ssh-rsa AAAAgithub',
+            f'{_hash_host("10.0.0.1")} ssh-rsa AAAAold',
+            '10.0.0.12 ssh-rsa AAAAtwelve',
+        ]
+        # no trailing newline
+        known_hosts_file.write_text('\n'.join(existing))
+
+        m = ssh.KnownHostsModifier(known_hosts_file)
+        assert m.get_lines_for_hostname('10.0.0.1') == [existing[2]]
+
+        new_lines = [
+            'github.com ssh-rsa AAAAgithub',
+            '[10.0.0.1]:2222 ssh-rsa AAAAnew',
+            '[10.0.0.1]:2222 ssh-ed25519 AAAAnew2',
+            '[10.0.0.1]:2222 ssh-rsa AAAAnew',
+        ]
+        assert m.update(lines_to_add=new_lines, hosts_to_remove=['10.0.0.1'])
+        assert known_hosts_file.read_text() == '\n'.join([
+            '# a comment',
+            'github.com ssh-rsa AAAAgithub',
+            '10.0.0.12 ssh-rsa AAAAtwelve',
+            '[10.0.0.1]:2222 ssh-rsa AAAAnew',
+            '[10.0.0.1]:2222 ssh-ed25519 AAAAnew2',
+        ]) + '\n'
+
+        # nothing new, so the file isn't touched
+        stat = os.stat(str(known_hosts_file))
+        assert not m.add_known_hosts(new_lines)
+        assert not ssh.KnownHostsModifier(known_hosts_file).add_known_host('github.com ssh-rsa AAAAgithub')
+        # nor is it when a host's lines are removed and the same lines added back, as claiming a workbench does
+        assert not ssh.KnownHostsModifier(known_hosts_file).update(lines_to_add=new_lines[1:3],
+                                                                   hosts_to_remove=['[10.0.0.1]:2222'])
+        assert os.stat(str(known_hosts_file)).st_ino == stat.st_ino
+
+        assert m.remove_all_lines_for_hostname('10.0.0.1', port=2222)
+        assert m.get_lines_for_hostname('10.0.0.1', port=2222) == []
+        assert m.get_lines_for_hostname('10.0.0.12') == ['10.0.0.12 ssh-rsa AAAAtwelve']
+
+        assert m.remove_line('10.0.0.12 ssh-rsa AAAAtwelve')
+        assert known_hosts_file.read_text() == '# a comment\ngithub.com ssh-rsa AAAAgithub\n'
+
+
+def test_add_line_if_does_not_exist():
+    with tempfile.TemporaryDirectory() as tdir:
+        filename = Path(tdir) / 'authorized_keys'
+        filename.write_text('ssh-rsa AAAA')
+        for _ in range(3):
+            ssh.add_line_if_does_not_exist(filename, 'ssh-rsa AAAA')
+            ssh.add_line_if_does_not_exist(filename, 'ssh-rsa BBBB\n')
+        assert filename.read_text() == 'ssh-rsa AAAA\nssh-rsa BBBB\n'
+
+
 if __name__ == '__main__':
     test_add_config()
     test_new_identity()
+    test_batched_config_updates()
+    test_known_hosts()
+    test_add_line_if_does_not_exist()
@@ -0,0 +1,167 @@
+import getpass
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from spin import ssh
+
+# stands in for ssh.  a master is a file at the control path; sessions run their command locally and log their
+#   arguments so tests can see whether they went through the master.
+FAKE_SSH = f'''#!{sys.executable}
+import json, os, subprocess, sys
+args = sys.argv[1:]
+options = dict(args[i + 1].split('=', 1) for i, a in enumerate(args) if a == '-o')
+control_path = options['ControlPath']
+with open(os.environ['FAKE_SSH_LOG'], 'a') as f:
+    f.write(json.dumps(args) + '\\n')
+if '-O' in args:
+    op = args[args.index('-O') + 1]
+    if op == 'check':
+        sys.exit(0 if os.path.exists(control_path) else 255)
+    if os.path.exists(control_path):
+        os.remove(control_path)
+    sys.exit(0)
+if '-N' in args:
+    open(control_path, 'w').close()
+    sys.exit(0)
+os.execv('/bin/sh', ['sh', '-c', args[-1]])
+'''
+
+
+def _get_fake_connection(tdir: Path, monkeypatch) -> ssh.MultiplexedSshConnection:
+    ssh_path = tdir / 'fake_ssh'
+    ssh_path.write_text(FAKE_SSH)
+    ssh_path.chmod(0o755)
+    monkeypatch.setenv('FAKE_SSH_LOG', str(tdir / 'ssh.log'))
+    return ssh.MultiplexedSshConnection('wb', control_path=str(tdir / 'mux-%C'), ssh_command=str(ssh_path),
+                                        verbose=False)
+
+
+def _read_fake_ssh_log(tdir: Path):
+    return [json.loads(line) for line in (tdir / 'ssh.log').read_text().splitlines()]
+
+
+def test_host_entry_multiplexing():
+    entry = ssh.SshConfigModifier.make_host_entry('wb', host_name='10.0.0.1', control_persist='10m')
+    assert entry.to_text() == '''Host wb
+    HostName        10.0.0.1
+    Port            22
+    AddKeysToAgent  yes
+    ForwardAgent    yes
+    ControlMaster   auto
+    ControlPath     ~/.ssh/spin-mux-%C
+    ControlPersist  10m
+'''
+    assert 'ControlMaster' not in ssh.SshConfigModifier.make_host_entry('wb', host_name='10.0.0.1').options
+
+
+def test_run_many_over_one_master(monkeypatch):
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        connection = _get_fake_connection(tdir, monkeypatch)
+
+        lines = []
+        results = connection.run_many(
+            [f'echo out{i}; echo err{i} >&2; sleep .5' for i in range(4)],
+            on_output=lambda i, stream, line: lines.append((i, stream, line)),
+        )
+        assert results == [(0, f'out{i}\n', f'err{i}\n') for i in range(4)]
+        assert sorted(lines) == sorted([(i, 'stdout', f'out{i}\n') for i in range(4)] +
+                                       [(i, 'stderr', f'err{i}\n') for i in range(4)])
+
+        # the next command reuses the master rather than checking for it again
+        assert connection.run('echo hi') == (0, 'hi\n', '')
+        calls = _read_fake_ssh_log(tdir)
+        assert len([c for c in calls if '-N' in c]) == 1
+        sessions = [c for c in calls if c[-1].startswith('echo')]
+        assert len(sessions) == 5
+        assert all('ControlMaster=auto' in c for c in sessions)
+
+        with pytest.raises(ValueError, match='1 of 2 commands'):
+            connection.run_many(['true', 'exit 3'])
+        with pytest.raises(TimeoutError):
+            connection.run('exec sleep 10', timeout=.5)
+
+        connection.close()
+        assert not connection.is_open()
+
+
+def _get_sshd():
+    return shutil.which('sshd') or next((p for p in ('/usr/sbin/sshd', '/usr/local/sbin/sshd') if os.path.exists(p)),
+                                        None)
+
+
+def _get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(_get_sshd() is None or shutil.which('ssh') is None, reason='needs sshd and ssh')
+def test_against_local_sshd():
+    with tempfile.TemporaryDirectory() as tdir:
+        tdir = Path(tdir)
+        for name in ('host_key', 'client_key'):
+            subprocess.check_call(['ssh-keygen', '-q', '-t', 'ed25519', '-N', '', '-f', str(tdir / name)])
+        (tdir / 'authorized_keys').write_text((tdir / 'client_key.pub').read_text())
+        (tdir / 'authorized_keys').chmod(0o600)
+        port = _get_free_port()
+        (tdir / 'sshd_config').write_text(f'''Port {port}
+ListenAddress 127.0.0.1
+HostKey {tdir / 'host_key'}
+AuthorizedKeysFile {tdir / 'authorized_keys'}
+PidFile {tdir / 'sshd.pid'}
+PasswordAuthentication no
+StrictModes no
+UsePAM no
+''')
+        sshd = subprocess.Popen([_get_sshd(), '-D', '-e', '-f', str(tdir / 'sshd_config')],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port)).close()
+                    break
+                except ConnectionRefusedError:
+                    if sshd.poll() is not None:
+                        pytest.skip(f"sshd wouldn't start: {sshd.stderr.read().decode('utf-8')}")
+                    time.sleep(.05)
+
+            connection = ssh.MultiplexedSshConnection(
+                '127.0.0.1',
+                control_path=str(tdir / 'mux-%C'),
+                ssh_options={
+                    'Port': str(port),
+                    'User': getpass.getuser(),
+                    'IdentityFile': str(tdir / 'client_key'),
+                    'IdentitiesOnly': 'yes',
+                    'UserKnownHostsFile': '/dev/null',
+                    'StrictHostKeyChecking': 'no',
+                },
+                verbose=False,
+            )
+            with connection:
+                assert connection.is_open()
+                start = time.monotonic()
+                results = connection.run_many([f'sleep 1; echo {i}' for i in range(6)], max_concurrency=6)
+                assert [stdout for _, stdout, _ in results] == [f'{i}\n' for i in range(6)]
+                # they ran side by side on the one connection
+                assert time.monotonic() - start < 4
+                assert connection.run('exit 7', error_on_nonzero_exit=False)[0] == 7
+            assert not connection.is_open()
+        finally:
+            sshd.terminate()
+            sshd.wait()
+
+
+if __name__ == '__main__':
+    test_host_entry_multiplexing()
+    test_against_local_sshd()
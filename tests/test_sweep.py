@@ -0,0 +1,138 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import bench_sweep
+from spin import sweep
+from spin.checkpoint import LocalBlobStore
+
+
+def train(lr, layers):
+    """Accuracy climbs towards a ceiling set by lr.  Bad trials run slowly enough to be worth killing."""
+    for step in range(1, 6):
+        sweep.report_metric('accuracy', lr * step / 5, step)
+        time.sleep(.05 if lr > .5 else .3)
+
+
+def _trial(trial_id, values):
+    return sweep.Trial(trial_id, {}, reports=[(i + 1, v) for i, v in enumerate(values)])
+
+
+def test_search_space():
+    space = {
+        'lr': sweep.LogUniform(1e-4, 1e-1),
+        'layers': sweep.Choice([2, 4]),
+        'units': sweep.IntUniform(8, 16),
+        'dropout': sweep.Uniform(0, .5),
+    }
+    params = sweep.sample_params(space, num_trials=50, seed=0)
+    assert params == sweep.sample_params(space, num_trials=50, seed=0)
+    assert all(1e-4 <= p['lr'] <= 1e-1 and p['layers'] in (2, 4) and 8 <= p['units'] <= 16 for p in params)
+    assert all(isinstance(p['units'], int) for p in params)
+
+
+def test_hypertune_metrics(monkeypatch):
+    with tempfile.TemporaryDirectory() as tdir:
+        filename = os.path.join(tdir, 'output.metrics')
+        monkeypatch.setenv(sweep.METRIC_FILE_ENV, filename)
+        sweep.report_metric('accuracy', .5, 1)
+        sweep.report_metric('loss', 2.0, 1)
+        sweep.report_metric('accuracy', .7, 2)
+        text = Path(filename).read_text() + '{"accuracy": "0.'
+        assert sweep.parse_metrics(text, 'accuracy') == [(1, .5), (2, .7)]
+
+
+def test_stopping_rules():
+    others = [_trial(str(i), [.1 * i, .2 * i, .3 * i]) for i in range(1, 5)]
+
+    median = sweep.MedianStoppingRule(min_step=2, min_trials=3)
+    assert not median.should_stop(_trial('a', [.01]), others, maximize=True)
+    assert median.should_stop(_trial('a', [.01, .02]), others, maximize=True)
+    assert not median.should_stop(_trial('a', [.5, .9]), others, maximize=True)
+    assert not median.should_stop(_trial('a', [.01, .02]), others, maximize=False)
+
+    asha = sweep.AshaRule(min_step=1, reduction_factor=2)
+    assert asha.get_rungs(9) == [1, 2, 4, 8]
+    loser = _trial('a', [.05, .1])
+    assert asha.should_stop(loser, others + [loser], maximize=True)
+    winner = _trial('b', [.05, .9])
+    assert not asha.should_stop(winner, others + [winner], maximize=True)
+    # between rungs, nobody is judged
+    assert not asha.should_stop(_trial('c', [.9, .9, .01]), others, maximize=True)
+
+
+def test_early_stopping_saves_gpu_steps():
+    for seed in range(3):
+        curves = bench_sweep.get_curves(seed=seed)
+        baseline = bench_sweep.simulate(curves, sweep.NoStoppingRule())
+        median = bench_sweep.simulate(curves, sweep.MedianStoppingRule(min_step=3))
+        asha = bench_sweep.simulate(curves, sweep.AshaRule(min_step=3, reduction_factor=3))
+        assert median['gpu_steps'] < .75 * baseline['gpu_steps']
+        assert asha['gpu_steps'] < .5 * baseline['gpu_steps']
+        assert median['regret'] < .01
+
+
+def test_local_sweep():
+    with tempfile.TemporaryDirectory() as tdir:
+        executor = sweep.LocalProcessExecutor(LocalBlobStore(tdir))
+        s = sweep.Sweep(
+            fn=train,
+            space={'lr': sweep.Choice([.2, .9, 1.0]), 'layers': sweep.Choice([2])},
+            metric='accuracy',
+            num_trials=8,
+            budgets={'cpu-pool': 3, 'gpu-pool': 1},
+            executor=executor,
+            stopping_rule=sweep.MedianStoppingRule(min_step=2, min_trials=2),
+            seed=1,
+            poll_interval=.05,
+            timeout=60,
+        )
+        max_running = {'cpu-pool': 0, 'gpu-pool': 0}
+        reports = []
+        for report in s:
+            reports.append(report)
+            for pool in max_running:
+                max_running[pool] = max(max_running[pool], len([t for t in s.get_running_trials()
+                                                                 if t.pool_name == pool]))
+        assert max_running['cpu-pool'] <= 3 and max_running['gpu-pool'] <= 1
+        assert s.is_done()
+        assert {t.status for t in s.trials} <= {sweep.Trial.SUCCEEDED, sweep.Trial.STOPPED}
+        assert any(t.status == sweep.Trial.STOPPED for t in s.trials if t.params['lr'] == .2)
+        best = s.get_best_trial()
+        assert best.params['lr'] == 1.0 and best.get_best_value() == 1.0
+        assert len(reports) == sum(len(t.reports) for t in s.trials)
+
+
+def test_kubernetes_executor(fake_cloud, tmp_path):
+    cloud = fake_cloud()
+    executor = sweep.KubernetesJobExecutor(
+        LocalBlobStore(tmp_path / 'store'), name='lr-sweep', container_image_uri='image', pod_store_dir='/mnt/store',
+        store_volume={'persistentVolumeClaim': {'claimName': 'sweeps'}}, verbose=False,
+    )
+    trials = [sweep.Trial(f'{i:04d}', {}, pool_name='gpu-pool') for i in range(3)]
+    for trial in trials:
+        executor.launch('sweep/abc', trial)
+
+    jobs = cloud.read()['kube']['job']
+    spec = jobs['lr-sweep-0001']['spec']
+    assert spec['backoffLimit'] == 0
+    assert spec['template']['spec']['nodeSelector'] == {'cloud.google.com/gke-nodepool': 'gpu-pool'}
+
+    with cloud.state.transaction() as state:
+        state['kube']['job']['lr-sweep-0000']['status'] = {'succeeded': 1}
+        state['kube']['job']['lr-sweep-0001']['status'] = {'failed': 1}
+    assert executor.get_statuses('sweep/abc', trials) == {
+        '0000': sweep.Trial.SUCCEEDED, '0001': sweep.Trial.FAILED, '0002': sweep.Trial.RUNNING,
+    }
+    executor.kill('sweep/abc', trials[2:])
+    assert set(cloud.read()['kube']['job']) == {
+        'lr-sweep-0000', 'lr-sweep-0001',
+    }
+
+
+if __name__ == '__main__':
+    test_search_space()
+    test_stopping_rules()
+    test_early_stopping_saves_gpu_steps()
+    test_local_sweep()
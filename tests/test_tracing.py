@@ -0,0 +1,105 @@
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+from spin import kubes, tracing, utils
+
+
+def test_disabled_tracing_is_a_no_op():
+    tracing.disable()
+    assert tracing.span('a') is tracing.span('b')
+    with tracing.span('a') as s:
+        s.set(exitcode=0)
+
+    @tracing.traced()
+    def f(x):
+        return x + 1
+    assert f(1) == 2
+
+
+def test_spans_nest_and_export():
+    tracer = tracing.enable()
+    try:
+        with tracing.span('outer', category='workbench'):
+            with tracing.span('inner', category='shell') as inner:
+                inner.set(exitcode=3)
+            with tracing.span('inner', category='shell'):
+                pass
+
+        def in_thread():
+            with tracing.span('thread root'):
+                pass
+        t = threading.Thread(target=in_thread)
+        t.start()
+        t.join()
+    finally:
+        tracing.disable()
+
+    by_name = {}
+    for s in tracer.spans:
+        by_name.setdefault(s.name, []).append(s)
+    outer = by_name['outer'][0]
+    assert all(s.parent is outer and s.depth == 1 for s in by_name['inner'])
+    assert by_name['thread root'][0].parent is None
+    assert by_name['inner'][0].attributes['exitcode'] == 3
+
+    summary = {r['name']: r for r in tracer.get_summary()}
+    assert summary['inner']['count'] == 2
+    assert summary['outer']['self_ms'] <= summary['outer']['total_ms']
+    assert 'shell: inner' in tracer.format_summary()
+
+    with tempfile.TemporaryDirectory() as tdir:
+        filename = Path(tdir) / 'trace.json'
+        tracer.write_chrome_trace(filename)
+        events = json.loads(filename.read_text())['traceEvents']
+    assert [e['name'] for e in events][0] == 'outer'
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+
+
+def test_shell_commands_are_traced():
+    tracer = tracing.enable()
+    try:
+        utils.ShellRunnerMixin(verbose=False)._run('echo hello world')
+    finally:
+        tracing.disable()
+
+    [s] = tracer.spans
+    assert s.name == 'echo hello'
+    assert s.category == 'shell'
+    assert s.attributes['exitcode'] == 0
+    assert s.attributes['stdout_bytes'] == len('hello world\n')
+
+
+def test_kubectl_applies_run_with_and_without_tracing():
+    service = kubes.KubernetesService('wb', deployment_name='wb', ports=[])
+    with tempfile.TemporaryDirectory() as tdir:
+        # a kubectl which reads the manifest and says what it applied
+        kubectl = Path(tdir) / 'kubectl'
+        kubectl.write_text('#!/bin/sh\ncat > /dev/null\necho "service/wb configured"\n')
+        kubectl.chmod(0o755)
+        path = os.environ['PATH']
+        os.environ['PATH'] = f'{tdir}{os.pathsep}{path}'
+        try:
+            tracing.disable()
+            assert service.create()[1] == 'service/wb configured\n'
+
+            tracer = tracing.enable()
+            try:
+                service.create()
+            finally:
+                tracing.disable()
+        finally:
+            os.environ['PATH'] = path
+
+    [s] = tracer.spans
+    assert (s.name, s.category) == ('kubectl apply', 'kubectl')
+    assert (s.attributes['kind'], s.attributes['object_name']) == ('service', 'wb')
+
+
+if __name__ == '__main__':
+    test_disabled_tracing_is_a_no_op()
+    test_spans_nest_and_export()
+    test_shell_commands_are_traced()
+    test_kubectl_applies_run_with_and_without_tracing()
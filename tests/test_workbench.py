@@ -0,0 +1,43 @@
+import pytest
+
+from spin import fleet, ssh
+
+
+def test_delete_workbench_from_before_labels(fake_cloud, make_workbench, tmp_path):
+    cloud = fake_cloud()
+    ssh_files = dict(known_hosts_file=str(tmp_path / 'known_hosts'), ssh_config_file=str(tmp_path / 'config'))
+    fleet.Fleet([make_workbench('old'), make_workbench('new')], verbose=False, **ssh_files).create()
+    with cloud.state.transaction() as s:
+        for objects in s['kube'].values():
+            for name, obj in objects.items():
+                if name.startswith('old'):
+                    obj['metadata'].pop('labels', None)
+
+    # nothing matches its labels, so its objects are deleted by name
+    make_workbench('old').delete(update_ssh_files=False)
+    kube = cloud.read()['kube']
+    assert set(kube['deployment']) == {'new'} and set(kube['service']) == {'new'}
+    assert set(kube['secret']) == {'new-ssh-server-keys', 'new-user-keys', 'new-user-login-public-keys'}
+    assert len(kube['persistentvolumeclaim']) == 6
+
+
+def test_workbench_keeps_ssh_files_in_step(fake_cloud, make_workbench, tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    fake_cloud()
+    config_file, known_hosts_file = tmp_path / '.ssh' / 'config', tmp_path / '.ssh' / 'known_hosts'
+    # left over from an earlier workbench with the same name
+    stale = ssh.SshConfigModifier.make_host_entry('wb', host_name='10.9.9.9')
+    ssh.SshConfigModifier(config_file).add_host_entries([stale])
+
+    wb = make_workbench('wb')
+    wb.create()
+    assert ssh.SshConfigModifier(config_file).get_host_entry('wb').options['HostName'] == wb.ip
+    assert ssh.KnownHostsModifier(known_hosts_file).get_lines_for_hostname(wb.ip)
+
+    wb.delete()
+    assert ssh.SshConfigModifier(config_file).get_host_entries() == []
+    assert ssh.KnownHostsModifier(known_hosts_file).get_lines_for_hostname(wb.ip) == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])